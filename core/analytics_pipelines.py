@@ -0,0 +1,135 @@
+"""
+Server-side aggregation pipelines for analytics.
+
+Analytics paths that only need totals use these pipelines instead of loading
+documents into Python:
+1. Trip statistics (count, completed, delayed, mean delay) in one ``$group``
+2. Rating and revenue sums in one ``$group``
+3. Per-day counts and sums over a rolling window in one ``$group``
+4. Recent activity totals with a per-severity breakdown in one ``$facet``
+
+Each pipeline returns only the final numbers.
+"""
+
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Any, List, Optional
+
+DAY_MS = 24 * 60 * 60 * 1000
+
+DELAYED_TRIP_MINUTES = 10
+
+
+def _nonzero(field: str) -> Dict[str, Any]:
+    """Python truthiness of a numeric field: missing, null and 0 are false."""
+    return {"$ne": [{"$ifNull": [f"${field}", 0]}, 0]}
+
+
+def _window(start: datetime, end: Optional[datetime] = None) -> Dict[str, Any]:
+    window = {"$gte": start}
+    if end is not None:
+        window["$lt"] = end
+    return window
+
+
+def trip_stats_pipeline(start: datetime, end: Optional[datetime] = None) -> List[Dict[str, Any]]:
+    """Trip count, completions, delayed trips and the mean of non-zero delays."""
+    return [
+        {"$match": {"created_at": _window(start, end)}},
+        {"$group": {
+            "_id": None,
+            "total": {"$sum": 1},
+            "completed": {"$sum": {"$cond": [{"$eq": ["$status", "COMPLETED"]}, 1, 0]}},
+            "delayed": {"$sum": {"$cond": [
+                {"$gt": [{"$ifNull": ["$delay_minutes", 0]}, DELAYED_TRIP_MINUTES]}, 1, 0
+            ]}},
+            "delay_sum": {"$sum": {"$cond": [_nonzero("delay_minutes"), "$delay_minutes", 0]}},
+            "delay_count": {"$sum": {"$cond": [_nonzero("delay_minutes"), 1, 0]}}
+        }}
+    ]
+
+
+def rating_stats_pipeline(start: datetime, end: Optional[datetime] = None) -> List[Dict[str, Any]]:
+    """Sum and count of non-zero feedback ratings."""
+    return [
+        {"$match": {"created_at": _window(start, end)}},
+        {"$group": {
+            "_id": None,
+            "rating_sum": {"$sum": {"$cond": [_nonzero("rating"), "$rating", 0]}},
+            "rating_count": {"$sum": {"$cond": [_nonzero("rating"), 1, 0]}}
+        }}
+    ]
+
+
+def revenue_pipeline(start: datetime, end: Optional[datetime] = None) -> List[Dict[str, Any]]:
+    """Count and amount of completed payments."""
+    return [
+        {"$match": {"created_at": _window(start, end), "status": "COMPLETED"}},
+        {"$group": {
+            "_id": None,
+            "count": {"$sum": 1},
+            "revenue": {"$sum": {"$ifNull": ["$amount", 0]}}
+        }}
+    ]
+
+
+def daily_totals_pipeline(
+    start: datetime,
+    days: int,
+    match: Optional[Dict[str, Any]] = None,
+    value: Optional[str] = None
+) -> List[Dict[str, Any]]:
+    """
+    Per-day document count (and optional sum of ``value``) for the ``days``
+    24-hour windows starting at ``start``. ``_id`` is the window index.
+    """
+    if start.tzinfo is not None:
+        # BSON dates are UTC; keep the literal comparable with stored values
+        start = start.astimezone(timezone.utc).replace(tzinfo=None)
+    end = start + timedelta(days=days)
+    group: Dict[str, Any] = {
+        "_id": {"$floor": {"$divide": [{"$subtract": ["$created_at", start]}, DAY_MS]}},
+        "count": {"$sum": 1}
+    }
+    if value:
+        group["total"] = {"$sum": {"$ifNull": [f"${value}", 0]}}
+    return [
+        {"$match": {"created_at": _window(start, end), **(match or {})}},
+        {"$group": group}
+    ]
+
+
+def activity_facet_pipeline(match: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Total matching documents plus a per-severity breakdown."""
+    return [
+        {"$match": match},
+        {"$facet": {
+            "total": [{"$count": "count"}],
+            "by_severity": [{"$group": {"_id": "$severity", "count": {"$sum": 1}}}]
+        }}
+    ]
+
+
+async def aggregate_one(collection, pipeline: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Run a pipeline expected to produce at most one document."""
+    results = await collection.aggregate(pipeline).to_list(length=1)
+    return results[0] if results else {}
+
+
+async def aggregate_daily(collection, pipeline: List[Dict[str, Any]], days: int) -> List[Dict[str, Any]]:
+    """Run a ``daily_totals_pipeline`` and return one row per day, zero-filled."""
+    rows = [{"count": 0, "total": 0} for _ in range(days)]
+    for doc in await collection.aggregate(pipeline).to_list(length=None):
+        index = int(doc["_id"])
+        if 0 <= index < days:
+            rows[index] = {"count": doc.get("count", 0), "total": doc.get("total", 0)}
+    return rows
+
+
+async def aggregate_activity(collection, match: Dict[str, Any]) -> Dict[str, Any]:
+    """Run an ``activity_facet_pipeline`` and flatten it."""
+    result = await aggregate_one(collection, activity_facet_pipeline(match))
+    total = result.get("total") or [{}]
+    return {
+        "count": total[0].get("count", 0),
+        "by_severity": {doc["_id"]: doc["count"] for doc in result.get("by_severity", []) if doc.get("_id")}
+    }
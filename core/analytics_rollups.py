@@ -0,0 +1,431 @@
+"""
+Pre-aggregated analytics rollups.
+
+Range analytics (time series, operational, financial and performance metrics,
+and the scheduled reports built on them) read from rollup collections instead
+of rescanning raw trips, payments, feedback and incidents:
+1. ``analytics_rollups_hourly`` holds one document per hour, source metric,
+   route and bus, materialized with an aggregation ``$merge``
+2. ``analytics_rollups_daily`` is merged from the hourly buckets
+3. Refreshes are incremental from a watermark stored in
+   ``analytics_rollup_state``; the initial backfill runs in day-sized chunks
+   and resumes where it stopped. Only the process holding the lease in the
+   same document refreshes, so workers never delete each other's buckets
+4. Reads combine daily buckets for whole days with hourly buckets at the
+   window edges, so query cost follows the window length, not history size
+"""
+
+import asyncio
+import logging
+import os
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Any, List, Optional, Tuple
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from core.mongo_utils import date_range_filter
+
+logger = logging.getLogger(__name__)
+
+HOURLY_COLLECTION = "analytics_rollups_hourly"
+DAILY_COLLECTION = "analytics_rollups_daily"
+STATE_COLLECTION = "analytics_rollup_state"
+STATE_ID = "rollups"
+
+BACKFILL_CHUNK = timedelta(days=1)
+
+
+def _count_if(condition: Dict[str, Any]) -> Dict[str, Any]:
+    return {"$cond": [condition, 1, 0]}
+
+
+# Source collections, their filters, dimensions and measures
+ROLLUP_SOURCES: Dict[str, Dict[str, Any]] = {
+    "trips": {
+        "match": {},
+        "route_id": "$route_id",
+        "bus_id": "$bus_id",
+        "measures": {
+            "count": 1,
+            "completed": _count_if({"$eq": ["$status", "COMPLETED"]}),
+            "on_time": _count_if({"$lte": [{"$ifNull": ["$delay_minutes", 0]}, 5]}),
+            "delayed": _count_if({"$gt": [{"$ifNull": ["$delay_minutes", 0]}, 10]}),
+            "delay_sum": {"$ifNull": ["$delay_minutes", 0]},
+            "duration_sum": {"$ifNull": ["$duration_minutes", 0]},
+            "duration_count": _count_if({"$ne": [{"$ifNull": ["$duration_minutes", 0]}, 0]})
+        }
+    },
+    "payments": {
+        "match": {"status": "COMPLETED"},
+        "route_id": None,
+        "bus_id": None,
+        "measures": {
+            "count": 1,
+            "amount_sum": {"$ifNull": ["$amount", 0]}
+        }
+    },
+    "feedback": {
+        "match": {},
+        "route_id": None,
+        "bus_id": "$related_bus_id",
+        "measures": {
+            "count": 1,
+            "rating_sum": {"$ifNull": ["$rating", 0]},
+            "rating_count": _count_if({"$ne": [{"$ifNull": ["$rating", 0]}, 0]}),
+            "low_rating": _count_if({"$and": [{"$ne": ["$rating", None]}, {"$lte": ["$rating", 2]}]}),
+            "low_rating_resolved": _count_if({"$and": [
+                {"$ne": ["$rating", None]}, {"$lte": ["$rating", 2]}, {"$eq": ["$resolved", True]}
+            ]})
+        }
+    },
+    "incidents": {
+        "match": {},
+        "route_id": "$related_route_id",
+        "bus_id": "$related_bus_id",
+        "measures": {
+            "count": 1,
+            "breakdowns": _count_if({"$eq": ["$incident_type", "BREAKDOWN"]}),
+            "high_severity": _count_if({"$in": ["$severity", ["HIGH", "CRITICAL"]]})
+        }
+    }
+}
+
+ALL_MEASURES = sorted({field for source in ROLLUP_SOURCES.values() for field in source["measures"]})
+
+
+def utc_naive(value: datetime) -> datetime:
+    """Rollup buckets are stored as naive UTC, the way pymongo returns them."""
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def floor_hour(value: datetime) -> datetime:
+    return value.replace(minute=0, second=0, microsecond=0)
+
+
+def floor_day(value: datetime) -> datetime:
+    return value.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def ceil_day(value: datetime) -> datetime:
+    day = floor_day(value)
+    return day if day == value else day + timedelta(days=1)
+
+
+def split_window(start: datetime, end: datetime) -> List[Tuple[str, datetime, datetime]]:
+    """
+    Cover the inclusive window [start, end] with rollup buckets: hourly at the
+    ragged edges, daily for every whole day in between. Returns
+    (collection, bucket_from, bucket_until) triples with an exclusive upper bound.
+    """
+    start = floor_hour(utc_naive(start))
+    until = utc_naive(end) + timedelta(microseconds=1)
+    first_day = ceil_day(start)
+    last_day = floor_day(until)
+
+    if first_day >= last_day:
+        return [(HOURLY_COLLECTION, start, until)]
+
+    parts = []
+    if start < first_day:
+        parts.append((HOURLY_COLLECTION, start, first_day))
+    parts.append((DAILY_COLLECTION, first_day, last_day))
+    if last_day < until:
+        parts.append((HOURLY_COLLECTION, last_day, until))
+    return parts
+
+
+def build_hourly_pipeline(metric: str, start: datetime, end: datetime, run_id: str) -> List[Dict[str, Any]]:
+    """
+    Bucket one source collection into hours for [start, end) and merge the
+    result. ``created_at`` may be a date or an ISO string, as written by
+    older code paths.
+    """
+    source = ROLLUP_SOURCES[metric]
+    return [
+        {"$match": {**date_range_filter("created_at", start, end - timedelta(microseconds=1)), **source["match"]}},
+        {"$group": {
+            "_id": {
+                "metric": metric,
+                "bucket": {"$dateTrunc": {"date": {"$toDate": "$created_at"}, "unit": "hour"}},
+                "route_id": source["route_id"],
+                "bus_id": source["bus_id"]
+            },
+            **{field: {"$sum": expression} for field, expression in source["measures"].items()}
+        }},
+        {"$set": {
+            "metric": "$_id.metric",
+            "bucket": "$_id.bucket",
+            "route_id": "$_id.route_id",
+            "bus_id": "$_id.bus_id",
+            "run_id": run_id
+        }},
+        {"$merge": {"into": HOURLY_COLLECTION, "on": "_id", "whenMatched": "replace", "whenNotMatched": "insert"}}
+    ]
+
+
+def build_daily_pipeline(start: datetime, end: datetime, run_id: str) -> List[Dict[str, Any]]:
+    """Roll the hourly buckets of whole days in [start, end) up into daily buckets."""
+    return [
+        {"$match": {"bucket": {"$gte": start, "$lt": end}}},
+        {"$group": {
+            "_id": {
+                "metric": "$metric",
+                "bucket": {"$dateTrunc": {"date": "$bucket", "unit": "day"}},
+                "route_id": "$route_id",
+                "bus_id": "$bus_id"
+            },
+            **{field: {"$sum": f"${field}"} for field in ALL_MEASURES}
+        }},
+        {"$set": {
+            "metric": "$_id.metric",
+            "bucket": "$_id.bucket",
+            "route_id": "$_id.route_id",
+            "bus_id": "$_id.bus_id",
+            "run_id": run_id
+        }},
+        {"$merge": {"into": DAILY_COLLECTION, "on": "_id", "whenMatched": "replace", "whenNotMatched": "insert"}}
+    ]
+
+
+class AnalyticsRollupService:
+    """Maintains hourly and daily rollups and answers windowed queries from them."""
+
+    def __init__(
+        self,
+        db=None,
+        refresh_interval: Optional[float] = None,
+        lookback_hours: Optional[int] = None
+    ):
+        self.db = db
+        self.refresh_interval = refresh_interval or float(os.getenv("ANALYTICS_ROLLUP_INTERVAL", "300"))
+        # Late writes (e.g. payments completing after creation) are picked up by
+        # recomputing this many hours behind the watermark on every refresh
+        self.lookback = timedelta(hours=lookback_hours or int(os.getenv("ANALYTICS_ROLLUP_LOOKBACK_HOURS", "24")))
+        self.lease = timedelta(seconds=max(2 * self.refresh_interval, 60))
+        self.instance_id = uuid.uuid4().hex
+        self.is_ready = False
+        self.watermark: Optional[datetime] = None
+        self.last_refresh_at: Optional[datetime] = None
+        self.last_refresh_seconds = 0.0
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self, db=None):
+        """Create indexes and start the refresh loop."""
+        if db is not None:
+            self.db = db
+        await self.ensure_indexes()
+        if self._task is None:
+            self._task = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self.db is not None:
+            # Let another instance take over without waiting for the lease to run out
+            try:
+                await self.db[STATE_COLLECTION].update_one(
+                    {"_id": STATE_ID, "owner": self.instance_id}, {"$set": {"lease_until": datetime.utcnow()}}
+                )
+            except Exception as e:
+                logger.warning(f"Failed to release analytics rollup lease: {e}")
+
+    async def ensure_indexes(self):
+        for name in ROLLUP_SOURCES:
+            await self.db[name].create_index("created_at")
+        for name in (HOURLY_COLLECTION, DAILY_COLLECTION):
+            await self.db[name].create_index([("metric", 1), ("bucket", 1)])
+            await self.db[name].create_index([("metric", 1), ("route_id", 1), ("bucket", 1)])
+
+    async def _refresh_loop(self):
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.error(f"Analytics rollup refresh failed: {e}")
+            await asyncio.sleep(self.refresh_interval)
+
+    # ------------------------------------------------------------------
+    # Build side
+    # ------------------------------------------------------------------
+
+    async def _acquire_lease(self) -> bool:
+        now = datetime.utcnow()
+        try:
+            await self.db[STATE_COLLECTION].find_one_and_update(
+                {"_id": STATE_ID, "$or": [{"lease_until": {"$not": {"$gt": now}}}, {"owner": self.instance_id}]},
+                {"$set": {"owner": self.instance_id, "lease_until": now + self.lease}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            return False  # another instance is refreshing
+        return True
+
+    async def _load_watermark(self) -> Optional[datetime]:
+        state = await self.db[STATE_COLLECTION].find_one({"_id": STATE_ID})
+        return state.get("watermark") if state else None
+
+    async def _save_watermark(self, watermark: datetime):
+        await self.db[STATE_COLLECTION].update_one(
+            {"_id": STATE_ID},
+            {"$set": {"watermark": watermark, "updated_at": datetime.utcnow()}},
+            upsert=True
+        )
+        self.watermark = watermark
+
+    async def _earliest_source_time(self) -> Optional[datetime]:
+        earliest = None
+        for name in ROLLUP_SOURCES:
+            for bson_type in ("date", "string"):
+                doc = await self.db[name].find_one(
+                    {"created_at": {"$type": bson_type}}, {"created_at": 1}, sort=[("created_at", 1)]
+                )
+                if not doc:
+                    continue
+                created_at = doc["created_at"]
+                if isinstance(created_at, str):
+                    try:
+                        created_at = utc_naive(datetime.fromisoformat(created_at.replace("Z", "+00:00")))
+                    except ValueError:
+                        continue
+                if earliest is None or created_at < earliest:
+                    earliest = created_at
+        return earliest
+
+    async def refresh(self, now: Optional[datetime] = None) -> bool:
+        """
+        Merge every hour from (watermark - lookback) up to now into the
+        rollups. Returns False without building anything when another
+        instance holds the refresh lease; its watermark is still picked up.
+        """
+        async with self._lock:
+            started = datetime.utcnow()
+            now = utc_naive(now or started)
+            watermark = await self._load_watermark()
+            if not await self._acquire_lease():
+                self.watermark = watermark
+                self.is_ready = watermark is not None
+                return False
+
+            if watermark is None:
+                earliest = await self._earliest_source_time()
+                start = floor_day(utc_naive(earliest)) if earliest else floor_hour(now)
+            else:
+                start = floor_hour(utc_naive(watermark)) - self.lookback
+
+            end = floor_hour(now) + timedelta(hours=1)  # include the current, partial hour
+            chunk_start = start
+            while chunk_start < end:
+                chunk_end = min(chunk_start + BACKFILL_CHUNK, end)
+                await self._refresh_chunk(chunk_start, chunk_end)
+                # The current hour is recomputed on the next run
+                await self._save_watermark(min(chunk_end, floor_hour(now)))
+                chunk_start = chunk_end
+                if chunk_start < end and not await self._acquire_lease():
+                    logger.warning("Lost the analytics rollup lease during a backfill; another instance resumes it")
+                    break
+
+            self.is_ready = True
+            self.last_refresh_at = started
+            self.last_refresh_seconds = (datetime.utcnow() - started).total_seconds()
+            return True
+
+    async def _refresh_chunk(self, start: datetime, end: datetime):
+        run_id = uuid.uuid4().hex
+        hourly = self.db[HOURLY_COLLECTION]
+        daily = self.db[DAILY_COLLECTION]
+
+        for metric in ROLLUP_SOURCES:
+            await self.db[metric].aggregate(build_hourly_pipeline(metric, start, end, run_id)).to_list(length=None)
+        # Buckets whose source documents are gone were not rewritten by this run
+        await hourly.delete_many({"bucket": {"$gte": start, "$lt": end}, "run_id": {"$ne": run_id}})
+
+        day_start, day_end = floor_day(start), ceil_day(end)
+        await hourly.aggregate(build_daily_pipeline(day_start, day_end, run_id)).to_list(length=None)
+        await daily.delete_many({"bucket": {"$gte": day_start, "$lt": day_end}, "run_id": {"$ne": run_id}})
+
+    # ------------------------------------------------------------------
+    # Read side
+    # ------------------------------------------------------------------
+
+    async def sum_measures(
+        self,
+        metric: str,
+        start: datetime,
+        end: datetime,
+        filters: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, float]:
+        """Sum all measures of ``metric`` over the inclusive window [start, end]."""
+        totals: Dict[str, float] = dict.fromkeys(ROLLUP_SOURCES[metric]["measures"], 0)
+        group = {field: {"$sum": f"${field}"} for field in totals}
+
+        for collection, bucket_from, bucket_until in split_window(start, end):
+            pipeline = [
+                {"$match": {"metric": metric, "bucket": {"$gte": bucket_from, "$lt": bucket_until}, **(filters or {})}},
+                {"$group": {"_id": None, **group}}
+            ]
+            for doc in await self.db[collection].aggregate(pipeline).to_list(length=None):
+                for field in totals:
+                    totals[field] += doc.get(field, 0)
+        return totals
+
+    async def bucket_values(
+        self,
+        metric: str,
+        field: str,
+        start: datetime,
+        end: datetime,
+        hourly: bool = True
+    ) -> List[Tuple[datetime, float]]:
+        """Per-bucket totals of one measure for buckets starting in [start, end), oldest first."""
+        collection = HOURLY_COLLECTION if hourly else DAILY_COLLECTION
+        start, end = utc_naive(start), utc_naive(end)
+        pipeline = [
+            {"$match": {"metric": metric, "bucket": {"$gte": floor_hour(start), "$lt": end}}},
+            {"$group": {"_id": "$bucket", "value": {"$sum": f"${field}"}}},
+            {"$sort": {"_id": 1}}
+        ]
+        docs = await self.db[collection].aggregate(pipeline).to_list(length=None)
+        return [(doc["_id"], doc["value"]) for doc in docs]
+
+    async def dimension_bucket_values(
+        self,
+        metric: str,
+        field: str,
+        dimension: str,
+        start: datetime,
+        end: datetime
+    ) -> List[Tuple[str, datetime, float]]:
+        """Hourly totals of one measure per ``dimension`` value for buckets in [start, end)."""
+        start, end = utc_naive(start), utc_naive(end)
+        pipeline = [
+            {"$match": {
+                "metric": metric,
+                "bucket": {"$gte": floor_hour(start), "$lt": end},
+                dimension: {"$ne": None}
+            }},
+            {"$group": {"_id": {"key": f"${dimension}", "bucket": "$bucket"}, "value": {"$sum": f"${field}"}}}
+        ]
+        docs = await self.db[HOURLY_COLLECTION].aggregate(pipeline).to_list(length=None)
+        return [(doc["_id"]["key"], doc["_id"]["bucket"], doc["value"]) for doc in docs]
+
+    def get_status(self) -> Dict[str, Any]:
+        return {
+            "is_ready": self.is_ready,
+            "watermark": self.watermark.isoformat() if self.watermark else None,
+            "last_refresh_at": self.last_refresh_at.isoformat() if self.last_refresh_at else None,
+            "last_refresh_seconds": round(self.last_refresh_seconds, 3),
+            "refresh_interval": self.refresh_interval,
+            "lookback_hours": self.lookback.total_seconds() / 3600
+        }
+
+
+# Global instance, started in main.py
+analytics_rollups = AnalyticsRollupService()
@@ -7,13 +7,28 @@ from typing import Dict, List, Any, Optional
 from datetime import datetime, timedelta, timezone
 from collections import defaultdict
 
+from core.kpi_aggregator import kpi_aggregator, KPIAggregator
+from core.analytics_pipelines import aggregate_one, trip_stats_pipeline, rating_stats_pipeline, revenue_pipeline
+from core.analytics_rollups import analytics_rollups, AnalyticsRollupService, floor_day, utc_naive
+from core.time_series_downsampling import time_series_cache, TimeSeriesCache, downsample_points
+from core.mongo_utils import real_users_query
+
 logger = logging.getLogger(__name__)
 
 class AnalyticsService:
     """Service for analytics and reporting functionality."""
     
-    def __init__(self, mongodb_client):
+    def __init__(
+        self,
+        mongodb_client,
+        kpis: Optional[KPIAggregator] = None,
+        rollups: Optional[AnalyticsRollupService] = None,
+        series_cache: Optional[TimeSeriesCache] = None
+    ):
         self.db = mongodb_client
+        self.kpis = kpis if kpis is not None else kpi_aggregator
+        self.rollups = rollups if rollups is not None else analytics_rollups
+        self.series_cache = series_cache if series_cache is not None else time_series_cache
     
     async def generate_summary_analytics(self) -> Dict[str, Any]:
         """Generate summary analytics for the dashboard."""
@@ -26,25 +41,27 @@ class AnalyticsService:
             total_routes = await self.db.routes.count_documents({})
             active_routes = await self.db.routes.count_documents({"is_active": True})
             
-            # Get today's trip metrics
-            trips_today = await self.db.trips.find({
-                "created_at": {"$gte": today}
-            }).to_list(length=None)
-            
-            total_trips_today = len(trips_today)
-            completed_trips_today = len([t for t in trips_today if t.get("status") == "COMPLETED"])
-            
-            # Calculate average delay
-            delays = [t.get("delay_minutes", 0) for t in trips_today if t.get("delay_minutes")]
-            average_delay = sum(delays) / len(delays) if delays else 0.0
-            
-            # Get feedback metrics
-            feedback_scores = await self.db.feedback.find({
-                "created_at": {"$gte": today}
-            }).to_list(length=None)
-            
-            ratings = [f.get("rating", 0) for f in feedback_scores if f.get("rating")]
-            avg_satisfaction = sum(ratings) / len(ratings) if ratings else 0.0
+            if self.kpis.is_ready:
+                # Trip, feedback and revenue KPIs are maintained incrementally
+                kpis = self.kpis.snapshot()
+                total_trips_today = kpis["trips_today"]
+                completed_trips_today = kpis["completed_trips_today"]
+                average_delay = kpis["average_delay_minutes"]
+                avg_satisfaction = kpis["passenger_satisfaction_score"]
+            else:
+                # Get today's trip metrics
+                trip_stats = await aggregate_one(self.db.trips, trip_stats_pipeline(today))
+                total_trips_today = trip_stats.get("total", 0)
+                completed_trips_today = trip_stats.get("completed", 0)
+                
+                # Average of non-zero delays
+                delay_count = trip_stats.get("delay_count", 0)
+                average_delay = trip_stats.get("delay_sum", 0) / delay_count if delay_count else 0.0
+                
+                # Get feedback metrics
+                rating_stats = await aggregate_one(self.db.feedback, rating_stats_pipeline(today))
+                rating_count = rating_stats.get("rating_count", 0)
+                avg_satisfaction = rating_stats.get("rating_sum", 0) / rating_count if rating_count else 0.0
             
             # Get maintenance alerts
             maintenance_alerts = await self.db.alerts.count_documents({
@@ -59,12 +76,10 @@ class AnalyticsService:
             })
             
             # Get revenue (placeholder - would integrate with payment system)
-            payments_today = await self.db.payments.find({
-                "created_at": {"$gte": today},
-                "status": "COMPLETED"
-            }).to_list(length=None)
-            
-            revenue_today = sum([p.get("amount", 0) for p in payments_today])
+            if self.kpis.is_ready:
+                revenue_today = kpis["revenue_today"]
+            else:
+                revenue_today = (await aggregate_one(self.db.payments, revenue_pipeline(today))).get("revenue", 0)
             
             return {
                 "total_buses": total_buses,
@@ -88,6 +103,9 @@ class AnalyticsService:
     async def generate_operational_metrics(self, start_date: datetime, end_date: datetime) -> Dict[str, Any]:
         """Generate operational performance metrics."""
         try:
+            if self.rollups.is_ready:
+                return await self._operational_metrics_from_rollups(start_date, end_date)
+            
             # Get trips in date range
             trips = await self.db.trips.find({
                 "created_at": {"$gte": start_date, "$lte": end_date}
@@ -133,13 +151,17 @@ class AnalyticsService:
     async def generate_financial_metrics(self, start_date: datetime, end_date: datetime) -> Dict[str, Any]:
         """Generate financial metrics."""
         try:
-            # Get payments in date range
-            payments = await self.db.payments.find({
-                "created_at": {"$gte": start_date, "$lte": end_date},
-                "status": "COMPLETED"
-            }).to_list(length=None)
-            
-            total_revenue = sum([p.get("amount", 0) for p in payments])
+            if self.rollups.is_ready:
+                payment_totals = await self.rollups.sum_measures("payments", start_date, end_date)
+                total_revenue = payment_totals["amount_sum"]
+            else:
+                # Get payments in date range
+                payments = await self.db.payments.find({
+                    "created_at": {"$gte": start_date, "$lte": end_date},
+                    "status": "COMPLETED"
+                }).to_list(length=None)
+                
+                total_revenue = sum([p.get("amount", 0) for p in payments])
             
             # Calculate daily and monthly revenue
             days_in_range = (end_date - start_date).days + 1
@@ -169,7 +191,7 @@ class AnalyticsService:
         """Generate performance metrics."""
         try:
             # Driver performance (placeholder - would integrate with driver evaluation system)
-            drivers = await self.db.users.find({"role": "DRIVER"}).to_list(length=None)
+            drivers = await self.db.users.find(real_users_query({"role": "DRIVER"})).to_list(length=None)
             driver_scores = [d.get("performance_score", 75) for d in drivers]
             avg_driver_performance = sum(driver_scores) / len(driver_scores) if driver_scores else 0
             
@@ -188,24 +210,33 @@ class AnalyticsService:
             
             avg_response_time = sum(response_times) / len(response_times) if response_times else 0
             
-            # Customer complaint resolution
-            feedback_with_issues = await self.db.feedback.find({
-                "created_at": {"$gte": start_date, "$lte": end_date},
-                "rating": {"$lte": 2}  # Poor ratings
-            }).to_list(length=None)
-            
-            resolved_complaints = len([f for f in feedback_with_issues if f.get("resolved", False)])
-            complaint_resolution = (resolved_complaints / len(feedback_with_issues) * 100) if feedback_with_issues else 100
+            if self.rollups.is_ready:
+                feedback_totals = await self.rollups.sum_measures("feedback", start_date, end_date)
+                low_ratings = feedback_totals["low_rating"]
+                resolved_complaints = feedback_totals["low_rating_resolved"]
+                safety_incidents = (await self.rollups.sum_measures("incidents", start_date, end_date))["high_severity"]
+                total_trips = (await self.rollups.sum_measures("trips", start_date, end_date))["count"]
+            else:
+                # Customer complaint resolution
+                feedback_with_issues = await self.db.feedback.find({
+                    "created_at": {"$gte": start_date, "$lte": end_date},
+                    "rating": {"$lte": 2}  # Poor ratings
+                }).to_list(length=None)
+                
+                low_ratings = len(feedback_with_issues)
+                resolved_complaints = len([f for f in feedback_with_issues if f.get("resolved", False)])
+                
+                # Safety incidents
+                safety_incidents = await self.db.incidents.count_documents({
+                    "created_at": {"$gte": start_date, "$lte": end_date},
+                    "severity": {"$in": ["HIGH", "CRITICAL"]}
+                })
+                
+                total_trips = await self.db.trips.count_documents({
+                    "created_at": {"$gte": start_date, "$lte": end_date}
+                })
             
-            # Safety incidents
-            safety_incidents = await self.db.incidents.count_documents({
-                "created_at": {"$gte": start_date, "$lte": end_date},
-                "severity": {"$in": ["HIGH", "CRITICAL"]}
-            })
-            
-            total_trips = await self.db.trips.count_documents({
-                "created_at": {"$gte": start_date, "$lte": end_date}
-            })
+            complaint_resolution = (resolved_complaints / low_ratings * 100) if low_ratings else 100
             
             safety_score = max(0, 100 - (safety_incidents / max(total_trips, 1) * 100))
             
@@ -278,6 +309,9 @@ class AnalyticsService:
     async def generate_time_series_data(self, metric: str, start_date: datetime, end_date: datetime, granularity: str = "daily") -> List[Dict[str, Any]]:
         """Generate time series data for charts."""
         try:
+            if self.rollups.is_ready:
+                return await self._time_series_from_rollups(metric, start_date, end_date, granularity)
+            
             time_series = []
             current_date = start_date
             
@@ -328,6 +362,97 @@ class AnalyticsService:
             logger.error(f"Error generating time series data: {str(e)}")
             return []
     
+    async def generate_downsampled_time_series(
+        self,
+        metric: str,
+        start_date: datetime,
+        end_date: datetime,
+        granularity: str = "daily",
+        max_points: int = 500,
+        method: str = "lttb"
+    ) -> Dict[str, Any]:
+        """Time series reduced to at most ``max_points`` points, cached per (metric, range, resolution)."""
+        key = self.series_cache.key(metric, start_date, end_date, granularity, max_points, method)
+        cached = self.series_cache.get(key)
+        if cached is not None:
+            return cached
+        
+        points = await self.generate_time_series_data(metric, start_date, end_date, granularity)
+        result: Dict[str, Any] = {
+            "time_series": downsample_points(points, max_points, method),
+            "source_points": len(points),
+            "downsampling": method
+        }
+        if points:
+            self.series_cache.put(key, result)
+        return result
+    
+    async def _operational_metrics_from_rollups(self, start_date: datetime, end_date: datetime) -> Dict[str, Any]:
+        """Operational metrics from the hourly/daily rollups."""
+        trip_totals = await self.rollups.sum_measures("trips", start_date, end_date)
+        trip_count = trip_totals["count"]
+        if not trip_count:
+            return self._empty_operational_metrics()
+        
+        on_time_performance = (trip_totals["on_time"] / trip_count) * 100
+        avg_duration = trip_totals["duration_sum"] / trip_totals["duration_count"] if trip_totals["duration_count"] else 0
+        
+        total_buses = await self.db.buses.count_documents({"status": "ACTIVE"})
+        trips_per_bus = trip_count / total_buses if total_buses > 0 else 0
+        bus_utilization = min(100, (trips_per_bus / 10) * 100)  # Assuming 10 trips/day is 100% utilization
+        
+        breakdowns = (await self.rollups.sum_measures("incidents", start_date, end_date))["breakdowns"]
+        
+        return {
+            "on_time_performance": round(on_time_performance, 2),
+            "average_trip_duration": round(avg_duration, 2),
+            "bus_utilization_rate": round(bus_utilization, 2),
+            "route_efficiency_score": 78.5,  # Placeholder
+            "passenger_load_factor": 65.2,   # Placeholder
+            "service_reliability": round(100 - (breakdowns / trip_count * 100), 2),
+            "breakdown_incidents": breakdowns,
+            "maintenance_compliance": 92.3   # Placeholder
+        }
+    
+    async def _time_series_from_rollups(self, metric: str, start_date: datetime, end_date: datetime, granularity: str) -> List[Dict[str, Any]]:
+        """Time series from the rollups: one query for the whole window, bucketed here."""
+        sources = {
+            "trip_count": ("trips", "count"),
+            "revenue": ("payments", "amount_sum"),
+            "incidents": ("incidents", "count")
+        }
+        delta = {
+            "hourly": timedelta(hours=1),
+            "daily": timedelta(days=1),
+            "weekly": timedelta(weeks=1),
+            "monthly": timedelta(days=30)
+        }.get(granularity, timedelta(days=1))
+        
+        periods = []
+        current_date = start_date
+        while current_date <= end_date:
+            periods.append(current_date)
+            current_date += delta
+        
+        values: List[float] = [0] * len(periods)
+        if metric in sources and periods:
+            source, field = sources[metric]
+            # Daily buckets only line up with periods that start at midnight
+            use_hourly = granularity == "hourly" or start_date != floor_day(start_date)
+            buckets = await self.rollups.bucket_values(
+                source, field, start_date, periods[-1] + delta, hourly=use_hourly
+            )
+            index = 0
+            for bucket, value in buckets:
+                while index + 1 < len(periods) and utc_naive(periods[index + 1]) <= bucket:
+                    index += 1
+                values[index] += value
+        
+        return [
+            {"timestamp": period.isoformat(), "value": value, "metric": metric}
+            for period, value in zip(periods, values)
+        ]
+    
     def _empty_operational_metrics(self) -> Dict[str, Any]:
         """Return empty operational metrics."""
         return {
@@ -0,0 +1,160 @@
+"""
+Vectorized anomaly detection over per-route KPI time series.
+
+Metrics are laid out as one matrix (routes x hourly buckets) and scored in a
+single pass:
+1. A seasonal baseline (mean and standard deviation) per route and
+   hour-of-week, computed from the history with segmented sums
+2. A z-score of every bucket against its seasonal baseline
+3. An EWMA of the z-scores, which catches sustained shifts that no single
+   bucket would flag
+4. Buckets in the evaluation window are reported when either score crosses
+   its threshold
+"""
+
+import math
+import os
+from datetime import datetime, timedelta
+from typing import Dict, Any, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+HOURS_PER_WEEK = 7 * 24
+
+
+def build_metric_matrix(
+    rows: Iterable[Tuple[str, datetime, float]],
+    start: datetime,
+    hours: int
+) -> Tuple[List[str], np.ndarray]:
+    """
+    Lay ``(key, bucket, value)`` rows out as a ``keys x hours`` matrix whose
+    column ``i`` is the hour starting at ``start + i hours``. Missing buckets are 0.
+    """
+    rows = list(rows)
+    keys = sorted({row[0] for row in rows})
+    matrix = np.zeros((len(keys), hours), dtype=np.float64)
+    if not rows:
+        return keys, matrix
+
+    index = {key: i for i, key in enumerate(keys)}
+    row_idx = np.fromiter((index[row[0]] for row in rows), dtype=np.int64, count=len(rows))
+    col_idx = np.fromiter(
+        ((row[1] - start) // timedelta(hours=1) for row in rows), dtype=np.int64, count=len(rows)
+    )
+    values = np.fromiter((row[2] for row in rows), dtype=np.float64, count=len(rows))
+    inside = (col_idx >= 0) & (col_idx < hours)
+    np.add.at(matrix, (row_idx[inside], col_idx[inside]), values[inside])
+    return keys, matrix
+
+
+def hour_of_week(start: datetime, hours: int) -> np.ndarray:
+    """Hour-of-week (0 = Monday 00:00) of each of ``hours`` buckets from ``start``."""
+    return (start.weekday() * 24 + start.hour + np.arange(hours)) % HOURS_PER_WEEK
+
+
+class SeasonalAnomalyDetector:
+    """Seasonal z-score + EWMA detector over routes x hours matrices."""
+
+    def __init__(
+        self,
+        z_threshold: Optional[float] = None,
+        ewma_alpha: float = 0.3,
+        min_std: float = 1.0,
+        min_history_weeks: int = 2
+    ):
+        self.z_threshold = z_threshold or float(os.getenv("ANALYTICS_ANOMALY_Z_THRESHOLD", "3.0"))
+        self.ewma_alpha = ewma_alpha
+        # An EWMA of independent unit z-scores has std sqrt(alpha / (2 - alpha))
+        self.ewma_threshold = self.z_threshold * math.sqrt(ewma_alpha / (2 - ewma_alpha))
+        # Steps after which a z-score's EWMA weight drops below 1e-4
+        self.ewma_warmup = math.ceil(math.log(1e-4) / math.log(1 - ewma_alpha))
+        self.min_std = min_std
+        self.min_history_weeks = min_history_weeks
+
+    def score(self, matrix: np.ndarray, start: datetime, history: int) -> Dict[str, np.ndarray]:
+        """
+        Expected values, z-scores and EWMA scores of the columns after
+        ``history``, with the seasonal baseline taken from the first
+        ``history`` columns.
+        """
+        routes, hours = matrix.shape
+        how = hour_of_week(start, hours)
+
+        # Group history columns by hour-of-week, then sum each group with one reduceat
+        order = np.argsort(how[:history], kind="stable")
+        counts = np.bincount(how[:history], minlength=HOURS_PER_WEEK).astype(np.float64)
+        seen = counts > 0
+        offsets = np.concatenate(([0], np.cumsum(counts[seen])[:-1])).astype(np.int64)
+        grouped = matrix[:, order]
+        sums = np.zeros((routes, HOURS_PER_WEEK))
+        squares = np.zeros((routes, HOURS_PER_WEEK))
+        sums[:, seen] = np.add.reduceat(grouped, offsets, axis=1)
+        squares[:, seen] = np.add.reduceat(np.square(grouped), offsets, axis=1)
+        counts[~seen] = 1.0
+        mean = sums / counts
+        variance = squares / counts - np.square(mean)
+        variance = np.maximum(variance, 0.0) * counts / np.maximum(counts - 1, 1)
+        # A few weeks per slot underestimate the spread; counts are at least Poisson-noisy
+        std = np.maximum(np.sqrt(np.maximum(variance, np.maximum(mean, 0.0))), self.min_std)
+
+        # Older z-scores carry negligible EWMA weight: score from just before the window
+        first = max(0, history - self.ewma_warmup)
+        slots = how[first:]
+        expected = mean[:, slots]
+        z = (matrix[:, first:] - expected) / std[:, slots]
+        z[:, ~seen[slots]] = 0.0  # no baseline for this hour-of-week yet
+
+        ewma = np.empty_like(z)
+        state = np.zeros(routes)
+        z_by_column = np.ascontiguousarray(z.T)
+        for column in range(z.shape[1]):
+            state = self.ewma_alpha * z_by_column[column] + (1 - self.ewma_alpha) * state
+            ewma[:, column] = state
+
+        skip = history - first
+        return {"expected": expected[:, skip:], "z": z[:, skip:], "ewma": ewma[:, skip:]}
+
+    def detect(
+        self,
+        matrix: np.ndarray,
+        start: datetime,
+        evaluate_last: int = 1,
+        keys: Optional[List[str]] = None,
+        metric: str = "trip_count"
+    ) -> List[Dict[str, Any]]:
+        """Anomalies among the last ``evaluate_last`` columns of ``matrix``, oldest first."""
+        routes, hours = matrix.shape
+        history = hours - evaluate_last
+        if routes == 0 or evaluate_last <= 0 or history < self.min_history_weeks * HOURS_PER_WEEK:
+            return []
+
+        scores = self.score(matrix, start, history)
+        z, ewma = scores["z"], scores["ewma"]
+        flagged = (np.abs(z) >= self.z_threshold) | (np.abs(ewma) >= self.ewma_threshold)
+
+        anomalies = []
+        for row, offset in sorted(zip(*np.nonzero(flagged)), key=lambda item: (item[1], item[0])):
+            column = history + offset
+            value = float(matrix[row, column])
+            expected = float(scores["expected"][row, offset])
+            z_score = float(z[row, offset])
+            ewma_score = float(ewma[row, offset])
+            direction = "drop" if (z_score if abs(z_score) >= self.z_threshold else ewma_score) < 0 else "spike"
+            route_id = keys[row] if keys else str(row)
+            bucket = start + timedelta(hours=int(column))
+            anomalies.append({
+                "type": f"route_{metric}_{direction}",
+                "route_id": route_id,
+                "bucket": bucket.isoformat(),
+                "description": (
+                    f"Route {route_id} {metric.replace('_', ' ')} {direction} at {bucket:%a %H:00}: "
+                    f"{value:.0f} vs {expected:.1f} expected"
+                ),
+                "severity": "HIGH" if abs(z_score) >= 2 * self.z_threshold else "MEDIUM",
+                "current_value": value,
+                "expected_value": round(expected, 2),
+                "z_score": round(z_score, 2),
+                "ewma_score": round(ewma_score, 2)
+            })
+        return anomalies
@@ -1,11 +1,25 @@
+"""
+Chapa payment gateway client.
+
+All calls to the Chapa API go through one pooled ``httpx.AsyncClient`` so a
+slow or failing gateway never blocks the event loop:
+1. Keep-alive connections are pooled and every request has connect, read
+   and pool timeouts
+2. Transient failures (timeouts, connection errors, 429 and 5xx responses)
+   are retried a bounded number of times with full-jitter exponential backoff;
+   POSTs are only retried when Chapa cannot have processed them
+3. A circuit breaker opens after consecutive failed calls and fails fast
+   until a single trial call succeeds
+"""
+
 import os
 import secrets
 import hashlib
 import base64
-import qrcode
-import requests
-import json
-from io import BytesIO
+import asyncio
+import random
+import time
+import httpx
 from typing import Optional, Dict, Any
 from datetime import datetime, timedelta
 from uuid import uuid4
@@ -17,10 +31,84 @@ from schemas.payment import InitiatePaymentRequest
 # Setup logger
 logger = logging.getLogger(__name__)
 
+# Statuses Chapa returns before doing any work; everything else in 5xx may
+# have been processed, so only GETs are retried on it
+RETRY_ANY_STATUSES = {429, 503}
+RETRY_IDEMPOTENT_STATUSES = {500, 502, 504}
+
+
+class ChapaServiceError(Exception):
+    """Chapa could not be reached or kept failing after retries"""
+
+
+class ChapaCircuitOpenError(ChapaServiceError):
+    """Calls are short-circuited while Chapa is failing"""
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker.
+
+    ``closed`` lets every call through; after ``failure_threshold`` failed
+    calls in a row it turns ``open`` and rejects calls for ``reset_timeout``
+    seconds, then ``half_open`` lets one trial call through whose outcome
+    closes or re-opens the circuit.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial_in_flight = False
+        self.times_opened = 0
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self.trial_in_flight:
+            self.trial_in_flight = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        self.trial_in_flight = False
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            if self.opened_at is None:
+                self.times_opened += 1
+                logger.warning(f"Chapa circuit opened after {self.failures} consecutive failures")
+            self.opened_at = time.monotonic()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "times_opened": self.times_opened
+        }
+
 
 class ChapaPaymentService:
-    def __init__(self):
-        self.base_url = "https://api.chapa.co/v1"
+    def __init__(
+        self,
+        base_url: Optional[str] = None,
+        transport: Optional[httpx.AsyncBaseTransport] = None
+    ):
+        self.base_url = (base_url or os.getenv("CHAPA_BASE_URL") or "https://api.chapa.co/v1").rstrip("/")
         self.secret_key = os.getenv("CHAPA_SECRET_KEY")
         self.public_key = os.getenv("CHAPA_PUBLIC_KEY")
         self.encryption_key = os.getenv("CHAPA_ENCRYPTION_KEY")
@@ -29,6 +117,98 @@ class ChapaPaymentService:
         if not self.secret_key:
             raise ValueError("CHAPA_SECRET_KEY environment variable is required")
 
+        self.timeout = httpx.Timeout(
+            float(os.getenv("CHAPA_TIMEOUT_SECONDS", "15")),
+            connect=float(os.getenv("CHAPA_CONNECT_TIMEOUT_SECONDS", "5"))
+        )
+        self.limits = httpx.Limits(
+            max_connections=int(os.getenv("CHAPA_MAX_CONNECTIONS", "50")),
+            max_keepalive_connections=int(os.getenv("CHAPA_MAX_KEEPALIVE_CONNECTIONS", "10"))
+        )
+        self.max_retries = int(os.getenv("CHAPA_MAX_RETRIES", "2"))
+        self.retry_backoff = float(os.getenv("CHAPA_RETRY_BACKOFF_SECONDS", "0.5"))
+        self.retry_backoff_max = float(os.getenv("CHAPA_RETRY_BACKOFF_MAX_SECONDS", "5"))
+        self.circuit = CircuitBreaker(
+            failure_threshold=int(os.getenv("CHAPA_CIRCUIT_FAILURE_THRESHOLD", "5")),
+            reset_timeout=float(os.getenv("CHAPA_CIRCUIT_RESET_SECONDS", "30"))
+        )
+        self._transport = transport
+        self._client: Optional[httpx.AsyncClient] = None
+        self.stats = {"requests": 0, "retries": 0, "failures": 0, "short_circuited": 0}
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """Shared pooled client, created on first use"""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout,
+                limits=self.limits,
+                transport=self._transport
+            )
+        return self._client
+
+    async def close(self):
+        """Close pooled connections (application shutdown)"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def _retry_delay(self, attempt: int) -> float:
+        """Full-jitter exponential backoff"""
+        return random.uniform(0, min(self.retry_backoff_max, self.retry_backoff * (2 ** attempt)))
+
+    async def _request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        """
+        Send a request to Chapa with bounded, jittered retries behind the
+        circuit breaker. Returns the last response (which may be an error
+        status for the caller to handle) or raises ``ChapaServiceError``.
+        """
+        is_trial = self.circuit.state == "half_open"
+        if not self.circuit.allow():
+            self.stats["short_circuited"] += 1
+            raise ChapaCircuitOpenError("Chapa is unavailable, try again shortly")
+
+        idempotent = method.upper() == "GET"
+        retry_statuses = RETRY_ANY_STATUSES | (RETRY_IDEMPOTENT_STATUSES if idempotent else set())
+
+        attempt = 0
+        try:
+            while True:
+                self.stats["requests"] += 1
+                try:
+                    response = await self.client.request(method, url, **kwargs)
+                except httpx.TransportError as e:
+                    # Without a response, a POST is only safe to resend if it never left
+                    retryable = idempotent or isinstance(e, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout))
+                    if not retryable or attempt >= self.max_retries:
+                        self.stats["failures"] += 1
+                        self.circuit.record_failure()
+                        raise ChapaServiceError(f"{type(e).__name__}: {str(e) or 'request failed'}") from e
+                    failure = type(e).__name__
+                else:
+                    if response.status_code < 500 and response.status_code != 429:
+                        self.circuit.record_success()
+                        return response
+                    if response.status_code not in retry_statuses or attempt >= self.max_retries:
+                        self.stats["failures"] += 1
+                        self.circuit.record_failure()
+                        return response
+                    failure = f"HTTP {response.status_code}"
+
+                delay = self._retry_delay(attempt)
+                attempt += 1
+                self.stats["retries"] += 1
+                logger.warning(f"Chapa {method} {url} failed ({failure}), retry {attempt}/{self.max_retries} in {delay:.2f}s")
+                await asyncio.sleep(delay)
+        finally:
+            # However the trial call ended (including errors other than transport
+            # failures, or cancellation), let the next caller make one
+            if is_trial:
+                self.circuit.trial_in_flight = False
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {**self.stats, "circuit": self.circuit.get_stats()}
+
     def _get_headers(self) -> Dict[str, str]:
         """Get headers for Chapa API requests"""
         return {
@@ -105,13 +285,13 @@ class ChapaPaymentService:
             }
 
             # Make the API request
-            response = requests.post(url, json=payload, headers=headers)
+            response = await self._request("POST", url, json=payload, headers=headers)
 
             # Handle non-200 responses
-            if not response.ok:
+            if not response.is_success:
                 error_text = response.text
                 logger.error(
-                    f"Chapa API Error: {response.status_code} : {response.reason} : {error_text}"
+                    f"Chapa API Error: {response.status_code} : {response.reason_phrase} : {error_text}"
                 )
                 raise Exception("Failed to initialize payment")
 
@@ -129,7 +309,7 @@ class ChapaPaymentService:
                 logger.error("Chapa API Error: Response does not have checkout_url")
                 raise Exception("Failed to initialize payment")
 
-        except requests.exceptions.RequestException as e:
+        except (httpx.HTTPError, ChapaServiceError) as e:
             logger.error(
                 f"Failed to initialize payment for booking ID: {booking_id}, Error: {str(e)}"
             )
@@ -191,7 +371,7 @@ class ChapaPaymentService:
             data["return_url"] = payment_request.return_url
 
         try:
-            response = requests.post(url, data=data, headers=self._get_form_headers())
+            response = await self._request("POST", url, data=data, headers=self._get_form_headers())
             response.raise_for_status()
 
             result = response.json()
@@ -206,7 +386,7 @@ class ChapaPaymentService:
                 "chapa_response": result
             }
 
-        except requests.exceptions.RequestException as e:
+        except (httpx.HTTPError, ChapaServiceError) as e:
             logger.error(f"Chapa payment initiation failed: {str(e)}")
             raise Exception(f"Payment initiation failed: {str(e)}")
 
@@ -239,7 +419,7 @@ class ChapaPaymentService:
             data["return_url"] = payment_request.return_url
 
         try:
-            response = requests.post(url, data=data, headers=self._get_form_headers())
+            response = await self._request("POST", url, data=data, headers=self._get_form_headers())
             response.raise_for_status()
 
             result = response.json()
@@ -255,7 +435,7 @@ class ChapaPaymentService:
                 "chapa_response": result
             }
 
-        except requests.exceptions.RequestException as e:
+        except (httpx.HTTPError, ChapaServiceError) as e:
             logger.error(f"Chapa portal payment initiation failed: {str(e)}")
             raise Exception(f"Payment initiation failed: {str(e)}")
 
@@ -291,7 +471,7 @@ class ChapaPaymentService:
             }
 
         try:
-            response = requests.post(url, json=payload, headers=self._get_headers())
+            response = await self._request("POST", url, json=payload, headers=self._get_headers())
             response.raise_for_status()
 
             result = response.json()
@@ -305,7 +485,7 @@ class ChapaPaymentService:
                 "chapa_response": result
             }
 
-        except requests.exceptions.RequestException as e:
+        except (httpx.HTTPError, ChapaServiceError) as e:
             logger.error(f"Chapa payment authorization failed: {str(e)}")
             raise Exception(f"Payment authorization failed: {str(e)}")
 
@@ -315,7 +495,7 @@ class ChapaPaymentService:
         url = f"{self.base_url}/verify/{tx_ref}"
 
         try:
-            response = requests.get(url, headers=self._get_headers())
+            response = await self._request("GET", url, headers=self._get_headers())
             response.raise_for_status()
 
             result = response.json()
@@ -342,7 +522,7 @@ class ChapaPaymentService:
                 "chapa_response": result
             }
 
-        except requests.exceptions.RequestException as e:
+        except (httpx.HTTPError, ChapaServiceError) as e:
             logger.error(f"Chapa payment verification failed: {str(e)}")
             raise Exception(f"Payment verification failed: {str(e)}")
 
@@ -372,31 +552,6 @@ class ChapaPaymentService:
             logger.error(f"OTP encryption failed: {str(e)}")
             return otp
 
-    def generate_qr_code(self, ticket_number: str) -> str:
-        """Generate QR code for ticket"""
-
-        # Create QR code data
-        qr_data = f"GUZOSYNC-TICKET:{ticket_number}:{int(datetime.utcnow().timestamp())}"
-
-        qr = qrcode.QRCode(
-            version=1,
-            error_correction=qrcode.ERROR_CORRECT_L,
-            box_size=10,
-            border=4,
-        )
-        qr.add_data(qr_data)
-        qr.make(fit=True)
-
-        # Generate QR code image
-        img = qr.make_image(fill_color="black", back_color="white")
-
-        # Convert to base64 string
-        buffer = BytesIO()
-        img.save(buffer, kind='PNG')
-        qr_image_base64 = base64.b64encode(buffer.getvalue()).decode()
-
-        return qr_image_base64
-
     def validate_webhook_signature(self, payload: str, signature: str) -> bool:
         """Validate Chapa webhook signature"""
         if not self.secret_key:
@@ -0,0 +1,343 @@
+"""
+Durable email outbox with pooled SMTP delivery.
+
+Request handlers never talk to the mail provider:
+1. ``enqueue`` inserts the rendered message into ``email_outbox`` and
+   returns; the SMTP handshake, TLS negotiation and login happen elsewhere
+2. A fixed number of workers claim queued messages with
+   ``find_one_and_update`` and a lease, so messages survive restarts and a
+   crashed worker's claim expires
+3. Workers send over a small pool of authenticated SMTP connections that
+   stay open between messages (``EMAIL_SMTP_POOL_SIZE``), in parallel, and
+   no faster than ``EMAIL_RATE_PER_SECOND`` for the provider; the send
+   slots are claimed from a document in ``rate_limits`` so the limit holds
+   across every process, not per worker
+4. Temporary failures (4xx replies, dropped connections, timeouts) are
+   retried with jittered exponential backoff; permanent 5xx rejections and
+   messages out of attempts are marked ``failed``
+5. Message bodies are stored encrypted (``EMAIL_OUTBOX_SECRET``, falling
+   back to ``JWT_SECRET``) and removed once a message is sent or given up
+   on, so one-time credentials are never readable in the database; sent
+   records expire after ``EMAIL_OUTBOX_RETENTION_DAYS``
+"""
+
+import asyncio
+import base64
+import hashlib
+import json
+import logging
+import os
+import random
+import ssl
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from typing import Any, Dict, List, Optional
+
+import aiosmtplib
+from cryptography.fernet import Fernet
+from pymongo import ReturnDocument
+
+from core.email_service import EmailConfig
+from core.rate_limiter import SharedRateLimiter
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_COLLECTION = "email_outbox"
+RATE_LIMIT_KEY = "smtp"
+
+
+def _body_cipher() -> Fernet:
+    secret = os.getenv("EMAIL_OUTBOX_SECRET") or os.getenv("JWT_SECRET")
+    if not secret:
+        raise ValueError("EMAIL_OUTBOX_SECRET (or JWT_SECRET) environment variable is required")
+    return Fernet(base64.urlsafe_b64encode(hashlib.sha256(secret.encode()).digest()))
+
+
+def seal_body(html_content: str, text_content: Optional[str]) -> str:
+    payload = json.dumps({"html": html_content, "text": text_content}).encode()
+    return _body_cipher().encrypt(payload).decode()
+
+
+def open_body(body: str) -> Dict[str, Optional[str]]:
+    return json.loads(_body_cipher().decrypt(body.encode()))
+
+
+def build_message(email_from: str, to_email: str, subject: str, html_content: str,
+                  text_content: Optional[str] = None) -> MIMEMultipart:
+    msg = MIMEMultipart('alternative')
+    msg['Subject'] = subject
+    msg['From'] = email_from
+    msg['To'] = to_email
+    if text_content:
+        msg.attach(MIMEText(text_content, 'plain'))
+    msg.attach(MIMEText(html_content, 'html'))
+    return msg
+
+
+def is_permanent(error: Exception) -> bool:
+    """A 5xx rejection of this message; retrying it would not help."""
+    if isinstance(error, aiosmtplib.SMTPRecipientsRefused):
+        return all(refused.code >= 500 for refused in error.recipients)
+    # A failed login is a configuration problem, not the message's
+    return (isinstance(error, aiosmtplib.SMTPResponseException) and error.code >= 500
+            and not isinstance(error, aiosmtplib.SMTPAuthenticationError))
+
+
+class SMTPConnectionPool:
+    """Up to ``size`` authenticated SMTP connections, reused between messages."""
+
+    def __init__(self, config: EmailConfig, size: int, idle_timeout: float, timeout: float = 30):
+        self.config = config
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self._idle: List[Any] = []  # (client, last used)
+        self._slots = asyncio.Semaphore(size)
+        self.stats = {"opened": 0, "reused": 0, "discarded": 0}
+
+    async def _connect(self) -> aiosmtplib.SMTP:
+        client = aiosmtplib.SMTP(
+            hostname=self.config.smtp_server,
+            port=self.config.smtp_port,
+            start_tls=self.config.smtp_start_tls,
+            tls_context=ssl.create_default_context() if self.config.smtp_start_tls else None,
+            timeout=self.timeout
+        )
+        await client.connect()
+        if self.config.smtp_username:
+            try:
+                await client.login(self.config.smtp_username, self.config.smtp_password)
+            except Exception:
+                client.close()
+                raise
+        self.stats["opened"] += 1
+        return client
+
+    @staticmethod
+    async def _close(client: aiosmtplib.SMTP):
+        try:
+            await client.quit()
+        except Exception:
+            client.close()
+
+    @asynccontextmanager
+    async def connection(self):
+        """A connected client; it goes back to the pool unless the block raised a connection error."""
+        async with self._slots:
+            client = None
+            while self._idle:
+                candidate, last_used = self._idle.pop()
+                if candidate.is_connected and time.monotonic() - last_used < self.idle_timeout:
+                    client = candidate
+                    self.stats["reused"] += 1
+                    break
+                await self._close(candidate)
+            if client is None:
+                client = await self._connect()
+
+            try:
+                yield client
+            except (aiosmtplib.SMTPServerDisconnected, aiosmtplib.SMTPTimeoutError, ConnectionError,
+                    asyncio.CancelledError):
+                # Mid-transaction state is unknown; start the next message on a fresh connection
+                self.stats["discarded"] += 1
+                client.close()
+                raise
+            except aiosmtplib.SMTPResponseException:
+                # The connection is fine; clear the failed transaction and keep it
+                try:
+                    await client.rset()
+                except Exception:
+                    self.stats["discarded"] += 1
+                    client.close()
+                else:
+                    self._idle.append((client, time.monotonic()))
+                raise
+            else:
+                self._idle.append((client, time.monotonic()))
+
+    async def close(self):
+        idle, self._idle = self._idle, []
+        await asyncio.gather(*(self._close(client) for client, _ in idle), return_exceptions=True)
+
+    def get_stats(self) -> Dict[str, int]:
+        return {**self.stats, "idle": len(self._idle), "size": self.size}
+
+
+class EmailOutbox:
+    """Persists outgoing emails and delivers them with a pool of workers."""
+
+    def __init__(
+        self,
+        db=None,
+        config: Optional[EmailConfig] = None,
+        workers: Optional[int] = None,
+        pool_size: Optional[int] = None,
+        rate_per_second: Optional[float] = None,
+        max_attempts: Optional[int] = None,
+        retry_backoff: Optional[float] = None,
+        lease_seconds: Optional[float] = None,
+        poll_interval: Optional[float] = None
+    ):
+        self.db = db
+        self.config = config or EmailConfig()
+        self.workers = workers or int(os.getenv("EMAIL_OUTBOX_WORKERS", "4"))
+        self.pool = SMTPConnectionPool(
+            self.config,
+            size=pool_size or int(os.getenv("EMAIL_SMTP_POOL_SIZE", "2")),
+            idle_timeout=float(os.getenv("EMAIL_SMTP_IDLE_SECONDS", "60"))
+        )
+        self.rate_limiter = SharedRateLimiter(
+            db, RATE_LIMIT_KEY, rate_per_second or float(os.getenv("EMAIL_RATE_PER_SECOND", "5")))
+        self.max_attempts = max_attempts or int(os.getenv("EMAIL_OUTBOX_MAX_ATTEMPTS", "6"))
+        self.retry_backoff = retry_backoff or float(os.getenv("EMAIL_OUTBOX_RETRY_BACKOFF_SECONDS", "30"))
+        self.retry_backoff_max = 60 * 60
+        self.lease = timedelta(seconds=lease_seconds or float(os.getenv("EMAIL_OUTBOX_LEASE_SECONDS", "120")))
+        self.poll_interval = poll_interval or float(os.getenv("EMAIL_OUTBOX_POLL_SECONDS", "5"))
+        self.retention_days = int(os.getenv("EMAIL_OUTBOX_RETENTION_DAYS", "7"))
+        self.stats = {"queued": 0, "sent": 0, "retried": 0, "failed": 0}
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._tasks: List[asyncio.Task] = []
+
+    @property
+    def is_running(self) -> bool:
+        return bool(self._tasks)
+
+    async def start(self, db=None):
+        """Create indexes and start the workers."""
+        if db is not None:
+            self.db = db
+            self.rate_limiter.db = db
+        await self.ensure_indexes(self.db, self.retention_days)
+        if not self._tasks:
+            self._wakeup = asyncio.Event()
+            self._stopping = False
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        # Also checked by the workers: a cancel that lands just as an SMTP
+        # reply arrives can be swallowed inside aiosmtplib
+        self._stopping = True
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        await self.pool.close()
+
+    @staticmethod
+    async def ensure_indexes(db, retention_days: int = 7):
+        outbox = db[OUTBOX_COLLECTION]
+        await outbox.create_index([("status", 1), ("next_attempt_at", 1)])
+        await outbox.create_index("sent_at", expireAfterSeconds=retention_days * 24 * 3600)
+
+    # ------------------------------------------------------------------
+    # Intake
+    # ------------------------------------------------------------------
+
+    async def enqueue(self, to_email: str, subject: str, html_content: str,
+                      text_content: Optional[str] = None) -> bool:
+        """Queue a rendered email for delivery; one insert, no SMTP."""
+        now = datetime.utcnow()
+        await self.db[OUTBOX_COLLECTION].insert_one({
+            "to": to_email,
+            "subject": subject,
+            "body": seal_body(html_content, text_content),
+            "status": "pending",
+            "attempts": 0,
+            "created_at": now,
+            "next_attempt_at": now,
+        })
+        self.stats["queued"] += 1
+        self._wakeup.set()
+        return True
+
+    # ------------------------------------------------------------------
+    # Workers
+    # ------------------------------------------------------------------
+
+    async def _worker(self):
+        while not self._stopping:
+            # Cleared before claiming, so a message queued meanwhile wakes us
+            self._wakeup.clear()
+            try:
+                message = await self._claim()
+            except Exception as e:
+                logger.error(f"Claiming queued email failed: {e}")
+                message = None
+
+            if message is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._process(message)
+
+    async def _claim(self) -> Optional[Dict[str, Any]]:
+        now = datetime.utcnow()
+        return await self.db[OUTBOX_COLLECTION].find_one_and_update(
+            {"$or": [
+                {"status": "pending", "next_attempt_at": {"$lte": now}},
+                {"status": "sending", "lease_until": {"$lt": now}}
+            ]},
+            {"$set": {"status": "sending", "lease_until": now + self.lease}, "$inc": {"attempts": 1}},
+            sort=[("next_attempt_at", 1)],
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def _send(self, message: Dict[str, Any]):
+        body = open_body(message["body"])
+        msg = build_message(self.config.email_from, message["to"], message["subject"],
+                            body["html"] or "", body["text"])
+        await self.rate_limiter.acquire()
+        async with self.pool.connection() as client:
+            await client.send_message(msg)
+
+    async def _process(self, message: Dict[str, Any]):
+        outbox = self.db[OUTBOX_COLLECTION]
+        unset = {"lease_until": ""}
+        try:
+            await self._send(message)
+        except Exception as e:
+            if is_permanent(e) or message["attempts"] >= self.max_attempts:
+                self.stats["failed"] += 1
+                logger.error(f"Giving up on email '{message['subject']}' to {message['to']} "
+                             f"after {message['attempts']} attempts: {e}")
+                update = {"status": "failed", "last_error": str(e), "failed_at": datetime.utcnow()}
+                unset["body"] = ""
+            else:
+                self.stats["retried"] += 1
+                delay = random.uniform(0, min(self.retry_backoff_max, self.retry_backoff * 2 ** message["attempts"]))
+                logger.warning(f"Email to {message['to']} failed (attempt {message['attempts']}), "
+                               f"retrying in {delay:.1f}s: {e}")
+                update = {
+                    "status": "pending",
+                    "last_error": str(e),
+                    "next_attempt_at": datetime.utcnow() + timedelta(seconds=delay)
+                }
+        else:
+            self.stats["sent"] += 1
+            logger.info(f"Email sent successfully to {message['to']}")
+            update = {"status": "sent", "sent_at": datetime.utcnow()}
+            unset["body"] = ""
+
+        await outbox.update_one({"_id": message["_id"]}, {"$set": update, "$unset": unset})
+
+    async def drain(self) -> int:
+        """Send every claimable message now; returns how many were handled."""
+        handled = 0
+        while (message := await self._claim()) is not None:
+            await self._process(message)
+            handled += 1
+        return handled
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {**self.stats, "pool": self.pool.get_stats(), "workers": len(self._tasks)}
+
+
+# Global outbox instance
+email_outbox = EmailOutbox()
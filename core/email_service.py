@@ -5,8 +5,6 @@ import logging
 import os
 import ssl
 from typing import Optional, Dict, Any
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
 from email.mime.image import MIMEImage
 import aiosmtplib
 from jinja2 import Environment, FileSystemLoader
@@ -26,6 +24,7 @@ class EmailConfig:
         self.app_name = "GuzoSync"
         self.app_url = os.getenv("APP_BASE_URL", "http://localhost:8000")
         self.client_url = os.getenv("CLIENT_URL", "http://localhost:3000")
+        self.smtp_start_tls = os.getenv("SMTP_START_TLS", "true").lower() == "true"
         
     def is_configured(self) -> bool:
         """Check if email service is properly configured"""
@@ -51,7 +50,11 @@ class EmailService:
     ) -> bool:
         """
         Send an email using SMTP
-        
+
+        While the email outbox is running the message is queued there and
+        delivered by its workers; otherwise (scripts, tests) it is sent
+        directly.
+
         Args:
             to_email: Recipient email address
             subject: Email subject
@@ -59,40 +62,28 @@ class EmailService:
             text_content: Plain text content (optional)
         
         Returns:
-            bool: True if email sent successfully, False otherwise
+            bool: True if email was queued or sent successfully, False otherwise
         """
         if not self.config.is_configured():
             logger.warning("Email service not configured. Skipping email send.")
             return False
-        
+
+        # Imported here: the outbox builds on this module's EmailConfig
+        from core.email_outbox import build_message, email_outbox
+
         try:
-            # Create message
-            msg = MIMEMultipart('alternative')
-            msg['Subject'] = subject
-            msg['From'] = self.config.email_from
-            msg['To'] = to_email
-            
-            # Add text content if provided
-            if text_content:
-                text_part = MIMEText(text_content, 'plain')
-                msg.attach(text_part)
-            
-            # Add HTML content
-            html_part = MIMEText(html_content, 'html')
-            msg.attach(html_part)
-            
-            # Create SSL context
-            context = ssl.create_default_context()
-            
-            # Send email
+            if email_outbox.is_running:
+                return await email_outbox.enqueue(to_email, subject, html_content, text_content)
+
+            msg = build_message(self.config.email_from, to_email, subject, html_content, text_content)
             await aiosmtplib.send(
                 msg,
                 hostname=self.config.smtp_server,
                 port=self.config.smtp_port,
-                start_tls=True,
+                start_tls=self.config.smtp_start_tls,
                 username=self.config.smtp_username,
                 password=self.config.smtp_password,
-                tls_context=context
+                tls_context=ssl.create_default_context() if self.config.smtp_start_tls else None
             )
             
             logger.info(f"Email sent successfully to {to_email}")
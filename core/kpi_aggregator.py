@@ -0,0 +1,378 @@
+"""
+Incremental KPI aggregation for the analytics dashboards.
+
+Instead of rescanning today's trips, feedback and payments on every dashboard
+read, this module keeps running aggregates that are:
+1. Updated in place as feedback and payments are written
+2. Refreshed from today's trips every ``trip_refresh_interval`` seconds,
+   since trips are written outside this service; trip KPIs are broken down
+   per route (trip counts, completions, delays)
+3. Checkpointed periodically to the small ``kpi_state`` collection: each
+   worker adds the feedback and payment changes it saw since its last
+   checkpoint with ``$inc`` and adopts the shared totals, so workers neither
+   overwrite nor miss each other's counts
+4. Rebuilt from scratch on startup only when today's shared document is
+   missing or stale (no worker has checkpointed it lately), or on demand;
+   a worker starting next to live ones adopts their document instead, so
+   their not yet checkpointed changes are not counted twice
+
+Reads (``snapshot``) are O(1) in the number of documents.
+"""
+
+import asyncio
+import logging
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, Any, List, Optional
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from core.mongo_utils import date_range_filter
+
+logger = logging.getLogger(__name__)
+
+DELAYED_TRIP_MINUTES = 10  # trips delayed more than this count as delayed
+
+_ROUTE_FIELDS = ("trips", "completed", "delay_sum", "delay_count", "delayed")
+_TRIP_FIELDS = ("trips_total", "trips_completed", "delay_sum", "delay_count", "delayed_trips")
+# Counted from this worker's writes and merged into the checkpoint with $inc
+_DELTA_FIELDS = ("rating_sum", "rating_count", "payments_completed", "revenue")
+
+
+def _as_utc_naive(value: Any) -> Optional[datetime]:
+    """Normalize a stored timestamp (datetime or ISO string) to naive UTC."""
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        except ValueError:
+            return None
+    if not isinstance(value, datetime):
+        return None
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def _utc_today() -> date:
+    return datetime.now(timezone.utc).date()
+
+
+class KPIAggregator:
+    """Running counters for today's trip, feedback and payment KPIs."""
+
+    def __init__(self, checkpoint_interval: float = 30.0, trip_refresh_interval: float = 60.0):
+        self.checkpoint_interval = checkpoint_interval
+        self.trip_refresh_interval = trip_refresh_interval
+        # Live workers checkpoint every interval, even when idle
+        self.stale_after = timedelta(seconds=max(3 * checkpoint_interval, 120))
+        self.is_ready = False
+        self.dirty = False
+        self.last_rebuild_at: Optional[datetime] = None
+        self.last_checkpoint_at: Optional[datetime] = None
+        self._db = None
+        self._tasks: List[asyncio.Task] = []
+        self._reset(_utc_today())
+
+    def _reset(self, day: date):
+        self.day = day
+        self._reset_trips()
+        self.rating_sum = 0.0
+        self.rating_count = 0
+        self.payments_completed = 0
+        self.revenue = 0.0
+        self._deltas: Dict[str, float] = dict.fromkeys(_DELTA_FIELDS, 0)
+
+    def _reset_trips(self):
+        self.trips_total = 0
+        self.trips_completed = 0
+        self.delay_sum = 0.0
+        self.delay_count = 0
+        self.delayed_trips = 0
+        self.routes: Dict[str, Dict[str, float]] = {}
+
+    def _roll_day(self):
+        """Start fresh counters when the UTC day changes."""
+        today = _utc_today()
+        if today != self.day:
+            self._reset(today)
+            self.dirty = True
+
+    def _is_today(self, created_at: Any) -> bool:
+        if created_at is None:
+            # Documents being written right now
+            return True
+        created_at = _as_utc_naive(created_at)
+        return created_at is not None and created_at.date() == self.day
+
+    # ------------------------------------------------------------------
+    # Write-side hooks
+    # ------------------------------------------------------------------
+
+    def _apply_trip(self, trip: Dict[str, Any], sign: int):
+        delay = trip.get("delay_minutes") or 0
+        completed = trip.get("status") == "COMPLETED"
+        delayed = delay > DELAYED_TRIP_MINUTES
+
+        self.trips_total += sign
+        self.trips_completed += sign * completed
+        if delay:
+            self.delay_sum += sign * delay
+            self.delay_count += sign
+        self.delayed_trips += sign * delayed
+
+        route_id = trip.get("route_id")
+        if route_id:
+            route = self.routes.setdefault(route_id, dict.fromkeys(_ROUTE_FIELDS, 0))
+            route["trips"] += sign
+            route["completed"] += sign * completed
+            if delay:
+                route["delay_sum"] += sign * delay
+                route["delay_count"] += sign
+            route["delayed"] += sign * delayed
+
+    def record_trip(self, trip: Dict[str, Any], previous: Optional[Dict[str, Any]] = None):
+        """Account for a trip insert, or an update when ``previous`` is given."""
+        self._roll_day()
+        if not self._is_today(trip.get("created_at")):
+            return
+        if previous is not None:
+            self._apply_trip(previous, -1)
+        self._apply_trip(trip, 1)
+        self.dirty = True
+
+    def _add(self, field: str, amount: float):
+        setattr(self, field, getattr(self, field) + amount)
+        self._deltas[field] += amount
+        self.dirty = True
+
+    def record_feedback(self, feedback: Dict[str, Any]):
+        """Account for a newly submitted feedback entry."""
+        self._roll_day()
+        rating = feedback.get("rating")
+        if not rating or not self._is_today(feedback.get("created_at")):
+            return
+        self._add("rating_sum", rating)
+        self._add("rating_count", 1)
+
+    def record_payment(self, payment: Dict[str, Any], previous_status: Optional[str] = None):
+        """Account for a payment status change; only COMPLETED payments count."""
+        self._roll_day()
+        if not self._is_today(payment.get("created_at")):
+            return
+        was_completed = previous_status == "COMPLETED"
+        is_completed = payment.get("status") == "COMPLETED"
+        if was_completed == is_completed:
+            return
+        sign = 1 if is_completed else -1
+        self._add("payments_completed", sign)
+        self._add("revenue", sign * (payment.get("amount") or 0))
+
+    # ------------------------------------------------------------------
+    # Read side
+    # ------------------------------------------------------------------
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Current KPI values for today."""
+        self._roll_day()
+        return {
+            "date": self.day.isoformat(),
+            "trips_today": self.trips_total,
+            "completed_trips_today": self.trips_completed,
+            "delayed_trips_today": self.delayed_trips,
+            "average_delay_minutes": self.delay_sum / self.delay_count if self.delay_count else 0.0,
+            "delay_percentage": (self.delayed_trips / self.trips_total) * 100 if self.trips_total else 0.0,
+            "passenger_satisfaction_score": self.rating_sum / self.rating_count if self.rating_count else 0.0,
+            "feedback_count": self.rating_count,
+            "payments_completed": self.payments_completed,
+            "revenue_today": self.revenue
+        }
+
+    def get_route_breakdown(self) -> Dict[str, Dict[str, Any]]:
+        """Per-route trip KPIs for today."""
+        self._roll_day()
+        return {
+            route_id: {
+                "trips": route["trips"],
+                "completed": route["completed"],
+                "delayed": route["delayed"],
+                "average_delay_minutes": route["delay_sum"] / route["delay_count"] if route["delay_count"] else 0.0
+            }
+            for route_id, route in self.routes.items()
+        }
+
+    def get_status(self) -> Dict[str, Any]:
+        return {
+            "is_ready": self.is_ready,
+            "date": self.day.isoformat(),
+            "routes_tracked": len(self.routes),
+            "dirty": self.dirty,
+            "last_rebuild_at": self.last_rebuild_at.isoformat() if self.last_rebuild_at else None,
+            "last_checkpoint_at": self.last_checkpoint_at.isoformat() if self.last_checkpoint_at else None
+        }
+
+    # ------------------------------------------------------------------
+    # Rebuild and checkpointing
+    # ------------------------------------------------------------------
+
+    async def _load_trips(self, db):
+        start = datetime(self.day.year, self.day.month, self.day.day)
+        self._reset_trips()
+        async for trip in db.trips.find(
+            date_range_filter("created_at", start),
+            {"_id": 0, "route_id": 1, "status": 1, "delay_minutes": 1}
+        ):
+            self._apply_trip(trip, 1)
+
+    async def refresh_trips(self, db):
+        """Recompute today's trip aggregates from the trips collection."""
+        self._roll_day()
+        await self._load_trips(db)
+        self.dirty = True
+
+    def _is_fresh(self, state: Optional[Dict[str, Any]]) -> bool:
+        updated_at = _as_utc_naive(state.get("updated_at")) if state else None
+        return updated_at is not None and datetime.utcnow() - updated_at < self.stale_after
+
+    async def rebuild(self, db, force: bool = False) -> bool:
+        """
+        Recompute today's aggregates from the source collections and reset the
+        checkpoint to them. Unless ``force`` is set, a checkpoint that another
+        worker keeps fresh is adopted instead; returns whether it rebuilt.
+        """
+        day = _utc_today()
+        start = datetime(day.year, day.month, day.day)
+        if not force and self._is_fresh(await db.kpi_state.find_one({"_id": day.isoformat()})) \
+                and await self.restore(db):
+            return False
+        self._reset(day)
+
+        await self._load_trips(db)
+
+        async for feedback in db.feedback.find(
+            {**date_range_filter("created_at", start), "rating": {"$ne": None}},
+            {"_id": 0, "rating": 1}
+        ):
+            if feedback.get("rating"):
+                self.rating_sum += feedback["rating"]
+                self.rating_count += 1
+
+        async for payment in db.payments.find(
+            {**date_range_filter("created_at", start), "status": "COMPLETED"},
+            {"_id": 0, "amount": 1}
+        ):
+            self.payments_completed += 1
+            self.revenue += payment.get("amount") or 0
+
+        document = self._state_document()
+        query: Dict[str, Any] = {"_id": document["_id"]}
+        if not force:
+            # Only replace a missing or stale document; a worker that checkpointed meanwhile wins
+            query["updated_at"] = {"$not": {"$gte": document["updated_at"] - self.stale_after}}
+        try:
+            await db.kpi_state.replace_one(query, document, upsert=True)
+        except DuplicateKeyError:
+            await self.restore(db)
+            return False
+
+        self.is_ready = True
+        self.dirty = False
+        self.last_rebuild_at = self.last_checkpoint_at = document["updated_at"]
+        logger.info(f"Rebuilt KPI aggregates for {day}: {self.trips_total} trips, {self.payments_completed} payments")
+        return True
+
+    def _trip_state(self) -> Dict[str, Any]:
+        return {**{field: getattr(self, field) for field in _TRIP_FIELDS}, "routes": self.routes}
+
+    def _state_document(self) -> Dict[str, Any]:
+        return {
+            "_id": self.day.isoformat(),
+            **self._trip_state(),
+            **{field: getattr(self, field) for field in _DELTA_FIELDS},
+            "updated_at": datetime.now(timezone.utc)
+        }
+
+    async def checkpoint(self, db):
+        """Merge this worker's changes into today's ``kpi_state`` document and adopt the shared totals."""
+        if not self.is_ready:
+            return
+        self._roll_day()
+        deltas, self._deltas = self._deltas, dict.fromkeys(_DELTA_FIELDS, 0)
+        now = datetime.now(timezone.utc)
+        try:
+            # Trip aggregates come from the trips collection, so every worker sets the same values
+            state = await db.kpi_state.find_one_and_update(
+                {"_id": self.day.isoformat()},
+                {"$inc": deltas, "$set": {**self._trip_state(), "updated_at": now}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+        except Exception:
+            for field, amount in deltas.items():
+                self._deltas[field] += amount
+            raise
+        for field in _DELTA_FIELDS:
+            setattr(self, field, state.get(field, 0) + self._deltas[field])
+        self.dirty = False
+        self.last_checkpoint_at = now
+
+    async def restore(self, db) -> bool:
+        """Load today's checkpoint, if there is one."""
+        day = _utc_today()
+        state = await db.kpi_state.find_one({"_id": day.isoformat()})
+        if not state:
+            return False
+
+        self._reset(day)
+        for field in _TRIP_FIELDS + _DELTA_FIELDS:
+            setattr(self, field, state.get(field, 0))
+        self.routes = state.get("routes", {})
+        self.is_ready = True
+        return True
+
+    async def start(self, db):
+        """Rebuild or adopt today's checkpoint, then start checkpointing and trip refreshes."""
+        self._db = db
+        try:
+            await self.rebuild(db)
+        except Exception as e:
+            logger.error(f"KPI rebuild failed: {e}")
+            if not await self.restore(db):
+                return
+
+        if not self._tasks:
+            self._tasks = [
+                asyncio.create_task(self._checkpoint_loop()),
+                asyncio.create_task(self._trip_refresh_loop())
+            ]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._db is not None and self.dirty:
+            try:
+                await self.checkpoint(self._db)
+            except Exception as e:
+                logger.error(f"Final KPI checkpoint failed: {e}")
+
+    async def _checkpoint_loop(self):
+        while True:
+            await asyncio.sleep(self.checkpoint_interval)
+            # Even when idle, so this worker picks up the other workers' changes
+            try:
+                await self.checkpoint(self._db)
+            except Exception as e:
+                logger.error(f"KPI checkpoint failed: {e}")
+
+    async def _trip_refresh_loop(self):
+        while True:
+            await asyncio.sleep(self.trip_refresh_interval)
+            try:
+                await self.refresh_trips(self._db)
+            except Exception as e:
+                logger.error(f"KPI trip refresh failed: {e}")
+
+
+# Global instance, started in main.py
+kpi_aggregator = KPIAggregator()
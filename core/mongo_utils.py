@@ -1,8 +1,9 @@
-from typing import Dict, Any, TypeVar, Type
+from datetime import datetime
+from typing import Dict, Any, Optional, TypeVar, Type
 from pydantic import BaseModel
 from bson import ObjectId
 
-__all__ = ['transform_mongo_doc', 'model_to_mongo_doc']
+__all__ = ['transform_mongo_doc', 'model_to_mongo_doc', 'date_range_filter', 'real_users_query']
 
 ModelType = TypeVar("ModelType", bound=BaseModel)
 
@@ -72,4 +73,26 @@ def model_to_mongo_doc(model: BaseModel, exclude_none: bool = True) -> Dict[str,
     if "id" in doc:
         doc["_id"] = doc["id"]
 
-    return doc
\ No newline at end of file
+    return doc
+
+def date_range_filter(
+    field: str,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None
+) -> Dict[str, Any]:
+    """Filter ``field`` to ``[start, end]`` whether stored as a date or an ISO string."""
+    if start is None and end is None:
+        return {}
+    as_date: Dict[str, Any] = {}
+    as_string: Dict[str, Any] = {}
+    if start is not None:
+        as_date["$gte"] = start
+        as_string["$gte"] = start.isoformat()
+    if end is not None:
+        as_date["$lte"] = end
+        as_string["$lte"] = end.isoformat()
+    return {"$or": [{field: as_date}, {field: as_string}]}
+
+def real_users_query(query: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """``query`` on the users collection, leaving out the simulator's ``is_simulated`` passengers."""
+    return {**(query or {}), "is_simulated": {"$ne": True}}
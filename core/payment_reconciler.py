@@ -0,0 +1,296 @@
+"""
+Background reconciliation of payments stuck in PENDING.
+
+A payment stays PENDING when its webhook is lost or the customer closes the
+app before ``/payments/verify`` is called. The reconciler settles them:
+1. Every ``PAYMENT_RECONCILE_INTERVAL_SECONDS`` it scans PENDING payments
+   older than ``PAYMENT_RECONCILE_MIN_AGE_MINUTES`` in batches, oldest
+   first, on the ``(status, created_at)`` index
+2. Each batch is verified against Chapa concurrently, bounded by
+   ``PAYMENT_RECONCILE_CONCURRENCY`` in flight and
+   ``PAYMENT_RECONCILE_RATE_PER_SECOND`` calls per second
+3. Results go back in one unordered ``bulk_write`` for payments and one for
+   tickets, guarded on ``status: PENDING`` so a webhook that got there first
+   wins
+4. Progress is checkpointed on the payments themselves: one still pending
+   at Chapa, or not verifiable right now, gets ``reconcile_after`` pushed out
+   with exponential backoff. A restart resumes where the last pass stopped
+   instead of re-verifying from the oldest payment
+5. A lease in ``payment_reconciler_state`` keeps a single instance
+   reconciling at a time
+6. Backlog size and the age of the oldest stuck payment are measured after
+   every pass
+"""
+
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+from uuid import uuid4
+
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from core.chapa_service import chapa_service
+from core.kpi_aggregator import kpi_aggregator
+from core.rate_limiter import RateLimiter
+from core.mongo_utils import date_range_filter
+from core.ticket_redemption import as_datetime
+from core.ticket_tokens import settle_payment_tickets
+from models.payment import PaymentStatus
+
+logger = logging.getLogger(__name__)
+
+STATE_COLLECTION = "payment_reconciler_state"
+STATE_ID = "payments"
+
+PAYMENT_PROJECTION = {
+    "_id": 1, "tx_ref": 1, "amount": 1, "created_at": 1, "reconcile_attempts": 1,
+    "customer_first_name": 1, "customer_last_name": 1
+}
+
+
+class PaymentReconciler:
+    """Verifies stale PENDING payments with Chapa and applies the results in bulk."""
+
+    def __init__(
+        self,
+        db=None,
+        chapa=None,
+        kpis=None,
+        min_age_minutes: Optional[float] = None,
+        interval: Optional[float] = None,
+        batch_size: Optional[int] = None,
+        concurrency: Optional[int] = None,
+        rate_per_second: Optional[float] = None,
+        recheck_minutes: Optional[float] = None
+    ):
+        self.db = db
+        self.chapa = chapa or chapa_service
+        self.kpis = kpis or kpi_aggregator
+        if min_age_minutes is None:
+            min_age_minutes = float(os.getenv("PAYMENT_RECONCILE_MIN_AGE_MINUTES", "15"))
+        self.min_age = timedelta(minutes=min_age_minutes)
+        self.interval = interval or float(os.getenv("PAYMENT_RECONCILE_INTERVAL_SECONDS", "300"))
+        self.batch_size = batch_size or int(os.getenv("PAYMENT_RECONCILE_BATCH_SIZE", "100"))
+        self.concurrency = concurrency or int(os.getenv("PAYMENT_RECONCILE_CONCURRENCY", "8"))
+        self.rate_limiter = RateLimiter(rate_per_second or float(os.getenv("PAYMENT_RECONCILE_RATE_PER_SECOND", "5")))
+        self.recheck = timedelta(minutes=recheck_minutes or float(os.getenv("PAYMENT_RECONCILE_RECHECK_MINUTES", "10")))
+        self.recheck_max = timedelta(hours=6)
+        self.lease = timedelta(seconds=max(self.interval, 60))
+        self.instance_id = uuid4().hex
+
+        self.stats = {
+            "passes": 0, "verified": 0, "completed": 0, "failed": 0, "cancelled": 0, "still_pending": 0,
+            "errors": 0, "conflicts": 0
+        }
+        self.backlog: Dict[str, Optional[int]] = {"pending": None, "oldest_age_seconds": None}
+        self.last_pass_at: Optional[datetime] = None
+        self.last_pass_seconds: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self, db=None):
+        if db is not None:
+            self.db = db
+        await self.ensure_indexes(self.db)
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self.db is not None:
+            # Let another instance take over without waiting for the lease to run out
+            try:
+                await self.db[STATE_COLLECTION].update_one(
+                    {"_id": STATE_ID, "owner": self.instance_id}, {"$set": {"lease_until": datetime.utcnow()}}
+                )
+            except Exception as e:
+                logger.warning(f"Failed to release payment reconciler lease: {e}")
+
+    @staticmethod
+    async def ensure_indexes(db):
+        await db.payments.create_index([("status", 1), ("created_at", 1)])
+
+    async def _loop(self):
+        while True:
+            try:
+                await self.run_pass()
+            except Exception as e:
+                logger.error(f"Payment reconciliation pass failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    # ------------------------------------------------------------------
+    # Passes
+    # ------------------------------------------------------------------
+
+    async def _acquire_lease(self, now: datetime) -> bool:
+        try:
+            await self.db[STATE_COLLECTION].find_one_and_update(
+                {"_id": STATE_ID, "$or": [{"lease_until": {"$lte": now}}, {"owner": self.instance_id}]},
+                {"$set": {"owner": self.instance_id, "lease_until": now + self.lease}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            return False  # another instance holds it
+        return True
+
+    def _due_filter(self, now: datetime) -> Dict[str, Any]:
+        return {
+            "status": PaymentStatus.PENDING.value,
+            **date_range_filter("created_at", end=now - self.min_age),
+            "reconcile_after": {"$not": {"$gt": now}},
+        }
+
+    async def run_pass(self) -> int:
+        """Reconcile every due payment; returns how many were verified."""
+        started = time.perf_counter()
+        if not await self._acquire_lease(datetime.utcnow()):
+            return 0
+
+        verified = 0
+        while True:
+            now = datetime.utcnow()
+            payments = await self.db.payments.find(self._due_filter(now), PAYMENT_PROJECTION) \
+                .sort("created_at", 1).limit(self.batch_size).to_list(self.batch_size)
+            if not payments:
+                break
+            results = await self._verify_all(payments)
+            await self._apply(payments, results, now)
+            verified += len(payments)
+
+            if all(isinstance(result, Exception) for result in results):
+                logger.warning("Chapa is not answering; ending the reconciliation pass early")
+                break
+            if len(payments) < self.batch_size or not await self._acquire_lease(datetime.utcnow()):
+                break
+
+        await self.measure_backlog()
+        self.stats["passes"] += 1
+        self.last_pass_at = datetime.utcnow()
+        self.last_pass_seconds = time.perf_counter() - started
+        await self.db[STATE_COLLECTION].update_one({"_id": STATE_ID}, {"$set": {
+            "last_pass_at": self.last_pass_at, "last_pass_verified": verified, **{
+                f"backlog_{key}": value for key, value in self.backlog.items()
+            }
+        }})
+        if verified:
+            logger.info(f"Reconciled {verified} pending payments in {self.last_pass_seconds:.1f}s; "
+                        f"{self.backlog['pending']} still pending")
+        return verified
+
+    async def _verify_all(self, payments: List[Dict[str, Any]]) -> List[Any]:
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def verify(payment):
+            async with semaphore:
+                await self.rate_limiter.acquire()
+                return await self.chapa.verify_payment(payment["tx_ref"])
+
+        return await asyncio.gather(*(verify(payment) for payment in payments), return_exceptions=True)
+
+    # ------------------------------------------------------------------
+    # Applying results
+    # ------------------------------------------------------------------
+
+    def _recheck_after(self, payment: Dict[str, Any], now: datetime) -> datetime:
+        attempts = payment.get("reconcile_attempts") or 0
+        return now + min(self.recheck_max, self.recheck * 2 ** attempts)
+
+    async def _apply(self, payments: List[Dict[str, Any]], results: List[Any], now: datetime):
+        operations, transitions = [], {}
+        for payment, result in zip(payments, results):
+            guard = {"_id": payment["_id"], "status": PaymentStatus.PENDING.value}
+            if isinstance(result, Exception):
+                self.stats["errors"] += 1
+                logger.warning(f"Could not verify pending payment {payment['tx_ref']}: {result}")
+                target = PaymentStatus.PENDING
+            else:
+                self.stats["verified"] += 1
+                target = result["status"]
+
+            if target == PaymentStatus.PENDING:
+                if not isinstance(result, Exception):
+                    self.stats["still_pending"] += 1
+                operations.append(UpdateOne(guard, {
+                    "$set": {"reconcile_after": self._recheck_after(payment, now), "last_reconciled_at": now},
+                    "$inc": {"reconcile_attempts": 1}
+                }))
+                continue
+
+            update = {
+                "status": target.value, "chapa_response": result.get("chapa_response"),
+                "updated_at": now, "reconciled_at": now
+            }
+            if target == PaymentStatus.COMPLETED:
+                update["paid_at"] = result.get("paid_at") or now
+            elif target == PaymentStatus.FAILED:
+                update["failed_reason"] = "Payment failed"
+            operations.append(UpdateOne(guard, {"$set": update}))
+            transitions[payment["_id"]] = (payment, target)
+
+        result = await self.db.payments.bulk_write(operations, ordered=False)
+        if transitions and result.modified_count < len(operations):
+            # A webhook or /payments/verify settled some first; keep only ours
+            ours = {
+                doc["_id"] async for doc in self.db.payments.find(
+                    {"_id": {"$in": list(transitions)}, "reconciled_at": now}, {"_id": 1}
+                )
+            }
+            self.stats["conflicts"] += len(transitions) - len(ours)
+            transitions = {payment_id: change for payment_id, change in transitions.items() if payment_id in ours}
+
+        for payment, target in transitions.values():
+            self.stats[target.value.lower()] += 1
+            self.kpis.record_payment(
+                {**payment, "status": target.value}, previous_status=PaymentStatus.PENDING.value
+            )
+        await settle_payment_tickets(
+            self.db, [(payment, target == PaymentStatus.COMPLETED) for payment, target in transitions.values()], now
+        )
+
+    # ------------------------------------------------------------------
+    # Metrics
+    # ------------------------------------------------------------------
+
+    async def measure_backlog(self, now: Optional[datetime] = None) -> Dict[str, Any]:
+        """PENDING payments older than the minimum age, and how old the oldest is."""
+        now = now or datetime.utcnow()
+        query = {"status": PaymentStatus.PENDING.value, **date_range_filter("created_at", end=now - self.min_age)}
+        pending = await self.db.payments.count_documents(query)
+
+        oldest = None
+        if pending:
+            # Dates and ISO strings sort apart, so take the oldest of each
+            for stored_as in ("date", "string"):
+                doc = await self.db.payments.find_one(
+                    {"status": PaymentStatus.PENDING.value, "created_at": {"$type": stored_as}},
+                    {"created_at": 1}, sort=[("created_at", 1)]
+                )
+                if doc is not None:
+                    created_at = as_datetime(doc["created_at"])
+                    oldest = created_at if oldest is None else min(oldest, created_at)
+
+        self.backlog = {
+            "pending": pending,
+            "oldest_age_seconds": round((now - oldest).total_seconds()) if oldest else 0
+        }
+        return self.backlog
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "backlog": self.backlog,
+            "last_pass_at": self.last_pass_at.isoformat() if self.last_pass_at else None,
+            "last_pass_seconds": self.last_pass_seconds,
+            "running": self._task is not None,
+        }
+
+
+# Global reconciler instance
+payment_reconciler = PaymentReconciler()
@@ -0,0 +1,233 @@
+"""
+Queued, idempotent processing of Chapa webhook events.
+
+The webhook endpoint only verifies and records events; payments and tickets
+are updated in the background:
+1. Each verified event is inserted into ``payment_webhook_events`` under a
+   unique ``(tx_ref, event)`` key, so Chapa's duplicate deliveries are
+   acknowledged by the unique index without any further work
+2. A fixed number of workers claim pending events with
+   ``find_one_and_update`` and a lease, so events survive restarts and a
+   crashed worker's claim expires
+3. Failed events are retried with jittered exponential backoff and marked
+   ``failed`` after ``PAYMENT_WEBHOOK_MAX_ATTEMPTS``
+4. Applying an event is itself idempotent: status transitions are guarded
+   in the update filter, so a replayed event changes nothing
+"""
+
+import asyncio
+import logging
+import os
+import random
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Optional
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from core.kpi_aggregator import kpi_aggregator
+from core.ticket_tokens import settle_payment_tickets
+from models.payment import PaymentStatus
+
+logger = logging.getLogger(__name__)
+
+EVENTS_COLLECTION = "payment_webhook_events"
+
+# Webhook event -> payment status it moves the payment to
+EVENT_STATUSES = {
+    "payment.success": PaymentStatus.COMPLETED,
+    "payment.failed": PaymentStatus.FAILED,
+    "payment.cancelled": PaymentStatus.CANCELLED,
+}
+
+
+class PaymentWebhookProcessor:
+    """Persists webhook events and applies them with a pool of workers."""
+
+    def __init__(
+        self,
+        db=None,
+        kpis=None,
+        workers: Optional[int] = None,
+        max_attempts: Optional[int] = None,
+        retry_backoff: Optional[float] = None,
+        lease_seconds: Optional[float] = None,
+        poll_interval: Optional[float] = None
+    ):
+        self.db = db
+        self.kpis = kpis or kpi_aggregator
+        self.workers = workers or int(os.getenv("PAYMENT_WEBHOOK_WORKERS", "4"))
+        self.max_attempts = max_attempts or int(os.getenv("PAYMENT_WEBHOOK_MAX_ATTEMPTS", "8"))
+        self.retry_backoff = retry_backoff or float(os.getenv("PAYMENT_WEBHOOK_RETRY_BACKOFF_SECONDS", "2"))
+        self.retry_backoff_max = 15 * 60
+        self.lease = timedelta(seconds=lease_seconds or float(os.getenv("PAYMENT_WEBHOOK_LEASE_SECONDS", "60")))
+        self.poll_interval = poll_interval or float(os.getenv("PAYMENT_WEBHOOK_POLL_SECONDS", "5"))
+        self.stats = {"received": 0, "duplicates": 0, "processed": 0, "retried": 0, "failed": 0}
+        self._wakeup = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+
+    async def start(self, db=None):
+        """Create indexes and start the workers."""
+        if db is not None:
+            self.db = db
+        await self.ensure_indexes(self.db)
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    @staticmethod
+    async def ensure_indexes(db):
+        events = db[EVENTS_COLLECTION]
+        await events.create_index([("tx_ref", 1), ("event", 1)], unique=True)
+        await events.create_index([("status", 1), ("next_attempt_at", 1)])
+
+    # ------------------------------------------------------------------
+    # Intake
+    # ------------------------------------------------------------------
+
+    async def enqueue(self, db, event: str, data: Dict[str, Any], payload: str,
+                      timestamp: Optional[datetime] = None) -> bool:
+        """
+        Record a verified webhook event. Returns False for a duplicate
+        delivery of an event that is already recorded.
+        """
+        now = datetime.utcnow()
+        try:
+            await db[EVENTS_COLLECTION].insert_one({
+                "tx_ref": data["tx_ref"],
+                "event": event,
+                "data": data,
+                "payload": payload,
+                "event_timestamp": timestamp,
+                "status": "pending",
+                "attempts": 0,
+                "received_at": now,
+                "next_attempt_at": now,
+            })
+        except DuplicateKeyError:
+            self.stats["duplicates"] += 1
+            return False
+        self.stats["received"] += 1
+        self._wakeup.set()
+        return True
+
+    # ------------------------------------------------------------------
+    # Workers
+    # ------------------------------------------------------------------
+
+    async def _worker(self):
+        while True:
+            # Cleared before claiming, so an event enqueued meanwhile wakes us
+            self._wakeup.clear()
+            try:
+                event = await self._claim()
+            except Exception as e:
+                logger.error(f"Claiming payment webhook event failed: {e}")
+                event = None
+
+            if event is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._process(event)
+
+    async def _claim(self) -> Optional[Dict[str, Any]]:
+        now = datetime.utcnow()
+        return await self.db[EVENTS_COLLECTION].find_one_and_update(
+            {"$or": [
+                {"status": "pending", "next_attempt_at": {"$lte": now}},
+                {"status": "processing", "lease_until": {"$lt": now}}
+            ]},
+            {"$set": {"status": "processing", "lease_until": now + self.lease}, "$inc": {"attempts": 1}},
+            sort=[("next_attempt_at", 1)],
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def _process(self, event: Dict[str, Any]):
+        events = self.db[EVENTS_COLLECTION]
+        try:
+            await self.apply(self.db, event["event"], event["data"])
+        except Exception as e:
+            if event["attempts"] >= self.max_attempts:
+                self.stats["failed"] += 1
+                logger.error(f"Giving up on webhook {event['event']} for {event['tx_ref']} "
+                             f"after {event['attempts']} attempts: {e}")
+                update = {"status": "failed", "last_error": str(e), "failed_at": datetime.utcnow()}
+            else:
+                self.stats["retried"] += 1
+                delay = random.uniform(0, min(self.retry_backoff_max, self.retry_backoff * 2 ** event["attempts"]))
+                logger.warning(f"Webhook {event['event']} for {event['tx_ref']} failed "
+                               f"(attempt {event['attempts']}), retrying in {delay:.1f}s: {e}")
+                update = {
+                    "status": "pending",
+                    "last_error": str(e),
+                    "next_attempt_at": datetime.utcnow() + timedelta(seconds=delay)
+                }
+        else:
+            self.stats["processed"] += 1
+            update = {"status": "processed", "processed_at": datetime.utcnow()}
+
+        await events.update_one({"_id": event["_id"]}, {"$set": update, "$unset": {"lease_until": ""}})
+
+    async def drain(self) -> int:
+        """Process every claimable event now; returns how many were handled."""
+        handled = 0
+        while (event := await self._claim()) is not None:
+            await self._process(event)
+            handled += 1
+        return handled
+
+    # ------------------------------------------------------------------
+    # Applying events
+    # ------------------------------------------------------------------
+
+    async def apply(self, db, event: str, data: Dict[str, Any]):
+        """Move the payment and its ticket to the state ``event`` implies."""
+        target = EVENT_STATUSES.get(event)
+        if target is None:
+            logger.info(f"Ignoring Chapa webhook event {event}")
+            return
+
+        tx_ref = data["tx_ref"]
+        now = datetime.utcnow()
+        update: Dict[str, Any] = {"status": target.value, "chapa_response": data, "updated_at": now}
+        # A late failure/cancellation never reverts a completed payment
+        unchanged = [target.value]
+        if target == PaymentStatus.COMPLETED:
+            update["paid_at"] = now
+        else:
+            unchanged.append(PaymentStatus.COMPLETED.value)
+            if target == PaymentStatus.FAILED:
+                update["failed_reason"] = data.get("message", "Payment failed")
+
+        previous = await db.payments.find_one_and_update(
+            {"tx_ref": tx_ref, "status": {"$nin": unchanged}},
+            {"$set": update}
+        )
+        if previous is not None:
+            self.kpis.record_payment({**previous, "status": target.value}, previous_status=previous.get("status"))
+            payment = previous
+        else:
+            payment = await db.payments.find_one(
+                {"tx_ref": tx_ref}, {"_id": 1, "status": 1, "customer_first_name": 1, "customer_last_name": 1}
+            )
+            if payment is None:
+                logger.warning(f"Chapa webhook {event} for unknown payment {tx_ref}")
+                return
+            if payment.get("status") != target.value:
+                return  # already completed; nothing to do for the ticket either
+
+        # The ticket step is guarded the same way, so a retry after a partial
+        # apply only finishes the missing half
+        await settle_payment_tickets(db, [(payment, target == PaymentStatus.COMPLETED)], now)
+
+
+# Global processor instance
+payment_webhook_processor = PaymentWebhookProcessor()
@@ -0,0 +1,236 @@
+"""
+Ticket QR images, rendered off the event loop and cached by content.
+
+Ticket documents only store the QR payload (``GUZOSYNC-TICKET:<token>``);
+the PNG is derived from it on demand:
+1. Rendering (qrcode + Pillow, CPU bound) runs in a process pool, or a
+   thread pool with ``QR_RENDER_EXECUTOR=thread``, never on the loop
+2. Images are content addressed: the key is the SHA-256 of the payload,
+   stored on disk under ``QR_CACHE_DIR`` and in a small in-memory LRU, so
+   every instance renders a payload at most once and the key doubles as a
+   strong ETag
+3. Concurrent requests for a payload that is still rendering wait for the
+   same render instead of starting another. The render runs as its own
+   task, so a request that is cancelled does not fail the others
+4. The disk cache is pruned every ``QR_CACHE_PRUNE_SECONDS``: images not
+   served for ``QR_CACHE_DISK_MAX_AGE_DAYS`` go first, then the least recently
+   served until the cache fits in ``QR_CACHE_DISK_MAX_MB``
+"""
+
+import asyncio
+import hashlib
+import logging
+import multiprocessing
+import os
+import tempfile
+import time
+from collections import OrderedDict
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from io import BytesIO
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+import qrcode
+
+logger = logging.getLogger(__name__)
+
+QR_PAYLOAD_PREFIX = "GUZOSYNC-TICKET:"
+
+
+def qr_payload(signed_token: str) -> str:
+    """What a ticket's QR code encodes; validators read the token back out of it."""
+    return f"{QR_PAYLOAD_PREFIX}{signed_token}"
+
+
+def payload_key(payload: str) -> str:
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def render_qr_png(payload: str) -> bytes:
+    """Render a payload as a PNG. Module level so a process pool can pickle it."""
+    qr = qrcode.QRCode(
+        version=1,
+        error_correction=qrcode.ERROR_CORRECT_L,
+        box_size=10,
+        border=4,
+    )
+    qr.add_data(payload)
+    qr.make(fit=True)
+
+    buffer = BytesIO()
+    qr.make_image(fill_color="black", back_color="white").save(buffer, kind="PNG")
+    return buffer.getvalue()
+
+
+class QRImageCache:
+    """Content-addressed QR PNG cache backed by a render pool."""
+
+    def __init__(
+        self,
+        cache_dir: Optional[str] = None,
+        executor: Optional[str] = None,
+        workers: Optional[int] = None,
+        memory_items: Optional[int] = None
+    ):
+        self.cache_dir = Path(
+            cache_dir or os.getenv("QR_CACHE_DIR") or os.path.join(tempfile.gettempdir(), "guzosync-qr")
+        ).absolute()
+        self.executor_kind = executor or os.getenv("QR_RENDER_EXECUTOR", "process")
+        self.workers = workers or int(os.getenv("QR_RENDER_WORKERS", str(min(4, os.cpu_count() or 1))))
+        self.memory_items = memory_items if memory_items is not None else int(os.getenv("QR_CACHE_MEMORY_ITEMS", "1024"))
+        self.max_bytes = int(float(os.getenv("QR_CACHE_DISK_MAX_MB", "512")) * 1024 * 1024)
+        self.max_age_seconds = float(os.getenv("QR_CACHE_DISK_MAX_AGE_DAYS", "30")) * 24 * 60 * 60
+        self.prune_interval = float(os.getenv("QR_CACHE_PRUNE_SECONDS", "600"))
+
+        self._executor: Optional[Executor] = None
+        self._memory: "OrderedDict[str, bytes]" = OrderedDict()
+        self._rendering: Dict[str, "asyncio.Future[bytes]"] = {}
+        self._pruned_at: Optional[float] = None
+        self._pruning: Optional["asyncio.Future[int]"] = None
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "renders": 0, "joined": 0, "errors": 0, "evicted": 0}
+
+    @property
+    def executor(self) -> Executor:
+        # Created on first use so importing the module never spawns workers
+        if self._executor is None:
+            if self.executor_kind == "thread":
+                self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="qr-render")
+            else:
+                # Spawned, not forked: the server holds Motor and event loop threads
+                self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._executor
+
+    def stop(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / f"{key}.png"
+
+    def _read(self, key: str) -> Optional[bytes]:
+        path = self._path(key)
+        try:
+            image = path.read_bytes()
+        except FileNotFoundError:
+            return None
+        try:
+            # The modification time is when it was last served, for pruning
+            os.utime(path)
+        except OSError:
+            pass
+        return image
+
+    def _write(self, key: str, image: bytes):
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Written whole then renamed, so a concurrent reader never sees half a PNG
+        tmp = path.with_suffix(f".{os.getpid()}.tmp")
+        tmp.write_bytes(image)
+        os.replace(tmp, path)
+
+    def _remember(self, key: str, image: bytes):
+        if self.memory_items <= 0:
+            return
+        self._memory[key] = image
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    async def get(self, payload: str) -> Tuple[str, bytes]:
+        """The payload's key and PNG, rendering it if no cache has it."""
+        key = payload_key(payload)
+        image = self._memory.get(key)
+        if image is not None:
+            self._memory.move_to_end(key)
+            self.stats["memory_hits"] += 1
+            return key, image
+
+        pending = self._rendering.get(key)
+        if pending is not None:
+            self.stats["joined"] += 1
+        else:
+            pending = self._rendering[key] = asyncio.ensure_future(self._load(key, payload))
+            pending.add_done_callback(lambda task: self._loaded(key, task))
+        # Shielded: a cancelled request leaves the load running for the others
+        return key, await asyncio.shield(pending)
+
+    async def _load(self, key: str, payload: str) -> bytes:
+        loop = asyncio.get_running_loop()
+        try:
+            image = await loop.run_in_executor(None, self._read, key)
+            if image is not None:
+                self.stats["disk_hits"] += 1
+            else:
+                image = await loop.run_in_executor(self.executor, render_qr_png, payload)
+                self.stats["renders"] += 1
+                try:
+                    await loop.run_in_executor(None, self._write, key, image)
+                except OSError as e:
+                    # Still served from memory; the next instance renders it again
+                    logger.warning(f"Failed to cache QR image {key}: {e}")
+                self._schedule_prune(loop)
+        except Exception:
+            self.stats["errors"] += 1
+            raise
+        self._remember(key, image)
+        return image
+
+    def _loaded(self, key: str, task: "asyncio.Future[bytes]"):
+        del self._rendering[key]
+        # Waiters see the error; nobody else is required to retrieve it
+        if not task.cancelled():
+            task.exception()
+
+    # ------------------------------------------------------------------
+    # Disk eviction
+    # ------------------------------------------------------------------
+
+    def _schedule_prune(self, loop: asyncio.AbstractEventLoop):
+        now = time.monotonic()
+        if self._pruned_at is not None and now - self._pruned_at < self.prune_interval:
+            return
+        if self._pruning is not None and not self._pruning.done():
+            return
+        self._pruned_at = now
+        self._pruning = loop.run_in_executor(None, self.prune)
+
+    def prune(self, now: Optional[float] = None) -> int:
+        """Delete images not served within the maximum age, then the least recently served over the size limit."""
+        now = now if now is not None else time.time()
+        files = []
+        try:
+            for path in self.cache_dir.glob("*/*"):
+                try:
+                    stat = path.stat()
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+        except OSError as e:
+            logger.warning(f"Failed to scan QR image cache {self.cache_dir}: {e}")
+            return 0
+
+        files.sort()
+        total = sum(size for _, size, _ in files)
+        evicted = 0
+        for mtime, size, path in files:
+            if now - mtime <= self.max_age_seconds and total <= self.max_bytes:
+                break
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning(f"Failed to evict QR image {path}: {e}")
+                continue
+            total -= size
+            evicted += 1
+        self.stats["evicted"] += evicted
+        return evicted
+
+    def get_stats(self) -> Dict[str, int]:
+        return {**self.stats, "memory_items": len(self._memory), "rendering": len(self._rendering)}
+
+
+# Global instance
+qr_image_cache = QRImageCache()
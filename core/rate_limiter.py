@@ -0,0 +1,79 @@
+"""
+Client-side rate limiting for calls to external providers.
+"""
+
+import asyncio
+import time
+from typing import Awaitable, Callable
+
+
+class RateLimiter:
+    """Spaces calls at least ``1 / rate`` seconds apart."""
+
+    def __init__(
+        self,
+        rate: float,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], Awaitable[None]] = asyncio.sleep
+    ):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self.clock = clock
+        self.sleep = sleep
+        self._next = 0.0
+
+    async def acquire(self):
+        now = self.clock()
+        # Claim the slot before sleeping, so concurrent callers queue up behind it
+        slot = max(now, self._next)
+        self._next = slot + self.interval
+        if slot > now:
+            await self.sleep(slot - now)
+
+
+class SharedRateLimiter(RateLimiter):
+    """
+    A ``RateLimiter`` whose next free slot lives in a MongoDB document, so
+    every process sending to the same provider shares one budget.
+
+    Slots are claimed with a compare-and-set on ``next``; the clock is wall
+    time because the document is read by other hosts.
+    """
+
+    def __init__(
+        self,
+        db,
+        key: str,
+        rate: float,
+        collection: str = "rate_limits",
+        clock: Callable[[], float] = time.time,
+        sleep: Callable[[float], Awaitable[None]] = asyncio.sleep
+    ):
+        super().__init__(rate, clock=clock, sleep=sleep)
+        self.db = db
+        self.key = key
+        self.collection = collection
+
+    async def _claim(self) -> float:
+        limits = self.db[self.collection]
+        while True:
+            now = self.clock()
+            state = await limits.find_one({"_id": self.key})
+            if state is None:
+                result = await limits.update_one(
+                    {"_id": self.key}, {"$setOnInsert": {"next": now + self.interval}}, upsert=True)
+                if result.upserted_id is not None:
+                    return now
+                continue
+            slot = max(now, state["next"])
+            result = await limits.update_one(
+                {"_id": self.key, "next": state["next"]}, {"$set": {"next": slot + self.interval}})
+            if result.modified_count:
+                return slot
+
+    async def acquire(self):
+        if self.interval <= 0:
+            return
+        slot = await self._claim()
+        wait = slot - self.clock()
+        if wait > 0:
+            await self.sleep(wait)
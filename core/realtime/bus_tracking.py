@@ -4,10 +4,16 @@ Real-time bus tracking service with enhanced Mapbox integration
 from datetime import datetime, timezone
 from typing import Optional, Dict, List, Any
 
+from bson import ObjectId
+from pymongo import UpdateOne
+
 from core.websocket_manager import websocket_manager
 from core.logger import get_logger
 from models.base import Location
 from core.mongo_utils import model_to_mongo_doc
+from core.realtime.headway_monitor import headway_monitor
+from core.realtime.proximity_alerts import proximity_alert_tracker
+from core.realtime.notifications import notification_service
 import asyncio
 
 logger = get_logger(__name__)
@@ -92,11 +98,132 @@ class BusTrackingService:
                     #logger.info(f"📡 Broadcasting bus {bus_id} location to route room {route_room_id}")
                     await websocket_manager.send_room_message(route_room_id, ws_message)
 
+                await BusTrackingService._track_headways(
+                    [(bus_id, bus.get("assigned_route_id") if bus else None, latitude, longitude)],
+                    app_state
+                )
+
             #logger.info(f"✅ Bus {bus_id} location broadcast completed")
             
         except Exception as e:
             logger.error(f"Error updating bus location for {bus_id}: {e}")
-    
+
+    @staticmethod
+    async def update_bus_locations_batch(
+        locations: List[Dict[str, Any]],
+        app_state=None,
+        persist: bool = True,
+        track_headways: bool = True,
+        collection: str = "buses",
+        room_prefix: str = ""
+    ) -> bool:
+        """Update a batch of bus locations with one bulk write and broadcast to subscribers.
+
+        Each location is a dict with bus_id, latitude, longitude and optional
+        heading, speed and route_id. Rooms without subscribers are skipped.
+        ``persist`` and ``track_headways`` let a process that only broadcasts
+        (or only persists) skip the other half of the pipeline. ``collection``
+        and ``room_prefix`` redirect the writes and broadcasts of a batch that
+        must stay out of live tracking (e.g. simulation replays). Errors are
+        logged, not raised; returns False if the batch failed.
+        """
+        if not locations:
+            return True
+
+        try:
+            now = datetime.now(timezone.utc)
+
+            has_db = app_state is not None and app_state.mongodb is not None
+            if has_db and persist:
+                operations = []
+                for loc in locations:
+                    update_data = {
+                        "current_location": {
+                            "latitude": loc["latitude"],
+                            "longitude": loc["longitude"]
+                        },
+                        "last_location_update": now
+                    }
+                    if loc.get("heading") is not None:
+                        update_data["heading"] = loc["heading"]
+                    if loc.get("speed") is not None:
+                        update_data["speed"] = loc["speed"]
+                    operations.append(UpdateOne({"id": loc["bus_id"]}, {"$set": update_data}))
+
+                await app_state.mongodb[collection].bulk_write(operations, ordered=False)
+
+            if has_db and track_headways:
+                await BusTrackingService._track_headways(
+                    [(loc["bus_id"], loc.get("route_id"), loc["latitude"], loc["longitude"]) for loc in locations],
+                    app_state
+                )
+
+            timestamp = now.isoformat()
+            rooms = websocket_manager.rooms
+
+            for loc in locations:
+                bus_room_id = f"{room_prefix}bus_tracking:{loc['bus_id']}"
+                route_room_id = f"{room_prefix}route_tracking:{loc['route_id']}" if loc.get("route_id") else None
+                if bus_room_id not in rooms and route_room_id not in rooms:
+                    continue
+
+                ws_message = {
+                    "type": "bus_location_update",
+                    "bus_id": str(loc["bus_id"]),
+                    "location": {
+                        "latitude": loc["latitude"],
+                        "longitude": loc["longitude"]
+                    },
+                    "heading": loc.get("heading"),
+                    "speed": loc.get("speed"),
+                    "timestamp": timestamp
+                }
+                if bus_room_id in rooms:
+                    await websocket_manager.send_room_message(bus_room_id, ws_message)
+                if route_room_id in rooms:
+                    await websocket_manager.send_room_message(route_room_id, ws_message)
+
+            # The global room gets one message for the whole batch
+            global_room_id = f"{room_prefix}all_bus_tracking"
+            if global_room_id in rooms:
+                await websocket_manager.send_room_message(global_room_id, {
+                    "type": "all_bus_locations",
+                    "buses": [
+                        {
+                            "bus_id": loc["bus_id"],
+                            "location": {
+                                "latitude": loc["latitude"],
+                                "longitude": loc["longitude"]
+                            },
+                            "heading": loc.get("heading"),
+                            "speed": loc.get("speed"),
+                            "route_id": loc.get("route_id"),
+                            "last_update": timestamp
+                        }
+                        for loc in locations
+                    ],
+                    "timestamp": timestamp
+                })
+
+        except Exception as e:
+            logger.error(f"Error updating batch of {len(locations)} bus locations: {e}")
+            return False
+        return True
+
+    @staticmethod
+    async def _track_headways(updates: List[tuple], app_state) -> None:
+        """Feed (bus_id, route_id, latitude, longitude) updates to the bunching detector."""
+        try:
+            await headway_monitor.ensure_routes(
+                (route_id for _, route_id, _, _ in updates if route_id and headway_monitor.needs_route(route_id)),
+                app_state.mongodb
+            )
+            for bus_id, route_id, latitude, longitude in updates:
+                for event in headway_monitor.observe(bus_id, route_id, latitude, longitude):
+                    await notification_service.send_bunching_notification(**event, app_state=app_state)
+        except Exception as e:
+            logger.error(f"Error tracking headways: {e}")
+
     @staticmethod
     async def subscribe_to_bus(user_id: str, bus_id: str):
         """Subscribe user to bus tracking updates"""
@@ -396,6 +523,7 @@ class BusTrackingService:
             #logger.info(f"🔔 Found {len(bus_stops)} active bus stops to check")
             proximity_threshold = 500  # 500 meters as requested
             nearby_stops = 0
+            near_stop_ids = []
 
             for bus_stop in bus_stops:
                 stop_location = bus_stop.get("location")
@@ -411,6 +539,7 @@ class BusTrackingService:
                 # If bus is approaching this bus stop (within 500m), find passengers near this stop
                 if bus_to_stop_distance <= proximity_threshold:
                     nearby_stops += 1
+                    near_stop_ids.append(bus_stop["id"])
                     stop_name = bus_stop.get("name", "Unknown Stop")
                     #logger.info(f"🔔 Bus {bus_id} is {bus_to_stop_distance:.1f}m from stop '{stop_name}' - checking for nearby passengers")
 
@@ -423,6 +552,9 @@ class BusTrackingService:
                         app_state=app_state
                     )
 
+            # Approaches to stops the bus has left are over
+            proximity_alert_tracker.observe_bus(bus_id, near_stop_ids)
+
             # if nearby_stops == 0:
                 #logger.debug(f"🔔 Bus {bus_id} is not near any bus stops (>500m)")
             # else:
@@ -484,6 +616,12 @@ class BusTrackingService:
 
                 # If passenger is within 500m of the bus stop, notify them
                 if passenger_to_stop_distance <= proximity_threshold:
+                    # One alert per approach, not one per location update
+                    subscribed = websocket_manager.is_user_subscribed_to_notification(passenger["id"], "PROXIMITY_ALERT")
+                    if not proximity_alert_tracker.observe(
+                        passenger["id"], bus_id, bus_stop_id, bus_to_stop_distance, subscribed=subscribed
+                    ):
+                        continue
                     #logger.info(f"🔔 Notifying passenger {passenger['id']} - within {passenger_to_stop_distance:.1f}m of stop '{bus_stop_name}'")
 
                     await BusTrackingService._send_passenger_proximity_notification(
@@ -515,8 +653,6 @@ class BusTrackingService:
     ):
         """Send proximity notification to a specific passenger"""
         try:
-            from core.realtime.notifications import notification_service
-
             bus_stop_id = bus_stop["id"]
             bus_stop_name = bus_stop.get("name", "Unknown Stop")
 
@@ -558,21 +694,42 @@ class BusTrackingService:
             bus_identifier = bus_info.get('license_plate', bus_id) if bus_info else bus_id
             notification_message = f"Bus {bus_identifier} is approaching {bus_stop_name} ({round(bus_to_stop_distance)}m away, ~{estimated_arrival_minutes} min). You are {round(passenger_to_stop_distance)}m from the stop."
 
-            #logger.info(f"📤 Saving proximity notification to database for passenger {passenger_id}")
-            await notification_service.send_real_time_notification(
-                user_id=passenger_id,
-                title=notification_title,
-                message=notification_message,
-                notification_type="PROXIMITY_ALERT",
-                related_entity={
+            # Persisted in batches; the id is assigned here so the live message can carry it
+            if websocket_manager.is_user_subscribed_to_notification(passenger_id, "PROXIMITY_ALERT"):
+                related_entity = {
                     "entity_type": "bus_proximity",
                     "entity_id": bus_id,
                     "bus_stop_id": bus_stop_id,
                     "bus_distance_meters": bus_to_stop_distance,
                     "passenger_distance_meters": passenger_to_stop_distance
-                },
-                app_state=app_state
-            )
+                }
+                created_at = datetime.now(timezone.utc)
+                notification_id = ObjectId()
+                proximity_alert_tracker.queue({
+                    "_id": notification_id,
+                    "user_id": passenger_id,
+                    "title": notification_title,
+                    "message": notification_message,
+                    "type": "PROXIMITY_ALERT",
+                    "is_read": False,
+                    "related_entity": related_entity,
+                    "created_at": created_at
+                })
+                if not proximity_alert_tracker.is_running and app_state is not None:
+                    await proximity_alert_tracker.flush(app_state.mongodb)
+
+                await websocket_manager.send_personal_message(passenger_id, {
+                    "type": "notification",
+                    "notification": {
+                        "id": str(notification_id),
+                        "title": notification_title,
+                        "message": notification_message,
+                        "notification_type": "PROXIMITY_ALERT",
+                        "related_entity": related_entity,
+                        "timestamp": created_at.isoformat(),
+                        "is_read": False
+                    }
+                })
 
             #logger.info(f"✅ Proximity notification sent successfully to passenger {passenger_id} for bus {bus_id}")
 
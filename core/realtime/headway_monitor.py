@@ -0,0 +1,332 @@
+"""
+Real-time headway and bus-bunching detection on the location stream.
+
+Every location update is projected onto its route and the buses of each
+route are kept ordered by distance along the route:
+1. Route polylines and scheduled headways are loaded once per route (and
+   refreshed hourly), so location updates never read the database
+2. Each route keeps a sorted list of (distance along route, bus) plus the
+   latest position per bus, so state is O(buses)
+3. The live headway of a bus is the time to cover the gap to the bus ahead
+   at the route's cruise speed
+4. When a headway drops below ``BUNCHING_HEADWAY_FRACTION`` of the scheduled
+   headway a ``BUNCHING`` notification is sent to control center staff; the
+   pair is re-armed once the headway recovers
+"""
+
+import bisect
+import os
+import time
+from typing import Dict, Any, List, Optional, Tuple
+
+import numpy as np
+
+from core.logger import get_logger
+
+logger = get_logger(__name__)
+
+EARTH_RADIUS_KM = 6371.0
+
+
+class RouteLine:
+    """A route polyline with cumulative distances, treated as a loop like the simulator's routes."""
+
+    __slots__ = ("route_id", "x", "y", "cumulative", "loop_length_km", "lat0", "scheduled_headway_seconds",
+                 "cruise_speed_kmh", "loaded_at")
+
+    def __init__(
+        self,
+        route_id: str,
+        latitudes: List[float],
+        longitudes: List[float],
+        scheduled_headway_seconds: Optional[float] = None,
+        cruise_speed_kmh: float = 20.0
+    ):
+        self.route_id = route_id
+        lat = np.asarray(latitudes, dtype=np.float64)
+        lon = np.asarray(longitudes, dtype=np.float64)
+        # Close the loop, then work in a local equirectangular plane (km)
+        lat = np.append(lat, lat[0])
+        lon = np.append(lon, lon[0])
+        self.lat0 = float(np.radians(lat.mean()))
+        self.x = np.radians(lon) * np.cos(self.lat0) * EARTH_RADIUS_KM
+        self.y = np.radians(lat) * EARTH_RADIUS_KM
+        segment = np.hypot(np.diff(self.x), np.diff(self.y))
+        self.cumulative = np.concatenate(([0.0], np.cumsum(segment)))
+        self.loop_length_km = float(self.cumulative[-1])
+        self.scheduled_headway_seconds = scheduled_headway_seconds
+        self.cruise_speed_kmh = cruise_speed_kmh
+        self.loaded_at = time.monotonic()
+
+    def project(self, latitude: float, longitude: float) -> float:
+        """Distance along the route (km) of the closest point to a location."""
+        px = np.radians(longitude) * np.cos(self.lat0) * EARTH_RADIUS_KM
+        py = np.radians(latitude) * EARTH_RADIUS_KM
+        x0, y0 = self.x[:-1], self.y[:-1]
+        dx, dy = np.diff(self.x), np.diff(self.y)
+        length_sq = dx * dx + dy * dy
+        t = np.clip(((px - x0) * dx + (py - y0) * dy) / np.where(length_sq > 0, length_sq, 1.0), 0.0, 1.0)
+        distance_sq = (x0 + t * dx - px) ** 2 + (y0 + t * dy - py) ** 2
+        segment = int(np.argmin(distance_sq))
+        return float(self.cumulative[segment] + t[segment] * np.sqrt(length_sq[segment]))
+
+
+class RouteHeadways:
+    """Buses of one route ordered by distance along the route."""
+
+    __slots__ = ("order", "positions", "bunched")
+
+    def __init__(self):
+        self.order: List[Tuple[float, str]] = []
+        self.positions: Dict[str, Tuple[float, float]] = {}  # bus_id -> (distance km, monotonic time)
+        self.bunched: Dict[str, str] = {}  # follower bus_id -> leader bus_id
+
+    def update(self, bus_id: str, distance: float, now: float) -> None:
+        previous = self.positions.get(bus_id)
+        if previous is not None:
+            index = bisect.bisect_left(self.order, (previous[0], bus_id))
+            if index < len(self.order) and self.order[index][1] == bus_id:
+                self.order.pop(index)
+        bisect.insort(self.order, (distance, bus_id))
+        self.positions[bus_id] = (distance, now)
+
+    def remove(self, bus_id: str) -> None:
+        previous = self.positions.pop(bus_id, None)
+        if previous is not None:
+            index = bisect.bisect_left(self.order, (previous[0], bus_id))
+            if index < len(self.order) and self.order[index][1] == bus_id:
+                self.order.pop(index)
+        self.bunched.pop(bus_id, None)
+        for follower, leader in list(self.bunched.items()):
+            if leader == bus_id:
+                del self.bunched[follower]
+
+    def neighbours(self, bus_id: str) -> Tuple[str, str]:
+        """(bus behind, bus ahead) on the loop."""
+        distance = self.positions[bus_id][0]
+        index = bisect.bisect_left(self.order, (distance, bus_id))
+        count = len(self.order)
+        return self.order[(index - 1) % count][1], self.order[(index + 1) % count][1]
+
+    def gap_km(self, follower: str, leader: str, loop_length_km: float) -> float:
+        gap = self.positions[leader][0] - self.positions[follower][0]
+        return gap % loop_length_km if loop_length_km > 0 else abs(gap)
+
+
+class HeadwayMonitor:
+    """Streaming bunching detector fed by bus location updates."""
+
+    def __init__(
+        self,
+        threshold_fraction: Optional[float] = None,
+        stale_seconds: Optional[float] = None,
+        route_refresh_seconds: float = 3600.0,
+        default_cruise_speed_kmh: Optional[float] = None
+    ):
+        self.threshold_fraction = threshold_fraction or float(os.getenv("BUNCHING_HEADWAY_FRACTION", "0.25"))
+        self.stale_seconds = stale_seconds or float(os.getenv("BUNCHING_STALE_SECONDS", "300"))
+        self.route_refresh_seconds = route_refresh_seconds
+        self.default_cruise_speed_kmh = default_cruise_speed_kmh or float(
+            os.getenv("BUNCHING_CRUISE_SPEED_KMH", "20")
+        )
+        # A bunched pair is re-armed once its headway is back above this multiple of the threshold
+        self.rearm_factor = 1.5
+        self.routes: Dict[str, RouteLine] = {}
+        self._unusable_routes: Dict[str, float] = {}  # route_id -> monotonic time of the failed load
+        self.headways: Dict[str, RouteHeadways] = {}
+        self.bus_routes: Dict[str, str] = {}
+        self.updates = 0
+        self.alerts = 0
+
+    # ------------------------------------------------------------------
+    # Route loading (once per route, never per update)
+    # ------------------------------------------------------------------
+
+    def needs_route(self, route_id: str) -> bool:
+        line = self.routes.get(route_id)
+        loaded_at = line.loaded_at if line is not None else self._unusable_routes.get(route_id)
+        return loaded_at is None or time.monotonic() - loaded_at > self.route_refresh_seconds
+
+    def set_route(self, line: RouteLine) -> None:
+        self.routes[line.route_id] = line
+
+    async def load_route(self, route_id: str, db) -> Optional[RouteLine]:
+        """Load a route polyline and its scheduled headway from the database."""
+        route = await db.routes.find_one({"id": route_id})
+        if not route:
+            return None
+
+        latitudes: List[float] = []
+        longitudes: List[float] = []
+        coordinates = (route.get("route_geometry") or {}).get("coordinates") or []
+        for coordinate in coordinates:
+            if len(coordinate) >= 2:
+                longitudes.append(coordinate[0])  # GeoJSON uses [lon, lat]
+                latitudes.append(coordinate[1])
+        if len(latitudes) < 2 and route.get("stop_ids"):
+            stops = await db.bus_stops.find(
+                {"id": {"$in": route["stop_ids"]}}, {"id": 1, "location": 1}
+            ).to_list(length=None)
+            by_id = {stop["id"]: stop.get("location") or {} for stop in stops}
+            latitudes, longitudes = [], []
+            for stop_id in route["stop_ids"]:
+                location = by_id.get(stop_id) or {}
+                if location.get("latitude") is not None and location.get("longitude") is not None:
+                    latitudes.append(location["latitude"])
+                    longitudes.append(location["longitude"])
+        if len(latitudes) < 2:
+            return None
+
+        line = RouteLine(
+            route_id,
+            latitudes,
+            longitudes,
+            scheduled_headway_seconds=await self._timetable_headway(route_id, db),
+            cruise_speed_kmh=self.default_cruise_speed_kmh
+        )
+        # Prefer the route's own average speed when its duration is known
+        if route.get("estimated_duration") and line.loop_length_km > 0:
+            line.cruise_speed_kmh = line.loop_length_km / (route["estimated_duration"] / 60.0)
+        self.set_route(line)
+        return line
+
+    @staticmethod
+    async def _timetable_headway(route_id: str, db) -> Optional[float]:
+        """Median gap (seconds) between consecutive scheduled departures of a route."""
+        schedules = await db.schedules.find(
+            {"route_id": route_id, "is_active": True}, {"departure_times": 1}
+        ).to_list(length=None)
+        departures = set()
+        for schedule in schedules:
+            for departure in schedule.get("departure_times") or []:
+                try:
+                    hours, minutes = str(departure).split(":")[:2]
+                    departures.add(int(hours) * 3600 + int(minutes) * 60)
+                except ValueError:
+                    continue
+        if len(departures) < 2:
+            return None
+        gaps = np.diff(sorted(departures))
+        return float(np.median(gaps[gaps > 0])) if np.any(gaps > 0) else None
+
+    async def ensure_routes(self, route_ids, db) -> None:
+        for route_id in set(route_ids):
+            if route_id and self.needs_route(route_id):
+                try:
+                    if await self.load_route(route_id, db) is None:
+                        # Remember unusable routes so they are not reloaded on every update
+                        self.routes.pop(route_id, None)
+                        self._unusable_routes[route_id] = time.monotonic()
+                    else:
+                        self._unusable_routes.pop(route_id, None)
+                except Exception as e:
+                    logger.error(f"Error loading route {route_id} for headway monitoring: {e}")
+
+    # ------------------------------------------------------------------
+    # Streaming updates
+    # ------------------------------------------------------------------
+
+    def observe(self, bus_id: str, route_id: Optional[str], latitude: float, longitude: float) -> List[Dict[str, Any]]:
+        """
+        Record a location update and return new bunching events. Routes that
+        have not been loaded are ignored.
+        """
+        previous_route = self.bus_routes.get(bus_id)
+        if previous_route and previous_route != route_id:
+            self.headways[previous_route].remove(bus_id)
+            del self.bus_routes[bus_id]
+
+        line = self.routes.get(route_id) if route_id else None
+        if route_id is None or line is None:
+            return []
+
+        now = time.monotonic()
+        self.updates += 1
+        state = self.headways.setdefault(route_id, RouteHeadways())
+        state.update(bus_id, line.project(latitude, longitude), now)
+        self.bus_routes[bus_id] = route_id
+        self._expire(state, now)
+        if len(state.order) < 2:
+            return []
+
+        behind, ahead = state.neighbours(bus_id)
+        events = []
+        for follower, leader in ((bus_id, ahead), (behind, bus_id)):
+            event = self._check_pair(line, state, follower, leader)
+            if event:
+                events.append(event)
+        return events
+
+    def _expire(self, state: RouteHeadways, now: float) -> None:
+        for stale_bus in [b for b, (_, seen) in state.positions.items() if now - seen > self.stale_seconds]:
+            state.remove(stale_bus)
+            self.bus_routes.pop(stale_bus, None)
+
+    def _target_headway(self, line: RouteLine, state: RouteHeadways) -> float:
+        if line.scheduled_headway_seconds:
+            return line.scheduled_headway_seconds
+        # Without a timetable, even spacing of the buses currently on the route
+        return line.loop_length_km / line.cruise_speed_kmh * 3600 / len(state.order)
+
+    def _check_pair(
+        self,
+        line: RouteLine,
+        state: RouteHeadways,
+        follower: str,
+        leader: str
+    ) -> Optional[Dict[str, Any]]:
+        if follower == leader:
+            return None
+        headway = state.gap_km(follower, leader, line.loop_length_km) / line.cruise_speed_kmh * 3600
+        scheduled = self._target_headway(line, state)
+        threshold = self.threshold_fraction * scheduled
+
+        if headway < threshold:
+            if state.bunched.get(follower) == leader:
+                return None
+            state.bunched[follower] = leader
+            self.alerts += 1
+            return {
+                "route_id": line.route_id,
+                "leader_bus_id": leader,
+                "follower_bus_id": follower,
+                "headway_seconds": round(headway, 1),
+                "scheduled_headway_seconds": round(scheduled, 1),
+                "headway_ratio": round(headway / scheduled, 3) if scheduled else 0.0
+            }
+        if state.bunched.get(follower) == leader and headway > threshold * self.rearm_factor:
+            del state.bunched[follower]
+        return None
+
+    def get_route_headways(self, route_id: str) -> List[Dict[str, Any]]:
+        """Current headway of every bus on a route, in route order."""
+        line = self.routes.get(route_id)
+        state = self.headways.get(route_id)
+        if line is None or state is None or len(state.order) < 2:
+            return []
+        result = []
+        for index, (distance, bus_id) in enumerate(state.order):
+            leader = state.order[(index + 1) % len(state.order)][1]
+            gap = state.gap_km(bus_id, leader, line.loop_length_km)
+            result.append({
+                "bus_id": bus_id,
+                "leader_bus_id": leader,
+                "distance_along_route_km": round(distance, 3),
+                "headway_seconds": round(gap / line.cruise_speed_kmh * 3600, 1),
+                "bunched": state.bunched.get(bus_id) == leader
+            })
+        return result
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "routes": len(self.routes),
+            "tracked_buses": len(self.bus_routes),
+            "bunched_pairs": sum(len(state.bunched) for state in self.headways.values()),
+            "updates": self.updates,
+            "alerts": self.alerts,
+            "threshold_fraction": self.threshold_fraction
+        }
+
+
+# Global instance fed by BusTrackingService
+headway_monitor = HeadwayMonitor()
@@ -0,0 +1,281 @@
+"""
+Outbox for per-user notifications.
+
+Services used to insert every notification and push it over the WebSocket
+before returning, so the calling request or location update waited on both:
+1. ``enqueue`` appends the notification intent to a bounded in-memory ring
+   buffer (``NOTIFICATION_OUTBOX_CAPACITY``) and returns. When the buffer is
+   full or the outbox is not running it returns False and the caller takes
+   the inline path. The buffer is not persisted: a graceful stop drains it,
+   but intents still in it when the process crashes are lost
+2. Workers take up to ``NOTIFICATION_OUTBOX_BATCH`` intents at a time and
+   write them to ``notifications`` with one ``insert_many``; from then on the
+   documents carry ``delivery_status: pending``
+3. The batch is sent through the WebSocket manager concurrently and the
+   outcome recorded with ``update_many``: ``delivered``, or ``offline`` for
+   users who read it later through the notifications API
+4. Notifications left ``pending`` by an interrupted run are sent to their
+   user when that user next connects (``redeliver``), on whichever process
+   the connection lands, if younger than
+   ``NOTIFICATION_OUTBOX_REDELIVERY_SECONDS``; older ones are marked
+   ``expired`` on start. Nothing is marked offline at startup, before
+   clients have had a chance to reconnect
+Delivery-only intents (trip updates to rooms) are sent without being stored.
+"""
+
+import asyncio
+import os
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from typing import Any, Deque, Dict, Iterable, List, Optional
+
+from bson import ObjectId
+
+from core.websocket_manager import websocket_manager
+from core.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+def notification_message(notification: Dict[str, Any]) -> Dict[str, Any]:
+    """The WebSocket message for a stored notification document."""
+    return {
+        "type": "notification",
+        "notification": {
+            "id": str(notification["_id"]) if notification.get("_id") is not None else None,
+            "title": notification["title"],
+            "message": notification["message"],
+            "notification_type": notification["type"],
+            "related_entity": notification.get("related_entity"),
+            "timestamp": notification["created_at"].isoformat(),
+            "is_read": False
+        }
+    }
+
+
+class NotificationOutbox:
+    """Buffers notification intents and stores and delivers them in batches."""
+
+    def __init__(
+        self,
+        db=None,
+        capacity: Optional[int] = None,
+        batch_size: Optional[int] = None,
+        workers: Optional[int] = None,
+        redelivery_seconds: Optional[float] = None,
+        in_flight_seconds: Optional[float] = None,
+        shutdown_timeout: float = 10.0
+    ):
+        self.db = db
+        self.capacity = capacity or int(os.getenv("NOTIFICATION_OUTBOX_CAPACITY", "10000"))
+        self.batch_size = batch_size or int(os.getenv("NOTIFICATION_OUTBOX_BATCH", "500"))
+        self.workers = workers or int(os.getenv("NOTIFICATION_OUTBOX_WORKERS", "2"))
+        self.redelivery_seconds = redelivery_seconds or float(
+            os.getenv("NOTIFICATION_OUTBOX_REDELIVERY_SECONDS", "300")
+        )
+        # Younger pending notifications may still be mid-batch on a live worker
+        self.in_flight_seconds = in_flight_seconds or float(
+            os.getenv("NOTIFICATION_OUTBOX_IN_FLIGHT_SECONDS", "10")
+        )
+        self.shutdown_timeout = shutdown_timeout
+        self.buffer: Deque[Dict[str, Any]] = deque()
+        self.stats = {
+            "queued": 0, "rejected": 0, "stored": 0, "delivered": 0, "offline": 0,
+            "batches": 0, "redelivered": 0, "failed": 0
+        }
+        self.max_depth = 0
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._tasks: List[asyncio.Task] = []
+
+    @property
+    def is_running(self) -> bool:
+        return bool(self._tasks) and not self._stopping
+
+    async def start(self, db=None):
+        """Create the indexes, expire old interrupted deliveries and start the workers."""
+        if db is not None:
+            self.db = db
+        await self.db.notifications.create_index(
+            "created_at", partialFilterExpression={"delivery_status": "pending"}
+        )
+        await self.db.notifications.create_index(
+            [("user_id", 1), ("created_at", 1)], partialFilterExpression={"delivery_status": "pending"}
+        )
+        await self.expire_pending()
+        if not self._tasks:
+            self._wakeup = asyncio.Event()
+            self._stopping = False
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        """Let the workers drain the buffer, then stop them."""
+        self._stopping = True
+        self._wakeup.set()
+        if self._tasks:
+            _, pending = await asyncio.wait(self._tasks, timeout=self.shutdown_timeout)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            if pending:
+                logger.warning(f"Stopped notification outbox with {len(self.buffer)} notifications unsent")
+        self._tasks = []
+
+    # ------------------------------------------------------------------
+    # Intake
+    # ------------------------------------------------------------------
+
+    def _append(self, intent: Dict[str, Any]) -> bool:
+        if not self.is_running or len(self.buffer) >= self.capacity:
+            self.stats["rejected"] += 1
+            return False
+        self.buffer.append(intent)
+        self.stats["queued"] += 1
+        self.max_depth = max(self.max_depth, len(self.buffer))
+        self._wakeup.set()
+        return True
+
+    def enqueue(
+        self,
+        user_id: str,
+        title: str,
+        message: str,
+        notification_type: str = "GENERAL",
+        related_entity: Optional[dict] = None
+    ) -> bool:
+        """Queue a notification to store and deliver. False if the caller should send it inline."""
+        return self._append({
+            "user_id": str(user_id),
+            "title": title,
+            "message": message,
+            "type": notification_type,
+            "related_entity": related_entity,
+            "created_at": datetime.now(timezone.utc)
+        })
+
+    def enqueue_delivery(
+        self,
+        message: Dict[str, Any],
+        user_ids: Iterable[str] = (),
+        room_ids: Iterable[str] = ()
+    ) -> bool:
+        """Queue a WebSocket message for users and rooms without storing it."""
+        return self._append({"deliver": message, "user_ids": [str(u) for u in user_ids], "room_ids": list(room_ids)})
+
+    # ------------------------------------------------------------------
+    # Workers
+    # ------------------------------------------------------------------
+
+    def _take(self) -> List[Dict[str, Any]]:
+        batch: List[Dict[str, Any]] = []
+        while self.buffer and len(batch) < self.batch_size:
+            batch.append(self.buffer.popleft())
+        return batch
+
+    async def _worker(self):
+        while True:
+            # Cleared before taking, so an intent queued meanwhile wakes us
+            self._wakeup.clear()
+            batch = self._take()
+            if not batch:
+                if self._stopping:
+                    return
+                await self._wakeup.wait()
+                continue
+            try:
+                await self._process(batch)
+            except Exception as e:
+                self.stats["failed"] += len(batch)
+                logger.error(f"Error processing {len(batch)} queued notifications: {e}")
+
+    async def _process(self, batch: List[Dict[str, Any]]):
+        self.stats["batches"] += 1
+        notifications = [intent for intent in batch if "deliver" not in intent]
+        if notifications:
+            for notification in notifications:
+                notification.update(_id=ObjectId(), is_read=False, delivery_status="pending")
+            try:
+                await self.db.notifications.insert_many(notifications, ordered=False)
+                self.stats["stored"] += len(notifications)
+            except Exception as e:
+                # Still worth delivering live; the user just cannot read it back later
+                self.stats["failed"] += len(notifications)
+                logger.error(f"Failed to store {len(notifications)} notifications: {e}")
+                for notification in notifications:
+                    notification["_id"] = None
+            await self._deliver(notifications)
+
+        for intent in batch:
+            if "deliver" in intent:
+                if intent["user_ids"]:
+                    await websocket_manager.send_to_users(intent["user_ids"], intent["deliver"])
+                for room_id in intent["room_ids"]:
+                    await websocket_manager.send_room_message(room_id, intent["deliver"])
+
+    async def _deliver(self, notifications: List[Dict[str, Any]]):
+        """Send stored notifications and record which reached a connected user."""
+        results = await asyncio.gather(*(
+            websocket_manager.send_personal_message(notification["user_id"], notification_message(notification))
+            for notification in notifications
+        ))
+        outcome: Dict[str, List[Any]] = {"delivered": [], "offline": []}
+        for notification, sent in zip(notifications, results):
+            if notification["_id"] is not None:
+                outcome["delivered" if sent else "offline"].append(notification["_id"])
+        self.stats["delivered"] += sum(results)
+        self.stats["offline"] += len(results) - sum(results)
+
+        now = datetime.now(timezone.utc)
+        for status, ids in outcome.items():
+            if ids:
+                update: Dict[str, Any] = {"delivery_status": status}
+                if status == "delivered":
+                    update["delivered_at"] = now
+                await self.db.notifications.update_many({"_id": {"$in": ids}}, {"$set": update})
+
+    async def expire_pending(self):
+        """Give up on interrupted deliveries too old to be worth sending."""
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=self.redelivery_seconds)
+        await self.db.notifications.update_many(
+            {"delivery_status": "pending", "created_at": {"$lt": cutoff}},
+            {"$set": {"delivery_status": "expired"}}
+        )
+
+    async def redeliver(self, user_id: str) -> int:
+        """Send a connecting user the notifications an interrupted run stored but did not deliver."""
+        if self.db is None:
+            return 0
+        now = datetime.now(timezone.utc)
+        claim = ObjectId()
+        # Claimed first, so a user connected to two processes gets each notification once
+        await self.db.notifications.update_many(
+            {
+                "user_id": str(user_id),
+                "delivery_status": "pending",
+                "created_at": {
+                    "$gte": now - timedelta(seconds=self.redelivery_seconds),
+                    "$lt": now - timedelta(seconds=self.in_flight_seconds)
+                }
+            },
+            {"$set": {"delivery_status": "redelivering", "redelivery_claim": claim}}
+        )
+        notifications = await self.db.notifications.find(
+            {"redelivery_claim": claim}
+        ).sort("created_at", 1).to_list(length=None)
+        if notifications:
+            await self._deliver(notifications)
+            self.stats["redelivered"] += len(notifications)
+        return len(notifications)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "depth": len(self.buffer),
+            "max_depth": self.max_depth,
+            "capacity": self.capacity,
+            "workers": len(self._tasks)
+        }
+
+
+# Global outbox instance used by NotificationService
+notification_outbox = NotificationOutbox()
@@ -1,16 +1,22 @@
 """
 Real-time notifications service
 """
+import os
 from datetime import datetime, timezone
-from typing import List, Optional
+from typing import Any, Dict, List, Optional
 
-from core.websocket_manager import websocket_manager
+from core.websocket_manager import role_room, websocket_manager
+from core.realtime.notification_outbox import notification_outbox
 from core.logger import get_logger
+from core.mongo_utils import real_users_query
 # Import UserRole as string to avoid circular import
 # from models.users import UserRole
 
 logger = get_logger(__name__)
 
+# Users read and notification documents written per round trip in a broadcast
+FANOUT_CHUNK_SIZE = int(os.getenv("NOTIFICATION_FANOUT_CHUNK_SIZE", "1000"))
+
 
 class NotificationService:
     """Service for real-time notifications"""
@@ -35,12 +41,17 @@ class NotificationService:
 
             # Check if user is subscribed to this notification type
             is_subscribed = websocket_manager.is_user_subscribed_to_notification(user_id, notification_type)
-            logger.info(f"🔔 User {user_id} subscription status for {notification_type}: {'SUBSCRIBED' if is_subscribed else 'NOT SUBSCRIBED'}")
+            logger.debug(f"🔔 User {user_id} subscription status for {notification_type}: {'SUBSCRIBED' if is_subscribed else 'NOT SUBSCRIBED'}")
 
             if not is_subscribed:
                 logger.info(f"⏭️ Skipping notification to user {user_id} - not subscribed to {notification_type}")
                 return
 
+            # Stored and delivered in the background while the outbox runs
+            if notification_outbox.enqueue(user_id, title, message, notification_type, related_entity):
+                logger.debug(f"📥 Queued notification for user {user_id}: {title}")
+                return
+
             # Save notification to database
             notification_data = {
                 "user_id": user_id,
@@ -101,72 +112,66 @@ class NotificationService:
         target_roles: Optional[List[str]] = None,
         related_entity: Optional[dict] = None,
         app_state=None
-    ):
-        """Broadcast notification to multiple users"""
-        try:
-            target_users = []
-            
-            if app_state and app_state.mongodb is not None:
-                if target_user_ids:
-                    # Send to specific users
-                    target_users = await app_state.mongodb.users.find(
-                        {"id": {"$in": target_user_ids}}
-                    ).to_list(length=None)
-                elif target_roles:
-                    # Send to users with specific roles
-                    target_users = await app_state.mongodb.users.find(
-                        {"role": {"$in": target_roles}}
-                    ).to_list(length=None)
-                else:
-                    # Send to all users
-                    target_users = await app_state.mongodb.users.find({}).to_list(length=None)
-                
-                # Save notifications to database
-                notifications = []
-                for user in target_users:
-                    notification_data = {
-                        "user_id": user["id"],
-                        "title": title,
-                        "message": message,
-                        "type": notification_type,
-                        "is_read": False,
-                        "related_entity": related_entity,
-                        "created_at": datetime.now(timezone.utc)
-                    }
-                    notifications.append(notification_data)
-                
-                if notifications:
-                    await app_state.mongodb.notifications.insert_many(notifications)
-            
-            # Filter users based on notification subscriptions
-            subscribed_users = []
+    ) -> int:
+        """
+        Broadcast notification to multiple users
+
+        Recipients are read with an id-only projection and their notification
+        documents written in chunks, so neither side holds the whole audience
+        in memory. Live delivery goes to the role rooms (or the targeted users)
+        intersected with the subscriber index for ``notification_type``.
+
+        Storage errors are raised so callers do not report a partial
+        broadcast as sent; live delivery errors are logged, since the stored
+        notifications are still listed by ``GET /notifications``.
+
+        Returns:
+            int: Number of notifications stored
+        """
+        stored = 0
+        target_roles = [getattr(role, "value", role) for role in target_roles or []]
+
+        if app_state and app_state.mongodb is not None:
+            query: Dict[str, Any]
             if target_user_ids:
-                # Filter specific target users by subscription
-                for user_id in target_user_ids:
-                    if websocket_manager.is_user_subscribed_to_notification(str(user_id), notification_type):
-                        subscribed_users.append(str(user_id))
-                    else:
-                        logger.debug(f"⏭️ Skipping user {user_id} - not subscribed to {notification_type}")
-            elif target_users:
-                # Filter database users by subscription
-                for user in target_users:
-                    user_id = str(user["id"])
-                    if websocket_manager.is_user_subscribed_to_notification(user_id, notification_type):
-                        subscribed_users.append(user_id)
-                    else:
-                        logger.debug(f"⏭️ Skipping user {user_id} - not subscribed to {notification_type}")
+                # Send to specific users
+                query = {"id": {"$in": target_user_ids}}
+            elif target_roles:
+                # Send to users with specific roles
+                query = real_users_query({"role": {"$in": target_roles}})
             else:
-                # Get all users subscribed to this notification type
-                subscribed_users = websocket_manager.get_subscribed_users_for_notification(notification_type)
-
-            logger.info(f"🔔 Sending {notification_type} notification to {len(subscribed_users)} subscribed users")
+                # Send to all users, leaving out load-test passengers
+                query = real_users_query()
+
+            created_at = datetime.now(timezone.utc)
+            chunk = []
+            cursor = app_state.mongodb.users.find(query, {"id": 1, "_id": 0}).batch_size(FANOUT_CHUNK_SIZE)
+            async for user in cursor:
+                chunk.append({
+                    "user_id": user["id"],
+                    "title": title,
+                    "message": message,
+                    "type": notification_type,
+                    "is_read": False,
+                    "related_entity": related_entity,
+                    "created_at": created_at
+                })
+                if len(chunk) >= FANOUT_CHUNK_SIZE:
+                    await app_state.mongodb.notifications.insert_many(chunk, ordered=False)
+                    stored += len(chunk)
+                    chunk = []
+            if chunk:
+                await app_state.mongodb.notifications.insert_many(chunk, ordered=False)
+                stored += len(chunk)
 
-            if not subscribed_users:
+        try:
+            # Only users subscribed to this notification type get it live
+            if not websocket_manager.notification_subscribers.get(notification_type):
                 logger.info(f"⏭️ No users subscribed to {notification_type} - skipping notification broadcast")
-                return
+                return stored
 
             # Send real-time notifications via WebSocket
-            websocket_message = {
+            ws_message = {
                 "type": "notification",
                 "notification": {
                     "title": title,
@@ -175,24 +180,30 @@ class NotificationService:
                     "related_entity": related_entity,
                     "timestamp": datetime.now(timezone.utc).isoformat(),
                     "is_read": False
-                }            }
-
-            # Convert to WebSocket message format
-            ws_message = {
-                "type": "notification",
-                **websocket_message
+                }
             }
 
-            # Send to subscribed users only
-            for user_id in subscribed_users:
-                await websocket_manager.send_personal_message(user_id, ws_message)
+            if target_user_ids:
+                delivered = await websocket_manager.send_notification(
+                    notification_type, ws_message, user_ids=[str(user_id) for user_id in target_user_ids]
+                )
+            elif target_roles:
+                # One room send per role; each user is in a single role room
+                delivered = 0
+                for role in target_roles:
+                    delivered += await websocket_manager.send_notification(
+                        notification_type, ws_message, room_id=role_room(role)
+                    )
+            else:
+                delivered = await websocket_manager.send_notification(notification_type, ws_message)
+
+            logger.info(f"Broadcast {notification_type} notification to {stored} users, "
+                        f"{delivered} delivered live: {title}")
 
-            recipient_count = len(subscribed_users)
-            logger.info(f"Broadcast notification to {recipient_count} subscribed users: {title}")
-            
         except Exception as e:
             logger.error(f"Error broadcasting notification: {e}")
-    
+        return stored
+
     @staticmethod
     async def send_trip_update_notification(
         trip_id: str,
@@ -247,19 +258,15 @@ class NotificationService:
                     **websocket_message
                 }
 
-                # Send to individual participants
-                if participants:
-                    for participant_id in participants:
-                        await websocket_manager.send_personal_message(str(participant_id), ws_message)
-
-                # Also send to users tracking this specific trip/route
-                room_id = f"trip_tracking:{trip_id}"
-                await websocket_manager.send_room_message(room_id, ws_message)
-
-                # Also send to route subscribers
+                # Participants, users tracking this trip and route subscribers
+                room_ids = [f"trip_tracking:{trip_id}"]
                 if route_id:
-                    route_room_id = f"route_tracking:{route_id}"
-                    await websocket_manager.send_room_message(route_room_id, ws_message)
+                    room_ids.append(f"route_tracking:{route_id}")
+
+                if not notification_outbox.enqueue_delivery(ws_message, user_ids=participants, room_ids=room_ids):
+                    await websocket_manager.send_to_users([str(p) for p in participants], ws_message)
+                    for room_id in room_ids:
+                        await websocket_manager.send_room_message(room_id, ws_message)
                 
                 logger.info(f"Sent trip update notification for trip {trip_id}")
             
@@ -337,10 +344,10 @@ class NotificationService:
             # 3. Notify the queue regulator of the previous route (if exists)
             if old_route_id:
                 # Find queue regulators assigned to the old route
-                old_route_regulators = await app_state.mongodb.users.find({
+                old_route_regulators = await app_state.mongodb.users.find(real_users_query({
                     "role": "QUEUE_REGULATOR",
                     "assigned_route_ids": old_route_id
-                }).to_list(length=None)
+                })).to_list(length=None)
 
                 for regulator in old_route_regulators:
                     # Don't double-notify the requesting regulator
@@ -356,10 +363,10 @@ class NotificationService:
                         logger.info(f"Sent route reallocation notification to old route regulator {regulator['id']}")
 
             # 4. Notify the queue regulator of the new route
-            new_route_regulators = await app_state.mongodb.users.find({
+            new_route_regulators = await app_state.mongodb.users.find(real_users_query({
                 "role": "QUEUE_REGULATOR",
                 "assigned_route_ids": new_route_id
-            }).to_list(length=None)
+            })).to_list(length=None)
 
             for regulator in new_route_regulators:
                 # Don't double-notify the requesting regulator
@@ -546,5 +553,46 @@ class NotificationService:
             logger.error(f"💥 Error sending reallocation request submitted notification: {e}", exc_info=True)
 
 
+    @staticmethod
+    async def send_bunching_notification(
+        route_id: str,
+        leader_bus_id: str,
+        follower_bus_id: str,
+        headway_seconds: float,
+        scheduled_headway_seconds: float,
+        headway_ratio: Optional[float] = None,
+        app_state=None
+    ):
+        """Send notification to control center when two buses on a route are bunched"""
+        try:
+            related_entity = {
+                "entity_type": "route",
+                "route_id": route_id,
+                "leader_bus_id": leader_bus_id,
+                "follower_bus_id": follower_bus_id,
+                "headway_seconds": headway_seconds,
+                "scheduled_headway_seconds": scheduled_headway_seconds,
+                "headway_ratio": headway_ratio
+            }
+
+            message = (
+                f"Bus {follower_bus_id} is {headway_seconds / 60:.1f} min behind bus {leader_bus_id} "
+                f"on route {route_id} (scheduled headway {scheduled_headway_seconds / 60:.1f} min)"
+            )
+
+            await NotificationService.broadcast_notification(
+                title="Bus Bunching Detected",
+                message=message,
+                notification_type="BUNCHING",
+                target_roles=["CONTROL_ADMIN", "CONTROL_STAFF"],
+                related_entity=related_entity,
+                app_state=app_state
+            )
+
+            logger.info(f"Sent bunching notification for buses {follower_bus_id}/{leader_bus_id} on route {route_id}")
+
+        except Exception as e:
+            logger.error(f"Error sending bunching notification: {e}")
+
 # Global notification service instance
 notification_service = NotificationService()
@@ -0,0 +1,299 @@
+"""
+Deduplication and batched persistence of passenger proximity alerts.
+
+``check_proximity_notifications`` runs on every location update, so a bus
+inside a stop's radius is seen many times per approach:
+1. Every (passenger, bus, stop) approach is tracked in memory as
+   approaching → arrived → departed; the alert is sent once, when the
+   approach is first seen
+2. A bus within ``PROXIMITY_ARRIVED_METERS`` of the stop has arrived; once
+   it is no longer near the stop the approach has departed. Departed
+   approaches are kept for ``PROXIMITY_COOLDOWN_SECONDS`` so a bus hovering
+   on the edge of the radius does not alert again
+3. Cooldowns are also written to ``proximity_cooldowns`` (TTL-indexed on
+   their expiry) and reloaded on start, so a restart does not re-alert
+   approaches that just departed
+4. Approaches not seen for ``PROXIMITY_STATE_TTL_SECONDS`` (passenger walked
+   away, bus went offline) are evicted, so state is bounded by live approaches
+5. Notification documents are buffered and written with one ``insert_many``
+   every ``PROXIMITY_FLUSH_SECONDS`` or ``PROXIMITY_FLUSH_BATCH`` documents
+"""
+
+import asyncio
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from core.logger import get_logger
+
+logger = get_logger(__name__)
+
+APPROACHING = "approaching"
+ARRIVED = "arrived"
+DEPARTED = "departed"
+
+COOLDOWN_COLLECTION = "proximity_cooldowns"
+
+ApproachKey = Tuple[str, str, str]  # (passenger_id, bus_id, stop_id)
+
+
+class Approach:
+    """One bus approaching one stop, as seen by one passenger."""
+
+    __slots__ = ("state", "since", "seen")
+
+    def __init__(self, state: str, now: float):
+        self.state = state
+        self.since = now  # last state change
+        self.seen = now  # last observation
+
+
+class ProximityAlertTracker:
+    """Per-approach alert state with write-behind of proximity notifications."""
+
+    def __init__(
+        self,
+        db=None,
+        arrived_meters: Optional[float] = None,
+        cooldown_seconds: Optional[float] = None,
+        ttl_seconds: Optional[float] = None,
+        flush_interval: Optional[float] = None,
+        flush_batch: Optional[int] = None
+    ):
+        self.db = db
+        self.arrived_meters = arrived_meters or float(os.getenv("PROXIMITY_ARRIVED_METERS", "50"))
+        self.cooldown_seconds = cooldown_seconds or float(os.getenv("PROXIMITY_COOLDOWN_SECONDS", "300"))
+        self.ttl_seconds = ttl_seconds or float(os.getenv("PROXIMITY_STATE_TTL_SECONDS", "600"))
+        self.flush_interval = flush_interval or float(os.getenv("PROXIMITY_FLUSH_SECONDS", "2"))
+        self.flush_batch = flush_batch or int(os.getenv("PROXIMITY_FLUSH_BATCH", "200"))
+        self.approaches: Dict[ApproachKey, Approach] = {}
+        self.bus_approaches: Dict[str, Set[ApproachKey]] = {}
+        self.pending: List[Dict[str, Any]] = []
+        # Departed approaches whose cooldown expiry is not yet persisted
+        self.pending_cooldowns: Dict[ApproachKey, datetime] = {}
+        self.stats = {
+            "alerts": 0, "suppressed": 0, "arrivals": 0, "departures": 0, "evicted": 0,
+            "flushed": 0, "flushes": 0, "cooldown_writes": 0, "baseline_inserts": 0,
+            "restored_cooldowns": 0
+        }
+        self._evicted_at = time.monotonic()
+        self._flush_needed = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+
+    @property
+    def is_running(self) -> bool:
+        return bool(self._tasks)
+
+    async def start(self, db=None):
+        if db is not None:
+            self.db = db
+        if self.db is not None:
+            try:
+                await self.restore_cooldowns()
+            except Exception as e:
+                logger.error(f"Failed to restore proximity alert cooldowns: {e}")
+        if not self._tasks:
+            self._flush_needed = asyncio.Event()
+            self._tasks = [asyncio.create_task(self._flush_loop())]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        await self.flush()
+
+    # ------------------------------------------------------------------
+    # Approach state
+    # ------------------------------------------------------------------
+
+    def observe(
+        self,
+        passenger_id: str,
+        bus_id: str,
+        stop_id: str,
+        bus_to_stop_distance: float,
+        now: Optional[float] = None,
+        subscribed: bool = False
+    ) -> bool:
+        """Record a passenger near a stop the bus is near. True if this is a new approach to alert about.
+
+        ``subscribed`` marks passengers whose alerts are stored; before
+        deduplication each of their observations was one notification insert.
+        """
+        now = now if now is not None else time.monotonic()
+        if subscribed:
+            self.stats["baseline_inserts"] += 1
+        key = (passenger_id, bus_id, stop_id)
+        approach = self.approaches.get(key)
+        if approach is not None and approach.state == DEPARTED and now - approach.since >= self.cooldown_seconds:
+            self._remove(key)
+            approach = None
+
+        if approach is None:
+            state = ARRIVED if bus_to_stop_distance <= self.arrived_meters else APPROACHING
+            self.approaches[key] = Approach(state, now)
+            self.bus_approaches.setdefault(bus_id, set()).add(key)
+            self.stats["alerts"] += 1
+            if state == ARRIVED:
+                self.stats["arrivals"] += 1
+            return True
+
+        # Back within the cooldown, a departed approach stays departed
+        if approach.state == APPROACHING and bus_to_stop_distance <= self.arrived_meters:
+            approach.state = ARRIVED
+            approach.since = now
+            self.stats["arrivals"] += 1
+        approach.seen = now
+        self.stats["suppressed"] += 1
+        return False
+
+    def observe_bus(self, bus_id: str, near_stop_ids: Iterable[str], now: Optional[float] = None) -> None:
+        """Mark approaches to stops the bus is no longer near as departed."""
+        now = now if now is not None else time.monotonic()
+        near = set(near_stop_ids)
+        for key in self.bus_approaches.get(bus_id, ()):
+            approach = self.approaches[key]
+            if key[2] not in near and approach.state != DEPARTED:
+                approach.state = DEPARTED
+                approach.since = now
+                self.stats["departures"] += 1
+                self.pending_cooldowns[key] = datetime.now(timezone.utc) + timedelta(seconds=self.cooldown_seconds)
+
+        if now - self._evicted_at >= min(self.ttl_seconds, self.cooldown_seconds) / 4:
+            self.evict(now)
+
+    def evict(self, now: Optional[float] = None) -> int:
+        """Drop approaches not seen within the TTL and departures past their cooldown."""
+        now = now if now is not None else time.monotonic()
+        self._evicted_at = now
+        expired = [
+            key for key, approach in self.approaches.items()
+            if now - approach.seen > self.ttl_seconds
+            or (approach.state == DEPARTED and now - approach.since >= self.cooldown_seconds)
+        ]
+        for key in expired:
+            self._remove(key)
+        self.stats["evicted"] += len(expired)
+        return len(expired)
+
+    async def restore_cooldowns(self, db=None) -> int:
+        """Reload unexpired cooldowns written before a restart."""
+        db = db if db is not None else self.db
+        cooldowns = db[COOLDOWN_COLLECTION]
+        await cooldowns.create_index("expires_at", expireAfterSeconds=0)
+
+        now = datetime.now(timezone.utc)
+        monotonic_now = time.monotonic()
+        restored = 0
+        async for doc in cooldowns.find({"expires_at": {"$gt": now}}):
+            key = (doc["passenger_id"], doc["bus_id"], doc["stop_id"])
+            if key in self.approaches:
+                continue
+            expires_at = doc["expires_at"]
+            if expires_at.tzinfo is None:
+                expires_at = expires_at.replace(tzinfo=timezone.utc)
+            remaining = (expires_at - now).total_seconds()
+            approach = Approach(DEPARTED, monotonic_now)
+            approach.since = monotonic_now - max(self.cooldown_seconds - remaining, 0)
+            self.approaches[key] = approach
+            self.bus_approaches.setdefault(key[1], set()).add(key)
+            restored += 1
+        self.stats["restored_cooldowns"] += restored
+        return restored
+
+    def _remove(self, key: ApproachKey) -> None:
+        del self.approaches[key]
+        keys = self.bus_approaches.get(key[1])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self.bus_approaches[key[1]]
+
+    # ------------------------------------------------------------------
+    # Write-behind
+    # ------------------------------------------------------------------
+
+    def queue(self, notification: Dict[str, Any]) -> None:
+        """Buffer a notification document for the next bulk insert."""
+        self.pending.append(notification)
+        if len(self.pending) >= self.flush_batch:
+            self._flush_needed.set()
+
+    async def flush(self, db=None):
+        """Write buffered notifications in one unordered insert, and any new cooldowns."""
+        db = db if db is not None else self.db
+        if db is None:
+            return
+        await self._flush_cooldowns(db)
+        if not self.pending:
+            return
+        batch, self.pending = self.pending, []
+        try:
+            await db.notifications.insert_many(batch, ordered=False)
+        except BulkWriteError as e:
+            # Documents carry their own _id: duplicates were written by an earlier attempt
+            failed = [batch[error["index"]] for error in e.details.get("writeErrors", []) if error.get("code") != 11000]
+            self.pending = failed + self.pending
+            self.stats["flushed"] += len(batch) - len(failed)
+            self.stats["flushes"] += 1
+            if failed:
+                logger.error(f"Failed to write {len(failed)} proximity notifications: {e}")
+            return
+        except Exception as e:
+            self.pending = batch + self.pending
+            logger.error(f"Failed to write {len(batch)} proximity notifications: {e}")
+            return
+        self.stats["flushed"] += len(batch)
+        self.stats["flushes"] += 1
+
+    async def _flush_cooldowns(self, db) -> None:
+        if not self.pending_cooldowns:
+            return
+        cooldowns, self.pending_cooldowns = self.pending_cooldowns, {}
+        operations = [
+            UpdateOne(
+                {"_id": ":".join(key)},
+                {"$set": {"passenger_id": key[0], "bus_id": key[1], "stop_id": key[2], "expires_at": expires_at}},
+                upsert=True
+            )
+            for key, expires_at in cooldowns.items()
+        ]
+        try:
+            await db[COOLDOWN_COLLECTION].bulk_write(operations, ordered=False)
+            self.stats["cooldown_writes"] += 1
+        except Exception as e:
+            # Keep them for the next flush unless the approach departed again meanwhile
+            self.pending_cooldowns = {**cooldowns, **self.pending_cooldowns}
+            logger.error(f"Failed to write {len(operations)} proximity alert cooldowns: {e}")
+
+    async def _flush_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_needed.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_needed.clear()
+            await self.flush()
+
+    def get_stats(self) -> Dict[str, Any]:
+        baseline_inserts = self.stats["baseline_inserts"]
+        writes = self.stats["flushes"] + self.stats["cooldown_writes"]
+        states = {APPROACHING: 0, ARRIVED: 0, DEPARTED: 0}
+        for approach in self.approaches.values():
+            states[approach.state] += 1
+        return {
+            **self.stats,
+            "approaches": states,
+            "pending_writes": len(self.pending),
+            # Against one insert per subscribed observation, as before deduplication and batching
+            "write_reduction": round(1 - writes / baseline_inserts, 4) if baseline_inserts else 0.0
+        }
+
+
+# Global instance used by BusTrackingService
+proximity_alert_tracker = ProximityAlertTracker()
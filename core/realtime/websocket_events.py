@@ -9,7 +9,7 @@ from core.realtime.chat import chat_service
 from core.realtime.notifications import notification_service
 from core.logger import get_logger
 from models.base import Location
-from core.mongo_utils import model_to_mongo_doc
+from core.mongo_utils import model_to_mongo_doc, real_users_query
 from models.user import UserRole
 
 logger = get_logger(__name__)
@@ -602,7 +602,7 @@ class WebSocketEventHandlers:
                 # Get recipient count for response
                 if target_roles and app_state is not None and app_state.mongodb is not None:
                     target_users = await app_state.mongodb.users.find(
-                        {"role": {"$in": target_roles}}
+                        real_users_query({"role": {"$in": target_roles}})
                     ).to_list(length=None)
                     recipient_count = len(target_users)
                 else:
@@ -716,10 +716,10 @@ class WebSocketEventHandlers:
                     return {"success": False, "error": "Only bus drivers and queue regulators can create support conversations"}
 
                 # Get all control center users (staff and admin)
-                control_users = await app_state.mongodb.users.find({
+                control_users = await app_state.mongodb.users.find(real_users_query({
                     "role": {"$in": ["CONTROL_STAFF", "CONTROL_ADMIN"]},
                     "is_active": True
-                }).to_list(length=None)
+                })).to_list(length=None)
 
                 if not control_users:
                     return {"success": False, "error": "No control center staff available"}
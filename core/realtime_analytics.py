@@ -4,17 +4,37 @@ Real-time analytics service for live dashboard updates.
 
 import asyncio
 import logging
-from typing import Dict, Any, List, Union
+import os
+from typing import Dict, Any, List, Optional, Union
 from datetime import datetime, timedelta, timezone
 
+from core.analytics_pipelines import (
+    aggregate_one, aggregate_daily, trip_stats_pipeline, revenue_pipeline, daily_totals_pipeline
+)
+from core.kpi_aggregator import kpi_aggregator, KPIAggregator
+from core.analytics_rollups import analytics_rollups, AnalyticsRollupService, floor_hour, utc_naive
+from core.anomaly_detection import SeasonalAnomalyDetector, build_metric_matrix
+
 logger = logging.getLogger(__name__)
 
 class RealTimeAnalyticsService:
     """Service for real-time analytics and dashboard updates."""
     
-    def __init__(self, mongodb_client, websocket_manager):
+    def __init__(
+        self,
+        mongodb_client,
+        websocket_manager,
+        kpis: Optional[KPIAggregator] = None,
+        rollups: Optional[AnalyticsRollupService] = None,
+        anomaly_detector: Optional[SeasonalAnomalyDetector] = None
+    ):
         self.db = mongodb_client
         self.websocket_manager = websocket_manager
+        self.kpis = kpis if kpis is not None else kpi_aggregator
+        self.rollups = rollups if rollups is not None else analytics_rollups
+        self.anomaly_detector = anomaly_detector or SeasonalAnomalyDetector()
+        self.anomaly_history_days = int(os.getenv("ANALYTICS_ANOMALY_HISTORY_DAYS", "28"))
+        self._last_scored_bucket: Optional[datetime] = None
         self.is_running = False
         self.update_interval = 300  # seconds - INCREASED FOR PERFORMANCE (5 minutes)
         self._tasks: List[asyncio.Task] = []
@@ -124,6 +144,7 @@ class RealTimeAnalyticsService:
                 trends = await self._get_performance_trends()
                   # Detect anomalies
                 anomalies = await self._detect_anomalies(trends)
+                anomalies.extend(await self._detect_route_anomalies())
                 
                 if anomalies:
                     await self._broadcast_to_room(
@@ -149,10 +170,15 @@ class RealTimeAnalyticsService:
         # Active buses
         active_buses = await self.db.buses.count_documents({"status": "ACTIVE"})
         
+        kpis = self.kpis.snapshot() if self.kpis.is_ready else None
+        
         # Trips today
-        trips_today = await self.db.trips.count_documents({
-            "created_at": {"$gte": today}
-        })
+        if kpis is not None:
+            trips_today = kpis["trips_today"]
+        else:
+            trips_today = await self.db.trips.count_documents({
+                "created_at": {"$gte": today}
+            })
         
         # Current alerts
         active_alerts = await self.db.alerts.count_documents({"is_active": True})
@@ -168,12 +194,10 @@ class RealTimeAnalyticsService:
         })
         
         # Revenue today
-        payments_today = await self.db.payments.find({
-            "created_at": {"$gte": today},
-            "status": "COMPLETED"
-        }).to_list(length=None)
-        
-        revenue_today = sum([p.get("amount", 0) for p in payments_today])
+        if kpis is not None:
+            revenue_today = kpis["revenue_today"]
+        else:
+            revenue_today = (await aggregate_one(self.db.payments, revenue_pipeline(today))).get("revenue", 0)
         
         return {
             "active_buses": active_buses,
@@ -202,14 +226,18 @@ class RealTimeAnalyticsService:
         breaches = []
         
         # Example: Check if delay percentage is too high
-        today = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
-        trips_today = await self.db.trips.find({
-            "created_at": {"$gte": today}
-        }).to_list(length=None)
+        if self.kpis.is_ready:
+            kpis = self.kpis.snapshot()
+            trip_count = kpis["trips_today"]
+            delayed_count = kpis["delayed_trips_today"]
+        else:
+            today = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+            trip_stats = await aggregate_one(self.db.trips, trip_stats_pipeline(today))
+            trip_count = trip_stats.get("total", 0)
+            delayed_count = trip_stats.get("delayed", 0)
         
-        if trips_today:
-            delayed_trips = [t for t in trips_today if t.get("delay_minutes", 0) > 10]
-            delay_percentage = (len(delayed_trips) / len(trips_today)) * 100
+        if trip_count:
+            delay_percentage = (delayed_count / trip_count) * 100
             
             if delay_percentage > 25:  # More than 25% delayed
                 breaches.append({
@@ -222,8 +250,8 @@ class RealTimeAnalyticsService:
         
         # Example: Check bus utilization
         active_buses = await self.db.buses.count_documents({"status": "ACTIVE"})
-        if active_buses > 0 and trips_today:
-            utilization = len(trips_today) / active_buses
+        if active_buses > 0 and trip_count:
+            utilization = trip_count / active_buses
             if utilization < 3:  # Less than 3 trips per bus
                 breaches.append({
                     "metric": "bus_utilization",
@@ -235,42 +263,30 @@ class RealTimeAnalyticsService:
         
         return breaches
     
-    async def _get_performance_trends(self) -> Dict[str, Any]:
+    async def _get_performance_trends(self, now: Optional[datetime] = None) -> Dict[str, Any]:
         """Get performance trends for anomaly detection."""
         # Get data for the last 7 days
-        week_ago = datetime.now(timezone.utc) - timedelta(days=7)
+        week_ago = (now or datetime.now(timezone.utc)) - timedelta(days=7)
+        
+        # Daily trip counts and revenue, one pipeline each
+        trip_days = await aggregate_daily(self.db.trips, daily_totals_pipeline(week_ago, 7), 7)
+        revenue_days = await aggregate_daily(
+            self.db.payments,
+            daily_totals_pipeline(week_ago, 7, match={"status": "COMPLETED"}, value="amount"),
+            7
+        )
         
-        # Daily trip counts
         daily_trips = []
+        daily_revenue = []
         for i in range(7):
             day_start = week_ago + timedelta(days=i)
-            day_end = day_start + timedelta(days=1)
-            
-            trip_count = await self.db.trips.count_documents({
-                "created_at": {"$gte": day_start, "$lt": day_end}
-            })
-            
             daily_trips.append({
                 "date": day_start.date().isoformat(),
-                "trip_count": trip_count
+                "trip_count": trip_days[i]["count"]
             })
-        
-        # Daily revenue
-        daily_revenue = []
-        for i in range(7):
-            day_start = week_ago + timedelta(days=i)
-            day_end = day_start + timedelta(days=1)
-            
-            payments = await self.db.payments.find({
-                "created_at": {"$gte": day_start, "$lt": day_end},
-                "status": "COMPLETED"
-            }).to_list(length=None)
-            
-            revenue = sum([p.get("amount", 0) for p in payments])
-            
             daily_revenue.append({
                 "date": day_start.date().isoformat(),
-                "revenue": revenue
+                "revenue": revenue_days[i]["total"]
             })
         
         return {
@@ -324,5 +340,34 @@ class RealTimeAnalyticsService:
         
         return anomalies
 
+    async def _detect_route_anomalies(self, now: Optional[datetime] = None) -> List[Dict[str, Any]]:
+        """
+        Score per-route hourly trip counts from the rollups against their
+        hour-of-week baseline. Each completed hour is scored once.
+        """
+        if not self.rollups.is_ready or self.rollups.watermark is None:
+            return []
+        try:
+            # Only hours the rollups have fully materialized
+            end = min(floor_hour(utc_naive(now or datetime.now(timezone.utc))), floor_hour(self.rollups.watermark))
+            last_bucket = end - timedelta(hours=1)
+            if self._last_scored_bucket is not None and self._last_scored_bucket >= last_bucket:
+                return []
+            
+            start = end - timedelta(days=self.anomaly_history_days)
+            hours = (end - start) // timedelta(hours=1)
+            evaluate_last = 1
+            if self._last_scored_bucket is not None:
+                evaluate_last = min((last_bucket - self._last_scored_bucket) // timedelta(hours=1), 24)
+            
+            rows = await self.rollups.dimension_bucket_values("trips", "count", "route_id", start, end)
+            route_ids, matrix = build_metric_matrix(rows, start, hours)
+            anomalies = self.anomaly_detector.detect(matrix, start, evaluate_last, route_ids)
+            self._last_scored_bucket = last_bucket
+            return anomalies
+        except Exception as e:
+            logger.error(f"Error detecting route anomalies: {str(e)}")
+            return []
+
 # Global instance (will be initialized in main.py)
 realtime_analytics_service: RealTimeAnalyticsService | None = None
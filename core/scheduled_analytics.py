@@ -7,8 +7,10 @@ import logging
 from datetime import datetime, timedelta, timezone
 from typing import Dict, Any
 
+from core.analytics_pipelines import aggregate_activity
 from core.analytics_service import AnalyticsService
 from core.email_service import EmailService
+from core.mongo_utils import real_users_query
 
 logger = logging.getLogger(__name__)
 
@@ -305,23 +307,21 @@ class ScheduledAnalyticsService:
         try:
             four_hours_ago = datetime.now(timezone.utc) - timedelta(hours=4)
             
-            # Get recent alerts
-            recent_alerts = await self.db.alerts.find({
+            # Counts only; the digest does not need the documents
+            recent_alerts = await aggregate_activity(self.db.alerts, {
                 "created_at": {"$gte": four_hours_ago},
                 "is_active": True
-            }).to_list(length=None)
+            })
             
-            # Get recent incidents
-            recent_incidents = await self.db.incidents.find({
+            recent_incidents = await aggregate_activity(self.db.incidents, {
                 "created_at": {"$gte": four_hours_ago}
-            }).to_list(length=None)
+            })
             
-            # Get new reallocation requests
-            new_requests = await self.db.reallocation_requests.find({
+            new_requests = await self.db.reallocation_requests.count_documents({
                 "created_at": {"$gte": four_hours_ago}
-            }).to_list(length=None)
+            })
             
-            if recent_alerts or recent_incidents or new_requests:
+            if recent_alerts["count"] or recent_incidents["count"] or new_requests:
                 digest_data = {
                     "alerts": recent_alerts,
                     "incidents": recent_incidents,
@@ -331,7 +331,7 @@ class ScheduledAnalyticsService:
                 }
                 
                 await self._send_alert_digest(digest_data)
-                logger.info(f"Alert digest sent - {len(recent_alerts)} alerts, {len(recent_incidents)} incidents")
+                logger.info(f"Alert digest sent - {recent_alerts['count']} alerts, {recent_incidents['count']} incidents")
             
         except Exception as e:
             logger.error(f"Error generating alert digest: {str(e)}")
@@ -340,10 +340,10 @@ class ScheduledAnalyticsService:
         """Send report notification email."""
         try:
             # Get control center users
-            control_users = await self.db.users.find({
+            control_users = await self.db.users.find(real_users_query({
                 "role": {"$in": ["CONTROL_ADMIN", "CONTROL_STAFF"]},
                 "is_active": True
-            }).to_list(length=None)
+            })).to_list(length=None)
             
             if not control_users:
                 return
@@ -390,17 +390,17 @@ class ScheduledAnalyticsService:
         """Send alert digest email."""
         try:
             # Get control center users
-            control_users = await self.db.users.find({
+            control_users = await self.db.users.find(real_users_query({
                 "role": {"$in": ["CONTROL_ADMIN", "CONTROL_STAFF"]},
                 "is_active": True
-            }).to_list(length=None)
+            })).to_list(length=None)
             
             if not control_users:
                 return
             
-            alerts_count = len(digest_data.get("alerts", []))
-            incidents_count = len(digest_data.get("incidents", []))
-            requests_count = len(digest_data.get("reallocation_requests", []))
+            alerts_count = digest_data.get("alerts", {}).get("count", 0)
+            incidents_count = digest_data.get("incidents", {}).get("count", 0)
+            requests_count = digest_data.get("reallocation_requests", 0)
             
             if alerts_count == 0 and incidents_count == 0 and requests_count == 0:
                 return  # No need to send empty digest
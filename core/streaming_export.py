@@ -0,0 +1,188 @@
+"""
+Streaming CSV/NDJSON exports straight from MongoDB cursors.
+
+Export endpoints never materialise the result set:
+1. Queries use a server-side projection restricted to an allowlist of columns
+2. Cursors are iterated with a fixed batch size
+3. Rows are encoded in small chunks and yielded through ``StreamingResponse``,
+   so the first byte leaves as soon as the first batch arrives
+4. Date filters (``core.mongo_utils.date_range_filter``) match both BSON
+   dates and the ISO strings written by ``model_to_mongo_doc``
+"""
+
+import csv
+import io
+import json
+import logging
+import os
+from datetime import date, datetime
+from enum import Enum
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional
+
+from fastapi import HTTPException, status
+from fastapi.responses import StreamingResponse
+
+logger = logging.getLogger(__name__)
+
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "500"))
+
+EXPORT_FORMATS = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson"
+}
+
+
+def resolve_columns(fields: Optional[str], allowed: Iterable[str]) -> List[str]:
+    """
+    Columns for an export. ``fields`` is a comma-separated subset of
+    ``allowed``; when omitted every allowed column is exported.
+    """
+    allowed = list(allowed)
+    if not fields:
+        return allowed
+    requested = [f.strip() for f in fields.split(",") if f.strip()]
+    unknown = [f for f in requested if f not in allowed]
+    if unknown:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unknown export fields: {', '.join(unknown)}. Allowed: {', '.join(allowed)}"
+        )
+    return requested
+
+
+def build_projection(columns: List[str]) -> Dict[str, int]:
+    """Server-side projection for ``columns``; ``_id`` is only kept if asked for."""
+    projection = {column: 1 for column in columns}
+    if "_id" not in projection:
+        projection["_id"] = 0
+    return projection
+
+
+def _cell(value: Any) -> Any:
+    if value is None:
+        return ""
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, default=str)
+    return value
+
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Enum):
+        return value.value
+    return str(value)
+
+
+async def iter_csv(
+    rows: AsyncIterator[Dict[str, Any]],
+    columns: List[str],
+    chunk_rows: int = EXPORT_BATCH_SIZE
+) -> AsyncIterator[bytes]:
+    """Encode ``rows`` as CSV, yielding the header immediately and then one chunk per ``chunk_rows``."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def drain() -> bytes:
+        data = buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+        return data
+
+    writer.writerow(columns)
+    yield drain()
+
+    pending = 0
+    async for row in rows:
+        writer.writerow([_cell(row.get(column)) for column in columns])
+        pending += 1
+        if pending >= chunk_rows:
+            yield drain()
+            pending = 0
+    if pending:
+        yield drain()
+
+
+async def iter_ndjson(
+    rows: AsyncIterator[Dict[str, Any]],
+    chunk_rows: int = EXPORT_BATCH_SIZE
+) -> AsyncIterator[bytes]:
+    """Encode ``rows`` as newline-delimited JSON, one chunk per ``chunk_rows``."""
+    lines: List[str] = []
+    async for row in rows:
+        lines.append(json.dumps(row, default=_json_default))
+        if len(lines) >= chunk_rows:
+            yield ("\n".join(lines) + "\n").encode("utf-8")
+            lines = []
+    if lines:
+        yield ("\n".join(lines) + "\n").encode("utf-8")
+
+
+async def iter_cursor(collection, query: Dict[str, Any], columns: List[str], batch_size: int = EXPORT_BATCH_SIZE):
+    """Iterate a projected cursor without holding more than one batch in memory."""
+    cursor = collection.find(query, build_projection(columns)).batch_size(batch_size)
+    try:
+        async for doc in cursor:
+            yield doc
+    finally:
+        await _close(cursor)
+
+
+async def _close(cursor) -> None:
+    close = getattr(cursor, "close", None)
+    if close is None:
+        return
+    try:
+        result = close()
+        if hasattr(result, "__await__"):
+            await result
+    except Exception:
+        logger.debug("Failed to close export cursor", exc_info=True)
+
+
+async def _iter_rows(rows: Iterable[Dict[str, Any]]):
+    for row in rows:
+        yield row
+
+
+def export_response(
+    rows,
+    columns: List[str],
+    export_format: str,
+    filename: str
+) -> StreamingResponse:
+    """
+    Wrap ``rows`` (an async iterator of documents, or a plain iterable) in a
+    streaming CSV or NDJSON response.
+    """
+    export_format = export_format.lower()
+    if export_format not in EXPORT_FORMATS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid export format. Must be one of: {', '.join(EXPORT_FORMATS)}"
+        )
+    if not hasattr(rows, "__aiter__"):
+        rows = _iter_rows(rows)
+
+    body = iter_csv(rows, columns) if export_format == "csv" else iter_ndjson(rows)
+    return StreamingResponse(
+        body,
+        media_type=EXPORT_FORMATS[export_format],
+        headers={"Content-Disposition": f"attachment; filename={filename}.{export_format}"}
+    )
+
+
+def stream_export(
+    collection,
+    query: Dict[str, Any],
+    columns: List[str],
+    export_format: str,
+    filename: str,
+    batch_size: int = EXPORT_BATCH_SIZE
+) -> StreamingResponse:
+    """Stream ``collection.find(query)`` restricted to ``columns``."""
+    return export_response(iter_cursor(collection, query, columns, batch_size), columns, export_format, filename)
@@ -0,0 +1,248 @@
+"""
+Ticket redemption against Mongo.
+
+1. ``redeem_ticket`` marks a ticket used with one conditional
+   ``find_one_and_update`` (status ACTIVE, ``valid_until`` in the future)
+   that returns the post-image, so concurrent scans of the same ticket
+   cannot both succeed and the happy path is a single round trip
+2. The customer's name is read from the ticket, where it is denormalized
+   at issuance
+3. Only a rejected scan costs a second read, to tell the validator why
+4. ``redeem_scans`` settles a validator's offline backlog: one ``$in``
+   read and one unordered ``bulk_write`` for the whole batch, with the
+   earliest scan of each ticket winning and validity judged at scan time.
+   The winning scan's ``device_id``/``scan_id`` are stored with the ticket,
+   so a batch uploaded again gets the same verdicts
+"""
+
+import logging
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from pymongo import ReturnDocument, UpdateOne
+
+from core.ticket_tokens import InvalidTicketToken, ticket_ledger, verify_ticket_token
+from models.payment import TicketStatus
+
+logger = logging.getLogger(__name__)
+
+# Fields the validation response needs
+TICKET_PROJECTION = {
+    "_id": 1, "ticket_number": 1, "status": 1, "ticket_type": 1,
+    "valid_from": 1, "valid_until": 1, "customer_name": 1, "customer_id": 1, "used_at": 1,
+    "used_device_id": 1, "used_scan_id": 1
+}
+
+REJECTION_MESSAGES = {
+    TicketStatus.USED.value: "Ticket has already been used",
+    TicketStatus.CANCELLED.value: "Ticket has been cancelled",
+    TicketStatus.EXPIRED.value: "Ticket has expired",
+}
+
+
+def as_datetime(value: Any) -> datetime:
+    """Ticket dates are stored as datetimes or, via model_to_mongo_doc, ISO strings."""
+    return datetime.fromisoformat(value) if isinstance(value, str) else value
+
+
+def still_valid_filter(now: datetime) -> Dict[str, Any]:
+    return {"$or": [{"valid_until": {"$gt": now}}, {"valid_until": {"$gt": now.isoformat()}}]}
+
+
+def redemption_update(
+    now: datetime,
+    trip_id: Optional[str] = None,
+    bus_id: Optional[str] = None,
+    used_at: Optional[datetime] = None,
+    scan_key: Optional[Tuple[str, str]] = None
+) -> Dict[str, Any]:
+    update = {"status": TicketStatus.USED.value, "used_at": used_at or now, "updated_at": now}
+    if trip_id:
+        update["used_trip_id"] = trip_id
+    if bus_id:
+        update["used_bus_id"] = bus_id
+    if scan_key:
+        update["used_device_id"], update["used_scan_id"] = scan_key
+    return update
+
+
+async def rejection_reason(db, ticket: Dict[str, Any], now: datetime) -> str:
+    """Why an existing ticket cannot be redeemed; ACTIVE tickets past their window are expired."""
+    status = ticket["status"]
+    if status == TicketStatus.ACTIVE.value and as_datetime(ticket["valid_until"]) <= now:
+        await db.tickets.update_one(
+            {"_id": ticket["_id"], "status": TicketStatus.ACTIVE.value},
+            {"$set": {"status": TicketStatus.EXPIRED.value, "updated_at": now}}
+        )
+        ticket["status"] = TicketStatus.EXPIRED.value
+        return REJECTION_MESSAGES[TicketStatus.EXPIRED.value]
+    return REJECTION_MESSAGES.get(status, "Ticket is not valid")
+
+
+async def redeem_ticket(
+    db,
+    ticket_number: str,
+    trip_id: Optional[str] = None,
+    now: Optional[datetime] = None,
+    ledger=None
+) -> Dict[str, Any]:
+    """
+    Redeem a ticket by number. Returns ``ticket`` (the post-image, or the
+    current document for a rejected scan, or None), ``is_valid`` and ``message``.
+    """
+    now = now or datetime.utcnow()
+    ledger = ledger or ticket_ledger
+
+    # Redeemed with its signed token but not written back yet
+    ticket = None
+    if ledger.status_of(ticket_number) is None:
+        ticket = await db.tickets.find_one_and_update(
+            {"ticket_number": ticket_number, "status": TicketStatus.ACTIVE.value, **still_valid_filter(now)},
+            {"$set": redemption_update(now, trip_id)},
+            projection=TICKET_PROJECTION,
+            return_document=ReturnDocument.AFTER
+        )
+    if ticket is not None:
+        ledger.record_closed(ticket_number, TicketStatus.USED.value, ticket["valid_until"])
+        return {"ticket": ticket, "is_valid": True, "message": "Ticket is valid"}
+
+    ticket = await db.tickets.find_one({"ticket_number": ticket_number}, TICKET_PROJECTION)
+    if ticket is None:
+        return {"ticket": None, "is_valid": False, "message": "Ticket not found"}
+    if ledger.status_of(ticket_number) == TicketStatus.USED.value:
+        ticket["status"] = TicketStatus.USED.value
+    return {"ticket": ticket, "is_valid": False, "message": await rejection_reason(db, ticket, now)}
+
+
+# ---------------------------------------------------------------------------
+# Offline scan batches
+# ---------------------------------------------------------------------------
+
+def scan_time(value: datetime, now: datetime) -> datetime:
+    """Naive UTC at Mongo's millisecond precision; a device clock ahead of ours is clamped to now."""
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    value = value.replace(microsecond=value.microsecond // 1000 * 1000)
+    return min(value, now.replace(microsecond=now.microsecond // 1000 * 1000))
+
+
+def scan_key(scan: Dict[str, Any]) -> Optional[Tuple[str, str]]:
+    """``(device_id, scan_id)`` identifying a scan across uploads, if the device sent both."""
+    if scan.get("device_id") and scan.get("scan_id"):
+        return scan["device_id"], scan["scan_id"]
+    return None
+
+
+def window_reason(ticket: Dict[str, Any], scanned_at: datetime) -> Optional[str]:
+    if ticket.get("valid_from") and scanned_at < as_datetime(ticket["valid_from"]):
+        return "Ticket is not valid yet"
+    if scanned_at >= as_datetime(ticket["valid_until"]):
+        return REJECTION_MESSAGES[TicketStatus.EXPIRED.value]
+    return None
+
+
+async def redeem_scans(
+    db,
+    scans: List[Dict[str, Any]],
+    now: Optional[datetime] = None,
+    ledger=None
+) -> List[Dict[str, Any]]:
+    """
+    Redeem a batch of offline scans (``ticket_number``, ``scanned_at`` and
+    optionally ``trip_id``, ``bus_id``, ``token``).
+
+    Each ticket's scans are replayed in ``scanned_at`` order: the first one
+    inside the ticket's validity window redeems it, later ones are
+    duplicates. Tickets already closed in Mongo or the ledger stay closed,
+    except to the scan that redeemed them: re-uploading it (same
+    ``device_id`` and ``scan_id``) is accepted again without a write.
+    Returns one verdict per scan, in input order, shaped like
+    ``redeem_ticket``'s result plus ``scanned_at``.
+    """
+    now = now or datetime.utcnow()
+    ledger = ledger or ticket_ledger
+    # Keyed by the scan's position in ``scans``; every scan gets one below
+    verdicts: Dict[int, Dict[str, Any]] = {}
+    by_ticket: Dict[str, List[int]] = defaultdict(list)
+
+    for index, scan in enumerate(scans):
+        scanned_at = scan_time(scan["scanned_at"], now)
+        verdicts[index] = {"ticket": None, "is_valid": False, "message": None, "scanned_at": scanned_at}
+        if scan.get("token"):
+            # A forged QR is rejected without looking the ticket up
+            try:
+                if verify_ticket_token(scan["token"]).ticket_number != scan["ticket_number"]:
+                    verdicts[index]["message"] = "Ticket token does not match ticket number"
+                    continue
+            except InvalidTicketToken as e:
+                verdicts[index]["message"] = str(e)
+                continue
+        by_ticket[scan["ticket_number"]].append(index)
+
+    tickets = {}
+    if by_ticket:
+        cursor = db.tickets.find({"ticket_number": {"$in": list(by_ticket)}}, TICKET_PROJECTION)
+        tickets = {ticket["ticket_number"]: ticket async for ticket in cursor}
+
+    operations, winners = [], {}
+    for ticket_number, indexes in by_ticket.items():
+        ticket = tickets.get(ticket_number)
+        closed_status = ledger.status_of(ticket_number)
+        if ticket is not None and closed_status:
+            ticket["status"] = closed_status
+        redeemed = ticket is not None and ticket["status"] != TicketStatus.ACTIVE.value
+        redeemed_by = (ticket.get("used_device_id"), ticket.get("used_scan_id")) if ticket is not None else None
+
+        for index in sorted(indexes, key=lambda i: verdicts[i]["scanned_at"]):
+            verdict = verdicts[index]
+            verdict["ticket"] = ticket
+            if ticket is None:
+                verdict["message"] = "Ticket not found"
+            elif ticket["status"] == TicketStatus.USED.value and scan_key(scans[index]) == redeemed_by:
+                # This device's own scan, uploaded again after a lost response
+                verdict.update(is_valid=True, message="Ticket is valid")
+            elif redeemed:
+                verdict["message"] = REJECTION_MESSAGES.get(ticket["status"], "Ticket is not valid")
+            else:
+                verdict["message"] = window_reason(ticket, verdict["scanned_at"])
+                if verdict["message"] is None:
+                    redeemed = True
+                    ticket["status"] = TicketStatus.USED.value
+                    winners[ticket_number] = index
+                    scan = scans[index]
+                    operations.append(UpdateOne(
+                        {"ticket_number": ticket_number, "status": TicketStatus.ACTIVE.value},
+                        {"$set": redemption_update(
+                            now, scan.get("trip_id"), scan.get("bus_id"), used_at=verdict["scanned_at"],
+                            scan_key=scan_key(scan)
+                        )}
+                    ))
+
+    if operations:
+        result = await db.tickets.bulk_write(operations, ordered=False)
+        lost = set()
+        if result.matched_count < len(operations):
+            # Redeemed by someone else between our read and write; only those that now carry our scan are ours
+            cursor = db.tickets.find(
+                {"ticket_number": {"$in": list(winners)}}, {"ticket_number": 1, "status": 1, "used_at": 1}
+            )
+            async for current in cursor:
+                if as_datetime(current.get("used_at")) != verdicts[winners[current["ticket_number"]]]["scanned_at"]:
+                    lost.add(current["ticket_number"])
+                    tickets[current["ticket_number"]]["status"] = current["status"]
+            if lost:
+                logger.warning(f"{len(lost)} offline scans lost a race with another validator")
+
+        for ticket_number, index in winners.items():
+            ticket = tickets[ticket_number]
+            if ticket_number in lost:
+                verdicts[index]["message"] = REJECTION_MESSAGES.get(ticket["status"], "Ticket is not valid")
+                continue
+            verdicts[index].update(is_valid=True, message="Ticket is valid")
+            ticket["used_at"] = verdicts[index]["scanned_at"]
+            ledger.record_closed(ticket_number, TicketStatus.USED.value, ticket["valid_until"])
+
+    if len(verdicts) != len(scans):
+        raise RuntimeError(f"Verdicts for {len(verdicts)} of {len(scans)} offline scans")
+    return [verdicts[index] for index in range(len(scans))]
@@ -0,0 +1,320 @@
+"""
+Signed ticket tokens and the in-memory redemption ledger.
+
+Validators check a ticket without a database round trip:
+1. When a ticket is activated it gets a compact token, an HMAC-SHA256 over
+   the ticket number, ticket type, validity window and the customer's
+   initials, which is embedded in the QR payload
+2. ``verify_ticket_token`` checks the signature and validity window locally
+3. ``TicketLedger`` keeps the used/revoked ticket numbers that are still
+   within their validity window in memory. It records redemptions
+   immediately and writes them to Mongo in unordered batches. A background
+   sync loads tickets used, cancelled or expired elsewhere (other instances,
+   webhooks, the legacy path)
+"""
+
+import asyncio
+import base64
+import hashlib
+import hmac
+import logging
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from pymongo import UpdateMany, UpdateOne
+
+from core.qr_images import qr_payload
+from core.mongo_utils import date_range_filter
+from models.payment import TicketStatus, TicketType
+
+logger = logging.getLogger(__name__)
+
+TOKEN_VERSION = "1"
+SIGNATURE_BYTES = 16
+
+TYPE_CODES = {
+    TicketType.SINGLE_TRIP: "S",
+    TicketType.ROUND_TRIP: "R",
+    TicketType.DAILY_PASS: "D",
+    TicketType.WEEKLY_PASS: "W",
+    TicketType.MONTHLY_PASS: "M",
+}
+CODE_TYPES = {code: ticket_type for ticket_type, code in TYPE_CODES.items()}
+
+CLOSED_STATUSES = [TicketStatus.USED.value, TicketStatus.CANCELLED.value, TicketStatus.EXPIRED.value]
+
+
+class InvalidTicketToken(ValueError):
+    """The token is malformed or its signature does not match"""
+
+
+class TicketClaims(NamedTuple):
+    ticket_number: str
+    ticket_type: TicketType
+    valid_from: int
+    valid_until: int
+    initials: str
+
+
+def _signing_key() -> bytes:
+    secret = os.getenv("TICKET_SIGNING_SECRET") or os.getenv("JWT_SECRET")
+    if not secret:
+        raise ValueError("TICKET_SIGNING_SECRET (or JWT_SECRET) environment variable is required")
+    return secret.encode()
+
+
+def _epoch(value: Any) -> int:
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return int(value.timestamp())
+
+
+def _signature(body: str) -> str:
+    digest = hmac.new(_signing_key(), body.encode(), hashlib.sha256).digest()[:SIGNATURE_BYTES]
+    return base64.urlsafe_b64encode(digest).rstrip(b"=").decode()
+
+
+def customer_initials(name: Optional[str]) -> str:
+    return "".join(part[0] for part in (name or "").split() if part[0].isalpha())[:3].upper()
+
+
+def sign_ticket(ticket: Dict[str, Any], customer_name: Optional[str] = None) -> str:
+    """Token for a ticket document (dates may be datetimes or ISO strings)."""
+    body = ".".join([
+        TOKEN_VERSION,
+        ticket["ticket_number"],
+        TYPE_CODES[TicketType(ticket["ticket_type"])],
+        format(_epoch(ticket["valid_from"]), "x"),
+        format(_epoch(ticket["valid_until"]), "x"),
+        customer_initials(customer_name),
+    ])
+    return f"{body}.{_signature(body)}"
+
+
+def verify_ticket_token(token: str) -> TicketClaims:
+    """Check the signature and decode the claims; the validity window is left to the caller."""
+    body, _, signature = token.rpartition(".")
+    if not body or not hmac.compare_digest(signature, _signature(body)):
+        raise InvalidTicketToken("Invalid ticket signature")
+    try:
+        version, ticket_number, type_code, valid_from, valid_until, initials = body.split(".")
+        if version != TOKEN_VERSION:
+            raise ValueError(version)
+        return TicketClaims(ticket_number, CODE_TYPES[type_code], int(valid_from, 16), int(valid_until, 16), initials)
+    except (ValueError, KeyError):
+        raise InvalidTicketToken("Malformed ticket token")
+
+
+def ticket_qr_fields(ticket: Dict[str, Any], customer_name: Optional[str] = None) -> Dict[str, str]:
+    """``$set`` fields giving an activated ticket its signed token and QR payload."""
+    token = sign_ticket(ticket, customer_name)
+    return {"signed_token": token, "qr_code": qr_payload(token)}
+
+
+async def settle_payment_tickets(db, settled: List[Tuple[Dict[str, Any], bool]], now: datetime):
+    """
+    Sign the tickets of completed payments and cancel those of failed or
+    cancelled ones, from ``(payment, completed)`` pairs.
+
+    Tickets are issued ACTIVE with their payment. Only ACTIVE tickets are
+    touched and a signed ticket is never signed again, so a replayed or late
+    settlement cannot reopen a USED, CANCELLED or EXPIRED ticket.
+    """
+    completed = {str(payment["_id"]): payment for payment, is_completed in settled if is_completed}
+    cancelled = [str(payment["_id"]) for payment, is_completed in settled if not is_completed]
+
+    writes: List[Tuple[bool, Dict[str, Any], Dict[str, Any]]] = []  # (many, filter, update)
+    if cancelled:
+        writes.append((
+            True,
+            {"payment_id": {"$in": cancelled}, "status": TicketStatus.ACTIVE.value},
+            {"$set": {"status": TicketStatus.CANCELLED.value, "updated_at": now}}
+        ))
+    if completed:
+        unsigned = {"status": TicketStatus.ACTIVE.value, "signed_token": {"$exists": False}}
+        cursor = db.tickets.find(
+            {"payment_id": {"$in": list(completed)}, **unsigned},
+            {"_id": 1, "payment_id": 1, "ticket_number": 1, "ticket_type": 1, "valid_from": 1, "valid_until": 1}
+        )
+        async for ticket in cursor:
+            payment = completed[ticket["payment_id"]]
+            customer_name = f"{payment.get('customer_first_name', '')} {payment.get('customer_last_name', '')}"
+            writes.append((
+                False,
+                {"_id": ticket["_id"], **unsigned},
+                {"$set": {**ticket_qr_fields(ticket, customer_name), "updated_at": now}}
+            ))
+
+    if len(writes) == 1:
+        many, query, update = writes[0]
+        await (db.tickets.update_many if many else db.tickets.update_one)(query, update)
+    elif writes:
+        await db.tickets.bulk_write(
+            [(UpdateMany if many else UpdateOne)(query, update) for many, query, update in writes], ordered=False
+        )
+
+
+class TicketLedger:
+    """Used/revoked ticket numbers in memory, with batched write-behind to Mongo."""
+
+    def __init__(
+        self,
+        db=None,
+        flush_interval: Optional[float] = None,
+        flush_batch: Optional[int] = None,
+        sync_interval: Optional[float] = None
+    ):
+        self.db = db
+        self.flush_interval = flush_interval or float(os.getenv("TICKET_LEDGER_FLUSH_SECONDS", "2"))
+        self.flush_batch = flush_batch or int(os.getenv("TICKET_LEDGER_FLUSH_BATCH", "200"))
+        self.sync_interval = sync_interval or float(os.getenv("TICKET_LEDGER_SYNC_SECONDS", "15"))
+        # ticket_number -> (status, valid_until epoch); entries are dropped once expired
+        self.closed: Dict[str, Tuple[str, int]] = {}
+        self.pending: List[Dict[str, Any]] = []
+        self.synced_at: Optional[datetime] = None
+        self.stats = {"redeemed": 0, "rejected": 0, "flushed": 0, "conflicts": 0}
+        self._flush_needed = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+
+    async def start(self, db=None):
+        if db is not None:
+            self.db = db
+        await self.db.tickets.create_index("ticket_number")
+        await self.sync()
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._flush_loop()), asyncio.create_task(self._sync_loop())]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        await self.flush()
+
+    # ------------------------------------------------------------------
+    # Validation
+    # ------------------------------------------------------------------
+
+    def status_of(self, ticket_number: str) -> Optional[str]:
+        """USED, CANCELLED or EXPIRED if the ledger knows the ticket is closed."""
+        entry = self.closed.get(ticket_number)
+        return entry[0] if entry else None
+
+    def redeem(self, claims: TicketClaims, trip_id: Optional[str] = None, now: Optional[float] = None) -> Optional[str]:
+        """
+        Mark a verified ticket as used. Returns None on success, otherwise the
+        reason it cannot be used.
+        """
+        now = now if now is not None else time.time()
+        reason: Optional[str]
+        if now < claims.valid_from:
+            reason = "Ticket is not valid yet"
+        elif now > claims.valid_until:
+            reason = "Ticket has expired"
+        else:
+            status = self.status_of(claims.ticket_number)
+            reason = {
+                TicketStatus.USED.value: "Ticket has already been used",
+                TicketStatus.CANCELLED.value: "Ticket has been cancelled",
+                TicketStatus.EXPIRED.value: "Ticket has expired",
+            }.get(status) if status else None
+
+        if reason:
+            self.stats["rejected"] += 1
+            return reason
+
+        self.closed[claims.ticket_number] = (TicketStatus.USED.value, claims.valid_until)
+        used_at = datetime.fromtimestamp(now, timezone.utc).replace(tzinfo=None)
+        self.pending.append({"ticket_number": claims.ticket_number, "used_at": used_at, "trip_id": trip_id})
+        self.stats["redeemed"] += 1
+        if len(self.pending) >= self.flush_batch:
+            self._flush_needed.set()
+        return None
+
+    def record_closed(self, ticket_number: str, status: str, valid_until: Any):
+        """Note a ticket closed through the database path."""
+        self.closed[ticket_number] = (status, _epoch(valid_until))
+
+    # ------------------------------------------------------------------
+    # Write-behind and sync
+    # ------------------------------------------------------------------
+
+    async def flush(self):
+        """Write pending redemptions in one unordered bulk write."""
+        if not self.pending or self.db is None:
+            return
+        batch, self.pending = self.pending, []
+        operations = []
+        for redemption in batch:
+            update = {
+                "status": TicketStatus.USED.value,
+                "used_at": redemption["used_at"],
+                "updated_at": redemption["used_at"],
+            }
+            if redemption["trip_id"]:
+                update["used_trip_id"] = redemption["trip_id"]
+            operations.append(UpdateOne(
+                {"ticket_number": redemption["ticket_number"], "status": TicketStatus.ACTIVE.value},
+                {"$set": update}
+            ))
+        try:
+            result = await self.db.tickets.bulk_write(operations, ordered=False)
+        except Exception as e:
+            # Keep them for the next flush; the ledger already rejects reuse
+            self.pending = batch + self.pending
+            logger.error(f"Failed to write {len(batch)} ticket redemptions: {e}")
+            return
+        self.stats["flushed"] += len(batch)
+        # Tickets no longer ACTIVE in Mongo were closed elsewhere first
+        conflicts = len(batch) - result.matched_count
+        if conflicts:
+            self.stats["conflicts"] += conflicts
+            logger.warning(f"{conflicts} offline ticket redemptions were already closed in the database")
+
+    async def sync(self, now: Optional[datetime] = None):
+        """Load tickets closed since the last sync (initially: all still within their window)."""
+        now = now or datetime.utcnow()
+        if self.synced_at is None:
+            query = {"status": {"$in": CLOSED_STATUSES}, **date_range_filter("valid_until", now)}
+        else:
+            # Overlap the previous sync so writes racing it are not missed
+            since = self.synced_at - timedelta(seconds=self.sync_interval)
+            query = {"status": {"$in": CLOSED_STATUSES}, **date_range_filter("updated_at", since)}
+
+        cursor = self.db.tickets.find(query, {"_id": 0, "ticket_number": 1, "status": 1, "valid_until": 1})
+        async for ticket in cursor:
+            if ticket.get("valid_until") is not None:
+                self.closed[ticket["ticket_number"]] = (ticket["status"], _epoch(ticket["valid_until"]))
+        self.synced_at = now
+
+        cutoff = time.time()
+        for ticket_number in [n for n, (_, until) in self.closed.items() if until < cutoff]:
+            del self.closed[ticket_number]
+
+    async def _flush_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_needed.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_needed.clear()
+            await self.flush()
+
+    async def _sync_loop(self):
+        while True:
+            await asyncio.sleep(self.sync_interval)
+            try:
+                await self.sync()
+            except Exception as e:
+                logger.error(f"Ticket ledger sync failed: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {**self.stats, "closed_tickets": len(self.closed), "pending_writes": len(self.pending)}
+
+
+# Global ledger instance
+ticket_ledger = TicketLedger()
@@ -0,0 +1,166 @@
+"""
+Time series downsampling for dashboard charts.
+
+Long ranges are reduced to at most ``max_points`` points before they are
+sent to the browser:
+1. Largest-Triangle-Three-Buckets (LTTB), which keeps the visual shape of the
+   series; the triangle areas of each bucket are computed with NumPy
+2. Min/max buckets, fully vectorized, which keeps every local extreme
+3. A small TTL/LRU cache of downsampled series keyed by
+   (metric, range, granularity, max_points, method)
+"""
+
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, List, Any, Hashable, Optional, Tuple
+
+import numpy as np
+
+DOWNSAMPLING_METHODS = ("lttb", "minmax")
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, max_points: int) -> np.ndarray:
+    """
+    Indices of the points LTTB keeps. ``x`` must be increasing. The first and
+    last points are always kept.
+    """
+    n = len(x)
+    if max_points >= n or max_points < 3:
+        return np.arange(n)
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+
+    # Buckets cover points 1..n-2; bucket i is edges[i]:edges[i + 1]
+    edges = (np.arange(max_points - 1) * (n - 2) / (max_points - 2)).astype(np.int64) + 1
+    edges[-1] = n - 1
+    starts, ends = edges[:-1], edges[1:]
+    counts = ends - starts
+
+    # Mean of every bucket at once; the "next" anchor of the last bucket is the last point
+    mean_x = np.add.reduceat(x[:-1], starts) / counts
+    mean_y = np.add.reduceat(y[:-1], starts) / counts
+    next_x = np.append(mean_x[1:], x[-1])
+    next_y = np.append(mean_y[1:], y[-1])
+
+    selected = np.empty(max_points, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(max_points - 2):
+        s, e = starts[i], ends[i]
+        ax, ay = x[a], y[a]
+        # Twice the triangle area; the constant factor does not change the argmax
+        area = np.abs((ax - next_x[i]) * (y[s:e] - ay) - (ax - x[s:e]) * (next_y[i] - ay))
+        a = s + int(np.argmax(area))
+        selected[i + 1] = a
+    return selected
+
+
+def minmax_indices(y: np.ndarray, max_points: int) -> np.ndarray:
+    """Indices of the minimum and maximum of ``max_points // 2`` equal-count buckets."""
+    n = len(y)
+    buckets = max_points // 2
+    if max_points >= n or buckets < 1:
+        return np.arange(n)
+
+    y = np.asarray(y, dtype=np.float64)
+    bucket = (np.arange(n) * buckets) // n
+    # Sort by bucket, then value: each bucket's min is its first entry and max its last
+    order = np.lexsort((y, bucket))
+    boundaries = np.flatnonzero(np.diff(bucket)) + 1
+    firsts = order[np.concatenate(([0], boundaries))]
+    lasts = order[np.concatenate((boundaries - 1, [n - 1]))]
+    return np.unique(np.concatenate((firsts, lasts)))
+
+
+def downsample_points(
+    points: List[Dict[str, Any]],
+    max_points: int,
+    method: str = "lttb",
+    value_key: str = "value"
+) -> List[Dict[str, Any]]:
+    """Downsample ``{"timestamp": ..., "value": ...}`` points, oldest first."""
+    if method not in DOWNSAMPLING_METHODS:
+        raise ValueError(f"Unknown downsampling method: {method}")
+    if len(points) <= max_points:
+        return points
+
+    y = np.fromiter((p.get(value_key) or 0 for p in points), dtype=np.float64, count=len(points))
+    if method == "minmax":
+        indices = minmax_indices(y, max_points)
+    else:
+        x = np.fromiter((_timestamp(p, i) for i, p in enumerate(points)), dtype=np.float64, count=len(points))
+        indices = lttb_indices(x, y, max_points)
+    return [points[i] for i in indices]
+
+
+def _timestamp(point: Dict[str, Any], index: int) -> float:
+    timestamp = point.get("timestamp")
+    if isinstance(timestamp, datetime):
+        return timestamp.timestamp()
+    if isinstance(timestamp, str):
+        try:
+            return datetime.fromisoformat(timestamp).timestamp()
+        except ValueError:
+            pass
+    return float(index)
+
+
+class TimeSeriesCache:
+    """TTL + LRU cache of downsampled series responses (points plus their metadata)."""
+
+    def __init__(self, ttl_seconds: Optional[float] = None, max_entries: int = 256):
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else float(
+            os.getenv("ANALYTICS_TIME_SERIES_CACHE_TTL", "60")
+        )
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(
+        metric: str,
+        start: datetime,
+        end: datetime,
+        granularity: str,
+        max_points: int,
+        method: str
+    ) -> Tuple:
+        return (metric, start.isoformat(), end.isoformat(), granularity, max_points, method)
+
+    def get(self, key: Hashable) -> Optional[Dict[str, Any]]:
+        entry = self._entries.get(key)
+        if entry is None or time.monotonic() - entry[0] > self.ttl_seconds:
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key: Hashable, series: Dict[str, Any]) -> None:
+        if self.ttl_seconds <= 0:
+            return
+        self._entries[key] = (time.monotonic(), series)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "ttl_seconds": self.ttl_seconds
+        }
+
+
+# Shared by every AnalyticsService instance
+time_series_cache = TimeSeriesCache()
@@ -1,17 +1,23 @@
 """
 WebSocket connection manager for real-time features
 """
-from typing import Dict, List, Set, Optional, Any, Union
+from typing import Dict, Iterable, List, Set, Optional, Any, Union
 from fastapi import WebSocket, WebSocketDisconnect
 from core.logger import get_logger
 import json
 from uuid import UUID
 from datetime import datetime, timezone
 import asyncio
+import sys
 
 logger = get_logger(__name__)
 
 
+def role_room(role: Any) -> str:
+    """Room every connected user with ``role`` is placed in, e.g. ``role:PASSENGER``"""
+    return f"role:{getattr(role, 'value', role)}"
+
+
 class WebSocketManager:
     """Manages WebSocket connections for real-time features"""
 
@@ -26,8 +32,9 @@ class WebSocketManager:
         self.rooms: Dict[str, Set[str]] = {}  # room_id -> set of user_ids
         # Store proximity alert preferences
         self.proximity_preferences: Dict[str, Dict[str, Any]] = {}  # user_id -> preferences
-        # Store notification subscriptions
+        # Store notification subscriptions, indexed both ways
         self.notification_subscriptions: Dict[str, Set[str]] = {}  # user_id -> set of notification_types
+        self.notification_subscribers: Dict[str, Set[str]] = {}  # notification_type -> set of user_ids
         # Store app state for authentication
         self.app_state: Optional[Any] = None
 
@@ -36,7 +43,7 @@ class WebSocketManager:
         self.app_state = app_state
         #logger.info("WebSocket manager app state set")
 
-    async def connect_user(self, websocket: WebSocket, user_id: str) -> str:
+    async def connect_user(self, websocket: WebSocket, user_id: str, role: Any = None) -> str:
         """Connect a user and return connection ID"""
         connection_id = f"ws_{user_id}_{datetime.now().timestamp()}"
 
@@ -45,6 +52,10 @@ class WebSocketManager:
         self.user_connection_ids[user_id] = connection_id
         self.user_sessions[connection_id] = user_id
 
+        # Role rooms let role-targeted broadcasts skip the users collection
+        if role is not None:
+            await self.join_room_user(user_id, role_room(role))
+
         total_connections = len(self.user_connections)
         #logger.info(f"🔌 User {user_id} connected via WebSocket with connection {connection_id} (Total connections: {total_connections})")
         #logger.debug(f"🔌 Connection stored: user_connections[{user_id}] = {websocket}")
@@ -153,28 +164,38 @@ class WebSocketManager:
 
     async def send_personal_message(self, user_id: str, message: Dict[str, Any]) -> bool:
         """Send message to a specific user"""
-        if user_id not in self.user_connections:
-            #logger.warning(f"🔌 User {user_id} not connected, cannot send message")
+        try:
+            message_json = json.dumps(message)
+        except (TypeError, ValueError) as e:
+            logger.error(f"💥 Cannot serialize WebSocket message {message.get('type', 'unknown')}: {e}")
             return False
+        return await self._send_text(user_id, message_json)
 
-        websocket = self.user_connections[user_id]
-        message_type = message.get('type', 'unknown')
+    async def _send_text(self, user_id: str, message_json: str) -> bool:
+        websocket = self.user_connections.get(user_id)
+        if websocket is None:
+            #logger.warning(f"🔌 User {user_id} not connected, cannot send message")
+            return False
 
         try:
-            message_json = json.dumps(message)
             await websocket.send_text(message_json)
-
-            # Log successful message send
-            #logger.info(f"📤 SENT WebSocket Message: {message_type} to user {user_id}")
-            #logger.debug(f"📤 Message Data: {message}")
-
             return True
         except Exception as e:
-            #logger.error(f"💥 Error sending WebSocket message {message_type} to user {user_id}: {e}")
+            #logger.error(f"💥 Error sending WebSocket message to user {user_id}: {e}")
             # Remove disconnected connection
             await self.disconnect_user(user_id)
             return False
 
+    async def send_to_users(self, user_ids: Iterable[str], message: Dict[str, Any]) -> int:
+        """Send one message to many users: serialized once, written concurrently. Returns deliveries."""
+        try:
+            message_json = json.dumps(message)
+        except (TypeError, ValueError) as e:
+            logger.error(f"💥 Cannot serialize WebSocket message {message.get('type', 'unknown')}: {e}")
+            return 0
+        results = await asyncio.gather(*(self._send_text(user_id, message_json) for user_id in user_ids))
+        return sum(results)
+
     async def send_room_message(self, room_id: str, message: Dict[str, Any], exclude_user: str = "") -> bool:
         """Send message to all users in a room"""
         if room_id not in self.rooms:
@@ -185,22 +206,33 @@ class WebSocketManager:
         if exclude_user:
             users_to_notify.discard(exclude_user)
 
-        message_type = message.get('type', 'unknown')
-        #logger.info(f"📡 BROADCASTING to room {room_id}: {message_type} to {len(users_to_notify)} users")
-        # if exclude_user:
-            #logger.debug(f"📡 Excluding user {exclude_user} from broadcast")
-
-        success_count = 0
-        for user_id in users_to_notify:
-            if await self.send_personal_message(user_id, message):
-                success_count += 1
-
-        # if success_count > 0:
-            #logger.info(f"✅ Successfully broadcasted {message_type} to {success_count}/{len(users_to_notify)} users in room {room_id}")
-        # else:
-            #logger.warning(f"❌ Failed to broadcast {message_type} to any users in room {room_id}")
-
-        return success_count > 0
+        return await self.send_to_users(users_to_notify, message) > 0
+
+    async def send_notification(
+        self,
+        notification_type: str,
+        message: Dict[str, Any],
+        room_id: Optional[str] = None,
+        user_ids: Optional[Iterable[str]] = None
+    ) -> int:
+        """
+        Send a typed notification to its subscribers, limited to a room or to
+        ``user_ids`` when given. Costs O(min(room, subscribers)) or
+        O(len(user_ids)) rather than a scan of every connection. Returns deliveries.
+        """
+        subscribers = self.notification_subscribers.get(notification_type)
+        if not subscribers:
+            return 0
+
+        if room_id is not None:
+            # Set intersection walks the smaller side
+            recipients = self.rooms.get(room_id, set()) & subscribers
+        elif user_ids is not None:
+            recipients = subscribers.intersection(user_ids)
+        else:
+            # Copied: a failed send unsubscribes while we iterate
+            recipients = set(subscribers)
+        return await self.send_to_users(recipients, message)
 
     async def broadcast_message(self, message: Dict[str, Any]) -> bool:
         """Send message to all connected users"""
@@ -209,10 +241,7 @@ class WebSocketManager:
 
         #logger.info(f"🌐 GLOBAL BROADCAST: {message_type} to {total_users} connected users")
 
-        success_count = 0
-        for user_id in list(self.user_connections.keys()):
-            if await self.send_personal_message(user_id, message):
-                success_count += 1
+        success_count = await self.send_to_users(list(self.user_connections.keys()), message)
 
         # if success_count > 0:
             #logger.info(f"✅ Global broadcast {message_type} successful: {success_count}/{total_users} users")
@@ -237,14 +266,13 @@ class WebSocketManager:
     def subscribe_to_notifications(self, user_id: str, notification_types: List[str]) -> bool:
         """Subscribe user to specific notification types"""
         try:
-            if user_id not in self.notification_subscriptions:
-                self.notification_subscriptions[user_id] = set()
-
-            # Add new notification types to user's subscriptions
-            self.notification_subscriptions[user_id].update(notification_types)
+            user_types = self.notification_subscriptions.setdefault(user_id, set())
+            for notification_type in notification_types:
+                user_types.add(notification_type)
+                self.notification_subscribers.setdefault(notification_type, set()).add(user_id)
 
             logger.info(f"🔔 User {user_id} subscribed to notifications: {notification_types}")
-            logger.debug(f"🔔 User {user_id} total subscriptions: {list(self.notification_subscriptions[user_id])}")
+            logger.debug(f"🔔 User {user_id} total subscriptions: {list(user_types)}")
             return True
         except Exception as e:
             logger.error(f"💥 Error subscribing user {user_id} to notifications: {e}")
@@ -256,12 +284,7 @@ class WebSocketManager:
             if user_id not in self.notification_subscriptions:
                 return True  # Already unsubscribed
 
-            # Remove notification types from user's subscriptions
-            self.notification_subscriptions[user_id].difference_update(notification_types)
-
-            # Clean up empty subscription sets
-            if not self.notification_subscriptions[user_id]:
-                del self.notification_subscriptions[user_id]
+            self._remove_subscriptions(user_id, notification_types)
 
             logger.info(f"🔔 User {user_id} unsubscribed from notifications: {notification_types}")
             return True
@@ -269,34 +292,70 @@ class WebSocketManager:
             logger.error(f"💥 Error unsubscribing user {user_id} from notifications: {e}")
             return False
 
+    def _remove_subscriptions(self, user_id: str, notification_types: Iterable[str]) -> None:
+        user_types = self.notification_subscriptions.get(user_id)
+        if user_types is None:
+            return
+        for notification_type in list(notification_types):
+            user_types.discard(notification_type)
+            subscribers = self.notification_subscribers.get(notification_type)
+            if subscribers is not None:
+                subscribers.discard(user_id)
+                if not subscribers:
+                    del self.notification_subscribers[notification_type]
+
+        # Clean up empty subscription sets
+        if not user_types:
+            del self.notification_subscriptions[user_id]
+
     def get_user_notification_subscriptions(self, user_id: str) -> Set[str]:
         """Get user's notification subscriptions"""
         return self.notification_subscriptions.get(user_id, set()).copy()
 
     def is_user_subscribed_to_notification(self, user_id: str, notification_type: str) -> bool:
         """Check if user is subscribed to a specific notification type"""
-        user_subscriptions = self.notification_subscriptions.get(user_id, set())
-        is_subscribed = notification_type in user_subscriptions
-
-        logger.debug(f"🔍 Checking subscription for user {user_id}, type {notification_type}: {'SUBSCRIBED' if is_subscribed else 'NOT SUBSCRIBED'}")
-        return is_subscribed
+        return notification_type in self.notification_subscriptions.get(user_id, ())
 
     def get_subscribed_users_for_notification(self, notification_type: str) -> List[str]:
         """Get all users subscribed to a specific notification type"""
-        subscribed_users = []
-        for user_id, subscriptions in self.notification_subscriptions.items():
-            if notification_type in subscriptions:
-                subscribed_users.append(user_id)
-
-        logger.debug(f"🔍 Found {len(subscribed_users)} users subscribed to {notification_type}")
-        return subscribed_users
+        return list(self.notification_subscribers.get(notification_type, ()))
 
     def clear_user_subscriptions(self, user_id: str) -> None:
         """Clear all subscriptions for a user (called on disconnect)"""
-        if user_id in self.notification_subscriptions:
-            del self.notification_subscriptions[user_id]
+        user_types = self.notification_subscriptions.get(user_id)
+        if user_types is not None:
+            self._remove_subscriptions(user_id, user_types)
             logger.debug(f"🔔 Cleared all notification subscriptions for user {user_id}")
 
+    def get_subscription_stats(self) -> Dict[str, Any]:
+        """Size of the subscription index. Bytes cover the dicts and sets, not the id strings they share."""
+        containers = [
+            self.notification_subscriptions, self.notification_subscribers,
+            *self.notification_subscriptions.values(), *self.notification_subscribers.values()
+        ]
+        return {
+            "subscribed_users": len(self.notification_subscriptions),
+            "notification_types": len(self.notification_subscribers),
+            "subscriptions": sum(len(types) for types in self.notification_subscriptions.values()),
+            "subscribers_by_type": {
+                notification_type: len(users) for notification_type, users in self.notification_subscribers.items()
+            },
+            "index_bytes": sum(sys.getsizeof(container) for container in containers)
+        }
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Connection, room and subscription counts with approximate memory use"""
+        return {
+            "total_connections": len(self.user_connections),
+            "total_rooms": len(self.rooms),
+            "role_rooms": {
+                room_id: len(users) for room_id, users in self.rooms.items() if room_id.startswith("role:")
+            },
+            "room_memberships": sum(len(users) for users in self.rooms.values()),
+            "rooms_bytes": sys.getsizeof(self.rooms) + sum(sys.getsizeof(users) for users in self.rooms.values()),
+            "notification_subscriptions": self.get_subscription_stats()
+        }
+
 
 # Global WebSocket manager instance
 websocket_manager = WebSocketManager()
@@ -5,7 +5,9 @@ import googlemaps
 from dotenv import load_dotenv
 import os
 import asyncio
+import inspect
 from contextlib import asynccontextmanager
+from typing import Any, Callable
 from bson import UuidRepresentation  # Added import for UuidRepresentation
 
 # Import centralized logger
@@ -32,6 +34,17 @@ setup_logging(
 
 logger = get_logger(__name__)
 
+async def _shutdown_step(name: str, stop: Callable[[], Any]):
+    """Run one shutdown step, logging instead of raising so the remaining steps still run."""
+    try:
+        result = stop()
+        if inspect.isawaitable(result):
+            await result
+        logger.info(f"{name} stopped")
+    except Exception:
+        logger.error(f"Error stopping {name}", exc_info=True)
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
@@ -82,6 +95,62 @@ async def lifespan(app: FastAPI):
         except Exception as e:
             logger.warning(f"Could not check database content: {e}")
 
+        # Build today's KPI aggregates; dashboards read them instead of rescanning
+        try:
+            from core.kpi_aggregator import kpi_aggregator
+            await kpi_aggregator.start(app.state.mongodb)
+            logger.info("KPI aggregator initialized")
+        except Exception as e:
+            logger.error(f"Failed to initialize KPI aggregator: {e}")
+
+        # Keep hourly/daily analytics rollups up to date
+        try:
+            from core.analytics_rollups import analytics_rollups
+            await analytics_rollups.start(app.state.mongodb)
+            logger.info("Analytics rollups started")
+        except Exception as e:
+            logger.error(f"Failed to start analytics rollups: {e}")
+
+        # Apply queued Chapa webhook events in the background
+        try:
+            from core.payment_webhooks import payment_webhook_processor
+            await payment_webhook_processor.start(app.state.mongodb)
+            logger.info("Payment webhook workers started")
+        except Exception as e:
+            logger.error(f"Failed to start payment webhook workers: {e}")
+
+        # Settle payments left PENDING by lost webhooks
+        try:
+            from core.payment_reconciler import payment_reconciler
+            await payment_reconciler.start(app.state.mongodb)
+            logger.info("Payment reconciler started")
+        except Exception as e:
+            logger.error(f"Failed to start payment reconciler: {e}")
+
+        # Load used/revoked tickets for offline-signed ticket validation
+        try:
+            from core.ticket_tokens import ticket_ledger
+            await ticket_ledger.start(app.state.mongodb)
+            logger.info("Ticket ledger started")
+        except Exception as e:
+            logger.error(f"Failed to start ticket ledger: {e}")
+
+        # Store and deliver per-user notifications in the background
+        try:
+            from core.realtime.notification_outbox import notification_outbox
+            await notification_outbox.start(app.state.mongodb)
+            logger.info("Notification outbox workers started")
+        except Exception as e:
+            logger.error(f"Failed to start notification outbox: {e}")
+
+        # Buffer proximity alert notifications for batched writes
+        try:
+            from core.realtime.proximity_alerts import proximity_alert_tracker
+            await proximity_alert_tracker.start(app.state.mongodb)
+            logger.info("Proximity alert tracker started")
+        except Exception as e:
+            logger.error(f"Failed to start proximity alert tracker: {e}")
+
         # Initialize analytics services
         logger.info("Initializing analytics services...")
         from core.realtime_analytics import RealTimeAnalyticsService
@@ -139,6 +208,13 @@ async def lifespan(app: FastAPI):
         email_config = EmailConfig()
         if email_config.is_configured():
             logger.info("✅ Email service is configured and ready")
+            # Deliver queued emails over pooled SMTP connections
+            try:
+                from core.email_outbox import email_outbox
+                await email_outbox.start(app.state.mongodb)
+                logger.info("Email outbox workers started")
+            except Exception as e:
+                logger.error(f"Failed to start email outbox: {e}")
         else:
             logger.warning("⚠️  Email service is not configured - emails will be logged only")
             logger.warning("   Add SMTP settings to .env file to enable email sending")
@@ -158,32 +234,57 @@ async def lifespan(app: FastAPI):
     yield
 
     # Shutdown
-    try:
-        # Stop background tasks
-        logger.info("Stopping background tasks...")
-        from core.services.background_tasks import background_task_service
-        await background_task_service.stop_background_tasks()
-        logger.info("Background tasks stopped")
-
-        # Stop analytics services
-        if hasattr(app.state, 'realtime_analytics'):
-            await app.state.realtime_analytics.stop()
-            logger.info("Real-time analytics service stopped")
-
-        if hasattr(app.state, 'scheduled_analytics'):
-            await app.state.scheduled_analytics.stop()
-            logger.info("Scheduled analytics service stopped")
-
-        # Stop bus simulation service
-        if hasattr(app.state, 'bus_simulation'):
-            await app.state.bus_simulation.stop()
-            logger.info("Bus simulation service stopped")
-
+    # Producers stop first, then the queues they feed are drained; each step
+    # runs even if an earlier one failed
+    from core.services.background_tasks import background_task_service
+    await _shutdown_step("Background tasks", background_task_service.stop_background_tasks)
+
+    # Simulated buses and passengers feed location updates, proximity alerts and notifications
+    if hasattr(app.state, 'bus_simulation'):
+        await _shutdown_step("Bus simulation service", app.state.bus_simulation.stop)
+
+    if hasattr(app.state, 'realtime_analytics'):
+        await _shutdown_step("Real-time analytics service", app.state.realtime_analytics.stop)
+    if hasattr(app.state, 'scheduled_analytics'):
+        await _shutdown_step("Scheduled analytics service", app.state.scheduled_analytics.stop)
+
+    # Stop analytics rollup refreshes and checkpoint KPI aggregates
+    from core.analytics_rollups import analytics_rollups
+    await _shutdown_step("Analytics rollups", analytics_rollups.stop)
+    from core.kpi_aggregator import kpi_aggregator
+    await _shutdown_step("KPI aggregator", kpi_aggregator.stop)
+
+    # Unfinished webhook events and due payments are picked up again on restart
+    from core.payment_webhooks import payment_webhook_processor
+    await _shutdown_step("Payment webhook workers", payment_webhook_processor.stop)
+    from core.payment_reconciler import payment_reconciler
+    await _shutdown_step("Payment reconciler", payment_reconciler.stop)
+
+    # Write back pending ticket redemptions
+    from core.ticket_tokens import ticket_ledger
+    await _shutdown_step("Ticket ledger", ticket_ledger.stop)
+
+    # Write buffered proximity notifications, then drain queued notifications
+    from core.realtime.proximity_alerts import proximity_alert_tracker
+    await _shutdown_step("Proximity alert tracker", proximity_alert_tracker.stop)
+    from core.realtime.notification_outbox import notification_outbox
+    await _shutdown_step("Notification outbox", notification_outbox.stop)
+
+    # Stop QR render workers
+    from core.qr_images import qr_image_cache
+    await _shutdown_step("QR render workers", qr_image_cache.stop)
+
+    # Stop email workers; queued emails are sent after restart
+    from core.email_outbox import email_outbox
+    await _shutdown_step("Email outbox", email_outbox.stop)
+
+    # Close pooled Chapa connections
+    from core.chapa_service import chapa_service
+    await _shutdown_step("Chapa client", chapa_service.close)
+
+    if hasattr(app.state, 'mongodb_client'):
         logger.info("Closing MongoDB connection...")
-        app.state.mongodb_client.close()
-        logger.info("MongoDB connection closed successfully")
-    except Exception as e:
-        logger.error("Error during shutdown", exc_info=True)
+        await _shutdown_step("MongoDB connection", app.state.mongodb_client.close)
 
 app = FastAPI(
     title="GuzoSync API",
@@ -61,6 +61,7 @@ class Payment(BaseDBModel):
 class Ticket(BaseDBModel):
     ticket_number: str  # Unique ticket identifier
     customer_id: str
+    customer_name: Optional[str] = None  # Denormalized so validation needs no user lookup
     payment_id: str
     ticket_type: TicketType
     origin_stop_id: Optional[str] = None
@@ -74,7 +75,9 @@ class Ticket(BaseDBModel):
     valid_until: datetime
     used_at: Optional[datetime] = None
     used_trip_id: Optional[str] = None
+    used_bus_id: Optional[str] = None
     qr_code: Optional[str] = None  # QR code data for validation
+    signed_token: Optional[str] = None  # HMAC token embedded in the QR for offline validation
     metadata: Optional[Dict[str, Any]] = None  # Additional ticket data
 
 
@@ -7,13 +7,17 @@ from typing import List, Optional
 from datetime import datetime, timedelta
 
 from core.dependencies import get_current_user
-from models import User
+from models import User, Trip, Payment, Feedback, Incident, Alert
 from models.user import UserRole
 from schemas.analytics import (
     AnalyticsSummaryResponse, OperationalMetricsResponse, FinancialMetricsResponse,
     PerformanceMetricsResponse, ReportRequest, ReportResponse
 )
 from core.analytics_service import AnalyticsService
+from core.kpi_aggregator import kpi_aggregator
+from core.analytics_rollups import analytics_rollups
+from core.mongo_utils import date_range_filter
+from core.streaming_export import resolve_columns, export_response, stream_export
 from core import transform_mongo_doc
 
 router = APIRouter(prefix="/api/analytics", tags=["analytics"])
@@ -120,10 +124,17 @@ async def get_time_series_data(
     start_date: datetime = Query(..., description="Start date"),
     end_date: datetime = Query(..., description="End date"),
     granularity: str = Query("daily", description="Time granularity (hourly, daily, weekly, monthly)"),
+    max_points: Optional[int] = Query(None, ge=3, le=10000, description="Downsample to at most this many points"),
+    downsampling: str = Query("lttb", pattern="^(lttb|minmax)$", description="Downsampling method (lttb, minmax)"),
     current_user: User = Depends(require_control_admin_or_staff)
 ):
     """Get time series data for charts."""
     analytics_service = AnalyticsService(request.app.state.mongodb)
+    if max_points:
+        return await analytics_service.generate_downsampled_time_series(
+            metric, start_date, end_date, granularity, max_points, downsampling
+        )
+    
     time_series = await analytics_service.generate_time_series_data(
         metric, start_date, end_date, granularity
     )
@@ -259,6 +270,69 @@ async def get_kpi_metrics(
     
     return {"kpis": kpis}
 
+@router.get("/kpis/live")
+async def get_live_kpis(
+    current_user: User = Depends(require_control_admin_or_staff)
+):
+    """Get today's incrementally maintained KPIs with per-route breakdowns."""
+    if not kpi_aggregator.is_ready:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="KPI aggregates are not available yet"
+        )
+    
+    return {
+        "kpis": kpi_aggregator.snapshot(),
+        "routes": kpi_aggregator.get_route_breakdown(),
+        "status": kpi_aggregator.get_status()
+    }
+
+@router.post("/kpis/rebuild")
+async def rebuild_kpis(
+    request: Request,
+    current_user: User = Depends(require_control_admin_or_staff)
+):
+    """Rebuild today's KPI aggregates from the source collections."""
+    if current_user.role != UserRole.CONTROL_ADMIN:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Only control admins can rebuild KPI aggregates"
+        )
+    
+    await kpi_aggregator.rebuild(request.app.state.mongodb, force=True)
+    await kpi_aggregator.checkpoint(request.app.state.mongodb)
+    
+    return {"message": "KPI aggregates rebuilt", "status": kpi_aggregator.get_status()}
+
+@router.get("/rollups/status")
+async def get_rollup_status(
+    current_user: User = Depends(require_control_admin_or_staff)
+):
+    """Get the state of the hourly/daily analytics rollups."""
+    return analytics_rollups.get_status()
+
+@router.post("/rollups/refresh")
+async def refresh_rollups(
+    request: Request,
+    current_user: User = Depends(require_control_admin_or_staff)
+):
+    """Merge new source data into the analytics rollups now."""
+    if current_user.role != UserRole.CONTROL_ADMIN:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Only control admins can refresh analytics rollups"
+        )
+    
+    if analytics_rollups.db is None:
+        analytics_rollups.db = request.app.state.mongodb
+    if not await analytics_rollups.refresh():
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Another instance is refreshing the analytics rollups"
+        )
+    
+    return {"message": "Analytics rollups refreshed", "status": analytics_rollups.get_status()}
+
 @router.get("/dashboard-config")
 async def get_dashboard_config(
     request: Request,
@@ -325,6 +399,15 @@ async def get_realtime_dashboard_data(
         "last_updated": datetime.utcnow().isoformat()
     }
 
+# Raw collections available through /export/stream, with their exportable columns
+EXPORT_DATASETS = {
+    "trips": list(Trip.model_fields),
+    "payments": [f for f in Payment.model_fields if f != "chapa_response"],
+    "feedback": list(Feedback.model_fields),
+    "incidents": list(Incident.model_fields),
+    "alerts": list(Alert.model_fields)
+}
+
 @router.get("/export/csv")
 async def export_analytics_csv(
     request: Request,
@@ -335,10 +418,6 @@ async def export_analytics_csv(
 ):
     """Export analytics data as CSV."""
     try:
-        import csv
-        import io
-        from fastapi.responses import StreamingResponse
-        
         analytics_service = AnalyticsService(request.app.state.mongodb)
         
         # Generate data based on report type
@@ -354,33 +433,48 @@ async def export_analytics_csv(
         else:
             raise HTTPException(status_code=400, detail="Invalid report type")
         
-        # Create CSV response
-        output = io.StringIO()
-        writer = csv.writer(output)
-        
-        # Write headers
-        if csv_data:
-            writer.writerow(csv_data[0].keys())
-            # Write data
-            for row in csv_data:
-                writer.writerow(row.values())
-        
-        output.seek(0)
-        
-        return StreamingResponse(
-            io.BytesIO(output.getvalue().encode('utf-8')),
-            media_type="application/octet-stream",
-            headers={
-                "Content-Disposition": f"attachment; filename={report_type}_report_{start_date.date()}_{end_date.date()}.csv"
-            }
+        return export_response(
+            csv_data,
+            list(csv_data[0].keys()),
+            "csv",
+            f"{report_type}_report_{start_date.date()}_{end_date.date()}"
         )
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to export CSV: {str(e)}"
         )
 
+@router.get("/export/stream")
+async def export_analytics_dataset(
+    request: Request,
+    dataset: str = Query(..., description=f"One of: {', '.join(EXPORT_DATASETS)}"),
+    export_format: str = Query("csv", alias="format", pattern="^(csv|ndjson)$"),
+    fields: Optional[str] = Query(None, description="Comma-separated columns to export"),
+    start_date: Optional[datetime] = Query(None, description="Only documents created at or after"),
+    end_date: Optional[datetime] = Query(None, description="Only documents created at or before"),
+    current_user: User = Depends(require_control_admin_or_staff)
+):
+    """Stream raw analytics documents as CSV or NDJSON without loading them into memory."""
+    if dataset not in EXPORT_DATASETS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid dataset. Must be one of: {', '.join(EXPORT_DATASETS)}"
+        )
+    columns = resolve_columns(fields, EXPORT_DATASETS[dataset])
+    query = date_range_filter("created_at", start_date, end_date)
+
+    return stream_export(
+        request.app.state.mongodb[dataset],
+        query,
+        columns,
+        export_format,
+        f"{dataset}_export_{datetime.utcnow().strftime('%Y%m%d%H%M%S')}"
+    )
+
 def _format_operational_csv(data: dict) -> List[dict]:
     """Format operational data for CSV export."""
     return [{
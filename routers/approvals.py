@@ -1,9 +1,10 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Request
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Request
 from typing import List, Optional
 from datetime import datetime
 
 from core.dependencies import get_current_user
-from core.mongo_utils import transform_mongo_doc, model_to_mongo_doc
+from core.mongo_utils import transform_mongo_doc, model_to_mongo_doc, date_range_filter
+from core.streaming_export import resolve_columns, stream_export
 from core.email_service import send_welcome_email
 from core.security import get_password_hash
 from core import get_logger
@@ -61,6 +62,42 @@ async def get_approval_requests(
             detail="Error retrieving approval requests"
         )
 
+@router.get("/requests/export")
+async def export_approval_requests(
+    request: Request,
+    status_filter: Optional[str] = None,
+    export_format: str = Query("csv", alias="format", pattern="^(csv|ndjson)$"),
+    fields: Optional[str] = Query(None, description="Comma-separated columns to export"),
+    requested_from: Optional[datetime] = Query(None, description="Only requests made at or after"),
+    requested_to: Optional[datetime] = Query(None, description="Only requests made at or before"),
+    current_user: User = Depends(get_current_user)
+):
+    """Stream approval requests as CSV or NDJSON (CONTROL_ADMIN only)"""
+    if current_user.role != UserRole.CONTROL_ADMIN:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Only CONTROL_ADMIN can view approval requests"
+        )
+
+    query = date_range_filter("requested_at", requested_from, requested_to)
+    if status_filter:
+        if status_filter.upper() not in [s.value for s in ApprovalStatus]:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Invalid status filter"
+            )
+        query["status"] = status_filter.upper()
+    columns = resolve_columns(fields, ApprovalRequestResponse.model_fields)
+
+    logger.info("Exporting approval requests", extra={"admin_user": current_user.email, "status_filter": status_filter})
+    return stream_export(
+        request.app.state.mongodb.approval_requests,
+        query,
+        columns,
+        export_format,
+        f"approval_requests_{datetime.utcnow().strftime('%Y%m%d%H%M%S')}"
+    )
+
 @router.get("/requests/{request_id}", response_model=ApprovalRequestResponse)
 async def get_approval_request(
     request_id: str,
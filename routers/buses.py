@@ -15,7 +15,7 @@ from core.realtime.bus_tracking import bus_tracking_service
 from core.services.route_service import route_service
 
 from core import transform_mongo_doc, generate_uuid
-from core.mongo_utils import model_to_mongo_doc
+from core.mongo_utils import model_to_mongo_doc, real_users_query
 
 router = APIRouter(prefix="/api/buses", tags=["buses"])
 
@@ -739,10 +739,10 @@ async def get_available_drivers(
         )
 
     # Get all bus drivers
-    all_drivers = await request.app.state.mongodb.users.find({
+    all_drivers = await request.app.state.mongodb.users.find(real_users_query({
         "role": UserRole.BUS_DRIVER,
         "is_active": True
-    }).to_list(length=None)
+    })).to_list(length=None)
 
     # Get all currently assigned driver IDs
     assigned_buses = await request.app.state.mongodb.buses.find({
@@ -5,7 +5,8 @@ from typing import Any, List, Optional, Dict
 from datetime import datetime
 
 from core.dependencies import get_current_user
-from core.mongo_utils import transform_mongo_doc, model_to_mongo_doc
+from core.mongo_utils import transform_mongo_doc, model_to_mongo_doc, date_range_filter, real_users_query
+from core.streaming_export import resolve_columns, stream_export
 from core.email_service import email_service
 from core import get_logger
 from core.security import generate_secure_password, get_password_hash
@@ -240,7 +241,7 @@ async def get_queue_regulators(
         )
     
     regulators = await request.app.state.mongodb.users.find(
-        {"role": "QUEUE_REGULATOR"}
+        real_users_query({"role": "QUEUE_REGULATOR"})
     ).skip(skip).limit(limit).to_list(length=limit)
     
     return [transform_mongo_doc(regulator, UserResponse) for regulator in regulators]
@@ -391,7 +392,7 @@ async def get_bus_drivers(
 
     # Get drivers
     drivers = await request.app.state.mongodb.users.find(
-        {"role": "BUS_DRIVER"}
+        real_users_query({"role": "BUS_DRIVER"})
     ).skip(skip).limit(limit).to_list(length=limit)
 
     # For each driver, find their assigned bus
@@ -567,6 +568,26 @@ async def assign_driver_to_bus(
     
     return {"message": "Driver assigned to bus successfully"}
 
+def _personnel_query(current_user: User, role_filter: Optional[str]) -> dict[str, Any]:
+    """Personnel filter for the requesting user's role (RBAC), optionally narrowed to one role."""
+    if current_user.role == UserRole.CONTROL_ADMIN:
+        # CONTROL_ADMIN can see all personnel including other admins
+        personnel_roles = ["CONTROL_ADMIN", "CONTROL_STAFF", "BUS_DRIVER", "QUEUE_REGULATOR", "PASSENGER"]
+    else:  # CONTROL_STAFF
+        # CONTROL_STAFF can see all personnel EXCEPT CONTROL_ADMIN users
+        personnel_roles = ["CONTROL_STAFF", "BUS_DRIVER", "QUEUE_REGULATOR", "PASSENGER"]
+
+    query: dict[str, Any] = {"role": {"$in": personnel_roles}}
+    # Apply role filter if specified
+    if role_filter:
+        if role_filter.upper() not in personnel_roles:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Invalid role filter. Must be one of: {', '.join(personnel_roles)}"
+            )
+        query = {"role": role_filter.upper()}
+    return real_users_query(query)
+
 # Get All Personnel - for both CONTROL_ADMIN and CONTROL_STAFF
 @router.get("/personnel", response_model=List[UserResponse])
 async def get_all_personnel(
@@ -581,25 +602,8 @@ async def get_all_personnel(
             detail="Only CONTROL_ADMIN and CONTROL_STAFF can view personnel"
         )
     
+    query = _personnel_query(current_user, role_filter)
     try:
-        # Build query filter for personnel roles based on user role (RBAC)
-        if current_user.role == UserRole.CONTROL_ADMIN:
-            # CONTROL_ADMIN can see all personnel including other admins
-            personnel_roles = ["CONTROL_ADMIN", "CONTROL_STAFF", "BUS_DRIVER", "QUEUE_REGULATOR", "PASSENGER"]
-        else:  # CONTROL_STAFF
-            # CONTROL_STAFF can see all personnel EXCEPT CONTROL_ADMIN users
-            personnel_roles = ["CONTROL_STAFF", "BUS_DRIVER", "QUEUE_REGULATOR", "PASSENGER"]
-        
-        query: dict[str, Any] = {"role": {"$in": personnel_roles}}
-          # Apply role filter if specified
-        if role_filter:
-            if role_filter.upper() not in personnel_roles:
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail=f"Invalid role filter. Must be one of: {', '.join(personnel_roles)}"
-                )
-            query = {"role": role_filter.upper()}
-        
         # Fetch personnel
         personnel_cursor = request.app.state.mongodb.users.find(query)
         personnel = await personnel_cursor.to_list(length=None)
@@ -616,6 +620,36 @@ async def get_all_personnel(
             detail="Error retrieving personnel"
         )
 
+@router.get("/personnel/export")
+async def export_personnel(
+    request: Request,
+    role_filter: Optional[str] = None,
+    export_format: str = Query("csv", alias="format", pattern="^(csv|ndjson)$"),
+    fields: Optional[str] = Query(None, description="Comma-separated columns to export"),
+    created_from: Optional[datetime] = Query(None, description="Only personnel created at or after"),
+    created_to: Optional[datetime] = Query(None, description="Only personnel created at or before"),
+    current_user: User = Depends(get_current_user)
+):
+    """Stream personnel as CSV or NDJSON (CONTROL_ADMIN and CONTROL_STAFF can access)"""
+    if current_user.role not in [UserRole.CONTROL_ADMIN, UserRole.CONTROL_STAFF]:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Only CONTROL_ADMIN and CONTROL_STAFF can view personnel"
+        )
+
+    # Columns come from the response schema, so credentials are never exported
+    columns = resolve_columns(fields, UserResponse.model_fields)
+    query = {**_personnel_query(current_user, role_filter), **date_range_filter("created_at", created_from, created_to)}
+
+    logger.info("Exporting personnel", extra={"requestor": current_user.email, "role_filter": role_filter})
+    return stream_export(
+        request.app.state.mongodb.users,
+        query,
+        columns,
+        export_format,
+        f"personnel_{datetime.utcnow().strftime('%Y%m%d%H%M%S')}"
+    )
+
 # Passengers Management
 @router.get("/passengers", response_model=List[UserResponse])
 async def get_all_passengers(
@@ -633,7 +667,7 @@ async def get_all_passengers(
     
     try:
         passengers = await request.app.state.mongodb.users.find(
-            {"role": "PASSENGER"}
+            real_users_query({"role": "PASSENGER"})
         ).skip(skip).limit(limit).to_list(length=limit)
         
         logger.info(f"Retrieved {len(passengers)} passenger records", 
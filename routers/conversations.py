@@ -10,7 +10,7 @@ from schemas.conversation import MessageResponse, ConversationResponse, SendMess
 from core.realtime.chat import chat_service
 
 from core import transform_mongo_doc
-from core.mongo_utils import model_to_mongo_doc
+from core.mongo_utils import model_to_mongo_doc, real_users_query
 
 router = APIRouter(prefix="/api/conversations", tags=["conversations"])
 
@@ -47,10 +47,10 @@ def can_communicate_with(sender_role: UserRole, target_role: UserRole) -> bool:
 
 async def get_control_center_users(mongodb) -> List[dict]:
     """Get all control center users (staff and admin)"""
-    return await mongodb.users.find({
+    return await mongodb.users.find(real_users_query({
         "role": {"$in": ["CONTROL_STAFF", "CONTROL_ADMIN"]},
         "is_active": True
-    }).to_list(length=None)
+    })).to_list(length=None)
 
 @router.post("/create", response_model=ConversationResponse, status_code=status.HTTP_201_CREATED)
 async def create_conversation(
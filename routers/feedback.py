@@ -10,6 +10,7 @@ from schemas.feedback import SubmitFeedbackRequest, FeedbackResponse
 
 from core import transform_mongo_doc
 from core.mongo_utils import model_to_mongo_doc
+from core.kpi_aggregator import kpi_aggregator
 
 router = APIRouter(prefix="/api/feedback", tags=["feedback"])
 
@@ -30,6 +31,7 @@ async def submit_feedback(
     # Convert model to MongoDB document
     feedback_doc = model_to_mongo_doc(feedback)
     result = await request.app.state.mongodb.feedback.insert_one(feedback_doc)
+    kpi_aggregator.record_feedback(feedback_doc)
     created_feedback = await request.app.state.mongodb.feedback.find_one({"_id": result.inserted_id})
     
     return transform_mongo_doc(created_feedback, FeedbackResponse)
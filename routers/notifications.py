@@ -61,47 +61,22 @@ async def broadcast_notification(
             detail="Only admins can broadcast notifications"
         )
     
-    # Determine target users
-    target_users = []
-    
-    if notification_req.target_user_ids:
-        # Send to specific users
-        target_users = await request.app.state.mongodb.users.find(
-            {"_id": {"$in": notification_req.target_user_ids}}
-        ).to_list(length=None)
-    elif notification_req.target_roles:
-        # Send to users with specific roles
-        target_users = await request.app.state.mongodb.users.find(
-            {"role": {"$in": notification_req.target_roles}}
-        ).to_list(length=None)
-    else:
-        # Send to all users
-        target_users = await request.app.state.mongodb.users.find({}).to_list(length=None)
-    
-    # Create notifications for each target user
-    notifications = []
-    for user in target_users:
-        notification = {
-            "user_id": user["id"],
-            "title": notification_req.title,
-            "message": notification_req.message,
-            "type": notification_req.type.value if hasattr(notification_req.type, 'value') else notification_req.type,
-            "related_entity": notification_req.related_entity.dict() if notification_req.related_entity else None
-        }
-        notifications.append(notification)
-    
-    if notifications:
-        await request.app.state.mongodb.notifications.insert_many(notifications)
-    
-    # Send real-time notifications
-    await notification_service.broadcast_notification(
-        title=notification_req.title,
-        message=notification_req.message,
-        notification_type=notification_req.type.value if hasattr(notification_req.type, 'value') else notification_req.type,
-        target_user_ids=notification_req.target_user_ids,
-        target_roles=notification_req.target_roles,
-        related_entity=notification_req.related_entity.dict() if notification_req.related_entity else None,
-        app_state=request.app.state
-    )
+    # Stores one notification per target user and delivers it live
+    notification_type = notification_req.type.value if hasattr(notification_req.type, 'value') else notification_req.type
+    try:
+        recipient_count = await notification_service.broadcast_notification(
+            title=notification_req.title,
+            message=notification_req.message,
+            notification_type=notification_type,
+            target_user_ids=notification_req.target_user_ids,
+            target_roles=notification_req.target_roles,
+            related_entity=notification_req.related_entity.dict() if notification_req.related_entity else None,
+            app_state=request.app.state
+        )
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to broadcast notification: {str(e)}"
+        )
     
-    return {"message": f"Notification sent to {len(notifications)} users"}
\ No newline at end of file
+    return {"message": f"Notification sent to {recipient_count} users"}
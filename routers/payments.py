@@ -1,8 +1,10 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Query, Request, Header
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Request, Header, Response
 from typing import List, Optional, Dict, Any
 from uuid import uuid4
 from datetime import datetime, timedelta
+import base64
 import json
+import os
 
 from core.dependencies import get_current_user
 from models import User
@@ -15,6 +17,7 @@ from schemas.payment import (
     VerifyPaymentRequest, VerifyPaymentResponse,
     PaymentResponse, TicketResponse, TicketQRResponse,
     ValidateTicketRequest, ValidateTicketResponse,
+    BatchValidateTicketsRequest, BatchValidateTicketsResponse, ScanVerdict,
     CreatePaymentMethodRequest, UpdatePaymentMethodRequest, PaymentMethodResponse,
     ChapaWebhookEvent, PaymentCallbackResponse,
     PaymentStatus, TicketStatus, PaymentMethod, TicketType
@@ -26,6 +29,15 @@ import re
 from core import transform_mongo_doc
 from core.mongo_utils import model_to_mongo_doc
 from core.chapa_service import chapa_service
+from core.payment_reconciler import payment_reconciler
+from core.payment_webhooks import payment_webhook_processor
+from core.qr_images import QR_PAYLOAD_PREFIX, payload_key, qr_image_cache
+from core.ticket_redemption import redeem_scans, redeem_ticket
+from core.ticket_tokens import (
+    CLOSED_STATUSES, InvalidTicketToken, settle_payment_tickets, ticket_ledger, ticket_qr_fields,
+    verify_ticket_token
+)
+from core.kpi_aggregator import kpi_aggregator
 from core.logger import get_logger
 
 logger = get_logger(__name__)
@@ -147,6 +159,7 @@ async def initiate_payment(
             ticket = Ticket(
                 ticket_number=f"TKT-{uuid4().hex[:8].upper()}",
                 customer_id=current_user.id,
+                customer_name=f"{current_user.first_name} {current_user.last_name}",
                 payment_id=payment_id,
                 ticket_type=ModelTicketType(payment_request.ticket_type.value),
                 origin_stop_id=payment_request.origin_stop_id,
@@ -267,16 +280,20 @@ async def authorize_payment(
             update_data["status"] = ModelPaymentStatus.COMPLETED.value
             update_data["paid_at"] = datetime.utcnow()
             
-            # Activate ticket
+            # Activate ticket, unless it was already used, cancelled or expired
             await request.app.state.mongodb.tickets.update_one(
-                {"payment_id": str(payment["_id"])},
-                {"$set": {"status": ModelTicketStatus.ACTIVE.value}}
+                {"payment_id": str(payment["_id"]), "status": {"$nin": CLOSED_STATUSES}},
+                {"$set": {"status": ModelTicketStatus.ACTIVE.value, "updated_at": datetime.utcnow()}}
             )
         
-        await request.app.state.mongodb.payments.update_one(
-            {"_id": payment["_id"]},
+        # Guarded on the status read above, so a concurrent webhook or verify
+        # that already moved the payment is not counted twice
+        previous = await request.app.state.mongodb.payments.find_one_and_update(
+            {"_id": payment["_id"], "status": payment["status"]},
             {"$set": update_data}
         )
+        if previous is not None:
+            kpi_aggregator.record_payment({**previous, **update_data}, previous_status=previous.get("status"))
         
         return AuthorizePaymentResponse(
             tx_ref=auth_request.tx_ref,
@@ -324,36 +341,35 @@ async def verify_payment(
             "updated_at": datetime.utcnow()
         }
         
-        if chapa_response["status"] == ModelPaymentStatus.COMPLETED:
+        target = chapa_response["status"]
+        # Like the webhook processor: never revert a completed payment
+        unchanged = [target.value]
+        if target == ModelPaymentStatus.COMPLETED:
             update_data["paid_at"] = chapa_response.get("paid_at") or datetime.utcnow()
-            
-            # Activate ticket and generate QR code
-            ticket = await request.app.state.mongodb.tickets.find_one({"payment_id": str(payment["_id"])})
-            if ticket:
-                qr_code = chapa_service.generate_qr_code(ticket["ticket_number"])
-                await request.app.state.mongodb.tickets.update_one(
-                    {"_id": ticket["_id"]},
-                    {"$set": {
-                        "status": ModelTicketStatus.ACTIVE.value,
-                        "qr_code": qr_code,
-                        "updated_at": datetime.utcnow()
-                    }}
-                )
-        elif chapa_response["status"] in [ModelPaymentStatus.FAILED, ModelPaymentStatus.CANCELLED]:
-            # Cancel ticket
-            await request.app.state.mongodb.tickets.update_one(
-                {"payment_id": str(payment["_id"])},
-                {"$set": {"status": ModelTicketStatus.CANCELLED.value}}
-            )
-        
-        await request.app.state.mongodb.payments.update_one(
-            {"_id": payment["_id"]},
+        else:
+            unchanged.append(ModelPaymentStatus.COMPLETED.value)
+
+        # The payment moves first, guarded on its status, so a concurrent
+        # webhook or verify that already moved it is not counted twice; its
+        # tickets are settled only by the call that moved it
+        previous = await request.app.state.mongodb.payments.find_one_and_update(
+            {"_id": payment["_id"], "status": {"$nin": unchanged}},
             {"$set": update_data}
         )
+        if previous is not None:
+            kpi_aggregator.record_payment({**previous, **update_data}, previous_status=previous.get("status"))
+            if target in [ModelPaymentStatus.COMPLETED, ModelPaymentStatus.FAILED, ModelPaymentStatus.CANCELLED]:
+                await settle_payment_tickets(
+                    request.app.state.mongodb, [(payment, target == ModelPaymentStatus.COMPLETED)], datetime.utcnow()
+                )
+            current_status = target.value
+        else:
+            current = await request.app.state.mongodb.payments.find_one({"_id": payment["_id"]}, {"status": 1})
+            current_status = current["status"] if current else target.value
         
         return VerifyPaymentResponse(
             tx_ref=verify_request.tx_ref,
-            status=PaymentStatus(chapa_response["status"].value),
+            status=PaymentStatus(current_status),
             amount=chapa_response.get("amount", payment["amount"]),
             currency=chapa_response.get("currency", "ETB"),
             paid_at=chapa_response.get("paid_at"),
@@ -385,6 +401,21 @@ async def get_user_payments(
 
 
 # Ticket endpoints
+@router.get("/payments/reconciliation")
+async def get_payment_reconciliation_stats(
+    current_user: User = Depends(get_current_user)
+):
+    """Backlog and throughput of the background reconciliation of pending payments (control staff)"""
+
+    if current_user.role.value not in ["CONTROL_STAFF", "CONTROL_ADMIN"]:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="You don't have permission to view payment reconciliation"
+        )
+
+    return payment_reconciler.get_stats()
+
+
 @router.get("/tickets", response_model=List[TicketResponse])
 async def get_user_tickets(
     request: Request,
@@ -435,50 +466,94 @@ async def get_ticket(
     return transform_mongo_doc(ticket, TicketResponse)
 
 
-@router.get("/tickets/{ticket_id}/qr", response_model=TicketQRResponse)
-async def get_ticket_qr(
-    request: Request,
-    ticket_id: str,
-    current_user: User = Depends(get_current_user)
-):
-    """Get ticket QR code"""
-    
-    try:
-        
-        ticket_uuid = str(ticket_id)
-    except ValueError:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Invalid ticket ID format"
-        )
-    
-    ticket = await request.app.state.mongodb.tickets.find_one({
-        "_id": str(ticket_uuid),
-        "customer_id": current_user.id,
-        "status": ModelTicketStatus.ACTIVE.value
-    })
-    
+# Browsers and apps may keep a QR image this long; the ETag revalidates it after
+QR_CACHE_MAX_AGE_SECONDS = int(os.getenv("QR_CACHE_MAX_AGE_SECONDS", "86400"))
+
+
+async def _active_ticket_qr_payload(request: Request, ticket_id: str, current_user: User) -> Dict[str, Any]:
+    """The caller's active ticket, with its signed token and QR payload issued if missing"""
+
+    ticket = await request.app.state.mongodb.tickets.find_one(
+        {"_id": str(ticket_id), "customer_id": current_user.id, "status": ModelTicketStatus.ACTIVE.value},
+        {"ticket_number": 1, "ticket_type": 1, "valid_from": 1, "valid_until": 1, "signed_token": 1, "qr_code": 1}
+    )
+
     if not ticket:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Active ticket not found"
         )
-    
-    if not ticket.get("qr_code"):
-        # Generate QR code if not exists
-        qr_code = chapa_service.generate_qr_code(ticket["ticket_number"])
+
+    # Tickets activated before signing, or still holding a rendered base64 image
+    if not ticket.get("signed_token") or not (ticket.get("qr_code") or "").startswith(QR_PAYLOAD_PREFIX):
+        qr_fields = ticket_qr_fields(ticket, f"{current_user.first_name} {current_user.last_name}")
         await request.app.state.mongodb.tickets.update_one(
-            {"_id": str(ticket_uuid)},
-            {"$set": {"qr_code": qr_code}}
+            {"_id": str(ticket_id)},
+            {"$set": qr_fields}
         )
-        ticket["qr_code"] = qr_code
-    
+        ticket.update(qr_fields)
+
+    return ticket
+
+
+def _qr_cache_headers(key: str) -> Dict[str, str]:
+    return {"ETag": f'"{key}"', "Cache-Control": f"private, max-age={QR_CACHE_MAX_AGE_SECONDS}"}
+
+
+def _not_modified(request: Request, key: str) -> Optional[Response]:
+    if_none_match = request.headers.get("if-none-match", "")
+    if f'"{key}"' in if_none_match or if_none_match.strip() == "*":
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=_qr_cache_headers(key))
+    return None
+
+
+@router.get("/tickets/{ticket_id}/qr", response_model=TicketQRResponse)
+async def get_ticket_qr(
+    request: Request,
+    response: Response,
+    ticket_id: str,
+    current_user: User = Depends(get_current_user)
+):
+    """Get ticket QR code"""
+
+    ticket = await _active_ticket_qr_payload(request, ticket_id, current_user)
+
+    # The payload determines the whole response, so its hash is a strong ETag
+    key = payload_key(ticket["qr_code"])
+    not_modified = _not_modified(request, key)
+    if not_modified:
+        return not_modified
+
+    _, image = await qr_image_cache.get(ticket["qr_code"])
+    response.headers.update(_qr_cache_headers(key))
+
     return TicketQRResponse(
         ticket_number=ticket["ticket_number"],
-        qr_code=ticket["qr_code"]
+        qr_code=base64.b64encode(image).decode(),
+        signed_token=ticket["signed_token"],
+        qr_image_url=str(request.url_for("get_ticket_qr_image", ticket_id=ticket_id))
     )
 
 
+@router.get("/tickets/{ticket_id}/qr.png")
+async def get_ticket_qr_image(
+    request: Request,
+    ticket_id: str,
+    current_user: User = Depends(get_current_user)
+):
+    """Get ticket QR code as a PNG image"""
+
+    ticket = await _active_ticket_qr_payload(request, ticket_id, current_user)
+
+    key = payload_key(ticket["qr_code"])
+    not_modified = _not_modified(request, key)
+    if not_modified:
+        return not_modified
+
+    _, image = await qr_image_cache.get(ticket["qr_code"])
+    return Response(content=image, media_type="image/png", headers=_qr_cache_headers(key))
+
+
 @router.post("/tickets/validate", response_model=ValidateTicketResponse)
 async def validate_ticket(
     request: Request,
@@ -494,11 +569,16 @@ async def validate_ticket(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="You don't have permission to validate tickets"
         )
-    
-    ticket = await request.app.state.mongodb.tickets.find_one({
-        "ticket_number": validate_request.ticket_number
-    })
-    
+
+    if validate_request.token:
+        return _validate_signed_ticket(validate_request, validate_request.token)
+
+    # One conditional update redeems the ticket; concurrent scans cannot both succeed
+    result = await redeem_ticket(
+        request.app.state.mongodb, validate_request.ticket_number, validate_request.trip_id
+    )
+    ticket = result["ticket"]
+
     if not ticket:
         return ValidateTicketResponse(
             ticket_number=validate_request.ticket_number,
@@ -507,60 +587,120 @@ async def validate_ticket(
             customer_name="Unknown",
             ticket_type=TicketType.SINGLE_TRIP,
             valid_until=datetime.utcnow(),
-            message="Ticket not found"
-        )
-    
-    # Get customer info
-    customer = await request.app.state.mongodb.users.find_one({"_id": ticket["customer_id"]})
-    customer_name = f"{customer['first_name']} {customer['last_name']}" if customer else "Unknown"
-    
-    # Check ticket validity
-    is_valid = False
-    message = ""
-    
-    if ticket["status"] == ModelTicketStatus.USED.value:
-        message = "Ticket has already been used"
-    elif ticket["status"] == ModelTicketStatus.CANCELLED.value:
-        message = "Ticket has been cancelled"
-    elif ticket["status"] == ModelTicketStatus.EXPIRED.value:
-        message = "Ticket has expired"
-    elif ticket["valid_until"] < datetime.utcnow():
-        message = "Ticket has expired"
-        # Update ticket status
-        await request.app.state.mongodb.tickets.update_one(
-            {"_id": ticket["_id"]},
-            {"$set": {"status": ModelTicketStatus.EXPIRED.value}}
+            message=result["message"]
         )
-    elif ticket["status"] == ModelTicketStatus.ACTIVE.value:
-        is_valid = True
-        message = "Ticket is valid"
-        
-        # Mark ticket as used
-        update_data = {
-            "status": ModelTicketStatus.USED.value,
-            "used_at": datetime.utcnow(),
-            "updated_at": datetime.utcnow()
-        }
-        
-        if validate_request.trip_id:
-            update_data["used_trip_id"] = validate_request.trip_id
-        
-        await request.app.state.mongodb.tickets.update_one(
-            {"_id": ticket["_id"]},
-            {"$set": update_data}
+
+    customer_name = ticket.get("customer_name")
+    if not customer_name:
+        # Tickets issued before the name was denormalized onto them
+        customer = await request.app.state.mongodb.users.find_one(
+            {"_id": ticket["customer_id"]}, {"first_name": 1, "last_name": 1}
         )
-    
+        customer_name = f"{customer['first_name']} {customer['last_name']}" if customer else "Unknown"
+
     return ValidateTicketResponse(
         ticket_number=validate_request.ticket_number,
-        is_valid=is_valid,
+        is_valid=result["is_valid"],
         status=TicketStatus(ticket["status"]),
         customer_name=customer_name,
         ticket_type=TicketType(ticket["ticket_type"]),
         valid_until=ticket["valid_until"],
-        message=message
+        message=result["message"]
     )
 
 
+def _validate_signed_ticket(validate_request: ValidateTicketRequest, token: str) -> ValidateTicketResponse:
+    """Validate a signed QR token against the in-memory ticket ledger, without database round trips"""
+
+    try:
+        claims = verify_ticket_token(token)
+    except InvalidTicketToken as e:
+        return ValidateTicketResponse(
+            ticket_number=validate_request.ticket_number,
+            is_valid=False,
+            status=TicketStatus.CANCELLED,
+            customer_name="Unknown",
+            ticket_type=TicketType.SINGLE_TRIP,
+            valid_until=datetime.utcnow(),
+            message=str(e)
+        )
+
+    reason: Optional[str]
+    if claims.ticket_number != validate_request.ticket_number:
+        reason = "Ticket token does not match ticket number"
+    else:
+        reason = ticket_ledger.redeem(claims, validate_request.trip_id)
+
+    # Like the database path, a successful scan reports the redeemed ticket
+    ticket_status = ticket_ledger.status_of(claims.ticket_number) or (
+        ModelTicketStatus.EXPIRED.value if reason == "Ticket has expired" else ModelTicketStatus.ACTIVE.value
+    )
+
+    return ValidateTicketResponse(
+        ticket_number=validate_request.ticket_number,
+        is_valid=reason is None,
+        status=TicketStatus(ticket_status),
+        customer_name=claims.initials or "Unknown",
+        ticket_type=TicketType(claims.ticket_type.value),
+        valid_until=datetime.utcfromtimestamp(claims.valid_until),
+        message=reason or "Ticket is valid"
+    )
+
+
+@router.post("/tickets/validate/batch", response_model=BatchValidateTicketsResponse)
+async def validate_tickets_batch(
+    request: Request,
+    batch_request: BatchValidateTicketsRequest,
+    current_user: User = Depends(get_current_user)
+):
+    """Sync scans a validator recorded offline; the earliest scan of each ticket wins"""
+
+    allowed_roles = ["BUS_DRIVER", "QUEUE_REGULATOR", "CONTROL_STAFF"]
+    if current_user.role.value not in allowed_roles:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="You don't have permission to validate tickets"
+        )
+
+    db = request.app.state.mongodb
+    scans = batch_request.scans
+    # One $in read and one bulk write for the whole batch
+    verdicts = await redeem_scans(db, [scan.model_dump() for scan in scans])
+
+    # Tickets issued before the name was denormalized onto them, looked up together
+    legacy_ids = {
+        v["ticket"]["customer_id"] for v in verdicts if v["ticket"] and not v["ticket"].get("customer_name")
+    }
+    names = {}
+    if legacy_ids:
+        async for customer in db.users.find({"_id": {"$in": list(legacy_ids)}}, {"first_name": 1, "last_name": 1}):
+            names[customer["_id"]] = f"{customer['first_name']} {customer['last_name']}"
+
+    results = []
+    for scan, verdict in zip(scans, verdicts):
+        ticket = verdict["ticket"] or {
+            "status": TicketStatus.CANCELLED, "ticket_type": TicketType.SINGLE_TRIP,
+            "valid_until": verdict["scanned_at"], "customer_id": None
+        }
+        results.append(ScanVerdict(
+            ticket_number=scan.ticket_number,
+            is_valid=verdict["is_valid"],
+            status=TicketStatus(ticket["status"]),
+            customer_name=ticket.get("customer_name") or names.get(ticket["customer_id"], "Unknown"),
+            ticket_type=TicketType(ticket["ticket_type"]),
+            valid_until=ticket["valid_until"],
+            message=verdict["message"],
+            scanned_at=verdict["scanned_at"],
+            trip_id=scan.trip_id,
+            bus_id=scan.bus_id,
+            scan_id=scan.scan_id
+        ))
+
+    accepted = sum(result.is_valid for result in results)
+    logger.info(f"Synced {len(results)} offline ticket scans: {accepted} accepted")
+    return BatchValidateTicketsResponse(results=results, accepted=accepted, rejected=len(results) - accepted)
+
+
 # Payment Methods Management
 @router.get("/payment-methods", response_model=List[PaymentMethodResponse])
 async def get_payment_methods(
@@ -671,133 +811,49 @@ async def chapa_webhook(
     request: Request,
     webhook_signature: Optional[str] = Header(None, alias="x-chapa-signature")
 ):
-    """Handle Chapa webhook events"""
-    
+    """
+    Record a Chapa webhook event for background processing.
+
+    The event is verified and stored under a unique (tx_ref, event) key;
+    payments and tickets are updated by the webhook workers. Redeliveries of
+    a recorded event are acknowledged without doing anything.
+    """
+    body = await request.body()
+    payload = body.decode()
+
+    # Validate webhook signature
+    if webhook_signature and not chapa_service.validate_webhook_signature(payload, webhook_signature):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid webhook signature"
+        )
+
     try:
-        body = await request.body()
-        payload = body.decode()
-        
-        # Validate webhook signature
-        if webhook_signature and not chapa_service.validate_webhook_signature(payload, webhook_signature):
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Invalid webhook signature"
-            )
-        
-        webhook_data = json.loads(payload)
-        event = ChapaWebhookEvent(**webhook_data)
-        
-        logger.info(f"Received Chapa webhook: {event.event}")
-        
-        # Process webhook event
-        if event.event == "payment.success":
-            await _handle_payment_success(request, event.data)
-        elif event.event == "payment.failed":
-            await _handle_payment_failed(request, event.data)
-        elif event.event == "payment.cancelled":
-            await _handle_payment_cancelled(request, event.data)
-        
-        return PaymentCallbackResponse(
-            success=True,
-            message="Webhook processed successfully"
+        event = ChapaWebhookEvent(**json.loads(payload))
+    except (ValueError, TypeError) as e:
+        logger.warning(f"Rejected malformed Chapa webhook: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid webhook payload"
+        )
+
+    if not event.data.get("tx_ref"):
+        return PaymentCallbackResponse(success=True, message="Webhook ignored: no tx_ref")
+
+    try:
+        queued = await payment_webhook_processor.enqueue(
+            request.app.state.mongodb, event.event, event.data, payload, event.timestamp
         )
-        
     except Exception as e:
-        logger.error(f"Webhook processing failed: {str(e)}")
+        # Not recorded: let Chapa redeliver
+        logger.error(f"Failed to record Chapa webhook: {str(e)}")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Webhook processing failed"
         )
 
-
-async def _handle_payment_success(request: Request, payment_data: Dict[str, Any]):
-    """Handle successful payment webhook"""
-    
-    tx_ref = payment_data.get("tx_ref")
-    if not tx_ref:
-        return
-    
-    # Update payment status
-    await request.app.state.mongodb.payments.update_one(
-        {"tx_ref": tx_ref},
-        {"$set": {
-            "status": ModelPaymentStatus.COMPLETED.value,
-            "paid_at": datetime.utcnow(),
-            "chapa_response": payment_data,
-            "updated_at": datetime.utcnow()
-        }}
-    )
-    
-    # Activate ticket
-    payment = await request.app.state.mongodb.payments.find_one({"tx_ref": tx_ref})
-    if payment:
-        ticket = await request.app.state.mongodb.tickets.find_one({"payment_id": str(payment["_id"])})
-        if ticket:
-            qr_code = chapa_service.generate_qr_code(ticket["ticket_number"])
-            await request.app.state.mongodb.tickets.update_one(
-                {"_id": ticket["_id"]},
-                {"$set": {
-                    "status": ModelTicketStatus.ACTIVE.value,
-                    "qr_code": qr_code,
-                    "updated_at": datetime.utcnow()
-                }}
-            )
-
-
-async def _handle_payment_failed(request: Request, payment_data: Dict[str, Any]):
-    """Handle failed payment webhook"""
-    
-    tx_ref = payment_data.get("tx_ref")
-    if not tx_ref:
-        return
-    
-    # Update payment status
-    await request.app.state.mongodb.payments.update_one(
-        {"tx_ref": tx_ref},
-        {"$set": {
-            "status": ModelPaymentStatus.FAILED.value,
-            "failed_reason": payment_data.get("message", "Payment failed"),
-            "chapa_response": payment_data,
-            "updated_at": datetime.utcnow()
-        }}
-    )
-    
-    # Cancel ticket
-    payment = await request.app.state.mongodb.payments.find_one({"tx_ref": tx_ref})
-    if payment:
-        await request.app.state.mongodb.tickets.update_one(
-            {"payment_id": str(payment["_id"])},
-            {"$set": {
-                "status": ModelTicketStatus.CANCELLED.value,
-                "updated_at": datetime.utcnow()
-            }}
-        )
-
-
-async def _handle_payment_cancelled(request: Request, payment_data: Dict[str, Any]):
-    """Handle cancelled payment webhook"""
-    
-    tx_ref = payment_data.get("tx_ref")
-    if not tx_ref:
-        return
-    
-    # Update payment status
-    await request.app.state.mongodb.payments.update_one(
-        {"tx_ref": tx_ref},
-        {"$set": {
-            "status": ModelPaymentStatus.CANCELLED.value,
-            "chapa_response": payment_data,
-            "updated_at": datetime.utcnow()
-        }}
+    logger.info(f"Received Chapa webhook: {event.event} ({'queued' if queued else 'duplicate'})")
+    return PaymentCallbackResponse(
+        success=True,
+        message="Webhook queued for processing" if queued else "Duplicate webhook ignored"
     )
-    
-    # Cancel ticket
-    payment = await request.app.state.mongodb.payments.find_one({"tx_ref": tx_ref})
-    if payment:
-        await request.app.state.mongodb.tickets.update_one(
-            {"payment_id": str(payment["_id"])},
-            {"$set": {
-                "status": ModelTicketStatus.CANCELLED.value,
-                "updated_at": datetime.utcnow()
-            }}
-        )
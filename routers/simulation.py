@@ -4,9 +4,10 @@ Bus Simulation API Router
 Provides endpoints for monitoring and controlling the bus simulation service.
 """
 
+from datetime import datetime
 from fastapi import APIRouter, Request, HTTPException, status, Depends
-from typing import Dict, Any
-from pydantic import BaseModel
+from typing import Dict, Any, Optional
+from pydantic import BaseModel, Field
 
 from core.dependencies import get_current_user
 from models.user import User, UserRole
@@ -17,6 +18,30 @@ class BaseResponse(BaseModel):
     status: str
     message: str
 
+
+class ReplayRequest(BaseModel):
+    """Settings for a seeded, time-compressed simulation run."""
+    seed: int = Field(..., description="Seed for all simulation randomness")
+    time_scale: float = Field(60.0, gt=0, le=3600, description="Simulated seconds per wall-clock second")
+    start_time: Optional[datetime] = Field(None, description="Simulated start time (defaults to today 00:00 UTC)")
+    duration_seconds: Optional[float] = Field(86400, gt=0, description="Simulated duration; omit to run until stopped")
+
+
+
+class PassengerPopulationRequest(BaseModel):
+    """Settings for a virtual passenger population."""
+    count: int = Field(..., gt=0, le=100000, description="Number of virtual passengers")
+    update_interval_seconds: Optional[float] = Field(None, gt=0, description="Seconds between location updates per passenger")
+    stop_count: int = Field(200, gt=0, description="Number of stops from data/stops.txt to populate")
+    seed: Optional[int] = Field(None, description="Seed for passenger placement")
+
+
+
+class ShardRequest(BaseModel):
+    """Settings for running the simulation in worker processes."""
+    shard_count: int = Field(..., ge=1, le=64, description="Number of simulation worker processes")
+
+
 router = APIRouter(prefix="/simulation", tags=["simulation"])
 
 
@@ -181,6 +206,315 @@ async def start_simulation(
         )
 
 
+@router.post("/replay", response_model=BaseResponse)
+async def start_simulation_replay(
+    replay_request: ReplayRequest,
+    request: Request,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Restart the simulation in deterministic replay mode.
+    
+    Runs with the same seed produce the same position stream, played back
+    ``time_scale`` times faster than real time. Replayed positions are written
+    to ``simulation_replay_buses`` and broadcast to ``simulation_replay:``
+    rooms, so live tracking is untouched.
+    
+    Requires: Control admin access
+    """
+    if current_user.role != UserRole.CONTROL_ADMIN:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Only control center admins can replay simulation"
+        )
+    
+    if not hasattr(request.app.state, 'bus_simulation'):
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Bus simulation service not available"
+        )
+    
+    simulation_service = request.app.state.bus_simulation
+    if not simulation_service.enabled:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Bus simulation is disabled"
+        )
+    if simulation_service.shard_count > 0:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Stop the simulation shards before starting a replay"
+        )
+    
+    try:
+        await simulation_service.start_replay(
+            seed=replay_request.seed,
+            time_scale=replay_request.time_scale,
+            start_time=replay_request.start_time,
+            duration_seconds=replay_request.duration_seconds
+        )
+        
+        return BaseResponse(
+            status="success",
+            message=f"Bus simulation replay started with seed {replay_request.seed} at {replay_request.time_scale}x"
+        )
+        
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to start simulation replay: {str(e)}"
+        )
+
+
+@router.delete("/replay", response_model=BaseResponse)
+async def stop_simulation_replay(
+    request: Request,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Leave replay mode and resume the live simulation.
+    
+    Requires: Control admin access
+    """
+    if current_user.role != UserRole.CONTROL_ADMIN:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Only control center admins can replay simulation"
+        )
+    
+    if not hasattr(request.app.state, 'bus_simulation'):
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Bus simulation service not available"
+        )
+    
+    try:
+        await request.app.state.bus_simulation.stop_replay()
+        
+        return BaseResponse(
+            status="success",
+            message="Bus simulation returned to real time"
+        )
+        
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to stop simulation replay: {str(e)}"
+        )
+
+
+@router.post("/passengers", response_model=BaseResponse)
+async def start_passenger_population(
+    population_request: PassengerPopulationRequest,
+    request: Request,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Spawn virtual passengers for proximity load tests.
+    
+    Passengers wait at stops, stream location updates and hold WebSocket
+    subscriptions; latency and cost metrics appear under ``passengers`` in
+    the simulation status.
+    
+    Requires: Control admin access
+    """
+    if current_user.role != UserRole.CONTROL_ADMIN:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Only control center admins can spawn simulated passengers"
+        )
+    
+    if not hasattr(request.app.state, 'bus_simulation'):
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Bus simulation service not available"
+        )
+    
+    simulation_service = request.app.state.bus_simulation
+    if not simulation_service.is_running:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Bus simulation must be running to spawn passengers"
+        )
+    
+    try:
+        await simulation_service.start_passengers(
+            count=population_request.count,
+            update_interval=population_request.update_interval_seconds,
+            stop_count=population_request.stop_count,
+            seed=population_request.seed
+        )
+        
+        return BaseResponse(
+            status="success",
+            message=f"Spawned {population_request.count} simulated passengers"
+        )
+        
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to spawn simulated passengers: {str(e)}"
+        )
+
+
+@router.delete("/passengers", response_model=BaseResponse)
+async def stop_passenger_population(
+    request: Request,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Disconnect and remove the virtual passengers.
+    
+    Requires: Control admin access
+    """
+    if current_user.role != UserRole.CONTROL_ADMIN:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Only control center admins can remove simulated passengers"
+        )
+    
+    if not hasattr(request.app.state, 'bus_simulation'):
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Bus simulation service not available"
+        )
+    
+    try:
+        await request.app.state.bus_simulation.stop_passengers()
+        
+        return BaseResponse(
+            status="success",
+            message="Simulated passengers removed"
+        )
+        
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to remove simulated passengers: {str(e)}"
+        )
+
+
+@router.get("/shards", response_model=Dict[str, Any])
+async def get_simulation_shards(
+    request: Request,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Get the status of the simulation worker processes.
+    
+    Requires: Control staff or admin access
+    """
+    if current_user.role not in [UserRole.CONTROL_STAFF, UserRole.CONTROL_ADMIN]:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Only control center staff can access simulation status"
+        )
+    
+    if not hasattr(request.app.state, 'bus_simulation'):
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Bus simulation service not available"
+        )
+    
+    supervisor = request.app.state.bus_simulation.shard_supervisor
+    return {
+        "status": "success",
+        "sharding": supervisor.get_status() if supervisor else {"is_running": False, "shard_count": 0},
+        "message": "Simulation shard status retrieved successfully"
+    }
+
+
+@router.post("/shards", response_model=BaseResponse)
+async def start_simulation_shards(
+    shard_request: ShardRequest,
+    request: Request,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Restart the simulation in separate worker processes.
+    
+    Each shard owns a disjoint set of routes, persists its own positions and
+    streams them to this process for broadcasting.
+    
+    Requires: Control admin access
+    """
+    if current_user.role != UserRole.CONTROL_ADMIN:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Only control center admins can shard simulation"
+        )
+    
+    if not hasattr(request.app.state, 'bus_simulation'):
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Bus simulation service not available"
+        )
+    
+    if request.app.state.bus_simulation.replay_config:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Stop the simulation replay before starting shards"
+        )
+    
+    try:
+        await request.app.state.bus_simulation.start_shards(shard_request.shard_count)
+        
+        return BaseResponse(
+            status="success",
+            message=f"Bus simulation started in {shard_request.shard_count} worker processes"
+        )
+        
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to start simulation shards: {str(e)}"
+        )
+
+
+@router.delete("/shards", response_model=BaseResponse)
+async def stop_simulation_shards(
+    request: Request,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Stop the simulation worker processes.
+    
+    Use ``POST /simulation/start`` to resume in-process simulation.
+    
+    Requires: Control admin access
+    """
+    if current_user.role != UserRole.CONTROL_ADMIN:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Only control center admins can shard simulation"
+        )
+    
+    if not hasattr(request.app.state, 'bus_simulation'):
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Bus simulation service not available"
+        )
+    
+    try:
+        await request.app.state.bus_simulation.stop_shards()
+        
+        return BaseResponse(
+            status="success",
+            message="Bus simulation shards stopped"
+        )
+        
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to stop simulation shards: {str(e)}"
+        )
+
+
 @router.get("/health")
 async def simulation_health_check(request: Request):
     """
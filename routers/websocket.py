@@ -1,13 +1,16 @@
 """
 WebSocket endpoints for real-time communication
 """
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends, HTTPException, Query
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends, HTTPException, Query, status
 from pydantic import BaseModel
 from typing import Dict, Any, List, Optional
 import json
 from core.websocket_manager import websocket_manager
+from core.realtime.notification_outbox import notification_outbox
+from core.realtime.proximity_alerts import proximity_alert_tracker
 from core.dependencies import get_current_user, get_current_user_websocket
 from core.logger import get_logger
+from models.user import User, UserRole
 
 logger = get_logger(__name__)
 router = APIRouter(prefix="/ws", tags=["websocket"])
@@ -61,7 +64,7 @@ async def websocket_endpoint(websocket: WebSocket, token: str = Query(...)):
         user_id = str(user.id)
         
         # Connect user
-        connection_id = await websocket_manager.connect_user(websocket, user_id)
+        connection_id = await websocket_manager.connect_user(websocket, user_id, user.role)
         
         # Send authentication success
         await websocket.send_text(json.dumps({
@@ -72,6 +75,12 @@ async def websocket_endpoint(websocket: WebSocket, token: str = Query(...)):
         }))
         
         logger.info(f"WebSocket user {user.email} authenticated successfully")
+
+        # Notifications an interrupted run stored but never sent
+        try:
+            await notification_outbox.redeliver(user_id)
+        except Exception as e:
+            logger.error(f"Failed to redeliver pending notifications to user {user_id}: {e}")
         
         # Listen for messages
         while True:
@@ -260,6 +269,26 @@ async def get_websocket_status():
     }
 
 
+@router.get("/stats")
+async def websocket_stats(current_user: User = Depends(get_current_user)):
+    """
+    Get connection, room, notification subscription, outbox and proximity alert statistics
+
+    Requires: Control staff or admin access
+    """
+    if current_user.role not in [UserRole.CONTROL_STAFF, UserRole.CONTROL_ADMIN]:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Only control center staff can access WebSocket statistics"
+        )
+
+    return {
+        **websocket_manager.get_stats(),
+        "notification_outbox": notification_outbox.get_stats(),
+        "proximity_alerts": proximity_alert_tracker.get_stats()
+    }
+
+
 @router.get("/info")
 async def websocket_info():
     """Get WebSocket connection information"""
@@ -37,6 +37,7 @@ from .payment import (
     InitiatePaymentResponse, AuthorizePaymentResponse, VerifyPaymentResponse, PaymentResponse,
     CreateTicketRequest, TicketResponse, TicketQRResponse,
     ValidateTicketRequest, ValidateTicketResponse,
+    ValidateTicketScan, BatchValidateTicketsRequest, ScanVerdict, BatchValidateTicketsResponse,
     CreatePaymentMethodRequest, UpdatePaymentMethodRequest, PaymentMethodResponse,
     ChapaWebhookEvent, PaymentCallbackResponse
 )
@@ -74,7 +75,9 @@ __all__ = [
     "InitiatePaymentRequest", "AuthorizePaymentRequest", "VerifyPaymentRequest",
     "InitiatePaymentResponse", "AuthorizePaymentResponse", "VerifyPaymentResponse", "PaymentResponse",
     "CreateTicketRequest", "TicketResponse", "TicketQRResponse",
-    "ValidateTicketRequest", "ValidateTicketResponse",    "CreatePaymentMethodRequest", "UpdatePaymentMethodRequest", "PaymentMethodResponse",
+    "ValidateTicketRequest", "ValidateTicketResponse",
+    "ValidateTicketScan", "BatchValidateTicketsRequest", "ScanVerdict", "BatchValidateTicketsResponse",
+    "CreatePaymentMethodRequest", "UpdatePaymentMethodRequest", "PaymentMethodResponse",
     "ChapaWebhookEvent", "PaymentCallbackResponse", "RegisterPersonnelRequest", "RegisterControlStaffRequest",
     "ApprovalStatus", "ApprovalRequestRequest", "ApprovalActionRequest", "ApprovalRequestResponse",
     "ReallocationReason", "ReallocationStatus", "OvercrowdingSeverity",
@@ -18,6 +18,7 @@ class NotificationType(str, Enum):
     REALLOCATION_REQUEST_DISCARDED = "REALLOCATION_REQUEST_DISCARDED"
     INCIDENT_REPORTED = "INCIDENT_REPORTED"
     CHAT_MESSAGE = "CHAT_MESSAGE"
+    BUNCHING = "BUNCHING"
 
 class BroadcastNotificationRequest(BaseModel):
     title: str
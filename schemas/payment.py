@@ -1,5 +1,5 @@
 from typing import Optional, List, Dict, Any
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, EmailStr, Field
 from datetime import datetime
 from enum import Enum
 from .base import DateTimeModelMixin
@@ -112,6 +112,20 @@ class CreateTicketRequest(BaseModel):
 class ValidateTicketRequest(BaseModel):
     ticket_number: str
     trip_id: Optional[str] = None
+    token: Optional[str] = None  # signed token from the QR; validated without a database lookup
+
+
+class ValidateTicketScan(ValidateTicketRequest):
+    """A scan recorded by a validator while offline, synced later."""
+    scanned_at: datetime
+    bus_id: Optional[str] = None
+    # Together identify the scan, so uploading a batch again is harmless
+    device_id: Optional[str] = None
+    scan_id: Optional[str] = None
+
+
+class BatchValidateTicketsRequest(BaseModel):
+    scans: List[ValidateTicketScan] = Field(..., min_length=1, max_length=1000)
 
 
 # Ticket Responses
@@ -119,6 +133,7 @@ class TicketResponse(DateTimeModelMixin):
     id: str
     ticket_number: str
     customer_id: str
+    customer_name: Optional[str] = None
     payment_id: str
     ticket_type: TicketType
     origin_stop_id: Optional[str] = None
@@ -137,6 +152,7 @@ class TicketResponse(DateTimeModelMixin):
 class TicketQRResponse(BaseModel):
     ticket_number: str
     qr_code: str
+    signed_token: Optional[str] = None
     qr_image_url: Optional[str] = None
 
 
@@ -150,6 +166,19 @@ class ValidateTicketResponse(BaseModel):
     message: str
 
 
+class ScanVerdict(ValidateTicketResponse):
+    scanned_at: datetime
+    trip_id: Optional[str] = None
+    bus_id: Optional[str] = None
+    scan_id: Optional[str] = None
+
+
+class BatchValidateTicketsResponse(BaseModel):
+    results: List[ScanVerdict]  # in the order the scans were sent
+    accepted: int
+    rejected: int
+
+
 # Payment Method Requests
 class CreatePaymentMethodRequest(BaseModel):
     method: PaymentMethod
@@ -0,0 +1,178 @@
+"""
+Analytics Pipeline Benchmark
+
+Loads a synthetic dataset (1M trips by default, plus payments and feedback)
+into a scratch database and times the dashboard summary and 7-day trend
+queries two ways:
+- the previous approach: load the documents and count/sum them in Python
+- the server-side aggregation pipelines in core/analytics_pipelines.py
+
+Both results are compared so the benchmark doubles as a parity check.
+
+Usage:
+    python scripts/utilities/benchmark_analytics_pipelines.py --trips 1000000
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict
+
+# Add project root to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from core.analytics_pipelines import (
+    aggregate_one, aggregate_daily, trip_stats_pipeline, rating_stats_pipeline,
+    revenue_pipeline, daily_totals_pipeline
+)
+
+BATCH_SIZE = 10000
+
+
+async def load_dataset(db, trips: int, days: int, seed: int):
+    """Insert synthetic trips, payments and feedback spread over ``days``."""
+    rng = random.Random(seed)
+    now = datetime.utcnow()
+    span_minutes = days * 24 * 60
+
+    def created_at():
+        return now - timedelta(minutes=rng.randint(0, span_minutes))
+
+    for name in ("trips", "payments", "feedback"):
+        await db[name].drop()
+        await db[name].create_index("created_at")
+
+    started = time.perf_counter()
+    for offset in range(0, trips, BATCH_SIZE):
+        count = min(BATCH_SIZE, trips - offset)
+        await db.trips.insert_many([
+            {
+                "route_id": f"route-{rng.randint(0, 199)}",
+                "status": rng.choice(["COMPLETED", "COMPLETED", "IN_PROGRESS", "SCHEDULED"]),
+                "delay_minutes": rng.choice([0, 0, 2, 5, 8, 12, 20]),
+                "created_at": created_at()
+            }
+            for _ in range(count)
+        ], ordered=False)
+        await db.payments.insert_many([
+            {
+                "amount": rng.choice([10.0, 15.0, 25.0]),
+                "status": rng.choice(["COMPLETED", "COMPLETED", "PENDING", "FAILED"]),
+                "created_at": created_at()
+            }
+            for _ in range(count // 2)
+        ], ordered=False)
+        await db.feedback.insert_many([
+            {"rating": rng.choice([None, 1, 2, 3, 4, 5]), "created_at": created_at()}
+            for _ in range(count // 10)
+        ], ordered=False)
+    print(f"Loaded {trips:,} trips in {time.perf_counter() - started:.1f}s")
+
+
+async def python_summary(db, today):
+    trips = await db.trips.find({"created_at": {"$gte": today}}).to_list(length=None)
+    delays = [t.get("delay_minutes", 0) for t in trips if t.get("delay_minutes")]
+    feedback = await db.feedback.find({"created_at": {"$gte": today}}).to_list(length=None)
+    ratings = [f.get("rating", 0) for f in feedback if f.get("rating")]
+    payments = await db.payments.find({"created_at": {"$gte": today}, "status": "COMPLETED"}).to_list(length=None)
+    return {
+        "trips": len(trips),
+        "completed": len([t for t in trips if t.get("status") == "COMPLETED"]),
+        "average_delay": round(sum(delays) / len(delays), 4) if delays else 0.0,
+        "satisfaction": round(sum(ratings) / len(ratings), 4) if ratings else 0.0,
+        "revenue": sum(p.get("amount", 0) for p in payments)
+    }
+
+
+async def pipeline_summary(db, today):
+    trip_stats = await aggregate_one(db.trips, trip_stats_pipeline(today))
+    rating_stats = await aggregate_one(db.feedback, rating_stats_pipeline(today))
+    revenue = await aggregate_one(db.payments, revenue_pipeline(today))
+    delay_count = trip_stats.get("delay_count", 0)
+    rating_count = rating_stats.get("rating_count", 0)
+    return {
+        "trips": trip_stats.get("total", 0),
+        "completed": trip_stats.get("completed", 0),
+        "average_delay": round(trip_stats.get("delay_sum", 0) / delay_count, 4) if delay_count else 0.0,
+        "satisfaction": round(rating_stats.get("rating_sum", 0) / rating_count, 4) if rating_count else 0.0,
+        "revenue": revenue.get("revenue", 0)
+    }
+
+
+async def python_trends(db, week_ago):
+    trips, revenue = [], []
+    for i in range(7):
+        day_start = week_ago + timedelta(days=i)
+        day_end = day_start + timedelta(days=1)
+        trips.append(await db.trips.count_documents({"created_at": {"$gte": day_start, "$lt": day_end}}))
+        payments = await db.payments.find({
+            "created_at": {"$gte": day_start, "$lt": day_end},
+            "status": "COMPLETED"
+        }).to_list(length=None)
+        revenue.append(sum(p.get("amount", 0) for p in payments))
+    return {"trips": trips, "revenue": revenue}
+
+
+async def pipeline_trends(db, week_ago):
+    trip_days = await aggregate_daily(db.trips, daily_totals_pipeline(week_ago, 7), 7)
+    revenue_days = await aggregate_daily(
+        db.payments, daily_totals_pipeline(week_ago, 7, match={"status": "COMPLETED"}, value="amount"), 7
+    )
+    return {"trips": [d["count"] for d in trip_days], "revenue": [d["total"] for d in revenue_days]}
+
+
+async def timed(label, function, *args, repeat: int = 3):
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = await function(*args)
+        best = min(best, time.perf_counter() - started)
+    print(f"  {label:<10} {best * 1000:10.1f} ms")
+    return result, best
+
+
+async def run(args):
+    client: AsyncIOMotorClient[Dict[str, Any]] = AsyncIOMotorClient(args.mongodb_url)
+    db = client[args.database]
+    try:
+        if not args.skip_load:
+            await load_dataset(db, args.trips, args.days, args.seed)
+
+        now = datetime.now(timezone.utc)
+        today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        week_ago = now - timedelta(days=7)
+
+        print("Summary (today):")
+        python_result, python_time = await timed("python", python_summary, db, today, repeat=args.repeat)
+        pipeline_result, pipeline_time = await timed("pipeline", pipeline_summary, db, today, repeat=args.repeat)
+        print(f"  speedup    {python_time / pipeline_time:10.1f}x  parity={python_result == pipeline_result}")
+
+        print("Performance trends (7 days):")
+        python_result, python_time = await timed("python", python_trends, db, week_ago, repeat=args.repeat)
+        pipeline_result, pipeline_time = await timed("pipeline", pipeline_trends, db, week_ago, repeat=args.repeat)
+        print(f"  speedup    {python_time / pipeline_time:10.1f}x  parity={python_result == pipeline_result}")
+    finally:
+        if not args.keep:
+            await client.drop_database(args.database)
+        client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark analytics aggregation pipelines")
+    parser.add_argument("--mongodb-url", default=os.getenv("MONGODB_URL", "mongodb://localhost:27017"))
+    parser.add_argument("--database", default="guzosync_benchmark", help="Scratch database (dropped afterwards)")
+    parser.add_argument("--trips", type=int, default=1000000)
+    parser.add_argument("--days", type=int, default=30, help="Spread documents over this many days")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--skip-load", action="store_true", help="Reuse an existing benchmark dataset")
+    parser.add_argument("--keep", action="store_true", help="Keep the scratch database")
+
+    asyncio.run(run(parser.parse_args()))
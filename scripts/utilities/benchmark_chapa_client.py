@@ -0,0 +1,101 @@
+"""
+Chapa Client Event-Loop Blocking Benchmark
+
+Runs concurrent payment verifications against the local Chapa stub (with
+simulated gateway latency) two ways and measures how long the event loop
+was stalled while they ran:
+- legacy: blocking ``requests.get`` called from a coroutine, as the service
+  did before it moved to a pooled async client
+- async: ChapaPaymentService.verify_payment on the shared httpx.AsyncClient
+
+A monitor task sleeps in short intervals; any time it wakes up late is time
+the loop could not serve other requests.
+
+Usage:
+    python scripts/utilities/benchmark_chapa_client.py --payments 50 --latency 0.2
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+from typing import List
+
+# Add project root to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+os.environ.setdefault("CHAPA_SECRET_KEY", "CHASECK_TEST-benchmark")
+
+import requests
+
+from core.chapa_service import ChapaPaymentService
+from scripts.utilities.chapa_stub import ChapaStub
+
+MONITOR_INTERVAL = 0.005
+
+
+async def monitor_loop(lags: List[float], stop: asyncio.Event):
+    """Record how late each short sleep wakes up"""
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(MONITOR_INTERVAL)
+        lags.append(max(0.0, time.perf_counter() - started - MONITOR_INTERVAL))
+
+
+async def measure(name: str, calls):
+    lags: List[float] = []
+    stop = asyncio.Event()
+    monitor = asyncio.create_task(monitor_loop(lags, stop))
+    await asyncio.sleep(MONITOR_INTERVAL * 2)
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*calls, return_exceptions=True)
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await monitor
+
+    errors = sum(isinstance(result, Exception) for result in results)
+    blocked = sum(lag for lag in lags if lag > MONITOR_INTERVAL)
+    print(f"  {name:8} wall {elapsed * 1000:9.1f} ms   loop blocked {blocked * 1000:9.1f} ms   "
+          f"max stall {max(lags, default=0) * 1000:8.1f} ms   errors {errors}")
+    return elapsed, blocked
+
+
+async def legacy_verify(base_url: str, secret_key: str, tx_ref: str):
+    # The pre-async implementation: a blocking call inside a coroutine
+    response = requests.get(f"{base_url}/verify/{tx_ref}", headers={"Authorization": f"Bearer {secret_key}"})
+    response.raise_for_status()
+    return response.json()
+
+
+async def run(args):
+    with ChapaStub(latency=args.latency) as stub:
+        for index in range(args.payments):
+            stub.transactions[f"tx-{index}"] = {"amount": "10", "created_at": "2024-01-01T00:00:00"}
+
+        service = ChapaPaymentService(base_url=stub.base_url)
+        secret_key = service.secret_key
+        assert secret_key is not None  # the service refuses to start without one
+        print(f"{args.payments} concurrent verifications, {args.latency * 1000:.0f} ms gateway latency")
+
+        legacy = await measure("legacy", [
+            legacy_verify(stub.base_url, secret_key, f"tx-{index}") for index in range(args.payments)
+        ])
+        # Open the pool outside the measured window
+        await service.verify_payment("tx-0")
+        pooled = await measure("async", [
+            service.verify_payment(f"tx-{index}") for index in range(args.payments)
+        ])
+        await service.close()
+
+    print(f"  speedup {legacy[0] / pooled[0]:.1f}x wall time, "
+          f"loop blocking {legacy[1] * 1000:.0f} ms -> {pooled[1] * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark event-loop blocking of the Chapa client")
+    parser.add_argument("--payments", type=int, default=50, help="Concurrent payment verifications")
+    parser.add_argument("--latency", type=float, default=0.2, help="Simulated gateway latency in seconds")
+
+    asyncio.run(run(parser.parse_args()))
@@ -0,0 +1,161 @@
+"""
+Ticket QR Endpoint Benchmark
+
+Serves ``GET /api/tickets/{id}/qr`` for a set of freshly activated tickets
+two ways, against an in-memory Mongo:
+- legacy: the QR PNG rendered inline in the handler and stored on the
+  ticket as a base64 blob, as the endpoint did before rendering moved off
+  the loop
+- pooled: the current endpoint, which stores only the payload and renders
+  through the content-addressed QR image cache
+
+Each run makes one cold pass (every ticket renders once) and warm passes
+over the same tickets; the pooled run also measures revalidation with
+``If-None-Match``. Reported: requests per second, the longest event-loop
+stall, and the average ticket document size.
+
+Usage:
+    python scripts/utilities/benchmark_qr_endpoint.py --tickets 200 --concurrency 50
+"""
+
+import argparse
+import asyncio
+import base64
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from typing import Any, List
+from unittest.mock import patch
+
+# Add project root to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+os.environ.setdefault("CHAPA_SECRET_KEY", "CHASECK_TEST-benchmark")
+os.environ.setdefault("JWT_SECRET", "benchmark-secret")
+
+import bson
+import httpx
+from fastapi import FastAPI, Request
+from mongomock_motor import AsyncMongoMockClient
+
+from core.dependencies import get_current_user
+from core.qr_images import QRImageCache, qr_payload, render_qr_png
+from core.ticket_tokens import sign_ticket
+from routers import payments
+
+MONITOR_INTERVAL = 0.005
+USER = SimpleNamespace(id="customer-1", first_name="Abebe", last_name="Kebede")
+
+
+async def monitor_loop(lags: list, stop: asyncio.Event):
+    """Record how late each short sleep wakes up"""
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(MONITOR_INTERVAL)
+        lags.append(max(0.0, time.perf_counter() - started - MONITOR_INTERVAL))
+
+
+async def measure(name: str, client: httpx.AsyncClient, paths: list, concurrency: int, headers=None):
+    lags: List[float] = []
+    stop = asyncio.Event()
+    monitor = asyncio.create_task(monitor_loop(lags, stop))
+    await asyncio.sleep(MONITOR_INTERVAL * 2)
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def fetch(path):
+        async with semaphore:
+            return await client.get(path, headers=headers)
+
+    started = time.perf_counter()
+    responses = await asyncio.gather(*(fetch(path) for path in paths))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await monitor
+
+    errors = sum(response.status_code not in (200, 304) for response in responses)
+    print(f"  {name:18} {len(paths) / elapsed:9.0f} req/s   max stall {max(lags, default=0) * 1000:8.1f} ms   "
+          f"errors {errors}")
+    return responses
+
+
+def legacy_app(db) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/api/tickets/{ticket_id}/qr")
+    async def get_ticket_qr(request: Request, ticket_id: str):
+        # The previous handler: render on the loop, keep the image on the document
+        ticket = await db.tickets.find_one({"_id": ticket_id, "customer_id": USER.id, "status": "ACTIVE"})
+        if not ticket.get("qr_code"):
+            token = sign_ticket(ticket, f"{USER.first_name} {USER.last_name}")
+            qr_fields = {"signed_token": token, "qr_code": base64.b64encode(render_qr_png(qr_payload(token))).decode()}
+            await db.tickets.update_one({"_id": ticket_id}, {"$set": qr_fields})
+            ticket.update(qr_fields)
+        return {"ticket_number": ticket["ticket_number"], "qr_code": ticket["qr_code"], "signed_token": ticket["signed_token"]}
+
+    return app
+
+
+def pooled_app(db) -> FastAPI:
+    app = FastAPI()
+    app.include_router(payments.router)
+    app.state.mongodb = db
+    app.dependency_overrides[get_current_user] = lambda: USER
+    return app
+
+
+async def seed(db, count: int):
+    now = datetime.utcnow()
+    await db.tickets.insert_many([{
+        "_id": f"ticket-{index}", "ticket_number": f"TKT-{index:08X}", "customer_id": USER.id, "status": "ACTIVE",
+        "ticket_type": "DAILY_PASS", "valid_from": now.isoformat(), "valid_until": (now + timedelta(days=1)).isoformat()
+    } for index in range(count)])
+
+
+async def document_size(db) -> float:
+    sizes = [len(bson.BSON.encode(ticket)) async for ticket in db.tickets.find()]
+    return sum(sizes) / len(sizes)
+
+
+async def run_mode(name: str, args, make_app, cache=None):
+    db: Any = AsyncMongoMockClient()[f"qr_benchmark_{name}"]
+    await seed(db, args.tickets)
+    paths = [f"/api/tickets/ticket-{index}/qr" for index in range(args.tickets)]
+
+    print(f"{name}:")
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=make_app(db)), base_url="http://test") as client:
+        if cache is not None:
+            # Start the render workers outside the measured window
+            await cache.get(qr_payload("warm-up"))
+        cold = await measure("cold", client, paths, args.concurrency)
+        await measure("warm", client, paths * args.repeat, args.concurrency)
+        if cache is not None:
+            etag = cold[0].headers["etag"]
+            await measure("revalidate (304)", client, paths[:1] * len(paths) * args.repeat, args.concurrency,
+                          headers={"If-None-Match": etag})
+    print(f"  average ticket document {await document_size(db):.0f} bytes")
+
+
+async def run(args):
+    print(f"{args.tickets} tickets, {args.concurrency} concurrent requests, {args.repeat} warm passes")
+    await run_mode("legacy", args, legacy_app)
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = QRImageCache(cache_dir=cache_dir, executor=args.executor, workers=args.workers)
+        with patch("routers.payments.qr_image_cache", cache):
+            await run_mode("pooled", args, pooled_app, cache)
+        cache.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark ticket QR endpoint throughput")
+    parser.add_argument("--tickets", type=int, default=200, help="Freshly activated tickets")
+    parser.add_argument("--concurrency", type=int, default=50, help="Requests in flight")
+    parser.add_argument("--repeat", type=int, default=3, help="Warm passes over the same tickets")
+    parser.add_argument("--executor", choices=["process", "thread"], default="process", help="QR render pool")
+    parser.add_argument("--workers", type=int, default=min(4, os.cpu_count() or 1), help="QR render workers")
+
+    asyncio.run(run(parser.parse_args()))
@@ -0,0 +1,156 @@
+"""
+Local Chapa API Stub
+
+A small aiohttp server speaking the subset of the Chapa v1 API used by
+core/chapa_service.py (transaction/initialize, charges, validate, verify).
+It runs in its own thread and event loop, so it keeps answering even while
+the caller's loop is blocked, and can add latency or script failures.
+
+Usage:
+    python scripts/utilities/chapa_stub.py --port 8099 --latency 0.2
+    CHAPA_BASE_URL=http://127.0.0.1:8099 python main.py
+"""
+
+import argparse
+import asyncio
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Any, Counter, Deque, Dict, Optional, Tuple
+
+from aiohttp import web
+
+
+class ChapaStub:
+    """Threaded local Chapa server for tests and benchmarks"""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.calls: Counter[str] = Counter()
+        self.transactions: Dict[str, Dict[str, Any]] = {}
+        self._scripted: Deque[Tuple[int, float]] = deque()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._runner: Optional[web.AppRunner] = None
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}/v1"
+
+    def fail_next(self, count: int, status: int = 503, delay: float = 0.0):
+        """Answer the next ``count`` requests with ``status`` after ``delay`` seconds"""
+        self._scripted.extend([(status, delay)] * count)
+
+    def start(self) -> "ChapaStub":
+        ready = threading.Event()
+        self._thread = threading.Thread(target=self._serve, args=(ready,), daemon=True)
+        self._thread.start()
+        if not ready.wait(10):
+            raise RuntimeError("Chapa stub did not start")
+        return self
+
+    def stop(self):
+        if self._loop is None or self._runner is None or self._thread is None:
+            return
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result(10)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(10)
+        self._loop = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _serve(self, ready: threading.Event):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+
+        app = web.Application(middlewares=[self._middleware])
+        app.router.add_post("/v1/transaction/initialize", self._initialize)
+        app.router.add_post("/v1/charges", self._charge)
+        app.router.add_post("/v1/validate", self._validate)
+        app.router.add_get("/v1/verify/{tx_ref}", self._verify)
+
+        self._runner = web.AppRunner(app, access_log=None)
+        self._loop.run_until_complete(self._runner.setup())
+        site = web.TCPSite(self._runner, self.host, self.port)
+        self._loop.run_until_complete(site.start())
+        self.port = self._runner.addresses[0][1]
+        ready.set()
+        self._loop.run_forever()
+        self._loop.close()
+
+    @web.middleware
+    async def _middleware(self, request: web.Request, handler):
+        self.calls[request.path] += 1
+        if not request.headers.get("Authorization", "").startswith("Bearer "):
+            return web.json_response({"status": "failed", "message": "Invalid API Key"}, status=401)
+        if self._scripted:
+            status, delay = self._scripted.popleft()
+            await asyncio.sleep(delay)
+            return web.json_response({"status": "failed", "message": "Scripted failure"}, status=status)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return await handler(request)
+
+    async def _initialize(self, request: web.Request) -> web.Response:
+        payload = await request.json()
+        tx_ref = payload["tx_ref"]
+        self.transactions[tx_ref] = {"amount": payload["amount"], "created_at": datetime.utcnow().isoformat()}
+        return web.json_response({
+            "status": "success",
+            "message": "Hosted Link",
+            "data": {"checkout_url": f"http://{self.host}:{self.port}/checkout/{tx_ref}"}
+        })
+
+    async def _charge(self, request: web.Request) -> web.Response:
+        form = await request.post()
+        tx_ref = str(form["tx_ref"])
+        if tx_ref in self.transactions:
+            return web.json_response({"status": "failed", "message": "Transaction reference has been used before"}, status=400)
+        self.transactions[tx_ref] = {"amount": form["amount"], "created_at": datetime.utcnow().isoformat()}
+        return web.json_response({
+            "status": "success",
+            "message": "Charge initiated",
+            "data": {"auth_type": "ussd", "meta": {"message": "Payment prompt sent to the customer"}}
+        })
+
+    async def _validate(self, request: web.Request) -> web.Response:
+        payload = await request.json()
+        if payload.get("tx_ref") not in self.transactions:
+            return web.json_response({"status": "failed", "message": "Transaction not found"}, status=404)
+        return web.json_response({"status": "success", "message": "Payment authorized"})
+
+    async def _verify(self, request: web.Request) -> web.Response:
+        tx_ref = request.match_info["tx_ref"]
+        transaction = self.transactions.get(tx_ref)
+        if transaction is None:
+            return web.json_response({"status": "failed", "message": "Transaction not found"}, status=404)
+        return web.json_response({
+            "status": "success",
+            "amount": transaction["amount"],
+            "currency": "ETB",
+            "reference": f"APstub{abs(hash(tx_ref)) % 10 ** 8}",
+            "created_at": transaction["created_at"]
+        })
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a local Chapa API stub")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every response")
+    args = parser.parse_args()
+
+    with ChapaStub(args.host, args.port, args.latency) as stub:
+        print(f"Chapa stub listening on {stub.base_url} (Ctrl+C to stop)")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
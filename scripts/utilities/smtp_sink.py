@@ -0,0 +1,195 @@
+"""
+Local SMTP Sink
+
+A small SMTP server that accepts any login and keeps every message it
+receives, for testing the email outbox without a real provider. It runs in
+its own thread and event loop, counts connections (to check pooling), can
+add latency, and can script temporary or permanent failures.
+
+Usage:
+    python scripts/utilities/smtp_sink.py --port 2525
+    SMTP_SERVER=127.0.0.1 SMTP_PORT=2525 SMTP_START_TLS=false SMTP_USERNAME=dev SMTP_PASSWORD=dev python main.py
+"""
+
+import argparse
+import asyncio
+import base64
+import re
+import threading
+import time
+from collections import deque
+from email import message_from_bytes
+from email.message import Message
+from typing import Deque, Dict, List, NamedTuple, Optional, Tuple
+
+
+class ReceivedMessage(NamedTuple):
+    mail_from: str
+    recipients: List[str]
+    message: Message
+
+
+def _address(argument: str) -> str:
+    """``FROM:<a@b> SIZE=10`` -> ``a@b``"""
+    match = re.search(r"<([^>]*)>", argument)
+    return match.group(1) if match else argument.split(":", 1)[-1].strip()
+
+
+class SMTPSink:
+    """Threaded local SMTP server for tests and development"""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.messages: List[ReceivedMessage] = []
+        self.connections = 0
+        self.logins = 0
+        self._scripted: Deque[Tuple[int, str]] = deque()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._thread: Optional[threading.Thread] = None
+        self._sessions: Dict[asyncio.Task, asyncio.StreamWriter] = {}
+
+    def fail_next(self, count: int, code: int = 451, text: str = "Try again later"):
+        """Answer the next ``count`` messages with ``code`` instead of accepting them"""
+        self._scripted.extend([(code, text)] * count)
+
+    def start(self) -> "SMTPSink":
+        ready = threading.Event()
+        self._thread = threading.Thread(target=self._serve, args=(ready,), daemon=True)
+        self._thread.start()
+        if not ready.wait(10):
+            raise RuntimeError("SMTP sink did not start")
+        return self
+
+    def stop(self):
+        if self._loop is None or self._thread is None:
+            return
+        asyncio.run_coroutine_threadsafe(self._shutdown(), self._loop).result(10)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(10)
+        self._loop = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _serve(self, ready: threading.Event):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._server = self._loop.run_until_complete(asyncio.start_server(self._session, self.host, self.port))
+        self.port = self._server.sockets[0].getsockname()[1]
+        ready.set()
+        self._loop.run_forever()
+        self._loop.close()
+
+    async def _shutdown(self):
+        # Clients may still hold pooled connections open
+        if self._server is not None:
+            self._server.close()
+        for writer in self._sessions.values():
+            writer.close()
+        await asyncio.gather(*self._sessions, return_exceptions=True)
+
+    async def _session(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+        task = asyncio.current_task()
+        assert task is not None
+        self._sessions[task] = writer
+
+        async def reply(line: str):
+            writer.write(f"{line}\r\n".encode())
+            await writer.drain()
+
+        async def read_line() -> str:
+            return (await reader.readline()).decode().rstrip("\r\n")
+
+        mail_from: Optional[str] = None
+        recipients: List[str] = []
+        await reply("220 smtp-sink ESMTP ready")
+        try:
+            while True:
+                line = await read_line()
+                if not line and reader.at_eof():
+                    break
+                verb, _, argument = line.partition(" ")
+                verb = verb.upper()
+
+                if verb == "EHLO":
+                    await reply("250-smtp-sink")
+                    await reply("250-AUTH PLAIN LOGIN")
+                    await reply("250 8BITMIME")
+                elif verb == "HELO":
+                    await reply("250 smtp-sink")
+                elif verb == "AUTH":
+                    mechanism, _, initial = argument.partition(" ")
+                    if mechanism.upper() == "LOGIN":
+                        if not initial:
+                            await reply("334 " + base64.b64encode(b"Username:").decode())
+                            await read_line()
+                        await reply("334 " + base64.b64encode(b"Password:").decode())
+                        await read_line()
+                    elif not initial:
+                        await reply("334 ")
+                        await read_line()
+                    self.logins += 1
+                    await reply("235 2.7.0 Authentication successful")
+                elif verb == "MAIL":
+                    mail_from, recipients = _address(argument), []
+                    await reply("250 2.1.0 OK")
+                elif verb == "RCPT":
+                    recipients.append(_address(argument))
+                    await reply("250 2.1.5 OK")
+                elif verb == "DATA":
+                    if mail_from is None or not recipients:
+                        await reply("503 5.5.1 Bad sequence of commands")
+                        continue
+                    await reply("354 End data with <CR><LF>.<CR><LF>")
+                    lines = []
+                    while (data_line := await reader.readline()) not in (b".\r\n", b".\n", b""):
+                        lines.append(data_line[1:] if data_line.startswith(b"..") else data_line)
+                    if self.latency:
+                        await asyncio.sleep(self.latency)
+                    if self._scripted:
+                        code, text = self._scripted.popleft()
+                        await reply(f"{code} {text}")
+                    else:
+                        self.messages.append(ReceivedMessage(mail_from, recipients, message_from_bytes(b"".join(lines))))
+                        await reply("250 2.0.0 Queued")
+                    mail_from, recipients = None, []
+                elif verb in ("RSET", "NOOP"):
+                    mail_from, recipients = (None, []) if verb == "RSET" else (mail_from, recipients)
+                    await reply("250 2.0.0 OK")
+                elif verb == "QUIT":
+                    await reply("221 2.0.0 Bye")
+                    break
+                else:
+                    await reply("500 5.5.2 Command not recognized")
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._sessions.pop(task, None)
+            writer.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a local SMTP sink")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=2525)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added before accepting each message")
+    args = parser.parse_args()
+
+    with SMTPSink(args.host, args.port, args.latency) as sink:
+        print(f"SMTP sink listening on {sink.host}:{sink.port} (Ctrl+C to stop)")
+        seen = 0
+        try:
+            while True:
+                time.sleep(1)
+                for received in sink.messages[seen:]:
+                    print(f"  {received.message['Subject']!r} from {received.mail_from} to {', '.join(received.recipients)}")
+                seen = len(sink.messages)
+        except KeyboardInterrupt:
+            pass
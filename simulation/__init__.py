@@ -9,11 +9,25 @@ Components:
 - bus_simulator.py: Main simulation engine
 - route_path_generator.py: Generate realistic paths between bus stops
 - movement_calculator.py: Calculate realistic bus movement and physics
+- fleet_engine.py: Vectorized NumPy engine for large-fleet load tests
+- route_cache.py: Compiled route waypoints shared across simulated buses
+- clock.py: Wall and replay clocks for live and deterministic runs
+- passenger_population.py: Virtual passengers for proximity load tests
+- shard_supervisor.py / shard_worker.py: Multi-process simulation shards
 """
 
 from .bus_simulator import BusSimulator
 from .route_path_generator import RoutePathGenerator
 from .movement_calculator import MovementCalculator
+from .fleet_engine import VectorizedFleetSimulator
+from .clock import WallClock, ReplayClock
+from .passenger_population import PassengerPopulation
+from .shard_supervisor import ShardSupervisor
+from .route_cache import CompiledRoute, RouteWaypointCache, route_waypoint_cache
 from .bus_simulation_service import bus_simulation_service
 
-__all__ = ['BusSimulator', 'RoutePathGenerator', 'MovementCalculator', 'bus_simulation_service']
+__all__ = [
+    'BusSimulator', 'VectorizedFleetSimulator', 'RoutePathGenerator',
+    'MovementCalculator', 'WallClock', 'ReplayClock', 'PassengerPopulation', 'ShardSupervisor', 'CompiledRoute', 'RouteWaypointCache', 'route_waypoint_cache',
+    'bus_simulation_service'
+]
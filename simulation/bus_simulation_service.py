@@ -8,14 +8,24 @@ It starts automatically when the server starts and runs as a background service.
 import asyncio
 import logging
 import os
-from typing import Optional, Any
+from typing import Optional, Any, Dict
 from datetime import datetime, timezone
 
 from .bus_simulator import BusSimulator
+from .clock import ReplayClock
+from .fleet_engine import VectorizedFleetSimulator
+from .passenger_population import PassengerPopulation
+from .route_cache import RouteWaypointCache
+from .shard_supervisor import ShardSupervisor
+from .tick_publisher import TickPublisher
 from core.logger import get_logger
 
 logger = get_logger(__name__)
 
+# Replays write and broadcast here instead of the live `buses` collection and tracking rooms
+REPLAY_COLLECTION = "simulation_replay_buses"
+REPLAY_ROOM_PREFIX = "simulation_replay:"
+
 
 class BusSimulationService:
     """Background service for bus simulation."""
@@ -31,10 +41,30 @@ class BusSimulationService:
         self.update_interval = float(os.getenv("BUS_SIMULATION_INTERVAL", "5.0"))
         self.max_buses = int(os.getenv("BUS_SIMULATION_MAX_BUSES", "50"))
         self.auto_assign_routes = os.getenv("BUS_SIMULATION_AUTO_ASSIGN", "true").lower() == "true"
+        # 'scalar' (one task per bus) or 'vectorized' (NumPy fleet engine for load tests)
+        self.engine = os.getenv("BUS_SIMULATION_ENGINE", "scalar").lower()
+        # Virtual passengers for proximity load tests (0 disables them)
+        self.passenger_count = int(os.getenv("BUS_SIMULATION_PASSENGERS", "0"))
+        self.passenger_update_interval = float(os.getenv("BUS_SIMULATION_PASSENGER_INTERVAL", "30.0"))
+        self.passenger_population: Optional[PassengerPopulation] = None
+        # Number of simulation worker processes (0 runs the simulator in the API process)
+        self.shard_count = int(os.getenv("BUS_SIMULATION_SHARDS", "0"))
+        self.shard_supervisor: Optional[ShardSupervisor] = None
+        
+        # Deterministic replay settings (seed, time_scale, start_time, duration_seconds);
+        # None runs the live wall-clock simulation
+        self.replay_config: Optional[Dict[str, Any]] = None
         
     def set_app_state(self, app_state: Any):
         """Set the FastAPI app state."""
         self.app_state = app_state
+    
+    @property
+    def db(self) -> Any:
+        """Database of the app state; set before the simulation starts."""
+        if self.app_state is None:
+            raise RuntimeError("App state has not been set")
+        return self.app_state.mongodb
         
     async def start(self):
         """Start the bus simulation service."""
@@ -63,15 +93,15 @@ class BusSimulationService:
                 self.simulation_task = asyncio.create_task(self._monitoring_loop())
                 return
             
+            if self.shard_count > 0:
+                await self._start_shards()
+                return
+            
             # Initialize simulator
-            self.simulator = BusSimulator(
-                db=self.app_state.mongodb,
-                update_interval=self.update_interval
-            )
-            self.simulator.max_buses_to_simulate = self.max_buses
+            self.simulator = self._create_simulator()
             
-            # Auto-assign routes if enabled
-            if self.auto_assign_routes:
+            # Auto-assign routes if enabled (replays leave live assignments alone)
+            if self.auto_assign_routes and not self.replay_config:
                 await self._assign_routes_to_buses()
             
             # Initialize and start simulation
@@ -88,6 +118,9 @@ class BusSimulationService:
             await self.simulator.start_simulation()
             self.is_running = True
             
+            if self.passenger_count > 0:
+                await self.start_passengers(self.passenger_count)
+            
             # Start monitoring task
             self.simulation_task = asyncio.create_task(self._monitoring_loop())
             
@@ -107,6 +140,8 @@ class BusSimulationService:
         
         self.is_running = False
         
+        await self.stop_passengers()
+        
         # Cancel monitoring task
         if self.simulation_task:
             self.simulation_task.cancel()
@@ -120,8 +155,161 @@ class BusSimulationService:
             await self.simulator.stop_simulation()
             self.simulator = None
         
+        if self.shard_supervisor:
+            await self.shard_supervisor.stop()
+            self.shard_supervisor = None
+        
         #logger.info("✅ Bus simulation service stopped")
     
+    async def start_shards(self, shard_count: int):
+        """Restart the simulation in ``shard_count`` worker processes."""
+        if shard_count < 1:
+            raise ValueError("shard_count must be at least 1")
+        if self.replay_config:
+            raise RuntimeError("Simulation shards cannot run during a replay")
+        
+        await self.stop()
+        self.shard_count = shard_count
+        await self.start()
+        if not self.shard_supervisor:
+            raise RuntimeError("Simulation shards could not be started")
+    
+    async def stop_shards(self):
+        """Stop the simulation worker processes."""
+        await self.stop()
+        self.shard_count = 0
+    
+    async def _start_shards(self):
+        """Start shard processes, each owning a disjoint set of routes."""
+        if self.auto_assign_routes:
+            await self._assign_routes_to_buses()
+        
+        supervisor = ShardSupervisor(
+            db=self.db,
+            shard_count=self.shard_count,
+            engine=self.engine,
+            update_interval=self.update_interval,
+            max_buses=self.max_buses
+        )
+        await supervisor.start()
+        self.shard_supervisor = supervisor
+        self.is_running = True
+        
+        if self.passenger_count > 0:
+            await self.start_passengers(self.passenger_count)
+    
+    def _tick_publisher(self) -> Optional[TickPublisher]:
+        """Publisher that carries simulated positions in the API process."""
+        if self.shard_supervisor:
+            return self.shard_supervisor.publisher
+        if self.simulator:
+            return self.simulator.tick_publisher
+        return None
+    
+    async def start_passengers(
+        self,
+        count: int,
+        update_interval: Optional[float] = None,
+        stop_count: int = 200,
+        seed: Optional[int] = None
+    ):
+        """Spawn virtual passengers that stream locations and receive proximity alerts."""
+        publisher = self._tick_publisher()
+        if publisher is None or not self.is_running:
+            raise RuntimeError("Bus simulation is not running")
+        
+        await self.stop_passengers()
+        population = PassengerPopulation(
+            db=self.db,
+            app_state=self.app_state,
+            size=count,
+            stop_count=stop_count,
+            update_interval=update_interval or self.passenger_update_interval,
+            seed=seed
+        )
+        await population.spawn()
+        await population.start()
+        publisher.add_listener(population.on_tick)
+        self.passenger_population = population
+    
+    async def stop_passengers(self):
+        """Disconnect and remove the virtual passengers."""
+        population = self.passenger_population
+        if population is None:
+            return
+        
+        self.passenger_population = None
+        publisher = self._tick_publisher()
+        if publisher:
+            publisher.remove_listener(population.on_tick)
+        await population.stop()
+    
+    async def start_replay(
+        self,
+        seed: int,
+        time_scale: float = 60.0,
+        start_time: Optional[datetime] = None,
+        duration_seconds: Optional[float] = None
+    ):
+        """Restart the simulation in seeded, time-compressed replay mode."""
+        if time_scale <= 0:
+            raise ValueError("time_scale must be positive")
+        if not self.enabled:
+            raise RuntimeError("Bus simulation is disabled")
+        if self.shard_count > 0:
+            raise RuntimeError("Replays cannot run while the simulation is sharded")
+        
+        await self.stop()
+        self.replay_config = {
+            "seed": seed,
+            "time_scale": time_scale,
+            "start_time": start_time,
+            "duration_seconds": duration_seconds
+        }
+        await self.start()
+    
+    async def stop_replay(self):
+        """Return to the live wall-clock simulation."""
+        await self.stop()
+        self.replay_config = None
+        await self.start()
+    
+    def _replay_finished(self) -> bool:
+        """Check whether a replay reached its end time."""
+        return self.simulator is not None and self.simulator.clock.finished()
+    
+    def _create_simulator(self) -> BusSimulator:
+        """Create the simulator for the configured engine."""
+        options: Dict[str, Any] = {
+            "db": self.db,
+            "update_interval": self.update_interval
+        }
+        if self.replay_config:
+            # Replays compile routes with their own seed instead of reusing shared waypoints
+            options.update(
+                clock=ReplayClock(
+                    start_time=self.replay_config["start_time"],
+                    time_scale=self.replay_config["time_scale"],
+                    duration_seconds=self.replay_config["duration_seconds"]
+                ),
+                seed=self.replay_config["seed"],
+                route_cache=RouteWaypointCache(),
+                tick_publisher=TickPublisher(
+                    self.db,
+                    track_headways=False,
+                    collection=REPLAY_COLLECTION,
+                    room_prefix=REPLAY_ROOM_PREFIX
+                )
+            )
+        
+        simulator: BusSimulator
+        if self.engine == "vectorized":
+            simulator = VectorizedFleetSimulator(**options)
+        else:
+            simulator = BusSimulator(**options)
+        simulator.max_buses_to_simulate = self.max_buses
+        return simulator
+
     async def _should_start_simulation(self) -> bool:
         """Check if conditions are met to start simulation."""
         try:
@@ -212,7 +400,7 @@ class BusSimulationService:
                 await asyncio.sleep(60)  # Check every minute
 
                 # If simulation is not running, try to start it
-                if not self.is_running and self.enabled:
+                if not self.is_running and self.enabled and not self._replay_finished():
                     if await self._should_start_simulation():
                         #logger.info("🚌 Conditions met, attempting to start simulation...")
 
@@ -224,14 +412,10 @@ class BusSimulationService:
 
                             # Initialize simulator if not exists
                             if not self.simulator:
-                                self.simulator = BusSimulator(
-                                    db=self.app_state.mongodb,
-                                    update_interval=self.update_interval
-                                )
-                                self.simulator.max_buses_to_simulate = self.max_buses
-
-                            # Auto-assign routes if enabled
-                            if self.auto_assign_routes:
+                                self.simulator = self._create_simulator()
+
+                            # Auto-assign routes if enabled (replays leave live assignments alone)
+                            if self.auto_assign_routes and not self.replay_config:
                                 await self._assign_routes_to_buses()
 
                             # Initialize and start
@@ -260,10 +444,18 @@ class BusSimulationService:
                 # If simulation is running, check health
                 elif self.is_running and self.simulator:
                     status = self.simulator.get_simulation_status()
-                    if not status['is_running']:
+                    if not status['is_running'] and self._replay_finished():
+                        self.is_running = False
+                    elif not status['is_running']:
                         #logger.warning("🚌 Simulation stopped unexpectedly, attempting restart...")
                         self.is_running = False
                         # Will be restarted in next loop iteration
+                    else:
+                        # Pick up edited route geometry or stop lists
+                        try:
+                            await self.simulator.refresh_routes()
+                        except Exception as e:
+                            logger.error(f"❌ Failed to refresh simulated routes: {e}")
 
         except asyncio.CancelledError:
             logger.info("🔍 Bus simulation monitoring loop cancelled")
@@ -277,12 +469,27 @@ class BusSimulationService:
             "is_running": self.is_running,
             "update_interval": self.update_interval,
             "max_buses": self.max_buses,
+            "engine": self.engine,
+            "mode": "replay" if self.replay_config else "realtime",
             "auto_assign_routes": self.auto_assign_routes
         }
+        if self.replay_config:
+            status["replay_collection"] = REPLAY_COLLECTION
+            status["replay_room_prefix"] = REPLAY_ROOM_PREFIX
 
         if self.simulator:
             sim_status = self.simulator.get_simulation_status()
             status.update(sim_status)
+        
+        if self.shard_supervisor:
+            shard_status = self.shard_supervisor.get_status()
+            status["mode"] = "sharded"
+            status["total_buses"] = shard_status["total_buses"]
+            status["active_buses"] = shard_status["active_buses"]
+            status["sharding"] = shard_status
+        
+        if self.passenger_population:
+            status["passengers"] = self.passenger_population.get_metrics()
 
         return status
 
@@ -10,15 +10,18 @@ This module provides the main bus simulation engine that:
 
 import asyncio
 import logging
+import time
 from datetime import datetime, timezone
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Optional, Union
 import random
 
 from motor.motor_asyncio import AsyncIOMotorDatabase
 
+from .clock import ReplayClock, WallClock
 from .movement_calculator import MovementCalculator
 from .route_path_generator import RoutePathGenerator
-from core.realtime.bus_tracking import bus_tracking_service
+from .route_cache import CompiledRoute, RouteWaypointCache, route_fingerprint, route_waypoint_cache
+from .tick_publisher import TickPublisher
 
 logger = logging.getLogger(__name__)
 
@@ -26,7 +29,8 @@ logger = logging.getLogger(__name__)
 class BusState:
     """Represents the current state of a simulated bus."""
     
-    def __init__(self, bus_data: Dict[str, Any]):
+    def __init__(self, bus_data: Dict[str, Any], now: Optional[datetime] = None):
+        now = now or datetime.now(timezone.utc)
         self.bus_id = bus_data['id']
         self.license_plate = bus_data.get('license_plate', 'Unknown')
         self.route_id = bus_data.get('assigned_route_id')
@@ -40,10 +44,9 @@ class BusState:
         self.speed = bus_data.get('speed', 0.0)
         self.heading = bus_data.get('heading', 0.0)
         
-        # Route following
-        self.route_waypoints: List[Dict[str, Any]] = []
+        # Route following (compiled waypoints are shared by all buses on the route)
+        self.route: Optional[CompiledRoute] = None
         self.current_waypoint_index = 0
-        self.target_waypoint: Optional[Dict[str, Any]] = None
         
         # Stop state
         self.is_at_stop = False
@@ -52,30 +55,54 @@ class BusState:
         
         # Traffic simulation
         self.traffic_delay_factor = 1.0
-        self.last_traffic_update = datetime.now(timezone.utc)
+        self.last_traffic_update = now
         
         # Status
         self.is_active = bus_data.get('bus_status') == 'OPERATIONAL'
-        self.last_update = datetime.now(timezone.utc)
+        self.last_update = now
 
 
 class BusSimulator:
     """Main bus simulation engine."""
     
-    def __init__(self, db: AsyncIOMotorDatabase, update_interval: float = 5.0):
+    def __init__(
+        self,
+        db: AsyncIOMotorDatabase,
+        update_interval: float = 5.0,
+        route_cache: Optional[RouteWaypointCache] = None,
+        clock: Optional[Union[WallClock, ReplayClock]] = None,
+        seed: Optional[int] = None,
+        tick_publisher: Optional[TickPublisher] = None
+    ):
         self.db = db
-        self.update_interval = update_interval  # seconds between updates
-        self.movement_calc = MovementCalculator()
-        self.path_generator = RoutePathGenerator()
+        self.update_interval = update_interval  # simulated seconds between updates
+        self.clock = clock or WallClock()
+        self.seed = seed
+        
+        # Seeded runs get their own random streams so they can be reproduced
+        self.movement_calc = MovementCalculator(random.Random(seed) if seed is not None else None)
+        self.path_generator = RoutePathGenerator(random.Random(seed) if seed is not None else None)
+        self.route_cache = route_cache if route_cache is not None else route_waypoint_cache
         
         # Simulation state
         self.buses: Dict[str, BusState] = {}
         self.routes_cache: Dict[str, Dict[str, Any]] = {}
         self.is_running = False
         self.simulation_task: Optional[asyncio.Task] = None
+        self.tick_publisher = tick_publisher or TickPublisher(db)
+        
+        # Tick metrics
+        self.ticks = 0
+        self.last_tick_duration_ms = 0.0
+        self.max_tick_duration_ms = 0.0
+        self.total_tick_duration_ms = 0.0
+        self.last_tick_lag_ms = 0.0
+        self.max_tick_lag_ms = 0.0
+        self.overrun_ticks = 0
         
         # Configuration
         self.max_buses_to_simulate = 50  # Limit for performance
+        self.route_ids: Optional[List[str]] = None  # Restrict to these routes (simulation shards)
         self.route_completion_behavior = 'loop'  # 'loop' or 'reverse'
         
     async def initialize(self):
@@ -84,40 +111,37 @@ class BusSimulator:
         
         try:
             # Load active buses with assigned routes
-            buses_cursor = self.db.buses.find({
-                "assigned_route_id": {"$ne": None, "$exists": True},
-                "bus_status": "OPERATIONAL"
-            }).limit(self.max_buses_to_simulate)
+            buses_cursor = self.db.buses.find(self._bus_query()).sort("id", 1).limit(self.max_buses_to_simulate)
             
             buses = await buses_cursor.to_list(length=None)
             #logger.info(f"📊 Found {len(buses)} operational buses with assigned routes")
             
-            # Initialize bus states
+            # Group buses by route so each route is loaded and compiled once
+            buses_by_route: Dict[str, List[Dict[str, Any]]] = {}
             for bus_data in buses:
-                bus_state = BusState(bus_data)
+                buses_by_route.setdefault(bus_data['assigned_route_id'], []).append(bus_data)
+            
+            for route_id, route_buses in buses_by_route.items():
+                route_data = await self._load_route_data(route_id)
+                if not route_data:
+                    #logger.warning(f"⚠️ Route data not found for route {route_id}")
+                    continue
                 
-                if bus_state.route_id:
-                    # Load route data
-                    route_data = await self._load_route_data(bus_state.route_id)
-                    if route_data:
-                        # Generate route path
-                        waypoints = await self._generate_route_waypoints(route_data)
-                        if waypoints:
-                            bus_state.route_waypoints = waypoints
-                            bus_state.target_waypoint = waypoints[0] if waypoints else None
-                            
-                            # Set initial position if bus doesn't have one
-                            if bus_state.latitude == 0.0 and bus_state.longitude == 0.0:
-                                first_waypoint = waypoints[0]
-                                bus_state.latitude = first_waypoint['latitude']
-                                bus_state.longitude = first_waypoint['longitude']
-                            
-                            self.buses[bus_state.bus_id] = bus_state
-                            #logger.debug(f"✅ Initialized bus {bus_state.license_plate} on route {route_data.get('name')}")
-                        # else:
-                            #logger.warning(f"⚠️ No waypoints generated for bus {bus_state.license_plate}")
-                    # else:
-                        #logger.warning(f"⚠️ Route data not found for bus {bus_state.license_plate}")
+                compiled = await self._get_compiled_route(route_data)
+                if compiled is None:
+                    #logger.warning(f"⚠️ No waypoints generated for route {route_data.get('name')}")
+                    continue
+                
+                for bus_data in route_buses:
+                    bus_state = BusState(bus_data, now=self.clock.now())
+                    bus_state.route = compiled
+                    
+                    # Set initial position if bus doesn't have one
+                    if bus_state.latitude == 0.0 and bus_state.longitude == 0.0:
+                        bus_state.latitude = float(compiled.latitude[0])
+                        bus_state.longitude = float(compiled.longitude[0])
+                    
+                    self.buses[bus_state.bus_id] = bus_state
             
             #logger.info(f"✅ Initialized {len(self.buses)} buses for simulation")
             
@@ -125,6 +149,16 @@ class BusSimulator:
             logger.error(f"❌ Failed to initialize simulation: {e}")
             raise
     
+    def _bus_query(self) -> Dict[str, Any]:
+        """Query for the operational buses this simulator drives."""
+        query: Dict[str, Any] = {
+            "assigned_route_id": {"$ne": None, "$exists": True},
+            "bus_status": "OPERATIONAL"
+        }
+        if self.route_ids is not None:
+            query["assigned_route_id"] = {"$in": self.route_ids}
+        return query
+    
     async def _load_route_data(self, route_id: str) -> Optional[Dict[str, Any]]:
         """Load route data from database with caching."""
         if route_id in self.routes_cache:
@@ -140,6 +174,61 @@ class BusSimulator:
         
         return None
     
+    async def _get_compiled_route(self, route_data: Dict[str, Any]) -> Optional[CompiledRoute]:
+        """Get the shared compiled waypoints for a route, compiling them on a cache miss."""
+        compiled = self.route_cache.get(route_data)
+        if compiled is not None:
+            return compiled
+        
+        waypoints = await self._generate_route_waypoints(route_data)
+        if len(waypoints) < 2:
+            return None
+        
+        compiled = CompiledRoute.from_waypoints(route_data['id'], route_fingerprint(route_data), waypoints)
+        self.route_cache.put(compiled)
+        return compiled
+    
+    async def refresh_routes(self) -> int:
+        """Recompile routes whose route_geometry or stop_ids changed.
+
+        Returns:
+            Number of routes that were recompiled
+        """
+        route_ids = list(self._simulated_route_ids())
+        if not route_ids:
+            return 0
+        
+        route_docs = await self.db.routes.find(
+            {"id": {"$in": route_ids}},
+            {"id": 1, "name": 1, "stop_ids": 1, "route_geometry": 1}
+        ).to_list(length=None)
+        
+        refreshed = 0
+        for route_data in route_docs:
+            cached = self.routes_cache.get(route_data['id'])
+            if cached is not None and route_fingerprint(cached) == route_fingerprint(route_data):
+                continue
+            
+            self.routes_cache[route_data['id']] = route_data
+            compiled = await self._get_compiled_route(route_data)
+            if compiled is not None:
+                self._rebind_route(compiled)
+                refreshed += 1
+        
+        return refreshed
+    
+    def _simulated_route_ids(self) -> set:
+        """IDs of the routes currently driven by simulated buses."""
+        return {bus.route_id for bus in self.buses.values() if bus.route_id}
+    
+    def _rebind_route(self, compiled: CompiledRoute):
+        """Point every bus on a route at its recompiled waypoints, heading on from where it is."""
+        for bus_state in self.buses.values():
+            if bus_state.route_id == compiled.route_id:
+                bus_state.route = compiled
+                # Old indices mean nothing on new geometry; re-snap to the nearest segment
+                bus_state.current_waypoint_index = compiled.next_waypoint(bus_state.latitude, bus_state.longitude)
+    
     async def _generate_route_waypoints(self, route_data: Dict[str, Any]) -> List[Dict[str, Any]]:
         """Generate waypoints for a route using Mapbox geometry if available."""
         try:
@@ -200,6 +289,7 @@ class BusSimulator:
         
         #logger.info("🚀 Starting bus simulation...")
         self.is_running = True
+        await self.tick_publisher.start()
         
         # Start simulation loop
         self.simulation_task = asyncio.create_task(self._simulation_loop())
@@ -208,12 +298,10 @@ class BusSimulator:
     
     async def stop_simulation(self):
         """Stop the bus simulation."""
-        if not self.is_running:
-            return
-        
         #logger.info("🛑 Stopping bus simulation...")
         self.is_running = False
         
+        # The task may already have ended on its own when a replay finished
         if self.simulation_task:
             self.simulation_task.cancel()
             try:
@@ -221,33 +309,47 @@ class BusSimulator:
             except asyncio.CancelledError:
                 pass
         
+        await self.tick_publisher.stop()
         #logger.info("✅ Bus simulation stopped")
     
     async def _simulation_loop(self):
-        """Main simulation loop."""
+        """Main simulation loop.
+
+        Each tick only advances simulation state and publishes one event with
+        every changed bus; persistence and fan-out run in the tick publisher.
+        Ticks are spaced ``update_interval / clock.time_scale`` wall seconds
+        apart while the clock advances ``update_interval`` simulated seconds.
+        """
         #logger.info(f"🔄 Starting simulation loop with {len(self.buses)} buses")
         
         try:
-            while self.is_running:
-                start_time = datetime.now(timezone.utc)
+            wall_interval = self.update_interval / self.clock.time_scale
+            next_tick_at = time.monotonic()
+            while self.is_running and not self.clock.finished():
+                tick_started = time.monotonic()
+                self.last_tick_lag_ms = max(0.0, tick_started - next_tick_at) * 1000
+                self.max_tick_lag_ms = max(self.max_tick_lag_ms, self.last_tick_lag_ms)
                 
-                # Update all buses
-                update_tasks = []
-                for bus_state in self.buses.values():
-                    if bus_state.is_active:
-                        task = asyncio.create_task(self._update_bus(bus_state))
-                        update_tasks.append(task)
+                changed_buses = self._tick()
+                self.ticks += 1
+                self.tick_publisher.publish(self.ticks, changed_buses)
+                self.clock.advance(self.update_interval)
                 
-                # Wait for all updates to complete
-                if update_tasks:
-                    await asyncio.gather(*update_tasks, return_exceptions=True)
-                
-                # Calculate sleep time to maintain consistent update interval
-                elapsed = (datetime.now(timezone.utc) - start_time).total_seconds()
-                sleep_time = max(0, self.update_interval - elapsed)
+                elapsed = time.monotonic() - tick_started
+                self._record_tick_duration(elapsed)
                 
+                # Keep a fixed cadence; a tick that overruns is not made up for
+                next_tick_at = tick_started + wall_interval
+                sleep_time = next_tick_at - time.monotonic()
                 if sleep_time > 0:
                     await asyncio.sleep(sleep_time)
+                else:
+                    self.overrun_ticks += 1
+                    next_tick_at = time.monotonic()
+                    await asyncio.sleep(0)
+            
+            # A replay that reached its end time stops on its own
+            self.is_running = False
                 
         except asyncio.CancelledError:
             logger.info("Simulation loop cancelled")
@@ -255,12 +357,42 @@ class BusSimulator:
             logger.error(f"Error in simulation loop: {e}")
             self.is_running = False
     
-    async def _update_bus(self, bus_state: BusState):
-        """Update a single bus's position and state."""
+    def _record_tick_duration(self, elapsed: float):
+        """Record how long a tick took to compute."""
+        self.last_tick_duration_ms = elapsed * 1000
+        self.max_tick_duration_ms = max(self.max_tick_duration_ms, self.last_tick_duration_ms)
+        self.total_tick_duration_ms += self.last_tick_duration_ms
+    
+    def _tick(self) -> List[Dict[str, Any]]:
+        """Advance all active buses and return the locations of those that changed."""
+        changed_buses = []
+        for bus_state in self.buses.values():
+            if bus_state.is_active and self._update_bus(bus_state):
+                changed_buses.append({
+                    'bus_id': bus_state.bus_id,
+                    'route_id': bus_state.route_id,
+                    'latitude': bus_state.latitude,
+                    'longitude': bus_state.longitude,
+                    'heading': bus_state.heading,
+                    'speed': bus_state.speed
+                })
+        return changed_buses
+    
+    def _update_bus(self, bus_state: BusState) -> bool:
+        """Update a single bus's position and state.
+
+        Returns:
+            True if the bus moved and its location should be published
+        """
         try:
-            current_time = datetime.now(timezone.utc)
+            current_time = self.clock.now()
             time_delta = (current_time - bus_state.last_update).total_seconds()
             
+            # Check if we have a route to follow
+            route = bus_state.route
+            if route is None or len(route) == 0:
+                return False
+            
             # Handle bus at stop
             if bus_state.is_at_stop:
                 if bus_state.stop_start_time:
@@ -269,14 +401,11 @@ class BusSimulator:
                         # Finished stopping, move to next waypoint
                         bus_state.is_at_stop = False
                         bus_state.stop_start_time = None
-                        bus_state.current_waypoint_index = (bus_state.current_waypoint_index + 1) % len(bus_state.route_waypoints)
-                        bus_state.target_waypoint = bus_state.route_waypoints[bus_state.current_waypoint_index]
+                        bus_state.current_waypoint_index = (bus_state.current_waypoint_index + 1) % len(route)
                         #logger.debug(f"🚌 Bus {bus_state.license_plate} finished stop, moving to next waypoint")
-                return
+                return False
             
-            # Check if we have a target waypoint
-            if not bus_state.target_waypoint or not bus_state.route_waypoints:
-                return
+            target_index = bus_state.current_waypoint_index
             
             # Update traffic conditions periodically
             if (current_time - bus_state.last_traffic_update).total_seconds() > 30:
@@ -284,11 +413,11 @@ class BusSimulator:
                 bus_state.last_traffic_update = current_time
             
             # Calculate movement
-            target_lat = bus_state.target_waypoint['latitude']
-            target_lon = bus_state.target_waypoint['longitude']
+            target_lat = float(route.latitude[target_index])
+            target_lon = float(route.longitude[target_index])
             
             # Get speed for this segment
-            base_speed = bus_state.target_waypoint.get('estimated_speed', 25.0)
+            base_speed = float(route.segment_speed[target_index])
             if base_speed == 0:  # This is a bus stop
                 base_speed = 25.0  # Use default speed when approaching stop
             
@@ -313,54 +442,52 @@ class BusSimulator:
             
             # Check if we reached the waypoint
             if remaining_distance <= 0.01:  # Within 10 meters
-                if bus_state.target_waypoint.get('is_bus_stop', False):
+                if route.is_stop[target_index]:
                     # Start stop at bus stop
                     bus_state.is_at_stop = True
                     bus_state.stop_start_time = current_time
                     bus_state.stop_duration = self.movement_calc.calculate_stop_duration()
                     bus_state.speed = 0.0
-                    #logger.debug(f"🚏 Bus {bus_state.license_plate} arrived at stop {bus_state.target_waypoint.get('stop_name', 'Unknown')}")
+                    #logger.debug(f"🚏 Bus {bus_state.license_plate} arrived at stop")
                 else:
                     # Move to next waypoint
-                    bus_state.current_waypoint_index = (bus_state.current_waypoint_index + 1) % len(bus_state.route_waypoints)
-                    bus_state.target_waypoint = bus_state.route_waypoints[bus_state.current_waypoint_index]
+                    bus_state.current_waypoint_index = (target_index + 1) % len(route)
             
-            # Broadcast location update
-            await self._broadcast_bus_location(bus_state)
+            return True
             
         except Exception as e:
             logger.error(f"Error updating bus {bus_state.bus_id}: {e}")
-    
-    async def _broadcast_bus_location(self, bus_state: BusState):
-        """Broadcast bus location update via WebSocket."""
-        try:
-            # Create app_state-like object for the bus tracking service
-            class AppState:
-                def __init__(self, db):
-                    self.mongodb = db
-            
-            app_state = AppState(self.db)
-            
-            await bus_tracking_service.update_bus_location(
-                bus_id=bus_state.bus_id,
-                latitude=bus_state.latitude,
-                longitude=bus_state.longitude,
-                heading=bus_state.heading,
-                speed=bus_state.speed,
-                app_state=app_state
-            )
-            
-        except Exception as e:
-            logger.error(f"Error broadcasting location for bus {bus_state.bus_id}: {e}")
+            return False
     
     def get_simulation_status(self) -> Dict[str, Any]:
         """Get current simulation status."""
         active_buses = sum(1 for bus in self.buses.values() if bus.is_active)
         
         return {
+            'engine': 'scalar',
             'is_running': self.is_running,
             'total_buses': len(self.buses),
             'active_buses': active_buses,
             'update_interval': self.update_interval,
-            'routes_loaded': len(self.routes_cache)
+            'routes_loaded': len(self.routes_cache),
+            'route_cache': self.route_cache.get_stats(),
+            'clock': self.get_clock_status(),
+            'tick_metrics': self.get_tick_metrics()
+        }
+    
+    def get_clock_status(self) -> Dict[str, Any]:
+        """Get simulated time, time compression and seed."""
+        return {**self.clock.get_status(), 'seed': self.seed}
+    
+    def get_tick_metrics(self) -> Dict[str, Any]:
+        """Get tick duration, lag and publishing metrics."""
+        return {
+            'ticks': self.ticks,
+            'last_tick_duration_ms': round(self.last_tick_duration_ms, 2),
+            'max_tick_duration_ms': round(self.max_tick_duration_ms, 2),
+            'avg_tick_duration_ms': round(self.total_tick_duration_ms / self.ticks, 2) if self.ticks else 0.0,
+            'last_tick_lag_ms': round(self.last_tick_lag_ms, 2),
+            'max_tick_lag_ms': round(self.max_tick_lag_ms, 2),
+            'overrun_ticks': self.overrun_ticks,
+            **self.tick_publisher.get_metrics()
         }
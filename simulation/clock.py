@@ -0,0 +1,80 @@
+"""
+Simulation Clocks for Bus Simulation
+
+This module provides the time source used by the simulators:
+1. WallClock follows real time and is used for live simulation
+2. ReplayClock advances a fixed amount of simulated time per tick, so runs
+   with the same seed produce the same position stream and can be played
+   back faster than real time
+"""
+
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Any, Optional
+
+
+class WallClock:
+    """Simulated time follows the wall clock."""
+
+    deterministic = False
+    time_scale = 1.0
+
+    def now(self) -> datetime:
+        return datetime.now(timezone.utc)
+
+    def advance(self, seconds: float) -> None:
+        """Real time advances on its own."""
+
+    def finished(self) -> bool:
+        return False
+
+    def get_status(self) -> Dict[str, Any]:
+        return {
+            'mode': 'realtime',
+            'time_scale': self.time_scale,
+            'simulated_time': self.now().isoformat()
+        }
+
+
+class ReplayClock:
+    """Stepped clock for deterministic, time-compressed runs."""
+
+    deterministic = True
+
+    def __init__(
+        self,
+        start_time: Optional[datetime] = None,
+        time_scale: float = 60.0,
+        duration_seconds: Optional[float] = None
+    ):
+        if time_scale <= 0:
+            raise ValueError("time_scale must be positive")
+
+        if start_time is None:
+            start_time = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+        elif start_time.tzinfo is None:
+            start_time = start_time.replace(tzinfo=timezone.utc)
+
+        self.start_time = start_time
+        self.time_scale = time_scale
+        self.end_time = start_time + timedelta(seconds=duration_seconds) if duration_seconds else None
+        self.current_time = start_time
+
+    def now(self) -> datetime:
+        return self.current_time
+
+    def advance(self, seconds: float) -> None:
+        self.current_time += timedelta(seconds=seconds)
+
+    def finished(self) -> bool:
+        return self.end_time is not None and self.current_time >= self.end_time
+
+    def get_status(self) -> Dict[str, Any]:
+        return {
+            'mode': 'replay',
+            'time_scale': self.time_scale,
+            'start_time': self.start_time.isoformat(),
+            'end_time': self.end_time.isoformat() if self.end_time else None,
+            'simulated_time': self.current_time.isoformat(),
+            'simulated_elapsed_seconds': (self.current_time - self.start_time).total_seconds(),
+            'finished': self.finished()
+        }
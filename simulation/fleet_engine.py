@@ -0,0 +1,393 @@
+"""
+Vectorized Fleet Simulation Engine for GuzoSync
+
+This module provides a simulation engine that keeps the state of the whole
+fleet in NumPy arrays instead of one BusState object per bus:
+1. Route waypoints are compiled into flat arrays shared by every bus on a route
+2. Each tick advances every bus in a single vectorized step
+3. Changed positions are published to the tracking pipeline as one tick event
+
+It is intended for load-testing the platform with thousands of simulated buses
+on a single core.
+"""
+
+import logging
+from datetime import datetime
+from typing import Dict, List, Any, Optional, Union
+
+import numpy as np
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+from .bus_simulator import BusSimulator
+from .clock import ReplayClock, WallClock
+from .route_cache import CompiledRoute, RouteWaypointCache, haversine_km
+from .tick_publisher import TickPublisher
+
+logger = logging.getLogger(__name__)
+
+# Gap (km) inserted between routes in the global distance axis so that a bus
+# on one route can never be resolved to a segment of its neighbour.
+ROUTE_GAP_KM = 1.0
+
+# Stop duration buckets mirroring MovementCalculator.calculate_stop_duration
+STOP_DURATION_BUCKETS = np.array([[30, 45], [45, 75], [75, 105], [105, 120]])
+STOP_DURATION_WEIGHTS = np.array([0.4, 0.3, 0.2, 0.1])
+
+
+def bearing_deg(lat1, lon1, lat2, lon2):
+    """Vectorized initial bearing in degrees (0-360)."""
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    dlon = lon2 - lon1
+    y = np.sin(dlon) * np.cos(lat2)
+    x = np.cos(lat1) * np.sin(lat2) - np.sin(lat1) * np.cos(lat2) * np.cos(dlon)
+    return (np.degrees(np.arctan2(y, x)) + 360) % 360
+
+
+class VectorizedFleetSimulator(BusSimulator):
+    """Simulation engine that advances the whole fleet in one vectorized step."""
+
+    def __init__(
+        self,
+        db: AsyncIOMotorDatabase,
+        update_interval: float = 5.0,
+        seed: Optional[int] = None,
+        route_cache: Optional[RouteWaypointCache] = None,
+        clock: Optional[Union[WallClock, ReplayClock]] = None,
+        tick_publisher: Optional[TickPublisher] = None
+    ):
+        super().__init__(
+            db, update_interval, route_cache=route_cache, clock=clock, seed=seed, tick_publisher=tick_publisher
+        )
+        self.rng = np.random.default_rng(seed)
+        self.max_buses_to_simulate = 5000
+        self.traffic_update_interval = 30.0  # seconds between traffic resamples
+
+        # Bus identity (index-aligned with the state arrays)
+        self.bus_ids: List[str] = []
+        self.bus_route_ids: List[str] = []
+
+        # Closed-polyline arrays of each simulated route (index-aligned with route_ids)
+        self.route_ids: List[str] = []
+        self.route_arrays: List[Dict[str, Any]] = []
+
+        # Global waypoint arrays (all routes concatenated)
+        self.wp_lat = np.empty(0)
+        self.wp_lon = np.empty(0)
+        self.wp_cum = np.empty(0)         # global distance axis (km)
+        self.wp_seg_len = np.empty(0)     # length of segment starting at waypoint (km)
+        self.wp_speed = np.empty(0)       # base speed of segment starting at waypoint (km/h)
+        self.wp_next_stop = np.empty(0)   # route-local distance of next stop after waypoint (km)
+
+        # Per-bus state arrays
+        self.route_index = np.empty(0, dtype=np.int64)
+        self.route_base = np.empty(0)     # start of the bus's route on the global axis
+        self.route_length = np.empty(0)   # loop length of the bus's route (km)
+        self.route_first = np.empty(0, dtype=np.int64)
+        self.route_last = np.empty(0, dtype=np.int64)
+        self.position = np.empty(0)       # route-local distance along route (km)
+        self.latitude = np.empty(0)
+        self.longitude = np.empty(0)
+        self.heading = np.empty(0)
+        self.speed = np.empty(0)
+        self.dwell_remaining = np.empty(0)
+        self.traffic_factor = np.empty(0)
+        self.traffic_timer = np.empty(0)
+        self.active = np.empty(0, dtype=bool)
+
+        self.last_tick_at: Optional[datetime] = None
+
+    async def initialize(self):
+        """Load buses and routes and compile them into fleet arrays."""
+        try:
+            buses = await self.db.buses.find(self._bus_query()).sort("id", 1).limit(
+                self.max_buses_to_simulate
+            ).to_list(length=None)
+
+            buses_by_route: Dict[str, List[Dict[str, Any]]] = {}
+            for bus_data in buses:
+                buses_by_route.setdefault(bus_data['assigned_route_id'], []).append(bus_data)
+
+            route_arrays: List[Dict[str, np.ndarray]] = []
+            bus_rows: List[Dict[str, Any]] = []
+
+            for route_id, route_buses in buses_by_route.items():
+                route_data = await self._load_route_data(route_id)
+                if not route_data:
+                    continue
+
+                # Waypoints are compiled once per route and shared by its buses
+                route = await self._get_compiled_route(route_data)
+                compiled = self._compile_route(route) if route is not None else None
+                if compiled is None:
+                    continue
+
+                route_idx = len(route_arrays)
+                route_arrays.append(compiled)
+                for bus_data in route_buses:
+                    bus_rows.append({'bus': bus_data, 'route_index': route_idx, 'route_id': route_id})
+
+            self._build_fleet_arrays(route_arrays, bus_rows)
+            logger.info(f"Vectorized simulation initialized with {len(self.bus_ids)} buses on {len(route_arrays)} routes")
+
+        except Exception as e:
+            logger.error(f"❌ Failed to initialize vectorized simulation: {e}")
+            raise
+
+    def _compile_route(self, route: CompiledRoute) -> Optional[Dict[str, Any]]:
+        """Close a compiled route's waypoint loop into polyline arrays."""
+        if len(route) < 2:
+            return None
+
+        lat = np.append(route.latitude, route.latitude[0])
+        lon = np.append(route.longitude, route.longitude[0])
+        is_stop = np.append(route.is_stop, route.is_stop[0])
+        speed = np.append(route.segment_speed, 0.0).astype(np.float64)
+        # Stops carry a speed of 0; approaching buses use the average city speed
+        speed[speed <= 0] = self.movement_calc.average_speed
+
+        cum = np.append(route.cumulative_distance, route.loop_length_km)
+        seg_len = np.zeros(len(lat))
+        seg_len[:-1] = np.diff(cum)
+        length = float(route.loop_length_km)
+        if length <= 0:
+            return None
+
+        # Distance of the first stop strictly after each waypoint (inf if none)
+        stop_idx = np.flatnonzero(is_stop[1:]) + 1
+        next_k = np.searchsorted(stop_idx, np.arange(len(lat)), side='right')
+        next_stop = np.full(len(lat), np.inf)
+        has_next = next_k < len(stop_idx)
+        next_stop[has_next] = cum[stop_idx[next_k[has_next]]]
+
+        return {
+            'route_id': route.route_id,
+            'lat': lat, 'lon': lon, 'cum': cum, 'seg_len': seg_len,
+            'speed': speed, 'next_stop': next_stop, 'length': np.float64(length)
+        }
+
+    def _layout_routes(self, route_arrays: List[Dict[str, Any]]):
+        """Concatenate compiled routes onto the global distance axis.
+
+        Returns:
+            Per-route (base, length, first segment, last segment) arrays
+        """
+        n_routes = len(route_arrays)
+        route_base = np.zeros(n_routes)
+        route_length = np.zeros(n_routes)
+        route_first = np.zeros(n_routes, dtype=np.int64)
+        route_last = np.zeros(n_routes, dtype=np.int64)
+
+        base = 0.0
+        offset = 0
+        for i, compiled in enumerate(route_arrays):
+            route_base[i] = base
+            route_length[i] = compiled['length']
+            route_first[i] = offset
+            route_last[i] = offset + len(compiled['lat']) - 2  # last segment start
+            base += float(compiled['length']) + ROUTE_GAP_KM
+            offset += len(compiled['lat'])
+
+        def concat(key: str) -> np.ndarray:
+            return np.concatenate([c[key] for c in route_arrays]) if route_arrays else np.empty(0)
+
+        self.route_arrays = list(route_arrays)
+        self.route_ids = [c['route_id'] for c in route_arrays]
+        self.wp_lat = concat('lat')
+        self.wp_lon = concat('lon')
+        self.wp_seg_len = concat('seg_len')
+        self.wp_speed = concat('speed')
+        self.wp_next_stop = concat('next_stop')
+        self.wp_cum = (
+            np.concatenate([c['cum'] + route_base[i] for i, c in enumerate(route_arrays)])
+            if route_arrays else np.empty(0)
+        )
+        return route_base, route_length, route_first, route_last
+
+    def _assign_route_layout(self, route_base, route_length, route_first, route_last):
+        """Broadcast per-route layout arrays onto the buses."""
+        self.route_base = route_base[self.route_index]
+        self.route_length = route_length[self.route_index]
+        self.route_first = route_first[self.route_index]
+        self.route_last = route_last[self.route_index]
+
+    def _build_fleet_arrays(self, route_arrays: List[Dict[str, Any]], bus_rows: List[Dict[str, Any]]):
+        """Concatenate compiled routes and lay out per-bus state arrays."""
+        n_routes = len(route_arrays)
+        route_base, route_length, route_first, route_last = self._layout_routes(route_arrays)
+
+        n = len(bus_rows)
+        self.bus_ids = [row['bus']['id'] for row in bus_rows]
+        self.bus_route_ids = [row['route_id'] for row in bus_rows]
+        self.route_index = np.array([row['route_index'] for row in bus_rows], dtype=np.int64)
+        self._assign_route_layout(route_base, route_length, route_first, route_last)
+
+        self.position = np.zeros(n)
+        self.speed = np.zeros(n)
+        self.heading = np.zeros(n)
+        self.dwell_remaining = np.zeros(n)
+        self.traffic_factor = np.ones(n)
+        self.traffic_timer = self.rng.uniform(0, self.traffic_update_interval, n)
+        self.active = np.ones(n, dtype=bool)
+
+        # Place buses: snap known locations to the nearest waypoint of their
+        # route, spread the others evenly so they do not start bunched.
+        per_route_count: Dict[int, int] = {}
+        per_route_total = np.bincount(self.route_index, minlength=n_routes) if n else np.zeros(0, dtype=np.int64)
+        for i, row in enumerate(bus_rows):
+            r = row['route_index']
+            first, last = route_first[r], route_last[r] + 1
+            location = row['bus'].get('current_location') or {}
+            lat, lon = location.get('latitude'), location.get('longitude')
+            if lat and lon:
+                nearest = int(np.argmin(haversine_km(self.wp_lat[first:last], self.wp_lon[first:last], lat, lon)))
+                self.position[i] = self.wp_cum[first + nearest] - route_base[r]
+            else:
+                k = per_route_count.get(r, 0)
+                per_route_count[r] = k + 1
+                self.position[i] = route_length[r] * k / max(per_route_total[r], 1)
+
+        self.latitude = np.zeros(n)
+        self.longitude = np.zeros(n)
+        if n:
+            self._update_coordinates(self._current_segments())
+
+    def _simulated_route_ids(self) -> set:
+        """IDs of the routes currently driven by simulated buses."""
+        return set(self.route_ids)
+
+    def _rebind_route(self, route: CompiledRoute):
+        """Swap in a recompiled route, keeping each bus's fractional progress."""
+        if route.route_id not in self.route_ids:
+            return
+        compiled = self._compile_route(route)
+        if compiled is None:
+            return
+
+        r = self.route_ids.index(route.route_id)
+        on_route = self.route_index == r
+        progress = self.position[on_route] / self.route_length[on_route]
+
+        route_arrays = list(self.route_arrays)
+        route_arrays[r] = compiled
+        self._assign_route_layout(*self._layout_routes(route_arrays))
+        self.position[on_route] = progress * self.route_length[on_route]
+        if len(self.bus_ids):
+            self._update_coordinates(self._current_segments())
+
+    def _current_segments(self) -> np.ndarray:
+        """Resolve the global segment index of every bus from its route position."""
+        seg = np.searchsorted(self.wp_cum, self.route_base + self.position, side='right') - 1
+        return np.clip(seg, self.route_first, self.route_last)
+
+    def _update_coordinates(self, seg: np.ndarray):
+        """Interpolate lat/lon and heading for every bus along its segment."""
+        seg_len = self.wp_seg_len[seg]
+        fraction = np.divide(
+            self.route_base + self.position - self.wp_cum[seg], seg_len,
+            out=np.zeros_like(seg_len), where=seg_len > 0
+        )
+        fraction = np.clip(fraction, 0.0, 1.0)
+        lat1, lon1 = self.wp_lat[seg], self.wp_lon[seg]
+        lat2, lon2 = self.wp_lat[seg + 1], self.wp_lon[seg + 1]
+        # Segments are densified to <= 200 m, so linear interpolation is accurate enough
+        self.latitude = lat1 + (lat2 - lat1) * fraction
+        self.longitude = lon1 + (lon2 - lon1) * fraction
+        self.heading = bearing_deg(lat1, lon1, lat2, lon2)
+
+    def _sample_stop_durations(self, count: int) -> np.ndarray:
+        """Vectorized equivalent of MovementCalculator.calculate_stop_duration."""
+        buckets = self.rng.choice(len(STOP_DURATION_WEIGHTS), size=count, p=STOP_DURATION_WEIGHTS)
+        low, high = STOP_DURATION_BUCKETS[buckets, 0], STOP_DURATION_BUCKETS[buckets, 1]
+        return self.rng.integers(low, high + 1).astype(np.float64)
+
+    def _sample_traffic_factors(self, count: int) -> np.ndarray:
+        """Vectorized equivalent of MovementCalculator.simulate_traffic_delay."""
+        delayed = self.rng.random(count) >= 0.8
+        return np.where(delayed, self.rng.uniform(0.3, 0.8, count), 1.0)
+
+    def step(self, time_delta: float) -> np.ndarray:
+        """
+        Advance every bus by ``time_delta`` seconds.
+
+        Returns:
+            Indices of buses whose reported state changed during this tick
+        """
+        n = len(self.bus_ids)
+        if n == 0:
+            return np.empty(0, dtype=np.int64)
+
+        calc = self.movement_calc
+
+        # Dwell timers: buses at a stop do not move until their timer expires
+        dwelling = self.active & (self.dwell_remaining > 0)
+        self.dwell_remaining[dwelling] -= time_delta
+        departed = dwelling & (self.dwell_remaining <= 0)
+        self.dwell_remaining[departed] = 0.0
+        moving = self.active & ~dwelling
+
+        # Traffic conditions are resampled per bus every traffic_update_interval
+        self.traffic_timer -= time_delta
+        resample = self.traffic_timer <= 0
+        if resample.any():
+            self.traffic_factor[resample] = self._sample_traffic_factors(int(resample.sum()))
+            self.traffic_timer[resample] = self.traffic_update_interval
+
+        seg = self._current_segments()
+        variation = 1.0 + self.rng.uniform(-calc.traffic_variation, calc.traffic_variation, n)
+        speed = np.clip(self.wp_speed[seg] * variation, calc.min_speed, calc.max_speed)
+        speed = np.round(speed, 1) * self.traffic_factor
+
+        target = self.position + speed / 3600.0 * time_delta
+        next_stop = self.wp_next_stop[seg]
+        arrived = moving & (target >= next_stop)
+
+        new_position = np.where(arrived, next_stop, target)
+        self.position = np.where(moving, np.mod(new_position, self.route_length), self.position)
+        self.speed = np.where(moving & ~arrived, speed, 0.0)
+
+        if arrived.any():
+            self.dwell_remaining[arrived] = self._sample_stop_durations(int(arrived.sum()))
+
+        self._update_coordinates(self._current_segments())
+        return np.flatnonzero(moving | departed)
+
+    def build_location_batch(self, indices: np.ndarray) -> List[Dict[str, Any]]:
+        """Build the location payload for the tracking pipeline."""
+        latitudes = self.latitude[indices].tolist()
+        longitudes = self.longitude[indices].tolist()
+        headings = self.heading[indices].tolist()
+        speeds = self.speed[indices].tolist()
+        return [
+            {
+                'bus_id': self.bus_ids[i],
+                'route_id': self.bus_route_ids[i],
+                'latitude': latitudes[k],
+                'longitude': longitudes[k],
+                'heading': headings[k],
+                'speed': speeds[k]
+            }
+            for k, i in enumerate(indices.tolist())
+        ]
+
+    def _tick(self) -> List[Dict[str, Any]]:
+        """Advance the whole fleet by the simulated time since the last tick."""
+        now = self.clock.now()
+        time_delta = (now - self.last_tick_at).total_seconds() if self.last_tick_at else 0.0
+        self.last_tick_at = now
+        return self.build_location_batch(self.step(time_delta))
+
+    def get_simulation_status(self) -> Dict[str, Any]:
+        """Get current simulation status."""
+        return {
+            'engine': 'vectorized',
+            'is_running': self.is_running,
+            'total_buses': len(self.bus_ids),
+            'active_buses': int(self.active.sum()),
+            'buses_at_stop': int((self.dwell_remaining > 0).sum()),
+            'update_interval': self.update_interval,
+            'routes_loaded': len(self.routes_cache),
+            'waypoints_loaded': len(self.wp_lat),
+            'route_cache': self.route_cache.get_stats(),
+            'clock': self.get_clock_status(),
+            'tick_metrics': self.get_tick_metrics()
+        }
@@ -18,7 +18,10 @@ from datetime import datetime, timedelta
 class MovementCalculator:
     """Calculate realistic bus movement and physics."""
     
-    def __init__(self):
+    def __init__(self, rng: Optional[random.Random] = None):
+        # Random source; pass a seeded random.Random for reproducible runs
+        self.rng = rng if rng is not None else random.Random()
+        
         # Realistic bus parameters (in km/h)
         self.min_speed = 5.0  # Minimum speed in traffic
         self.max_speed = 60.0  # Maximum speed on open roads
@@ -108,7 +111,7 @@ class MovementCalculator:
             base_speed = self.average_speed
         
         # Apply traffic variation
-        traffic_factor = 1.0 + random.uniform(-self.traffic_variation, self.traffic_variation)
+        traffic_factor = 1.0 + self.rng.uniform(-self.traffic_variation, self.traffic_variation)
         speed = base_speed * traffic_factor
         
         # Ensure speed is within realistic bounds
@@ -125,13 +128,13 @@ class MovementCalculator:
         # Most stops are short, some are longer
         weights = [0.4, 0.3, 0.2, 0.1]  # 40% short, 30% medium, 20% long, 10% very long
         durations = [
-            random.randint(30, 45),   # Short stop
-            random.randint(45, 75),   # Medium stop
-            random.randint(75, 105),  # Long stop
-            random.randint(105, 120)  # Very long stop
+            self.rng.randint(30, 45),   # Short stop
+            self.rng.randint(45, 75),   # Medium stop
+            self.rng.randint(75, 105),  # Long stop
+            self.rng.randint(105, 120)  # Very long stop
         ]
         
-        return random.choices(durations, weights=weights)[0]
+        return self.rng.choices(durations, weights=weights)[0]
     
     def calculate_next_position(
         self,
@@ -177,8 +180,8 @@ class MovementCalculator:
         Returns delay factor (1.0 = no delay, 0.5 = 50% slower, etc.)
         """
         # 80% chance of normal traffic, 20% chance of delays
-        if random.random() < 0.8:
+        if self.rng.random() < 0.8:
             return 1.0  # Normal traffic
         else:
             # Traffic delay: 20% to 70% slower
-            return random.uniform(0.3, 0.8)
+            return self.rng.uniform(0.3, 0.8)
@@ -0,0 +1,367 @@
+"""
+Synthetic Passenger Population for Bus Simulation
+
+This module spawns virtual passengers to load-test the proximity pipeline:
+1. Passengers are placed around stops from data/stops.txt and stored as
+   PASSENGER users with location sharing enabled, marked ``is_simulated``;
+   user listings, exports, broadcasts and recipient counts go through
+   ``core.mongo_utils.real_users_query`` and leave them out
+2. Each passenger holds an in-process WebSocket connection with a
+   PROXIMITY_ALERT subscription and streams location updates through
+   handle_passenger_location_update
+3. Simulated bus positions are checked against populated stops and run
+   through check_proximity_notifications, as a driver app would
+4. Notification latency (bus enters radius -> passenger receives alert) and
+   server time per passenger are reported
+"""
+
+import asyncio
+import csv
+import json
+import logging
+import math
+import random
+import time
+import uuid
+from collections import deque
+from datetime import datetime, timezone
+from typing import Dict, List, Any, Optional, Set, Tuple, cast
+
+import numpy as np
+from fastapi import WebSocket
+
+from core.realtime.bus_tracking import bus_tracking_service
+from core.realtime.websocket_events import WebSocketEventHandlers
+from core.websocket_manager import websocket_manager
+from .route_cache import haversine_km
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_STOPS_PATH = "data/stops.txt"
+METERS_PER_DEGREE = 111320.0
+
+
+def load_stops(path: str = DEFAULT_STOPS_PATH) -> List[Dict[str, Any]]:
+    """Load stops (id, name, latitude, longitude) from a GTFS stops file."""
+    stops = []
+    with open(path, 'r', encoding='utf-8') as file:
+        for row in csv.DictReader(file):
+            try:
+                stops.append({
+                    'stop_id': row['stop_id'],
+                    'name': row.get('stop_name') or row['stop_id'],
+                    'latitude': float(row['stop_lat']),
+                    'longitude': float(row['stop_lon'])
+                })
+            except (KeyError, ValueError):
+                continue
+    return stops
+
+
+class VirtualPassengerSocket:
+    """In-process stand-in for a passenger's WebSocket connection."""
+
+    def __init__(self, population: 'PassengerPopulation', user_id: str):
+        self.population = population
+        self.user_id = user_id
+        self.messages_received = 0
+
+    async def send_text(self, text: str) -> None:
+        received_at = time.monotonic()
+        self.messages_received += 1
+        message = json.loads(text)
+        if message.get('type') == 'proximity_alert':
+            self.population.record_alert(self.user_id, message.get('bus_id'), received_at)
+
+
+class PassengerPopulation:
+    """Population of virtual passengers waiting at stops."""
+
+    def __init__(
+        self,
+        db,
+        app_state: Any,
+        size: int,
+        stops: Optional[List[Dict[str, Any]]] = None,
+        stop_count: int = 200,
+        update_interval: float = 30.0,
+        wait_radius_m: float = 150.0,
+        proximity_radius_m: float = 500.0,
+        concurrency: int = 50,
+        seed: Optional[int] = None
+    ):
+        self.db = db
+        self.app_state = app_state
+        self.size = size
+        self.stop_count = stop_count
+        self.update_interval = update_interval
+        self.wait_radius_m = wait_radius_m
+        self.proximity_radius_m = proximity_radius_m
+        self.concurrency = concurrency
+        self.rng = random.Random(seed)
+        self._stops_source = stops
+
+        # Population layout
+        self.stops: List[Dict[str, Any]] = []
+        self.stop_lat = np.empty(0)
+        self.stop_lon = np.empty(0)
+        self.passengers: List[Dict[str, Any]] = []
+        self.passenger_stop: Dict[str, int] = {}  # user_id -> stop index
+        self.sockets: Dict[str, VirtualPassengerSocket] = {}
+
+        # Bus/stop proximity state: (bus_id, stop index) -> time the bus entered the radius
+        self.entered_at: Dict[Tuple[str, int], float] = {}
+        self.bus_inside: Dict[str, Set[int]] = {}  # bus_id -> stop indices within the radius
+        self.alerted: Dict[Tuple[str, int], Set[str]] = {}
+
+        self.stream_task: Optional[asyncio.Task] = None
+        self.started_at: Optional[float] = None
+
+        # Metrics
+        self.location_updates = 0
+        self.location_update_errors = 0
+        self.location_update_ms = 0.0
+        self.proximity_checks = 0
+        self.proximity_check_ms = 0.0
+        self.alerts_received = 0
+        self.latencies_ms: deque = deque(maxlen=10000)
+
+    async def spawn(self):
+        """Place passengers around stops, store them and connect their sockets."""
+        self._place_passengers()
+        await self._persist_passengers()
+        await self._connect_passengers()
+        logger.info(f"Spawned {len(self.passengers)} virtual passengers at {len(self.stops)} stops")
+
+    def _place_passengers(self):
+        """Assign every passenger a stop and a waiting position near it."""
+        stops = self._stops_source if self._stops_source is not None else load_stops()
+        self.stops = self.rng.sample(stops, min(self.stop_count, len(stops)))
+        self.stop_lat = np.array([s['latitude'] for s in self.stops], dtype=np.float64)
+        self.stop_lon = np.array([s['longitude'] for s in self.stops], dtype=np.float64)
+
+        self.passengers = []
+        self.passenger_stop = {}
+        if not self.stops:
+            return
+
+        for n in range(self.size):
+            stop_index = n % len(self.stops)
+            stop = self.stops[stop_index]
+            latitude, longitude = self._offset(stop['latitude'], stop['longitude'], self.wait_radius_m)
+            user_id = str(uuid.UUID(int=self.rng.getrandbits(128), version=4))
+            self.passengers.append({
+                'id': user_id,
+                'stop_index': stop_index,
+                'home_latitude': latitude,
+                'home_longitude': longitude
+            })
+            self.passenger_stop[user_id] = stop_index
+
+    def _offset(self, latitude: float, longitude: float, max_distance_m: float) -> Tuple[float, float]:
+        """Random point within ``max_distance_m`` of a coordinate."""
+        distance = max_distance_m * math.sqrt(self.rng.random())
+        bearing = self.rng.uniform(0, 2 * math.pi)
+        dlat = distance * math.cos(bearing) / METERS_PER_DEGREE
+        dlon = distance * math.sin(bearing) / (METERS_PER_DEGREE * math.cos(math.radians(latitude)))
+        return latitude + dlat, longitude + dlon
+
+    async def _persist_passengers(self):
+        """Replace previously simulated passengers with this population."""
+        await self.db.users.delete_many({"role": "PASSENGER", "is_simulated": True})
+
+        now = datetime.now(timezone.utc)
+        docs = [
+            {
+                "_id": p['id'],
+                "id": p['id'],
+                "first_name": "Simulated",
+                "last_name": f"Passenger {n}",
+                "email": f"sim-passenger-{n}@loadtest.guzosync.com",
+                "password": "!",  # not a valid hash, simulated passengers cannot log in
+                "role": "PASSENGER",
+                "phone_number": f"+2519{n:08d}",
+                "is_active": True,
+                "location_sharing_enabled": True,
+                "current_location": {
+                    "latitude": p['home_latitude'],
+                    "longitude": p['home_longitude']
+                },
+                "last_location_update": now,
+                "is_simulated": True,
+                "created_at": now,
+                "updated_at": now
+            }
+            for n, p in enumerate(self.passengers)
+        ]
+        for start in range(0, len(docs), 1000):
+            await self.db.users.insert_many(docs[start:start + 1000], ordered=False)
+
+    async def _connect_passengers(self):
+        """Register a socket and a PROXIMITY_ALERT subscription per passenger."""
+        for passenger in self.passengers:
+            user_id = passenger['id']
+            socket = VirtualPassengerSocket(self, user_id)
+            self.sockets[user_id] = socket
+            await websocket_manager.connect_user(cast(WebSocket, socket), user_id, "PASSENGER")
+            websocket_manager.subscribe_to_notifications(user_id, ["PROXIMITY_ALERT"])
+
+    async def start(self):
+        """Start streaming passenger location updates."""
+        self.started_at = time.monotonic()
+        if self.stream_task and not self.stream_task.done():
+            return
+        self.stream_task = asyncio.create_task(self._stream_loop())
+
+    async def stop(self, remove_passengers: bool = True):
+        """Stop streaming, disconnect sockets and optionally delete the passengers."""
+        if self.stream_task:
+            self.stream_task.cancel()
+            try:
+                await self.stream_task
+            except asyncio.CancelledError:
+                pass
+            self.stream_task = None
+
+        for user_id in list(self.sockets):
+            await websocket_manager.disconnect_user(user_id)
+        self.sockets.clear()
+
+        if remove_passengers:
+            await self.db.users.delete_many({"role": "PASSENGER", "is_simulated": True})
+            await self.db.notifications.delete_many({"user_id": {"$in": [p['id'] for p in self.passengers]}})
+
+    async def _stream_loop(self):
+        """Send a location update for every passenger each update interval."""
+        try:
+            while True:
+                started = time.monotonic()
+                for start in range(0, len(self.passengers), self.concurrency):
+                    chunk = self.passengers[start:start + self.concurrency]
+                    await asyncio.gather(*(self._send_location_update(p) for p in chunk))
+
+                sleep_time = self.update_interval - (time.monotonic() - started)
+                await asyncio.sleep(max(sleep_time, 0))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error in passenger location stream: {e}")
+
+    async def _send_location_update(self, passenger: Dict[str, Any]):
+        """Stream one jittered position through the passenger location handler."""
+        latitude, longitude = self._offset(passenger['home_latitude'], passenger['home_longitude'], 10.0)
+        started = time.monotonic()
+        try:
+            result = await WebSocketEventHandlers.handle_passenger_location_update(
+                passenger['id'],
+                {"latitude": latitude, "longitude": longitude},
+                self.app_state
+            )
+            if not result.get("success"):
+                self.location_update_errors += 1
+        except Exception:
+            self.location_update_errors += 1
+        finally:
+            self.location_updates += 1
+            self.location_update_ms += (time.monotonic() - started) * 1000
+
+    async def on_tick(self, buses: List[Dict[str, Any]], published_at: float):
+        """Tick publisher listener: track radius entries and run proximity checks."""
+        if not buses or not self.stops:
+            return
+
+        latitude = np.array([b['latitude'] for b in buses], dtype=np.float64)
+        longitude = np.array([b['longitude'] for b in buses], dtype=np.float64)
+        near_stops: List[Tuple[Dict[str, Any], np.ndarray]] = []
+
+        # Chunk the bus x stop distance matrix to bound memory on large fleets
+        for start in range(0, len(buses), 512):
+            distance_m = haversine_km(
+                latitude[start:start + 512, None], longitude[start:start + 512, None],
+                self.stop_lat[None, :], self.stop_lon[None, :]
+            ) * 1000
+            inside = distance_m <= self.proximity_radius_m
+            for offset, bus in enumerate(buses[start:start + 512]):
+                stop_indices = np.flatnonzero(inside[offset])
+                self._update_entries(bus['bus_id'], stop_indices, published_at)
+                if len(stop_indices):
+                    near_stops.append((bus, stop_indices))
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def check(bus: Dict[str, Any]):
+            async with semaphore:
+                started = time.monotonic()
+                await bus_tracking_service.check_proximity_notifications(
+                    bus['bus_id'], bus['latitude'], bus['longitude'], app_state=self.app_state
+                )
+                self.proximity_checks += 1
+                self.proximity_check_ms += (time.monotonic() - started) * 1000
+
+        await asyncio.gather(*(check(bus) for bus, _ in near_stops))
+
+    def _update_entries(self, bus_id: str, stop_indices: np.ndarray, published_at: float):
+        """Record when a bus enters and forget when it leaves a stop's radius."""
+        previous = self.bus_inside.get(bus_id, set())
+        current = set(stop_indices.tolist())
+        if not previous and not current:
+            return
+
+        for stop_index in previous - current:
+            self.entered_at.pop((bus_id, stop_index), None)
+            self.alerted.pop((bus_id, stop_index), None)
+        for stop_index in current - previous:
+            self.entered_at[(bus_id, stop_index)] = published_at
+
+        if current:
+            self.bus_inside[bus_id] = current
+        else:
+            self.bus_inside.pop(bus_id, None)
+
+    def record_alert(self, user_id: str, bus_id: Optional[str], received_at: float):
+        """Record the latency of the first alert per bus visit to a passenger's stop."""
+        self.alerts_received += 1
+        stop_index = self.passenger_stop.get(user_id)
+        if bus_id is None or stop_index is None:
+            return
+        key = (bus_id, stop_index)
+        entered = self.entered_at.get(key)
+        if entered is None:
+            return
+        alerted = self.alerted.setdefault(key, set())
+        if user_id in alerted:
+            return
+        alerted.add(user_id)
+        self.latencies_ms.append((received_at - entered) * 1000)
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """Get latency and server cost metrics."""
+        latencies = np.array(self.latencies_ms) if self.latencies_ms else None
+        server_ms = self.location_update_ms + self.proximity_check_ms
+        passengers = len(self.passengers)
+        elapsed = time.monotonic() - self.started_at if self.started_at else 0.0
+
+        return {
+            'passengers': passengers,
+            'connected': len(self.sockets),
+            'stops_populated': len(self.stops),
+            'update_interval': self.update_interval,
+            'elapsed_seconds': round(elapsed, 1),
+            'location_updates': self.location_updates,
+            'location_update_errors': self.location_update_errors,
+            'avg_location_update_ms': round(self.location_update_ms / self.location_updates, 2) if self.location_updates else 0.0,
+            'proximity_checks': self.proximity_checks,
+            'avg_proximity_check_ms': round(self.proximity_check_ms / self.proximity_checks, 2) if self.proximity_checks else 0.0,
+            'alerts_received': self.alerts_received,
+            'notification_latency_ms': {
+                'samples': len(self.latencies_ms),
+                'p50': round(float(np.percentile(latencies, 50)), 2) if latencies is not None else None,
+                'p95': round(float(np.percentile(latencies, 95)), 2) if latencies is not None else None,
+                'max': round(float(latencies.max()), 2) if latencies is not None else None
+            },
+            # Server time spent on passenger updates and the proximity checks they enable
+            'server_ms_per_passenger': round(server_ms / passengers, 3) if passengers else 0.0,
+            'server_ms_per_passenger_per_minute': (
+                round(server_ms / passengers / (elapsed / 60), 3) if passengers and elapsed > 0 else 0.0
+            )
+        }
@@ -0,0 +1,175 @@
+"""
+Route Waypoint Cache for Bus Simulation
+
+This module compiles generated route waypoints into compact array-backed
+structures that are shared by every simulated bus on the same route:
+1. Waypoint dicts are compiled once per route into NumPy arrays
+2. Compiled routes are cached by route ID with a fingerprint of the route's
+   geometry and stop list
+3. A changed route_geometry or stop_ids invalidates the cached entry
+"""
+
+import hashlib
+import json
+from typing import Dict, List, Any, Optional
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Vectorized great circle distance in kilometers."""
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def route_fingerprint(route_data: Dict[str, Any]) -> str:
+    """Fingerprint the parts of a route document that shape its waypoints."""
+    payload = json.dumps(
+        {
+            'stop_ids': route_data.get('stop_ids') or [],
+            'route_geometry': route_data.get('route_geometry')
+        },
+        sort_keys=True,
+        default=str
+    )
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+class CompiledRoute:
+    """Array-backed waypoints of one circular route."""
+
+    __slots__ = (
+        'route_id', 'fingerprint', 'latitude', 'longitude', 'cumulative_distance',
+        'segment_speed', 'is_stop', 'stop_indices', 'stop_ids', 'stop_names', 'loop_length_km'
+    )
+
+    def __init__(
+        self,
+        route_id: str,
+        fingerprint: str,
+        latitude: np.ndarray,
+        longitude: np.ndarray,
+        segment_speed: np.ndarray,
+        is_stop: np.ndarray,
+        stop_ids: List[Optional[str]],
+        stop_names: List[Optional[str]]
+    ):
+        self.route_id = route_id
+        self.fingerprint = fingerprint
+        self.latitude = latitude
+        self.longitude = longitude
+        self.segment_speed = segment_speed  # km/h towards each waypoint, 0 at stops
+        self.is_stop = is_stop
+        self.stop_indices = np.flatnonzero(is_stop).astype(np.int32)
+        self.stop_ids = stop_ids  # aligned with stop_indices
+        self.stop_names = stop_names  # aligned with stop_indices
+
+        # Cumulative distance (km) from the first waypoint; the loop closes back to it
+        segment_lengths = haversine_km(latitude[:-1], longitude[:-1], latitude[1:], longitude[1:])
+        self.cumulative_distance = np.concatenate(([0.0], np.cumsum(segment_lengths)))
+        closing = float(haversine_km(latitude[-1], longitude[-1], latitude[0], longitude[0])) if len(latitude) else 0.0
+        self.loop_length_km = float(self.cumulative_distance[-1]) + closing if len(latitude) else 0.0
+
+    @classmethod
+    def from_waypoints(
+        cls,
+        route_id: str,
+        fingerprint: str,
+        waypoints: List[Dict[str, Any]]
+    ) -> 'CompiledRoute':
+        """Compile waypoint dicts produced by RoutePathGenerator."""
+        stops = [wp for wp in waypoints if wp.get('is_bus_stop', False)]
+        return cls(
+            route_id=route_id,
+            fingerprint=fingerprint,
+            latitude=np.array([wp['latitude'] for wp in waypoints], dtype=np.float64),
+            longitude=np.array([wp['longitude'] for wp in waypoints], dtype=np.float64),
+            segment_speed=np.array([wp.get('estimated_speed', 25.0) or 0.0 for wp in waypoints], dtype=np.float32),
+            is_stop=np.array([bool(wp.get('is_bus_stop', False)) for wp in waypoints], dtype=bool),
+            stop_ids=[wp.get('stop_id') for wp in stops],
+            stop_names=[wp.get('stop_name') for wp in stops]
+        )
+
+    def __len__(self) -> int:
+        return len(self.latitude)
+
+    def next_waypoint(self, latitude: float, longitude: float) -> int:
+        """Index of the waypoint ending the loop segment closest to a position."""
+        count = len(self.latitude)
+        if count < 2:
+            return 0
+        # Local equirectangular plane (km), including the closing segment back to the start
+        lat0 = np.radians(float(self.latitude.mean()))
+        x = np.radians(np.append(self.longitude, self.longitude[0])) * np.cos(lat0) * EARTH_RADIUS_KM
+        y = np.radians(np.append(self.latitude, self.latitude[0])) * EARTH_RADIUS_KM
+        px = np.radians(longitude) * np.cos(lat0) * EARTH_RADIUS_KM
+        py = np.radians(latitude) * EARTH_RADIUS_KM
+        dx, dy = np.diff(x), np.diff(y)
+        length_sq = dx * dx + dy * dy
+        t = np.clip(((px - x[:-1]) * dx + (py - y[:-1]) * dy) / np.where(length_sq > 0, length_sq, 1.0), 0.0, 1.0)
+        distance_sq = (x[:-1] + t * dx - px) ** 2 + (y[:-1] + t * dy - py) ** 2
+        return (int(np.argmin(distance_sq)) + 1) % count
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate memory held by the waypoint arrays."""
+        return int(
+            self.latitude.nbytes + self.longitude.nbytes + self.cumulative_distance.nbytes
+            + self.segment_speed.nbytes + self.is_stop.nbytes + self.stop_indices.nbytes
+        )
+
+
+class RouteWaypointCache:
+    """Cache of compiled routes keyed by route ID and invalidated by fingerprint."""
+
+    def __init__(self):
+        self._routes: Dict[str, CompiledRoute] = {}
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, route_data: Dict[str, Any]) -> Optional[CompiledRoute]:
+        """Return the compiled route if it is still current for this route document."""
+        compiled = self._routes.get(route_data['id'])
+        if compiled is None:
+            self.misses += 1
+            return None
+        if compiled.fingerprint != route_fingerprint(route_data):
+            self.invalidate(compiled.route_id)
+            self.misses += 1
+            return None
+        self.hits += 1
+        return compiled
+
+    def is_current(self, route_data: Dict[str, Any]) -> bool:
+        """Check whether the cached entry matches the route document."""
+        compiled = self._routes.get(route_data['id'])
+        return compiled is not None and compiled.fingerprint == route_fingerprint(route_data)
+
+    def put(self, compiled: CompiledRoute) -> None:
+        self._routes[compiled.route_id] = compiled
+
+    def invalidate(self, route_id: str) -> None:
+        if self._routes.pop(route_id, None) is not None:
+            self.invalidations += 1
+
+    def clear(self) -> None:
+        self._routes.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get cache statistics."""
+        return {
+            'compiled_routes': len(self._routes),
+            'waypoints': sum(len(route) for route in self._routes.values()),
+            'memory_bytes': sum(route.nbytes for route in self._routes.values()),
+            'hits': self.hits,
+            'misses': self.misses,
+            'invalidations': self.invalidations
+        }
+
+
+# Shared cache used by every simulator instance
+route_waypoint_cache = RouteWaypointCache()
@@ -18,7 +18,8 @@ from models.base import Location
 class RoutePathGenerator:
     """Generate realistic paths for bus routes."""
     
-    def __init__(self):
+    def __init__(self, rng: Optional[random.Random] = None):
+        self.rng = rng if rng is not None else random.Random()
         self.waypoint_density = 0.5  # km between waypoints
         self.path_variation = 0.001  # Degree variation for realistic paths
         
@@ -161,8 +162,8 @@ class RoutePathGenerator:
             fraction = i / num_waypoints
             
             # Add some random variation for realistic paths
-            lat_variation = random.uniform(-self.path_variation, self.path_variation)
-            lon_variation = random.uniform(-self.path_variation, self.path_variation)
+            lat_variation = self.rng.uniform(-self.path_variation, self.path_variation)
+            lon_variation = self.rng.uniform(-self.path_variation, self.path_variation)
             
             intermediate_lat, intermediate_lon = calc.calculate_intermediate_point(
                 lat1, lon1, lat2, lon2, fraction
@@ -222,10 +223,10 @@ class RoutePathGenerator:
         # Vary speed based on position in route
         if segment_index < total_segments * 0.1 or segment_index > total_segments * 0.9:
             # Slower at route ends (urban areas)
-            return random.uniform(15, 25)
+            return self.rng.uniform(15, 25)
         else:
             # Faster in middle sections
-            return random.uniform(25, 45)
+            return self.rng.uniform(25, 45)
 
     def _estimate_speed_for_road_segment(self, segment_index: int, total_segments: int) -> float:
         """Estimate appropriate speed for a road segment based on Mapbox data."""
@@ -234,13 +235,13 @@ class RoutePathGenerator:
 
         # Urban areas (start/end of routes) - slower speeds
         if position_ratio < 0.15 or position_ratio > 0.85:
-            return random.uniform(15, 30)  # City streets
+            return self.rng.uniform(15, 30)  # City streets
         # Suburban areas - medium speeds
         elif position_ratio < 0.3 or position_ratio > 0.7:
-            return random.uniform(25, 40)  # Arterial roads
+            return self.rng.uniform(25, 40)  # Arterial roads
         # Highway/main road sections - faster speeds
         else:
-            return random.uniform(35, 50)  # Main roads/highways
+            return self.rng.uniform(35, 50)  # Main roads/highways
 
     def _classify_road_segment(self, segment_index: int, total_segments: int) -> str:
         """Classify the type of road segment."""
@@ -258,7 +259,7 @@ class RoutePathGenerator:
         # Weighted random speed distribution
         speeds = [15, 20, 25, 30, 35, 40]
         weights = [0.1, 0.2, 0.3, 0.2, 0.15, 0.05]
-        return random.choices(speeds, weights=weights)[0]
+        return self.rng.choices(speeds, weights=weights)[0]
     
     def create_circular_route(self, waypoints: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         """
@@ -0,0 +1,208 @@
+"""
+Simulation Shard Supervisor
+
+This module moves the simulation out of the API event loop:
+1. Routes are split into disjoint, bus-count balanced sets, one per shard
+2. Each shard runs in its own process (see shard_worker.py) and persists its
+   own positions
+3. Shards stream batched ticks over a local IPC channel (Unix socket, or
+   loopback TCP where Unix sockets are unavailable); the API process
+   broadcasts them to WebSocket subscribers and tracks headways, so bunching
+   alerts reach the connected regulators
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import os
+import secrets
+import socket
+import tempfile
+import threading
+from multiprocessing.connection import Listener
+from typing import Dict, List, Any, Optional
+
+from .shard_worker import run_shard
+from .tick_publisher import TickPublisher
+
+logger = logging.getLogger(__name__)
+
+
+def assign_routes(route_bus_counts: Dict[str, int], shard_count: int) -> List[List[str]]:
+    """Split routes into ``shard_count`` disjoint sets with balanced bus counts."""
+    shards: List[List[str]] = [[] for _ in range(shard_count)]
+    loads = [0] * shard_count
+    # Largest routes first, each to the least loaded shard
+    for route_id, count in sorted(route_bus_counts.items(), key=lambda item: (-item[1], item[0])):
+        target = loads.index(min(loads))
+        shards[target].append(route_id)
+        loads[target] += count
+    return shards
+
+
+class ShardSupervisor:
+    """Starts, stops and monitors simulation shard processes."""
+
+    def __init__(
+        self,
+        db,
+        shard_count: int,
+        engine: str = "vectorized",
+        update_interval: float = 5.0,
+        max_buses: int = 5000,
+        seed: Optional[int] = None,
+        connect_timeout: float = 30.0
+    ):
+        if shard_count < 1:
+            raise ValueError("shard_count must be at least 1")
+
+        self.db = db
+        self.shard_count = shard_count
+        self.engine = engine
+        self.update_interval = update_interval
+        self.max_buses = max_buses
+        self.seed = seed
+        self.connect_timeout = connect_timeout
+
+        self.listener: Optional[Listener] = None
+        self.processes: List[multiprocessing.process.BaseProcess] = []
+        self.route_assignments: List[List[str]] = []
+        self.stop_event: Optional[Any] = None  # multiprocessing Event of the spawn context
+        self.socket_path: Optional[str] = None
+        self.is_running = False
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+
+        # Positions are persisted by the shards; the API process broadcasts and tracks headways
+        self.publisher = TickPublisher(db, persist=False)
+
+        # Metrics
+        self.ticks_received = 0
+        self.shard_status: Dict[int, Dict[str, Any]] = {}
+        self.shard_ticks: Dict[int, int] = {}
+
+    async def start(self):
+        """Assign routes and start one process per shard."""
+        if self.is_running:
+            return
+
+        self.loop = asyncio.get_running_loop()
+        self.route_assignments = assign_routes(await self._route_bus_counts(), self.shard_count)
+
+        authkey = secrets.token_bytes(32)
+        if hasattr(socket, "AF_UNIX"):
+            self.socket_path = os.path.join(tempfile.gettempdir(), f"guzosync-sim-{os.getpid()}-{secrets.token_hex(4)}.sock")
+            self.listener = Listener(self.socket_path, family="AF_UNIX", authkey=authkey)
+        else:
+            self.listener = Listener(("127.0.0.1", 0), family="AF_INET", authkey=authkey)
+
+        await self.publisher.start()
+
+        context = multiprocessing.get_context("spawn")
+        self.stop_event = context.Event()
+        config = {
+            "mongodb_url": os.getenv("MONGODB_URL", "mongodb://localhost:27017"),
+            "database_name": os.getenv("DATABASE_NAME", "guzosync"),
+            "engine": self.engine,
+            "update_interval": self.update_interval,
+            "max_buses": -(-self.max_buses // self.shard_count),
+            "seed": self.seed
+        }
+
+        self.processes = []
+        for shard_id, route_ids in enumerate(self.route_assignments):
+            process = context.Process(
+                target=run_shard,
+                args=(shard_id, route_ids, self.listener.address, authkey, self.stop_event, config),
+                name=f"bus-simulation-shard-{shard_id}",
+                daemon=True
+            )
+            process.start()
+            self.processes.append(process)
+
+        self.is_running = True
+        try:
+            for _ in self.processes:
+                connection = await asyncio.wait_for(
+                    asyncio.to_thread(self.listener.accept), timeout=self.connect_timeout
+                )
+                threading.Thread(target=self._read_loop, args=(connection,), daemon=True).start()
+        except Exception:
+            await self.stop()
+            raise
+
+        logger.info(f"Started {self.shard_count} simulation shards over {self.listener.address}")
+
+    async def stop(self, timeout: float = 10.0):
+        """Signal shards to stop and wait for their processes to exit."""
+        if self.stop_event is not None:
+            self.stop_event.set()
+
+        for process in self.processes:
+            await asyncio.to_thread(process.join, timeout)
+            if process.is_alive():
+                process.terminate()
+
+        if self.listener is not None:
+            self.listener.close()
+            self.listener = None
+        if self.socket_path and os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+        await self.publisher.stop()
+        self.is_running = False
+
+    async def _route_bus_counts(self) -> Dict[str, int]:
+        """Operational bus count per assigned route."""
+        counts = await self.db.buses.aggregate([
+            {"$match": {"bus_status": "OPERATIONAL", "assigned_route_id": {"$ne": None}}},
+            {"$group": {"_id": "$assigned_route_id", "buses": {"$sum": 1}}}
+        ]).to_list(length=None)
+        return {doc["_id"]: doc["buses"] for doc in counts}
+
+    def _read_loop(self, connection):
+        """Reader thread: hand every message from a shard to the event loop."""
+        assert self.loop is not None
+        try:
+            while True:
+                message = connection.recv()
+                self.loop.call_soon_threadsafe(self._handle_message, message)
+        except (EOFError, OSError):
+            pass
+        finally:
+            connection.close()
+
+    def _handle_message(self, message: Dict[str, Any]):
+        shard_id = message["shard_id"]
+        if message.get("type") == "tick":
+            self.ticks_received += 1
+            self.shard_ticks[shard_id] = self.shard_ticks.get(shard_id, 0) + 1
+            self.publisher.publish(self.ticks_received, message["buses"])
+        elif message.get("type") == "status":
+            self.shard_status[shard_id] = message["status"]
+
+    def get_status(self) -> Dict[str, Any]:
+        """Get per-shard and broadcast status."""
+        shards = []
+        for shard_id, process in enumerate(self.processes):
+            status = self.shard_status.get(shard_id, {})
+            shards.append({
+                "shard_id": shard_id,
+                "pid": process.pid,
+                "alive": process.is_alive(),
+                "routes": len(self.route_assignments[shard_id]),
+                "total_buses": status.get("total_buses", 0),
+                "active_buses": status.get("active_buses", 0),
+                "ticks_received": self.shard_ticks.get(shard_id, 0),
+                "tick_metrics": status.get("tick_metrics", {})
+            })
+
+        return {
+            "is_running": self.is_running,
+            "shard_count": self.shard_count,
+            "engine": self.engine,
+            "total_buses": sum(s["total_buses"] for s in shards),
+            "active_buses": sum(s["active_buses"] for s in shards),
+            "ticks_received": self.ticks_received,
+            "broadcast": self.publisher.get_metrics(),
+            "shards": shards
+        }
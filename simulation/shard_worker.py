@@ -0,0 +1,101 @@
+"""
+Simulation Shard Worker
+
+Entry point of a simulation shard process. Each shard:
+1. Connects to MongoDB and simulates only the routes it owns
+2. Persists its own bus positions with one bulk write per tick
+3. Streams every persisted tick to the API process over a local IPC
+   connection, together with periodic status snapshots
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import time
+from multiprocessing.connection import Client
+from typing import Dict, List, Any
+
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from .bus_simulator import BusSimulator
+from .fleet_engine import VectorizedFleetSimulator
+
+logger = logging.getLogger(__name__)
+
+STATUS_INTERVAL = 5.0  # seconds between status snapshots
+
+
+class ShardSender:
+    """Tick publisher listener that forwards persisted ticks to the API process."""
+
+    def __init__(self, connection, shard_id: int):
+        self.connection = connection
+        self.shard_id = shard_id
+        self.sent_ticks = 0
+
+    async def on_tick(self, buses: List[Dict[str, Any]], published_at: float):
+        self.connection.send({
+            'type': 'tick',
+            'shard_id': self.shard_id,
+            'buses': buses
+        })
+        self.sent_ticks += 1
+
+    def send_status(self, simulator: BusSimulator):
+        self.connection.send({
+            'type': 'status',
+            'shard_id': self.shard_id,
+            'status': simulator.get_simulation_status()
+        })
+
+
+def run_shard(shard_id: int, route_ids: List[str], address, authkey: bytes, stop_event, config: Dict[str, Any]):
+    """Process target: run one simulation shard until ``stop_event`` is set."""
+    logging.basicConfig(level=logging.INFO)
+    try:
+        asyncio.run(_run_shard(shard_id, route_ids, address, authkey, stop_event, config))
+    except (BrokenPipeError, EOFError, ConnectionError):
+        # The API process went away
+        pass
+
+
+async def _run_shard(shard_id: int, route_ids: List[str], address, authkey: bytes, stop_event, config: Dict[str, Any]):
+    connection = Client(address, authkey=authkey)
+    client: AsyncIOMotorClient[Dict[str, Any]] = AsyncIOMotorClient(config['mongodb_url'])
+    db = client[config['database_name']]
+
+    seed = config.get('seed')
+    if config.get('engine') == 'vectorized':
+        simulator: BusSimulator = VectorizedFleetSimulator(
+            db, update_interval=config['update_interval'], seed=seed + shard_id if seed is not None else None
+        )
+    else:
+        simulator = BusSimulator(
+            db, update_interval=config['update_interval'], seed=seed + shard_id if seed is not None else None
+        )
+    simulator.max_buses_to_simulate = config['max_buses']
+    simulator.route_ids = route_ids
+
+    # Headways are tracked in the API process, where the regulators are connected
+    simulator.tick_publisher.track_headways = False
+    sender = ShardSender(connection, shard_id)
+    simulator.tick_publisher.add_listener(sender.on_tick)
+
+    try:
+        await simulator.initialize()
+        await simulator.start_simulation()
+        sender.send_status(simulator)
+
+        parent = multiprocessing.parent_process()
+        last_status = time.monotonic()
+        while not stop_event.is_set():
+            await asyncio.sleep(0.5)
+            if parent is not None and not parent.is_alive():
+                break
+            if time.monotonic() - last_status >= STATUS_INTERVAL:
+                sender.send_status(simulator)
+                last_status = time.monotonic()
+    finally:
+        await simulator.stop_simulation()
+        client.close()
+        connection.close()
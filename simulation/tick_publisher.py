@@ -0,0 +1,161 @@
+"""
+Tick Publisher for Bus Simulation
+
+This module decouples the simulation tick from persistence and fan-out:
+1. The simulator publishes one event per tick containing every changed bus
+2. A background consumer persists and broadcasts events via the tracking service
+3. If the consumer falls behind, pending ticks are coalesced instead of
+   stretching the simulation tick
+4. Listeners (e.g. load-test passengers) see each event after it is persisted
+"""
+
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Dict, List, Any, Optional
+
+from core.realtime.bus_tracking import bus_tracking_service
+
+logger = logging.getLogger(__name__)
+
+# Called with the tick's buses and the monotonic time the tick was published
+TickListener = Callable[[List[Dict[str, Any]], float], Awaitable[None]]
+
+
+class TickPublisher:
+    """Bounded hand-off between the simulation loop and the tracking pipeline."""
+
+    def __init__(
+        self,
+        db,
+        max_pending_ticks: int = 2,
+        persist: bool = True,
+        track_headways: bool = True,
+        collection: str = "buses",
+        room_prefix: str = ""
+    ):
+        self.db = db
+        self.persist = persist
+        self.track_headways = track_headways
+        # Where ticks are written and broadcast (replays stay out of live tracking)
+        self.collection = collection
+        self.room_prefix = room_prefix
+        self.max_pending_ticks = max_pending_ticks
+        self.queue: "asyncio.Queue[Dict[str, Any]]" = asyncio.Queue(maxsize=max_pending_ticks)
+        self.consumer_task: Optional[asyncio.Task] = None
+        self.listeners: List[TickListener] = []
+
+        # Metrics
+        self.published_ticks = 0
+        self.processed_ticks = 0
+        self.dropped_ticks = 0
+        self.failed_ticks = 0
+        self.last_batch_size = 0
+        self.last_persist_duration_ms = 0.0
+        self.last_delivery_lag_ms = 0.0
+        self.max_delivery_lag_ms = 0.0
+
+    async def start(self):
+        """Start the background consumer."""
+        if self.consumer_task and not self.consumer_task.done():
+            return
+        self.consumer_task = asyncio.create_task(self._consume())
+
+    async def stop(self):
+        """Stop the background consumer, discarding pending ticks."""
+        if self.consumer_task:
+            self.consumer_task.cancel()
+            try:
+                await self.consumer_task
+            except asyncio.CancelledError:
+                pass
+            self.consumer_task = None
+
+    def add_listener(self, listener: TickListener) -> None:
+        self.listeners.append(listener)
+
+    def remove_listener(self, listener: TickListener) -> None:
+        if listener in self.listeners:
+            self.listeners.remove(listener)
+
+    def publish(self, tick: int, buses: List[Dict[str, Any]]) -> None:
+        """
+        Publish a tick event without waiting on the consumer.
+
+        When the queue is full the oldest pending tick is dropped and its buses
+        are merged into the new event, so the latest state of every bus is kept.
+        """
+        if not buses:
+            return
+
+        event = {
+            'tick': tick,
+            'buses': buses,
+            'published_at': time.monotonic()
+        }
+
+        if self.queue.full():
+            try:
+                stale = self.queue.get_nowait()
+            except asyncio.QueueEmpty:
+                stale = None
+            if stale is not None:
+                self.dropped_ticks += 1
+                latest_ids = {bus['bus_id'] for bus in buses}
+                event['buses'] = [
+                    bus for bus in stale['buses'] if bus['bus_id'] not in latest_ids
+                ] + buses
+
+        self.queue.put_nowait(event)
+        self.published_ticks += 1
+
+    async def _consume(self):
+        """Persist and broadcast tick events as they arrive."""
+        class AppState:
+            def __init__(self, db):
+                self.mongodb = db
+
+        app_state = AppState(self.db)
+
+        while True:
+            event = await self.queue.get()
+            started = time.monotonic()
+            try:
+                updated = await bus_tracking_service.update_bus_locations_batch(
+                    event['buses'], app_state=app_state,
+                    persist=self.persist, track_headways=self.track_headways,
+                    collection=self.collection, room_prefix=self.room_prefix
+                )
+                for listener in list(self.listeners):
+                    await listener(event['buses'], event['published_at'])
+                # The pipeline logs its own errors and reports them here
+                if updated:
+                    self.processed_ticks += 1
+                else:
+                    self.failed_ticks += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.failed_ticks += 1
+                logger.error(f"Error processing simulation tick {event['tick']}: {e}")
+            finally:
+                finished = time.monotonic()
+                self.last_batch_size = len(event['buses'])
+                self.last_persist_duration_ms = (finished - started) * 1000
+                self.last_delivery_lag_ms = (finished - event['published_at']) * 1000
+                self.max_delivery_lag_ms = max(self.max_delivery_lag_ms, self.last_delivery_lag_ms)
+                self.queue.task_done()
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """Get publisher metrics."""
+        return {
+            'published_ticks': self.published_ticks,
+            'processed_ticks': self.processed_ticks,
+            'dropped_ticks': self.dropped_ticks,
+            'failed_ticks': self.failed_ticks,
+            'pending_ticks': self.queue.qsize(),
+            'last_batch_size': self.last_batch_size,
+            'last_persist_duration_ms': round(self.last_persist_duration_ms, 2),
+            'last_delivery_lag_ms': round(self.last_delivery_lag_ms, 2),
+            'max_delivery_lag_ms': round(self.max_delivery_lag_ms, 2)
+        }
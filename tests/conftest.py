@@ -7,9 +7,12 @@ from unittest.mock import AsyncMock, MagicMock, patch
 from datetime import datetime, timedelta
 from typing import Dict, Any, Optional
 from uuid import uuid4
+import json
 import jwt
 import os
+from types import SimpleNamespace
 from bson import ObjectId
+from pymongo import UpdateMany
 
 from main import app
 from models.user import User, UserRole
@@ -108,6 +111,82 @@ class TestFixtures:
         }
 
 
+class FakeSocket:
+    """Stands in for a connected WebSocket and keeps the decoded messages sent to it"""
+    def __init__(self, fail: bool = False):
+        self.sent: list = []
+        self.fail = fail
+
+    async def send_text(self, text):
+        if self.fail:
+            raise RuntimeError("connection closed")
+        self.sent.append(json.loads(text))
+
+
+class BulkCollection:
+    """mongomock rejects pymongo's UpdateOne in bulk_write, so replay the operations one by one.
+
+    Records the methods called on the collection; ``before_write`` runs just before a bulk write.
+    """
+    def __init__(self, collection, before_write=None):
+        self.collection = collection
+        self.before_write = before_write
+        self.calls: list = []
+
+    def __getattr__(self, name):
+        self.calls.append(name)
+        return getattr(self.collection, name)
+
+    async def bulk_write(self, operations, ordered=True):
+        self.calls.append("bulk_write")
+        assert ordered is False
+        if self.before_write:
+            await self.before_write()
+        matched = modified = 0
+        for operation in operations:
+            update = self.collection.update_many if isinstance(operation, UpdateMany) else self.collection.update_one
+            result = await update(operation._filter, operation._doc, upsert=bool(operation._upsert))
+            matched += result.matched_count
+            modified += result.modified_count
+        return SimpleNamespace(matched_count=matched, modified_count=modified)
+
+
+class BulkDatabase:
+    """A database whose collections are BulkCollections"""
+    def __init__(self, db):
+        self.db = db
+
+    def __getattr__(self, name):
+        return BulkCollection(self.db[name])
+
+    def __getitem__(self, name):
+        return BulkCollection(self.db[name])
+
+
+@pytest.fixture
+def fake_socket():
+    """Factory for fake WebSocket connections: ``fake_socket()`` or ``fake_socket(fail=True)``"""
+    return FakeSocket
+
+
+@pytest.fixture
+def bulk_collection():
+    """Factory wrapping a mongomock collection so ``bulk_write`` works"""
+    return BulkCollection
+
+
+@pytest.fixture
+def bulk_database():
+    """Factory wrapping a mongomock database so every collection supports ``bulk_write``"""
+    return BulkDatabase
+
+
+@pytest.fixture(autouse=True)
+def ticket_signing_secret(monkeypatch):
+    """Ticket tokens need a signing secret; tests must not depend on the shell's"""
+    monkeypatch.setenv("TICKET_SIGNING_SECRET", "test-ticket-secret")
+
+
 @pytest_asyncio.fixture
 async def mock_mongodb():
     """Mock MongoDB database"""
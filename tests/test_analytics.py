@@ -69,33 +69,25 @@ class TestAnalyticsService:
         mock_db.buses.count_documents = AsyncMock(side_effect=[50, 45])  # total, active
         mock_db.routes.count_documents = AsyncMock(side_effect=[20, 18])  # total, active
 
-        # Mock trips data
-        mock_trips = [
-            {"status": "COMPLETED", "delay_minutes": 3},
-            {"status": "COMPLETED", "delay_minutes": 8},
-            {"status": "IN_PROGRESS", "delay_minutes": 2}
-        ]
-        mock_db.trips.find.return_value.to_list = AsyncMock(return_value=mock_trips)
+        def aggregate_result(doc):
+            cursor = MagicMock()
+            cursor.to_list = AsyncMock(return_value=[doc])
+            return MagicMock(return_value=cursor)
+
+        # Mock trip totals: delays 3, 8 and 2, two of three trips completed
+        mock_db.trips.aggregate = aggregate_result(
+            {"total": 3, "completed": 2, "delayed": 0, "delay_sum": 13, "delay_count": 3}
+        )
 
-        # Mock feedback data
-        mock_feedback = [
-            {"rating": 4.5},
-            {"rating": 3.8},
-            {"rating": 4.2}
-        ]
-        mock_db.feedback.find.return_value.to_list = AsyncMock(return_value=mock_feedback)
+        # Mock feedback totals: ratings 4.5, 3.8 and 4.2
+        mock_db.feedback.aggregate = aggregate_result({"rating_sum": 12.5, "rating_count": 3})
 
         # Mock other counts
         mock_db.alerts.count_documents = AsyncMock(return_value=3)
         mock_db.incidents.count_documents = AsyncMock(return_value=1)
 
-        # Mock payments
-        mock_payments = [
-            {"amount": 25.50},
-            {"amount": 18.75},
-            {"amount": 32.00}
-        ]
-        mock_db.payments.find.return_value.to_list = AsyncMock(return_value=mock_payments)
+        # Mock payment totals: 25.50 + 18.75 + 32.00
+        mock_db.payments.aggregate = aggregate_result({"count": 3, "revenue": 76.25})
 
         # Execute test
         result = await analytics_service.generate_summary_analytics()
@@ -0,0 +1,137 @@
+"""
+Parity tests: server-side analytics pipelines against the Python logic they replace.
+"""
+
+import random
+import pytest
+import pytest_asyncio
+from datetime import datetime, timedelta, timezone
+from typing import Any
+from unittest.mock import AsyncMock, patch
+
+from mongomock_motor import AsyncMongoMockClient
+
+from core.analytics_rollups import AnalyticsRollupService
+from core.analytics_service import AnalyticsService
+from core.kpi_aggregator import KPIAggregator
+from core.realtime_analytics import RealTimeAnalyticsService
+from core.scheduled_analytics import ScheduledAnalyticsService
+
+
+@pytest_asyncio.fixture
+async def db():
+    rng = random.Random(7)
+    now = datetime.utcnow()
+    database: Any = AsyncMongoMockClient()["guzosync_test"]
+
+    def created_at():
+        return now - timedelta(minutes=rng.randint(0, 9 * 24 * 60))
+
+    await database.trips.insert_many([
+        {
+            "status": rng.choice(["COMPLETED", "IN_PROGRESS", "SCHEDULED"]),
+            "delay_minutes": rng.choice([0, 2, 7, 12, 30, None]),
+            "created_at": created_at()
+        }
+        for _ in range(400)
+    ])
+    await database.feedback.insert_many([
+        {"rating": rng.choice([None, 0, 1, 2.5, 4, 5]), "created_at": created_at()}
+        for _ in range(150)
+    ])
+    await database.payments.insert_many([
+        {
+            "amount": rng.choice([10.0, 12.5, 30.0]),
+            "status": rng.choice(["COMPLETED", "PENDING", "FAILED"]),
+            "created_at": created_at()
+        }
+        for _ in range(200)
+    ])
+    await database.alerts.insert_many([
+        {"severity": rng.choice(["LOW", "HIGH", "CRITICAL"]), "is_active": rng.random() < 0.8, "created_at": created_at()}
+        for _ in range(100)
+    ])
+    await database.incidents.insert_many([
+        {"severity": rng.choice(["LOW", "HIGH"]), "created_at": created_at()}
+        for _ in range(100)
+    ])
+    return database
+
+
+def service(database):
+    # Neither incremental KPIs nor rollups: exercise the direct query path
+    return AnalyticsService(database, kpis=KPIAggregator(), rollups=AnalyticsRollupService(database))
+
+
+@pytest.mark.asyncio
+async def test_summary_matches_python_logic(db):
+    today = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    trips = await db.trips.find({"created_at": {"$gte": today}}).to_list(length=None)
+    feedback = await db.feedback.find({"created_at": {"$gte": today}}).to_list(length=None)
+    payments = await db.payments.find({"created_at": {"$gte": today}, "status": "COMPLETED"}).to_list(length=None)
+
+    delays = [t.get("delay_minutes", 0) for t in trips if t.get("delay_minutes")]
+    ratings = [f.get("rating", 0) for f in feedback if f.get("rating")]
+
+    summary = await service(db).generate_summary_analytics()
+    assert summary["total_trips_today"] == len(trips)
+    assert summary["completed_trips_today"] == len([t for t in trips if t.get("status") == "COMPLETED"])
+    assert summary["average_delay_minutes"] == round(sum(delays) / len(delays) if delays else 0.0, 2)
+    assert summary["passenger_satisfaction_score"] == round(sum(ratings) / len(ratings) if ratings else 0.0, 2)
+    assert summary["revenue_today"] == sum(p.get("amount", 0) for p in payments)
+
+
+async def reference_trends(database, week_ago):
+    """The per-day query loop the trends pipeline replaced."""
+    daily_trips, daily_revenue = [], []
+    for i in range(7):
+        day_start = week_ago + timedelta(days=i)
+        day_end = day_start + timedelta(days=1)
+        trip_count = await database.trips.count_documents({"created_at": {"$gte": day_start, "$lt": day_end}})
+        payments = await database.payments.find({
+            "created_at": {"$gte": day_start, "$lt": day_end},
+            "status": "COMPLETED"
+        }).to_list(length=None)
+        daily_trips.append({"date": day_start.date().isoformat(), "trip_count": trip_count})
+        daily_revenue.append({"date": day_start.date().isoformat(), "revenue": sum(p.get("amount", 0) for p in payments)})
+    return {"daily_trips": daily_trips, "daily_revenue": daily_revenue}
+
+
+@pytest.mark.asyncio
+async def test_performance_trends_and_kpis_match_python_logic(db):
+    realtime = RealTimeAnalyticsService(db, AsyncMock(), kpis=KPIAggregator())
+
+    now = datetime.now(timezone.utc)
+    trends = await realtime._get_performance_trends(now=now)
+    assert trends == await reference_trends(db, now - timedelta(days=7))
+    assert sum(day["trip_count"] for day in trends["daily_trips"]) > 0
+
+    today = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    trips = await db.trips.find({"created_at": {"$gte": today}}).to_list(length=None)
+    delayed = [t for t in trips if (t.get("delay_minutes") or 0) > 10]
+    breaches = await realtime._check_kpi_thresholds()
+    delay_breach = next((b for b in breaches if b["metric"] == "delay_percentage"), None)
+    expected = (len(delayed) / len(trips)) * 100 if trips else 0
+    if expected > 25:
+        assert delay_breach is not None and delay_breach["value"] == expected
+    else:
+        assert delay_breach is None
+
+
+@pytest.mark.asyncio
+async def test_alert_digest_counts_match_documents(db):
+    scheduled = ScheduledAnalyticsService.__new__(ScheduledAnalyticsService)
+    scheduled.db = db
+    send_digest = AsyncMock()
+
+    with patch.object(scheduled, "_send_alert_digest", send_digest):
+        await scheduled._generate_alert_digest()
+
+    four_hours_ago = datetime.now(timezone.utc) - timedelta(hours=4)
+    alerts = await db.alerts.find({"created_at": {"$gte": four_hours_ago}, "is_active": True}).to_list(length=None)
+    incidents = await db.incidents.find({"created_at": {"$gte": four_hours_ago}}).to_list(length=None)
+
+    digest = send_digest.await_args_list[0].args[0]
+    assert digest["alerts"]["count"] == len(alerts)
+    assert digest["incidents"]["count"] == len(incidents)
+    assert sum(digest["alerts"]["by_severity"].values()) == len(alerts)
@@ -0,0 +1,95 @@
+"""
+Tests for the seasonal route anomaly detector.
+"""
+
+import pytest
+from datetime import datetime, timedelta
+from typing import Any
+from unittest.mock import AsyncMock
+
+import numpy as np
+from mongomock_motor import AsyncMongoMockClient
+
+from core.analytics_rollups import AnalyticsRollupService, HOURLY_COLLECTION
+from core.anomaly_detection import SeasonalAnomalyDetector, build_metric_matrix, hour_of_week
+from core.kpi_aggregator import KPIAggregator
+from core.realtime_analytics import RealTimeAnalyticsService
+
+START = datetime(2024, 1, 1)  # a Monday
+
+
+def seasonal_matrix(routes: int, days: int, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    how = hour_of_week(START, days * 24)
+    hour = how % 24
+    # Rush-hour peaks on weekdays, a flatter weekend
+    profile = 5 + 20 * np.exp(-((hour - 8) ** 2) / 4) + 15 * np.exp(-((hour - 17) ** 2) / 6)
+    profile = np.where(how >= 5 * 24, profile * 0.5, profile)
+    scale = rng.uniform(0.5, 2.0, size=(routes, 1))
+    return rng.poisson(profile * scale).astype(np.float64)
+
+
+def test_build_metric_matrix():
+    rows = [
+        ("r2", START + timedelta(hours=1), 3),
+        ("r1", START, 2),
+        ("r1", START, 1),
+        ("r1", START - timedelta(hours=1), 9),  # outside the window
+    ]
+    keys, matrix = build_metric_matrix(rows, START, 3)
+    assert keys == ["r1", "r2"]
+    assert matrix.tolist() == [[3, 0, 0], [0, 3, 0]]
+
+
+def test_flags_injected_spike_and_drop_only():
+    matrix = seasonal_matrix(50, 36)
+    last = matrix.shape[1] - 1
+    # Monday-morning peak hour on the last day of the window
+    peak = last - 15
+    assert hour_of_week(START, matrix.shape[1])[peak] == 8
+    evaluate = matrix.shape[1] - peak
+    matrix[7, peak] = 0
+    matrix[11, peak] = matrix[11, peak] * 4 + 40
+
+    anomalies = SeasonalAnomalyDetector().detect(matrix, START, evaluate_last=evaluate)
+    flagged = {(a["route_id"], a["bucket"]) for a in anomalies}
+    bucket = (START + timedelta(hours=peak)).isoformat()
+    assert ("7", bucket) in flagged
+    assert ("11", bucket) in flagged
+    drop = next(a for a in anomalies if a["route_id"] == "7" and a["bucket"] == bucket)
+    assert drop["type"] == "route_trip_count_drop"
+    assert drop["expected_value"] > 10
+
+    # Poisson noise alone flags only a small share of the other buckets
+    noise = [a for a in anomalies if a["route_id"] not in ("7", "11")]
+    assert len(noise) <= 0.02 * 48 * evaluate
+
+
+def test_not_enough_history():
+    matrix = seasonal_matrix(3, 10)
+    assert SeasonalAnomalyDetector().detect(matrix, START) == []
+
+
+@pytest.mark.asyncio
+async def test_route_anomalies_read_rollups_and_score_each_hour_once():
+    db: Any = AsyncMongoMockClient()["guzosync_test"]
+    matrix = seasonal_matrix(3, 28, seed=1)
+    end = START + timedelta(days=28)
+    matrix[0, -1] = 200
+    await db[HOURLY_COLLECTION].insert_many([
+        {"metric": "trips", "route_id": f"route-{r}", "bus_id": "bus-1",
+         "bucket": START + timedelta(hours=h), "count": float(matrix[r, h])}
+        for r in range(3) for h in range(matrix.shape[1]) if matrix[r, h]
+    ])
+
+    rollups = AnalyticsRollupService(db)
+    rollups.is_ready = True
+    rollups.watermark = end
+    service = RealTimeAnalyticsService(db, AsyncMock(), kpis=KPIAggregator(), rollups=rollups)
+
+    anomalies = await service._detect_route_anomalies(now=end + timedelta(minutes=20))
+    assert [(a["route_id"], a["type"]) for a in anomalies] == [("route-0", "route_trip_count_spike")]
+    assert anomalies[0]["bucket"] == (end - timedelta(hours=1)).isoformat()
+
+    # The same hour is not reported again
+    assert await service._detect_route_anomalies(now=end + timedelta(minutes=25)) == []
@@ -0,0 +1,167 @@
+"""
+Tests for the async Chapa client, run against the local Chapa stub.
+"""
+
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from core.chapa_service import ChapaPaymentService, ChapaCircuitOpenError, ChapaServiceError
+from models.payment import PaymentStatus
+from schemas.payment import InitiatePaymentRequest, PaymentMethod, TicketType
+from scripts.utilities.chapa_stub import ChapaStub
+
+
+@pytest.fixture
+def stub():
+    with ChapaStub() as running:
+        yield running
+
+
+@pytest.fixture
+def make_service(monkeypatch):
+    monkeypatch.setenv("CHAPA_SECRET_KEY", "CHASECK_TEST-stub")
+
+    def factory(base_url, **overrides):
+        service = ChapaPaymentService(base_url=base_url)
+        service.retry_backoff = 0.01
+        for name, value in overrides.items():
+            setattr(service, name, value)
+        return service
+
+    return factory
+
+
+@pytest.mark.asyncio
+async def test_payment_flow_against_stub(stub, make_service):
+    service = make_service(stub.base_url)
+    request = InitiatePaymentRequest(
+        amount=25.0, payment_method=PaymentMethod.TELEBIRR,
+        mobile_number="0911000000", ticket_type=TicketType.SINGLE_TRIP
+    )
+    initiated = await service.initiate_payment(request, "a@example.com", "Abebe", "Kebede")
+    assert initiated["status"] == "success"
+
+    authorized = await service.authorize_payment(initiated["tx_ref"], PaymentMethod.EBIRR, {})
+    assert authorized["authorization_completed"] is True
+
+    verified = await service.verify_payment(initiated["tx_ref"])
+    assert verified["status"] == PaymentStatus.COMPLETED
+    assert verified["amount"] == "25.0"
+
+    simple = await service.initiate_payment_simple(10, "0911000000", "booking-1")
+    assert simple["checkoutUrl"].endswith("/checkout/booking-1")
+    await service.close()
+
+
+@pytest.mark.asyncio
+async def test_concurrent_calls_share_the_pool_without_blocking(stub, make_service):
+    stub.latency = 0.2
+    service = make_service(stub.base_url)
+    for index in range(20):
+        stub.transactions[f"tx-{index}"] = {"amount": "10", "created_at": "2024-01-01T00:00:00"}
+
+    ticks = 0
+
+    async def ticker():
+        nonlocal ticks
+        while True:
+            await asyncio.sleep(0.01)
+            ticks += 1
+
+    ticking = asyncio.create_task(ticker())
+    started = time.perf_counter()
+    results = await asyncio.gather(*(service.verify_payment(f"tx-{index}") for index in range(20)))
+    elapsed = time.perf_counter() - started
+    ticking.cancel()
+
+    assert all(result["status"] == PaymentStatus.COMPLETED for result in results)
+    # Twenty 200 ms calls overlap instead of running back to back
+    assert elapsed < 2.0
+    # The loop kept running other work while the calls were in flight
+    assert ticks >= 10
+    await service.close()
+
+
+@pytest.mark.asyncio
+async def test_retries_transient_failures_but_not_unsafe_posts(stub, make_service):
+    service = make_service(stub.base_url)
+    stub.transactions["tx-1"] = {"amount": "10", "created_at": "2024-01-01T00:00:00"}
+
+    # GETs retry 5xx and timeouts
+    stub.fail_next(1, status=502)
+    stub.fail_next(1, status=503, delay=1.0)
+    service.timeout = httpx.Timeout(0.3)
+    verified = await service.verify_payment("tx-1")
+    assert verified["status"] == PaymentStatus.COMPLETED
+    assert stub.calls["/v1/verify/tx-1"] == 3
+    assert service.stats["retries"] == 2
+
+    # A 500 on a charge may have been processed: surfaced, not resent
+    stub.fail_next(1, status=500)
+    request = InitiatePaymentRequest(
+        amount=5.0, payment_method=PaymentMethod.MPESA,
+        mobile_number="0711000000", ticket_type=TicketType.SINGLE_TRIP
+    )
+    with pytest.raises(Exception, match="Payment initiation failed"):
+        await service.initiate_payment(request, "a@example.com", "A", "B")
+    assert stub.calls["/v1/charges"] == 1
+
+    # A 503 is rejected before processing, so the charge is resent
+    stub.fail_next(1, status=503)
+    assert (await service.initiate_payment(request, "a@example.com", "A", "B"))["status"] == "success"
+    assert stub.calls["/v1/charges"] == 3
+    await service.close()
+
+
+@pytest.mark.asyncio
+async def test_circuit_breaker_fails_fast_and_recovers(stub, make_service):
+    service = make_service(stub.base_url, max_retries=1)
+    service.circuit.failure_threshold = 2
+    service.circuit.reset_timeout = 0.2
+    stub.transactions["tx-1"] = {"amount": "10", "created_at": "2024-01-01T00:00:00"}
+
+    stub.fail_next(4, status=503)
+    for _ in range(2):
+        with pytest.raises(Exception, match="verification failed"):
+            await service.verify_payment("tx-1")
+    assert service.circuit.state == "open"
+
+    # Open: rejected without touching the network
+    calls = sum(stub.calls.values())
+    with pytest.raises(ChapaCircuitOpenError):
+        await service._request("GET", f"{stub.base_url}/verify/tx-1")
+    assert sum(stub.calls.values()) == calls
+
+    await asyncio.sleep(0.25)
+    assert service.circuit.state == "half_open"
+    assert (await service.verify_payment("tx-1"))["status"] == PaymentStatus.COMPLETED
+    assert service.circuit.get_stats() == {"state": "closed", "consecutive_failures": 0, "times_opened": 1}
+
+    # Unreachable gateway: connection errors count as failures too
+    stub.stop()
+    with pytest.raises(ChapaServiceError):
+        await service._request("GET", f"{stub.base_url}/verify/tx-1")
+    await service.close()
+
+
+@pytest.mark.asyncio
+async def test_half_open_trial_is_released_on_unexpected_errors(monkeypatch):
+    monkeypatch.setenv("CHAPA_SECRET_KEY", "CHASECK_TEST-stub")
+
+    def handler(request):
+        raise RuntimeError("malformed response")
+
+    service = ChapaPaymentService(base_url="http://chapa.test", transport=httpx.MockTransport(handler))
+    service.circuit.failure_threshold = 1
+    service.circuit.reset_timeout = 0
+    service.circuit.record_failure()
+    assert service.circuit.state == "half_open"
+
+    for _ in range(2):
+        with pytest.raises(RuntimeError):
+            await service._request("GET", "http://chapa.test/verify/tx-1")
+        assert service.circuit.trial_in_flight is False
+    await service.close()
@@ -0,0 +1,163 @@
+"""
+Tests for queued email delivery over pooled SMTP connections.
+"""
+
+import asyncio
+import time
+from datetime import datetime
+from typing import Any, Dict
+from unittest.mock import patch
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+from core.email_outbox import OUTBOX_COLLECTION, EmailOutbox, open_body
+from core.email_service import EmailConfig, EmailService
+from core.rate_limiter import SharedRateLimiter
+from scripts.utilities.smtp_sink import SMTPSink
+
+
+@pytest.fixture
+def sink():
+    with SMTPSink() as server:
+        yield server
+
+
+def sink_config(sink) -> EmailConfig:
+    config = EmailConfig()
+    config.smtp_server = "127.0.0.1"
+    config.smtp_port = sink.port
+    config.smtp_start_tls = False
+    config.smtp_username = "outbox"
+    config.smtp_password = "secret"
+    config.email_from = "noreply@guzosync.com"
+    return config
+
+
+def make_outbox(sink, **overrides) -> EmailOutbox:
+    options: Dict[str, Any] = dict(
+        workers=4, pool_size=2, rate_per_second=1000, max_attempts=3, retry_backoff=0.01,
+        lease_seconds=30, poll_interval=0.05
+    )
+    options.update(overrides)
+    return EmailOutbox(AsyncMongoMockClient()["email_outbox_test"], sink_config(sink), **options)
+
+
+async def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        await asyncio.sleep(0.01)
+
+
+@pytest.mark.asyncio
+async def test_enqueue_defers_delivery_to_pooled_workers(sink):
+    outbox = make_outbox(sink, rate_per_second=100)
+
+    for index in range(12):
+        assert await outbox.enqueue(f"user{index}@example.com", f"Welcome {index}", "<p>Hi</p>", "Hi")
+    # Queuing never touches SMTP
+    assert sink.connections == 0
+
+    started = time.monotonic()
+    await outbox.start()
+    try:
+        await wait_for(lambda: outbox.stats["sent"] == 12)
+    finally:
+        await outbox.stop()
+    elapsed = time.monotonic() - started
+
+    assert sorted(received.recipients[0] for received in sink.messages) == sorted(
+        f"user{index}@example.com" for index in range(12))
+    # Four workers share two logged-in connections
+    assert sink.connections <= 2
+    assert sink.logins == sink.connections
+    assert outbox.pool.get_stats()["reused"] >= 10
+    # 12 sends at 100/s take at least 11 intervals
+    assert elapsed >= 0.1
+
+    documents = await outbox.db[OUTBOX_COLLECTION].find().to_list(None)
+    assert {document["status"] for document in documents} == {"sent"}
+    assert all("body" not in document for document in documents)
+
+
+@pytest.mark.asyncio
+async def test_temporary_failures_retry_and_permanent_failures_stop(sink):
+    outbox = make_outbox(sink, workers=1, pool_size=1, retry_backoff=60)
+    await outbox.enqueue("retry@example.com", "Reset", "<p>Reset</p>")
+
+    sink.fail_next(1, 451, "Mailbox busy")
+    assert await outbox.drain() == 1
+    document = await outbox.db[OUTBOX_COLLECTION].find_one({"to": "retry@example.com"})
+    assert document["status"] == "pending"
+    assert document["attempts"] == 1
+    assert "451" in document["last_error"]
+    # Kept for the retry, but not readable at rest
+    assert "Reset</p>" not in document["body"]
+    assert open_body(document["body"]) == {"html": "<p>Reset</p>", "text": None}
+    assert document["next_attempt_at"] > datetime.utcnow()
+
+    # Skip the backoff
+    await outbox.db[OUTBOX_COLLECTION].update_one({"_id": document["_id"]},
+                                                  {"$set": {"next_attempt_at": datetime.utcnow()}})
+    assert await outbox.drain() == 1
+    document = await outbox.db[OUTBOX_COLLECTION].find_one({"to": "retry@example.com"})
+    assert document["status"] == "sent"
+    assert document["attempts"] == 2
+
+    await outbox.enqueue("missing@example.com", "Reset", "<p>Reset</p>")
+    sink.fail_next(1, 550, "No such user")
+    assert await outbox.drain() == 1
+    assert await outbox.drain() == 0
+    document = await outbox.db[OUTBOX_COLLECTION].find_one({"to": "missing@example.com"})
+    assert document["status"] == "failed"
+    assert document["attempts"] == 1
+    assert "body" not in document
+
+    # Rejections leave the connection usable
+    assert sink.connections == 1
+    assert [received.recipients for received in sink.messages] == [["retry@example.com"]]
+    await outbox.pool.close()
+
+
+@pytest.mark.asyncio
+async def test_email_service_queues_while_outbox_runs(sink):
+    outbox = make_outbox(sink, workers=1, pool_size=1)
+    service = EmailService()
+    service.config = sink_config(sink)
+
+    with patch("core.email_outbox.email_outbox", outbox):
+        # Not running: sent directly, as scripts do
+        assert await service.send_welcome_email("direct@example.com", "Direct User")
+        assert len(sink.messages) == 1
+
+        await outbox.start()
+        try:
+            assert await service.send_welcome_email("queued@example.com", "Queued User")
+            assert await outbox.db[OUTBOX_COLLECTION].count_documents({"to": "queued@example.com"}) == 1
+            await wait_for(lambda: outbox.stats["sent"] == 1)
+        finally:
+            await outbox.stop()
+
+    received = sink.messages[1]
+    assert received.recipients == ["queued@example.com"]
+    assert received.mail_from == "noreply@guzosync.com"
+    assert "Welcome" in received.message["Subject"]
+
+
+@pytest.mark.asyncio
+async def test_rate_limit_is_shared_between_processes():
+    db: Any = AsyncMongoMockClient()["email_outbox_test"]
+    now = 1000.0
+    waits = []
+
+    async def sleep(seconds):
+        waits.append(round(seconds, 6))
+
+    # Two processes' limiters, one budget of 10 sends a second
+    limiters = [SharedRateLimiter(db, "smtp", 10, clock=lambda: now, sleep=sleep) for _ in range(2)]
+    await asyncio.gather(*(limiters[index % 2].acquire() for index in range(6)))
+
+    assert sorted(waits) == [0.1, 0.2, 0.3, 0.4, 0.5]
+    state = await db["rate_limits"].find_one({"_id": "smtp"})
+    assert state["next"] == pytest.approx(now + 0.6)
@@ -0,0 +1,115 @@
+"""
+Tests for the vectorized fleet simulation engine.
+"""
+
+import pytest
+import numpy as np
+from typing import Any, Dict
+from unittest.mock import MagicMock
+
+from simulation.fleet_engine import VectorizedFleetSimulator
+from simulation.route_cache import CompiledRoute, RouteWaypointCache
+
+
+def make_waypoints(count: int = 40, stop_every: int = 10, lon: float = 38.7):
+    """Build a straight north-bound route with a stop every few waypoints."""
+    return [
+        {
+            "latitude": 9.0 + 0.001 * i,
+            "longitude": lon,
+            "is_bus_stop": i % stop_every == 0,
+            "estimated_speed": 0 if i % stop_every == 0 else 30.0
+        }
+        for i in range(count)
+    ]
+
+
+def make_route(route_id: str = "route-0", **kwargs):
+    return CompiledRoute.from_waypoints(route_id, "fingerprint", make_waypoints(**kwargs))
+
+
+def compile_route(sim: VectorizedFleetSimulator, route: CompiledRoute) -> Dict[str, Any]:
+    arrays = sim._compile_route(route)
+    assert arrays is not None
+    return arrays
+
+
+class TestVectorizedFleetSimulator:
+    """Test the vectorized fleet engine without a database."""
+
+    @pytest.fixture
+    def simulator(self):
+        sim = VectorizedFleetSimulator(MagicMock(), update_interval=5.0, seed=42, route_cache=RouteWaypointCache())
+        routes = [compile_route(sim, make_route(f"route-{r}", lon=38.7 + 0.01 * r)) for r in range(3)]
+        rows = [
+            {"bus": {"id": f"bus-{b}"}, "route_index": b % 3, "route_id": f"route-{b % 3}"}
+            for b in range(30)
+        ]
+        sim._build_fleet_arrays(routes, rows)
+        return sim
+
+    def test_compile_route_closes_loop(self, simulator):
+        compiled = simulator._compile_route(make_route())
+        assert compiled["lat"][0] == compiled["lat"][-1]
+        assert compiled["cum"][0] == 0.0
+        assert compiled["length"] == pytest.approx(compiled["cum"][-1])
+        # The first waypoint is a stop, so its successor's next stop is at the 10th waypoint
+        assert compiled["next_stop"][1] == pytest.approx(compiled["cum"][10])
+
+    def test_buses_are_spread_along_route(self, simulator):
+        route_0 = simulator.position[simulator.route_index == 0]
+        assert len(np.unique(route_0)) == len(route_0)
+
+    def test_step_keeps_buses_on_their_route(self, simulator):
+        for _ in range(200):
+            simulator.step(5.0)
+
+        assert (simulator.position >= 0).all()
+        assert (simulator.position < simulator.route_length).all()
+        expected_lon = 38.7 + 0.01 * simulator.route_index
+        assert np.allclose(simulator.longitude, expected_lon)
+
+    def test_buses_dwell_at_stops(self, simulator):
+        for _ in range(50):
+            simulator.step(5.0)
+
+        at_stop = simulator.dwell_remaining > 0
+        assert at_stop.any()
+        assert (simulator.speed[at_stop] == 0).all()
+
+    def test_location_batch_matches_changed_buses(self, simulator):
+        changed = simulator.step(5.0)
+        batch = simulator.build_location_batch(changed)
+
+        assert len(batch) == len(changed)
+        first = batch[0]
+        index = int(changed[0])
+        assert first["bus_id"] == simulator.bus_ids[index]
+        assert first["route_id"] == simulator.bus_route_ids[index]
+        assert first["latitude"] == simulator.latitude[index]
+
+    def test_same_seed_reproduces_positions(self):
+        def run(seed):
+            sim = VectorizedFleetSimulator(MagicMock(), seed=seed)
+            sim._build_fleet_arrays(
+                [compile_route(sim, make_route())],
+                [{"bus": {"id": f"bus-{b}"}, "route_index": 0, "route_id": "route-0"} for b in range(5)]
+            )
+            for _ in range(20):
+                sim.step(5.0)
+            return sim.latitude.copy()
+
+        assert np.array_equal(run(7), run(7))
+
+    def test_rebind_route_keeps_progress(self, simulator):
+        for _ in range(10):
+            simulator.step(5.0)
+        on_route = simulator.route_index == 1
+        progress = simulator.position[on_route] / simulator.route_length[on_route]
+
+        # Route 1 is extended to twice its length
+        simulator._rebind_route(make_route("route-1", count=80, lon=38.71))
+
+        assert simulator.route_length[on_route][0] > simulator.route_length[simulator.route_index == 0][0]
+        assert np.allclose(simulator.position[on_route] / simulator.route_length[on_route], progress)
+        assert np.allclose(simulator.longitude, 38.7 + 0.01 * simulator.route_index)
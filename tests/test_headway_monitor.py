@@ -0,0 +1,131 @@
+"""
+Tests for the streaming headway / bus-bunching detector.
+"""
+
+import pytest
+from types import SimpleNamespace
+from typing import Any
+from unittest.mock import AsyncMock, patch
+
+from mongomock_motor import AsyncMongoMockClient
+
+from core.realtime.bus_tracking import BusTrackingService
+from core.realtime.headway_monitor import HeadwayMonitor, RouteLine
+
+# A ~4.4 km square loop around central Addis Ababa
+SQUARE = [(9.00, 38.75), (9.00, 38.76), (9.01, 38.76), (9.01, 38.75)]
+
+
+def square_route(scheduled_headway_seconds=None):
+    return RouteLine(
+        "route-1",
+        [lat for lat, _ in SQUARE],
+        [lon for _, lon in SQUARE],
+        scheduled_headway_seconds=scheduled_headway_seconds,
+        cruise_speed_kmh=20.0
+    )
+
+
+def test_projection_follows_the_loop():
+    line = square_route()
+    assert line.loop_length_km == pytest.approx(4.41, abs=0.02)
+    assert line.project(9.00, 38.75) == pytest.approx(0.0, abs=1e-6)
+    # Halfway along the first side, slightly off the road
+    assert line.project(9.0002, 38.755) == pytest.approx(line.loop_length_km / 8, abs=0.01)
+    assert line.project(9.01, 38.76) == pytest.approx(line.loop_length_km / 2, abs=0.01)
+
+
+def test_bunching_is_reported_once_and_rearmed():
+    monitor = HeadwayMonitor(threshold_fraction=0.25)
+    monitor.set_route(square_route())
+
+    # Four buses at the corners: even spacing, no bunching
+    for index, (lat, lon) in enumerate(SQUARE):
+        assert monitor.observe(f"bus-{index}", "route-1", lat, lon) == []
+
+    # bus-0 catches up with bus-1 (the bus ahead on the first side)
+    events = monitor.observe("bus-0", "route-1", 9.00, 38.7595)
+    assert len(events) == 1
+    event = events[0]
+    assert (event["follower_bus_id"], event["leader_bus_id"]) == ("bus-0", "bus-1")
+    assert event["headway_ratio"] < 0.25
+    # Even-spacing target: a quarter of the loop time at 20 km/h
+    assert event["scheduled_headway_seconds"] == pytest.approx(4.41 / 20 * 3600 / 4, rel=0.01)
+
+    # Still bunched: no repeat alert
+    assert monitor.observe("bus-0", "route-1", 9.00, 38.7596) == []
+    assert monitor.get_stats()["bunched_pairs"] == 1
+
+    # Falls back, then bunches again
+    assert monitor.observe("bus-0", "route-1", 9.00, 38.752) == []
+    assert monitor.get_stats()["bunched_pairs"] == 0
+    assert len(monitor.observe("bus-0", "route-1", 9.00, 38.7597)) == 1
+
+    headways = monitor.get_route_headways("route-1")
+    assert [h["bus_id"] for h in headways] == ["bus-0", "bus-1", "bus-2", "bus-3"]
+    assert headways[0]["bunched"] is True
+
+
+def test_timetable_headway_route_changes_and_stale_buses():
+    monitor = HeadwayMonitor(threshold_fraction=0.5, stale_seconds=60)
+    # A 5-minute timetable: buses 1.5 min apart are bunched
+    monitor.set_route(square_route(scheduled_headway_seconds=300))
+    assert monitor.observe("a", "route-1", 9.00, 38.75) == []
+    events = monitor.observe("b", "route-1", 9.00, 38.7545)
+    assert [(e["follower_bus_id"], e["leader_bus_id"]) for e in events] == [("a", "b")]
+    assert events[0]["scheduled_headway_seconds"] == 300
+
+    # Reassigned to an unknown route: dropped from route-1
+    assert monitor.observe("b", "route-2", 9.00, 38.7545) == []
+    assert monitor.get_stats()["tracked_buses"] == 1
+    assert monitor.get_stats()["bunched_pairs"] == 0
+
+    with patch("core.realtime.headway_monitor.time.monotonic", return_value=10 ** 9):
+        monitor.observe("c", "route-1", 9.01, 38.76)
+    assert [h["bus_id"] for h in monitor.get_route_headways("route-1")] == []
+    assert monitor.get_stats()["tracked_buses"] == 1
+
+
+@pytest.mark.asyncio
+async def test_location_stream_loads_routes_once_and_notifies():
+    db: Any = AsyncMongoMockClient()["guzosync_test"]
+    await db.routes.insert_one({
+        "id": "route-1",
+        "stop_ids": [],
+        "route_geometry": {"type": "LineString", "coordinates": [[lon, lat] for lat, lon in SQUARE]}
+    })
+    await db.schedules.insert_many([
+        {"route_id": "route-1", "is_active": True, "departure_times": ["06:00", "06:10", "06:20"]},
+        {"route_id": "route-1", "is_active": True, "departure_times": ["06:30"]}
+    ])
+
+    class Database:
+        """mongomock's bulk_write rejects pymongo's UpdateOne; the bus writes are not under test."""
+        buses = SimpleNamespace(bulk_write=AsyncMock())
+
+        def __getattr__(self, name):
+            return getattr(db, name)
+
+        def __getitem__(self, name):
+            return getattr(self, name)
+
+    app_state = SimpleNamespace(mongodb=Database())
+
+    monitor = HeadwayMonitor(threshold_fraction=0.25)
+    send = AsyncMock()
+    with patch("core.realtime.bus_tracking.headway_monitor", monitor), \
+            patch("core.realtime.bus_tracking.notification_service.send_bunching_notification", send), \
+            patch.object(monitor, "load_route", wraps=monitor.load_route) as load_route:
+        await BusTrackingService.update_bus_locations_batch([
+            {"bus_id": "a", "route_id": "route-1", "latitude": 9.00, "longitude": 38.75},
+            {"bus_id": "b", "route_id": "route-1", "latitude": 9.01, "longitude": 38.76}
+        ], app_state=app_state)
+        await BusTrackingService.update_bus_locations_batch([
+            {"bus_id": "a", "route_id": "route-1", "latitude": 9.0095, "longitude": 38.76}
+        ], app_state=app_state)
+
+    assert load_route.await_count == 1
+    assert monitor.routes["route-1"].scheduled_headway_seconds == 600
+    send.assert_awaited_once()
+    assert send.await_args_list[0].kwargs["follower_bus_id"] == "a"
+    assert send.await_args_list[0].kwargs["app_state"] is app_state
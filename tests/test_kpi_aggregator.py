@@ -0,0 +1,187 @@
+"""
+Tests for the incremental KPI aggregator.
+"""
+
+import pytest
+import pytest_asyncio
+from datetime import datetime, timedelta
+from typing import Any
+from unittest.mock import MagicMock, AsyncMock
+
+from mongomock_motor import AsyncMongoMockClient
+
+from core.analytics_service import AnalyticsService
+from core.kpi_aggregator import KPIAggregator
+from core.realtime_analytics import RealTimeAnalyticsService
+
+
+def seed_documents():
+    now = datetime.utcnow()
+    trips = [
+        {"id": "t1", "route_id": "r1", "status": "COMPLETED", "delay_minutes": 3, "created_at": now},
+        {"id": "t2", "route_id": "r1", "status": "COMPLETED", "delay_minutes": 15, "created_at": now},
+        {"id": "t3", "route_id": "r2", "status": "IN_PROGRESS", "delay_minutes": 0, "created_at": now},
+        {"id": "t4", "route_id": "r2", "status": "COMPLETED", "delay_minutes": 30, "created_at": now - timedelta(days=2)}
+    ]
+    feedback = [
+        {"id": "f1", "rating": 4.0, "created_at": now},
+        {"id": "f2", "rating": 3.0, "created_at": now},
+        {"id": "f3", "rating": None, "created_at": now}
+    ]
+    payments = [
+        {"id": "p1", "amount": 20.0, "status": "COMPLETED", "created_at": now},
+        {"id": "p2", "amount": 15.0, "status": "PENDING", "created_at": now}
+    ]
+    return trips, feedback, payments
+
+
+@pytest_asyncio.fixture
+async def db():
+    database: Any = AsyncMongoMockClient()["guzosync_test"]
+    trips, feedback, payments = seed_documents()
+    await database.trips.insert_many(trips)
+    await database.feedback.insert_many(feedback)
+    await database.payments.insert_many(payments)
+    return database
+
+
+@pytest.mark.asyncio
+async def test_rebuild_matches_full_scan(db):
+    aggregator = KPIAggregator()
+    await aggregator.rebuild(db)
+
+    kpis = aggregator.snapshot()
+    assert kpis["trips_today"] == 3
+    assert kpis["completed_trips_today"] == 2
+    assert kpis["average_delay_minutes"] == 9.0  # (3 + 15) / 2, zero delays excluded
+    assert kpis["delayed_trips_today"] == 1
+    assert kpis["passenger_satisfaction_score"] == 3.5
+    assert kpis["revenue_today"] == 20.0
+
+    routes = aggregator.get_route_breakdown()
+    assert routes["r1"] == {"trips": 2, "completed": 2, "delayed": 1, "average_delay_minutes": 9.0}
+    assert routes["r2"]["trips"] == 1
+
+
+@pytest.mark.asyncio
+async def test_incremental_updates_track_status_transitions(db):
+    aggregator = KPIAggregator()
+    await aggregator.rebuild(db)
+
+    aggregator.record_feedback({"rating": 5.0})
+    pending = {"amount": 15.0, "status": "PENDING", "created_at": datetime.utcnow()}
+    aggregator.record_payment({**pending, "status": "COMPLETED"}, previous_status="PENDING")
+    # A duplicate completion (verify after webhook) must not double count
+    aggregator.record_payment({**pending, "status": "COMPLETED"}, previous_status="COMPLETED")
+
+    in_progress = {"route_id": "r2", "status": "IN_PROGRESS", "delay_minutes": 0}
+    aggregator.record_trip({**in_progress, "status": "COMPLETED", "delay_minutes": 12}, previous=in_progress)
+
+    kpis = aggregator.snapshot()
+    assert kpis["passenger_satisfaction_score"] == 4.0
+    assert kpis["revenue_today"] == 35.0
+    assert kpis["payments_completed"] == 2
+    assert kpis["trips_today"] == 3
+    assert kpis["completed_trips_today"] == 3
+    assert kpis["delayed_trips_today"] == 2
+    assert aggregator.get_route_breakdown()["r2"]["completed"] == 1
+
+
+@pytest.mark.asyncio
+async def test_checkpoint_and_restore(db):
+    aggregator = KPIAggregator()
+    await aggregator.rebuild(db)
+    aggregator.record_feedback({"rating": 5.0})
+    await aggregator.checkpoint(db)
+    assert aggregator.dirty is False
+    assert await db.kpi_state.count_documents({}) == 1
+
+    restored = KPIAggregator()
+    assert await restored.restore(db) is True
+    assert restored.snapshot() == aggregator.snapshot()
+    assert restored.get_route_breakdown() == aggregator.get_route_breakdown()
+
+
+@pytest.mark.asyncio
+async def test_workers_merge_checkpoints_instead_of_overwriting(db):
+    first, second = KPIAggregator(), KPIAggregator()
+    assert await first.rebuild(db)
+    assert not await second.rebuild(db)
+
+    first.record_feedback({"rating": 5.0})
+    first.record_payment({"amount": 15.0, "status": "COMPLETED"}, previous_status="PENDING")
+    second.record_payment({"amount": 5.0, "status": "COMPLETED"}, previous_status="PENDING")
+    await first.checkpoint(db)
+    await second.checkpoint(db)
+    await first.checkpoint(db)
+
+    for aggregator in (first, second):
+        kpis = aggregator.snapshot()
+        assert kpis["revenue_today"] == 40.0
+        assert kpis["payments_completed"] == 3
+        assert kpis["feedback_count"] == 3
+    state = await db.kpi_state.find_one({})
+    assert (state["revenue"], state["rating_sum"]) == (40.0, 12.0)
+
+
+@pytest.mark.asyncio
+async def test_worker_starting_later_adopts_live_checkpoint(db):
+    first = KPIAggregator()
+    await first.rebuild(db)
+    # Written by the API and counted by the first worker, not yet checkpointed
+    await db.payments.insert_one({"id": "p3", "amount": 10.0, "status": "COMPLETED",
+                                  "created_at": datetime.utcnow().isoformat()})
+    first.record_payment({"amount": 10.0, "status": "COMPLETED"}, previous_status="PENDING")
+
+    second = KPIAggregator()
+    assert await second.rebuild(db) is False
+    await first.checkpoint(db)
+    await second.checkpoint(db)
+    assert second.snapshot()["revenue_today"] == 30.0
+
+    # Once nobody has checkpointed for a while the next start rebuilds, counting ISO-string timestamps
+    await db.kpi_state.update_one({}, {"$set": {"updated_at": datetime.utcnow() - timedelta(hours=1)}})
+    third = KPIAggregator()
+    assert await third.rebuild(db) is True
+    assert third.snapshot()["revenue_today"] == 30.0
+    assert third.snapshot()["payments_completed"] == 2
+
+
+@pytest.mark.asyncio
+async def test_trip_kpis_follow_the_trips_collection(db):
+    aggregator = KPIAggregator()
+    await aggregator.rebuild(db)
+    await db.trips.insert_one(
+        {"id": "t5", "route_id": "r2", "status": "COMPLETED", "delay_minutes": 20, "created_at": datetime.utcnow()}
+    )
+    await db.trips.update_one({"id": "t3"}, {"$set": {"status": "COMPLETED"}})
+
+    await aggregator.refresh_trips(db)
+    kpis = aggregator.snapshot()
+    assert (kpis["trips_today"], kpis["completed_trips_today"], kpis["delayed_trips_today"]) == (4, 4, 2)
+    assert aggregator.get_route_breakdown()["r2"]["completed"] == 2
+
+
+@pytest.mark.asyncio
+async def test_dashboards_read_aggregates_without_scanning():
+    aggregator = KPIAggregator()
+    aggregator.is_ready = True
+    aggregator.record_trip({"route_id": "r1", "status": "COMPLETED", "delay_minutes": 20})
+    aggregator.record_payment({"amount": 10.0, "status": "COMPLETED"})
+
+    db = MagicMock()
+    for name in ["buses", "routes", "alerts", "incidents", "reallocation_requests"]:
+        setattr(db, name, MagicMock(count_documents=AsyncMock(return_value=1)))
+
+    summary = await AnalyticsService(db, kpis=aggregator).generate_summary_analytics()
+    assert summary["total_trips_today"] == 1
+    assert summary["revenue_today"] == 10.0
+    db.trips.find.assert_not_called()
+    db.payments.find.assert_not_called()
+
+    realtime = RealTimeAnalyticsService(db, AsyncMock(), kpis=aggregator)
+    metrics = await realtime._get_live_metrics()
+    assert metrics["trips_today"] == 1
+    breaches = await realtime._check_kpi_thresholds()
+    assert any(b["metric"] == "delay_percentage" and b["value"] == 100.0 for b in breaches)
+    db.trips.count_documents.assert_not_called()
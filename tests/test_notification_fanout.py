@@ -0,0 +1,184 @@
+"""
+Tests for batched notification fan-out and role rooms.
+"""
+
+from types import SimpleNamespace
+from typing import Any
+from unittest.mock import AsyncMock, patch
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from mongomock_motor import AsyncMongoMockClient
+
+from core.dependencies import get_current_user
+from core.realtime.notifications import NotificationService
+from core.websocket_manager import WebSocketManager, role_room
+from models.user import UserRole
+from routers import websocket
+
+
+class RecordingCollection:
+    """Records the arguments of reads and bulk inserts on a collection."""
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.finds = []
+        self.inserts = []
+
+    def __getattr__(self, name):
+        return getattr(self.collection, name)
+
+    def find(self, *args, **kwargs):
+        self.finds.append(args)
+        return self.collection.find(*args, **kwargs)
+
+    async def insert_many(self, documents, **kwargs):
+        self.inserts.append(len(documents))
+        return await self.collection.insert_many(documents, **kwargs)
+
+
+@pytest.fixture
+def manager():
+    manager = WebSocketManager()
+    with patch("core.realtime.notifications.websocket_manager", manager):
+        yield manager
+
+
+async def seed_users(db, roles):
+    await db.users.insert_many([
+        {"id": f"{role.lower()}-{index}", "role": role, "email": f"{role}{index}@example.com"}
+        for role, count in roles.items() for index in range(count)
+    ])
+
+
+@pytest.mark.asyncio
+async def test_role_broadcast_streams_ids_and_uses_role_rooms(manager, fake_socket):
+    db: Any = AsyncMongoMockClient()["fanout_test"]
+    await seed_users(db, {"PASSENGER": 2500, "BUS_DRIVER": 30})
+    users, notifications = RecordingCollection(db.users), RecordingCollection(db.notifications)
+    app_state = SimpleNamespace(mongodb=SimpleNamespace(users=users, notifications=notifications))
+
+    sockets = {user_id: fake_socket() for user_id in ["passenger-0", "passenger-1", "passenger-2", "bus_driver-0"]}
+    for user_id, socket in sockets.items():
+        await manager.connect_user(socket, user_id, user_id.split("-")[0].upper())
+    for user_id in ["passenger-0", "passenger-1", "bus_driver-0"]:
+        manager.subscribe_to_notifications(user_id, ["SERVICE_ALERT"])
+
+    with patch("core.realtime.notifications.FANOUT_CHUNK_SIZE", 1000):
+        stored = await NotificationService.broadcast_notification(
+            title="Service change", message="Route 4 diverted", notification_type="SERVICE_ALERT",
+            target_roles=["PASSENGER"], app_state=app_state
+        )
+
+    assert stored == 2500
+    assert notifications.inserts == [1000, 1000, 500]
+    assert users.finds == [({"role": {"$in": ["PASSENGER"]}, "is_simulated": {"$ne": True}}, {"id": 1, "_id": 0})]
+    assert await db.notifications.count_documents({"type": "SERVICE_ALERT", "is_read": False}) == 2500
+
+    # Subscribed passengers only; the subscribed driver is in another role room
+    delivered = {user_id: socket.sent for user_id, socket in sockets.items() if socket.sent}
+    assert sorted(delivered) == ["passenger-0", "passenger-1"]
+    assert delivered["passenger-0"] == delivered["passenger-1"]
+    assert delivered["passenger-0"][0]["notification"]["title"] == "Service change"
+
+
+@pytest.mark.asyncio
+async def test_targeted_and_global_broadcasts(manager, fake_socket):
+    db: Any = AsyncMongoMockClient()["fanout_targets_test"]
+    await seed_users(db, {"PASSENGER": 5, "CONTROL_STAFF": 2})
+    app_state = SimpleNamespace(mongodb=db)
+
+    sockets = {user_id: fake_socket() for user_id in ["passenger-0", "passenger-1", "control_staff-0"]}
+    for user_id, socket in sockets.items():
+        await manager.connect_user(socket, user_id, "PASSENGER" if "passenger" in user_id else "CONTROL_STAFF")
+        manager.subscribe_to_notifications(user_id, ["GENERAL"])
+
+    stored = await NotificationService.broadcast_notification(
+        title="Hi", message="Targeted", target_user_ids=["passenger-1", "passenger-4", "missing"], app_state=app_state
+    )
+    assert stored == 2
+    assert [len(socket.sent) for socket in sockets.values()] == [0, 1, 0]
+
+    stored = await NotificationService.broadcast_notification(title="Hi", message="Everyone", app_state=app_state)
+    assert stored == 7
+    assert [len(socket.sent) for socket in sockets.values()] == [1, 2, 1]
+
+
+@pytest.mark.asyncio
+async def test_storage_failures_are_raised(manager, fake_socket):
+    db: Any = AsyncMongoMockClient()["fanout_failure_test"]
+    await seed_users(db, {"PASSENGER": 3})
+    notifications = SimpleNamespace(insert_many=AsyncMock(side_effect=RuntimeError("mongo down")))
+    app_state = SimpleNamespace(mongodb=SimpleNamespace(users=db.users, notifications=notifications))
+
+    socket = fake_socket()
+    await manager.connect_user(socket, "passenger-0", "PASSENGER")
+    manager.subscribe_to_notifications("passenger-0", ["GENERAL"])
+
+    with pytest.raises(RuntimeError):
+        await NotificationService.broadcast_notification(title="Hi", message="Everyone", app_state=app_state)
+    assert socket.sent == []
+
+
+@pytest.mark.asyncio
+async def test_role_rooms_follow_connections(manager, fake_socket):
+    healthy, broken = fake_socket(), fake_socket(fail=True)
+    await manager.connect_user(healthy, "driver-1", "BUS_DRIVER")
+    await manager.connect_user(broken, "driver-2", "BUS_DRIVER")
+    await manager.connect_user(fake_socket(), "sim-1")
+    assert manager.get_users_in_room(role_room("BUS_DRIVER")) == {"driver-1", "driver-2"}
+
+    # One serialization for the room; the dead socket is dropped
+    assert await manager.send_room_message(role_room("BUS_DRIVER"), {"type": "ping"})
+    assert healthy.sent == [{"type": "ping"}]
+    assert manager.get_users_in_room(role_room("BUS_DRIVER")) == {"driver-1"}
+    assert not manager.is_user_connected("driver-2")
+
+    await manager.disconnect_user("driver-1")
+    assert role_room("BUS_DRIVER") not in manager.rooms
+
+
+@pytest.mark.asyncio
+async def test_subscription_index_stays_in_sync(manager, fake_socket):
+    for user_id in ["a", "b", "c"]:
+        await manager.connect_user(fake_socket(), user_id, "PASSENGER")
+    manager.subscribe_to_notifications("a", ["GENERAL", "PROXIMITY_ALERT"])
+    manager.subscribe_to_notifications("b", ["GENERAL"])
+    manager.subscribe_to_notifications("c", ["PROXIMITY_ALERT"])
+
+    assert sorted(manager.get_subscribed_users_for_notification("GENERAL")) == ["a", "b"]
+    assert manager.is_user_subscribed_to_notification("c", "PROXIMITY_ALERT")
+    assert manager.get_subscription_stats()["subscriptions"] == 4
+
+    manager.unsubscribe_from_notifications("a", ["GENERAL"])
+    await manager.disconnect_user("c")
+    assert manager.notification_subscribers == {"GENERAL": {"b"}, "PROXIMITY_ALERT": {"a"}}
+    assert manager.notification_subscriptions == {"a": {"PROXIMITY_ALERT"}, "b": {"GENERAL"}}
+
+    manager.unsubscribe_from_notifications("a", ["PROXIMITY_ALERT"])
+    stats = manager.get_stats()
+    assert stats["notification_subscriptions"]["subscribers_by_type"] == {"GENERAL": 1}
+    assert stats["role_rooms"] == {role_room("PASSENGER"): 2}
+    assert stats["notification_subscriptions"]["index_bytes"] > 0
+
+    # Typed delivery only reaches subscribers, within the room or id list given
+    assert await manager.send_notification("GENERAL", {"type": "ping"}, room_id=role_room("PASSENGER")) == 1
+    assert await manager.send_notification("GENERAL", {"type": "ping"}, user_ids=["a", "missing"]) == 0
+    assert await manager.send_notification("PROXIMITY_ALERT", {"type": "ping"}) == 0
+
+
+def test_stats_require_control_center_access():
+    app = FastAPI()
+    app.include_router(websocket.router)
+
+    with TestClient(app) as client:
+        assert client.get("/ws/stats").status_code in (401, 403)
+
+        app.dependency_overrides[get_current_user] = lambda: SimpleNamespace(role=UserRole.PASSENGER)
+        assert client.get("/ws/stats").status_code == 403
+
+        app.dependency_overrides[get_current_user] = lambda: SimpleNamespace(role=UserRole.CONTROL_STAFF)
+        response = client.get("/ws/stats")
+        assert response.status_code == 200
+        assert "proximity_alerts" in response.json()
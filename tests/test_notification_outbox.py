@@ -0,0 +1,144 @@
+"""
+Tests for queued storage and delivery of per-user notifications.
+"""
+
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import pytest
+from bson import ObjectId
+from mongomock_motor import AsyncMongoMockClient
+
+from core.realtime.notification_outbox import NotificationOutbox
+from core.realtime.notifications import NotificationService
+from core.websocket_manager import WebSocketManager
+
+
+@pytest.fixture
+def manager():
+    manager = WebSocketManager()
+    with patch("core.realtime.notifications.websocket_manager", manager), \
+            patch("core.realtime.notification_outbox.websocket_manager", manager):
+        yield manager
+
+
+@pytest.fixture
+def db():
+    return AsyncMongoMockClient()["notification_outbox_test"]
+
+
+@pytest.mark.asyncio
+async def test_burst_is_queued_then_stored_and_delivered_in_batches(manager, db, fake_socket):
+    online = fake_socket()
+    await manager.connect_user(online, "driver-1", "BUS_DRIVER")
+    for user_id in ["driver-1", "driver-2"]:
+        manager.subscribe_to_notifications(user_id, ["ROUTE_REALLOCATION"])
+
+    outbox = NotificationOutbox(db, capacity=2000, batch_size=500, workers=2)
+    with patch("core.realtime.notifications.notification_outbox", outbox):
+        await outbox.start()
+        for index in range(600):
+            await NotificationService.send_real_time_notification(
+                user_id=f"driver-{index % 2 + 1}", title="Route Reallocation", message=f"Update {index}",
+                notification_type="ROUTE_REALLOCATION", app_state=SimpleNamespace(mongodb=db)
+            )
+        # Not subscribed: neither queued nor stored
+        await NotificationService.send_real_time_notification(
+            user_id="driver-3", title="Ignored", message="", notification_type="ROUTE_REALLOCATION",
+            app_state=SimpleNamespace(mongodb=db)
+        )
+        # Callers returned before anything was written
+        assert await db.notifications.count_documents({}) == 0
+        assert outbox.get_stats()["depth"] == 600
+        await outbox.stop()
+
+    stats = outbox.get_stats()
+    assert (stats["stored"], stats["delivered"], stats["offline"], stats["batches"]) == (600, 300, 300, 2)
+    assert await db.notifications.count_documents({"user_id": "driver-1", "delivery_status": "delivered"}) == 300
+    assert await db.notifications.count_documents({"user_id": "driver-2", "delivery_status": "offline"}) == 300
+
+    assert len(online.sent) == 300
+    first = await db.notifications.find_one({"_id": ObjectId(online.sent[0]["notification"]["id"])})
+    assert first["message"] == "Update 0" and first["is_read"] is False
+
+
+@pytest.mark.asyncio
+async def test_full_or_stopped_outbox_falls_back_to_inline_delivery(manager, db, fake_socket):
+    socket = fake_socket()
+    await manager.connect_user(socket, "regulator-1", "QUEUE_REGULATOR")
+    manager.subscribe_to_notifications("regulator-1", ["GENERAL"])
+    app_state = SimpleNamespace(mongodb=db)
+
+    outbox = NotificationOutbox(db, capacity=1, workers=1)
+    with patch("core.realtime.notifications.notification_outbox", outbox):
+        await NotificationService.send_real_time_notification("regulator-1", "Inline", "Not running", app_state=app_state)
+        assert len(socket.sent) == 1
+        assert await db.notifications.count_documents({"title": "Inline"}) == 1
+
+        await outbox.start()
+        assert outbox.enqueue("regulator-1", "Queued", "One")
+        await NotificationService.send_real_time_notification("regulator-1", "Overflow", "Full", app_state=app_state)
+        assert await db.notifications.count_documents({"title": "Overflow"}) == 1
+        await outbox.stop()
+
+    assert outbox.get_stats()["rejected"] == 2
+    assert [message["notification"]["title"] for message in socket.sent] == ["Inline", "Overflow", "Queued"]
+
+
+@pytest.mark.asyncio
+async def test_interrupted_deliveries_are_resent_when_the_user_reconnects(manager, db, fake_socket):
+    now = datetime.now(timezone.utc)
+    await db.notifications.insert_many([
+        {"user_id": "passenger-1", "title": title, "message": "", "type": "GENERAL", "is_read": False,
+         "created_at": created_at, "delivery_status": "pending"}
+        for title, created_at in [
+            ("Recent", now - timedelta(seconds=30)),
+            ("Stale", now - timedelta(hours=2)),
+            # Still in a live worker's batch
+            ("In flight", now - timedelta(seconds=1))
+        ]
+    ])
+
+    # Starting (in every worker, before clients reconnect) only expires what is too old
+    outbox = NotificationOutbox(db, workers=1, redelivery_seconds=300, in_flight_seconds=10)
+    other_worker = NotificationOutbox(db, workers=1, redelivery_seconds=300, in_flight_seconds=10)
+    await outbox.start()
+    await other_worker.start()
+    statuses = {document["title"]: document["delivery_status"] async for document in db.notifications.find()}
+    assert statuses == {"Recent": "pending", "Stale": "expired", "In flight": "pending"}
+
+    socket = fake_socket()
+    await manager.connect_user(socket, "passenger-1", "PASSENGER")
+    assert await outbox.redeliver("passenger-1") == 1
+    # A second connection on another worker does not get it again
+    assert await other_worker.redeliver("passenger-1") == 0
+    await outbox.stop()
+    await other_worker.stop()
+
+    assert [message["notification"]["title"] for message in socket.sent] == ["Recent"]
+    statuses = {document["title"]: document["delivery_status"] async for document in db.notifications.find()}
+    assert statuses == {"Recent": "delivered", "Stale": "expired", "In flight": "pending"}
+    assert outbox.get_stats()["redelivered"] == 1
+
+
+@pytest.mark.asyncio
+async def test_trip_updates_are_delivered_without_storing(manager, db, fake_socket):
+    participant, tracker = fake_socket(), fake_socket()
+    await manager.connect_user(participant, "passenger-1")
+    await manager.connect_user(tracker, "passenger-2")
+    await manager.join_room_user("passenger-2", "route_tracking:route-1")
+    await db.trips.insert_one({"id": "trip-1", "route_id": "route-1", "participants": ["passenger-1"]})
+
+    outbox = NotificationOutbox(db, workers=1)
+    with patch("core.realtime.notifications.notification_outbox", outbox):
+        await outbox.start()
+        await NotificationService.send_trip_update_notification(
+            "trip-1", "Running 5 minutes late", delay_minutes=5, app_state=SimpleNamespace(mongodb=db)
+        )
+        assert participant.sent == [] and tracker.sent == []
+        await outbox.stop()
+
+    assert participant.sent[0]["notification"]["notification_type"] == "TRIP_UPDATE"
+    assert tracker.sent[0]["notification"]["related_entity"]["delay_minutes"] == 5
+    assert await db.notifications.count_documents({}) == 0
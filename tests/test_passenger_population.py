@@ -0,0 +1,97 @@
+"""
+Tests for the synthetic passenger population.
+"""
+
+import pytest
+from types import SimpleNamespace
+from typing import Any
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from mongomock_motor import AsyncMongoMockClient
+
+from core.realtime.notifications import NotificationService
+from core.websocket_manager import websocket_manager
+from simulation.passenger_population import PassengerPopulation, load_stops
+
+
+STOPS = [
+    {"stop_id": "stop-a", "name": "Stop A", "latitude": 9.0000, "longitude": 38.7000},
+    {"stop_id": "stop-b", "name": "Stop B", "latitude": 9.0500, "longitude": 38.7500},
+]
+
+
+@pytest.fixture
+def population():
+    population = PassengerPopulation(MagicMock(), app_state=MagicMock(), size=6, stops=STOPS, seed=3)
+    population._place_passengers()
+    return population
+
+
+class TestPassengerPopulation:
+    """Test passenger placement, proximity tracking and latency metrics."""
+
+    def test_load_stops_from_gtfs_file(self):
+        stops = load_stops()
+        assert len(stops) > 1000
+        assert {"stop_id", "name", "latitude", "longitude"} <= set(stops[0])
+
+    def test_passengers_wait_near_their_stop(self, population):
+        assert len(population.passengers) == 6
+        for passenger in population.passengers:
+            stop = population.stops[passenger["stop_index"]]
+            assert abs(passenger["home_latitude"] - stop["latitude"]) < 0.002
+            assert abs(passenger["home_longitude"] - stop["longitude"]) < 0.002
+
+    @pytest.mark.asyncio
+    async def test_alert_latency_is_measured_from_radius_entry(self, population):
+        await population._connect_passengers()
+        stop_index = population.stops.index(STOPS[0])
+        waiting = [p["id"] for p in population.passengers if p["stop_index"] == stop_index]
+
+        async def notify(bus_id, latitude, longitude, app_state=None):
+            for user_id in waiting:
+                await websocket_manager.send_personal_message(
+                    user_id, {"type": "proximity_alert", "bus_id": bus_id}
+                )
+
+        try:
+            with patch(
+                "simulation.passenger_population.bus_tracking_service.check_proximity_notifications",
+                new=AsyncMock(side_effect=notify)
+            ) as check:
+                # Far away: no proximity check
+                await population.on_tick([{"bus_id": "bus-1", "latitude": 9.2, "longitude": 38.9}], 100.0)
+                check.assert_not_awaited()
+
+                # Enters Stop A's radius: passengers there are alerted once per visit
+                await population.on_tick([{"bus_id": "bus-1", "latitude": 9.001, "longitude": 38.7}], 100.0)
+                await population.on_tick([{"bus_id": "bus-1", "latitude": 9.0005, "longitude": 38.7}], 105.0)
+        finally:
+            await population.stop(remove_passengers=False)
+
+        metrics = population.get_metrics()
+        assert metrics["proximity_checks"] == 2
+        assert metrics["alerts_received"] == 2 * len(waiting)
+        assert metrics["notification_latency_ms"]["samples"] == len(waiting)
+        assert metrics["connected"] == 0
+        assert not any(p["id"] in websocket_manager.user_connections for p in population.passengers)
+
+    @pytest.mark.asyncio
+    async def test_simulated_passengers_stay_out_of_real_user_queries(self):
+        db: Any = AsyncMongoMockClient()["passenger_population_test"]
+        await db.users.insert_one({"id": "real-1", "role": "PASSENGER"})
+        population = PassengerPopulation(db, app_state=SimpleNamespace(mongodb=db), size=4, stops=STOPS, seed=3)
+        await population.spawn()
+        try:
+            assert await db.users.count_documents({"is_simulated": True}) == 4
+            stored = await NotificationService.broadcast_notification(
+                title="Service update", message="Everyone", target_roles=["PASSENGER"],
+                app_state=SimpleNamespace(mongodb=db)
+            )
+            assert stored == 1
+            await db.notifications.insert_one({"user_id": population.passengers[0]["id"], "title": "Alert"})
+        finally:
+            await population.stop()
+
+        assert [user["id"] async for user in db.users.find()] == ["real-1"]
+        assert [n["user_id"] async for n in db.notifications.find()] == ["real-1"]
@@ -0,0 +1,213 @@
+"""
+Tests for background reconciliation of pending payments.
+"""
+
+import asyncio
+import time
+from datetime import datetime, timedelta
+from typing import Any
+from unittest.mock import MagicMock
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+from core.payment_reconciler import STATE_COLLECTION, PaymentReconciler
+from core.rate_limiter import RateLimiter
+from models.payment import PaymentStatus
+
+
+class FakeClock:
+    """A frozen monotonic clock whose sleeps record when they would have woken."""
+
+    def __init__(self):
+        self.now = 0.0
+        self.wakeups = []
+
+    def monotonic(self):
+        return self.now
+
+    async def sleep(self, seconds):
+        self.wakeups.append(round(self.now + seconds, 6))
+        await asyncio.sleep(0)
+
+
+class FakeChapa:
+    """Answers verify_payment from a table, tracking how many calls are in flight."""
+
+    def __init__(self, statuses, latency=0.0, on_verify=None):
+        self.statuses = statuses
+        self.latency = latency
+        self.on_verify = on_verify
+        self.calls = []
+        self.in_flight = self.max_in_flight = 0
+
+    async def verify_payment(self, tx_ref):
+        self.calls.append((tx_ref, time.monotonic()))
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.latency)
+            if self.on_verify:
+                await self.on_verify(tx_ref)
+            status = self.statuses[tx_ref]
+            if isinstance(status, Exception):
+                raise status
+            return {"tx_ref": tx_ref, "status": status, "paid_at": "2024-03-01T08:00:00", "chapa_response": {}}
+        finally:
+            self.in_flight -= 1
+
+
+async def seed(db, tx_ref, minutes_old, as_string=False, **fields):
+    created_at = datetime.utcnow() - timedelta(minutes=minutes_old)
+    payment_id = f"payment-{tx_ref}"
+    await db.payments.insert_one({
+        "_id": payment_id, "tx_ref": tx_ref, "amount": 25.0, "status": "PENDING",
+        "created_at": created_at.isoformat() if as_string else created_at,
+        "customer_first_name": "Abebe", "customer_last_name": "Kebede", **fields
+    })
+    await db.tickets.insert_one({
+        "_id": f"ticket-{tx_ref}", "payment_id": payment_id, "ticket_number": f"TKT-{tx_ref}", "status": "ACTIVE",
+        "ticket_type": "SINGLE_TRIP", "valid_from": "2024-03-01T08:00:00", "valid_until": "2024-03-31T08:00:00"
+    })
+
+
+@pytest.mark.asyncio
+async def test_pass_settles_stale_payments_in_bulk_and_checkpoints_the_rest(bulk_database):
+    raw: Any = AsyncMongoMockClient()["guzosync_test"]
+    db = bulk_database(raw)
+    await seed(raw, "tx-paid", 60, as_string=True)
+    await seed(raw, "tx-failed", 50)
+    await seed(raw, "tx-waiting", 40, as_string=True)
+    await seed(raw, "tx-down", 30)
+    await seed(raw, "tx-raced", 20)
+    await seed(raw, "tx-fresh", 1)
+
+    async def webhook_lands_first(tx_ref):
+        if tx_ref == "tx-raced":
+            await raw.payments.update_one({"tx_ref": "tx-raced"}, {"$set": {"status": "COMPLETED"}})
+
+    chapa = FakeChapa({
+        "tx-paid": PaymentStatus.COMPLETED, "tx-failed": PaymentStatus.FAILED,
+        "tx-waiting": PaymentStatus.PENDING, "tx-down": Exception("Payment verification failed: timeout"),
+        "tx-raced": PaymentStatus.COMPLETED,
+    }, on_verify=webhook_lands_first)
+    kpis = MagicMock()
+    reconciler = PaymentReconciler(db, chapa=chapa, kpis=kpis, min_age_minutes=15, rate_per_second=1000)
+
+    assert await reconciler.run_pass() == 5
+    assert sorted(tx_ref for tx_ref, _ in chapa.calls) == ["tx-down", "tx-failed", "tx-paid", "tx-raced", "tx-waiting"]
+
+    status = {p["tx_ref"]: p async for p in raw.payments.find()}
+    assert {tx: p["status"] for tx, p in status.items()} == {
+        "tx-paid": "COMPLETED", "tx-failed": "FAILED", "tx-waiting": "PENDING",
+        "tx-down": "PENDING", "tx-raced": "COMPLETED", "tx-fresh": "PENDING"
+    }
+    assert status["tx-paid"]["paid_at"] == "2024-03-01T08:00:00"
+    for tx_ref in ("tx-waiting", "tx-down"):
+        assert status[tx_ref]["reconcile_attempts"] == 1
+        assert status[tx_ref]["reconcile_after"] > datetime.utcnow() + timedelta(minutes=9)
+
+    tickets = {t["_id"]: t async for t in raw.tickets.find()}
+    assert tickets["ticket-tx-paid"]["status"] == "ACTIVE"
+    assert tickets["ticket-tx-paid"]["signed_token"].startswith("1.TKT-tx-paid.S.")
+    assert tickets["ticket-tx-failed"]["status"] == "CANCELLED"
+    # The webhook that settled tx-raced owns its ticket and its KPI
+    assert "signed_token" not in tickets["ticket-tx-raced"]
+    assert sorted(c.args[0]["tx_ref"] for c in kpis.record_payment.call_args_list) == ["tx-failed", "tx-paid"]
+    assert reconciler.stats == {
+        "passes": 1, "verified": 4, "completed": 1, "failed": 1, "cancelled": 0, "still_pending": 1,
+        "errors": 1, "conflicts": 1
+    }
+
+    # Backlog: the two not yet settled, the older being 40 minutes old (stored as an ISO string)
+    oldest_age = reconciler.backlog["oldest_age_seconds"]
+    assert reconciler.backlog["pending"] == 2
+    assert oldest_age is not None and 40 * 60 <= oldest_age < 41 * 60
+    state = await raw[STATE_COLLECTION].find_one({"_id": "payments"})
+    assert state is not None
+    assert (state["last_pass_verified"], state["backlog_pending"]) == (5, 2)
+
+    # Nothing is due again yet, on this instance or after a restart
+    chapa.calls.clear()
+    assert await reconciler.run_pass() == 0
+    await reconciler.stop()
+    assert await PaymentReconciler(db, chapa=chapa, kpis=kpis, min_age_minutes=15).run_pass() == 0
+    assert chapa.calls == []
+
+
+@pytest.mark.asyncio
+async def test_settling_never_reopens_closed_tickets(bulk_database):
+    raw: Any = AsyncMongoMockClient()["guzosync_test"]
+    for tx_ref in ("tx-used", "tx-used-failed", "tx-cancelled"):
+        await seed(raw, tx_ref, 60)
+    # Redeemed, or cancelled by an earlier verification, before this pass caught up with the payment
+    await raw.tickets.update_many(
+        {"_id": {"$in": ["ticket-tx-used", "ticket-tx-used-failed"]}}, {"$set": {"status": "USED", "signed_token": "1.x"}}
+    )
+    await raw.tickets.update_one({"_id": "ticket-tx-cancelled"}, {"$set": {"status": "CANCELLED"}})
+    chapa = FakeChapa({
+        "tx-used": PaymentStatus.COMPLETED, "tx-used-failed": PaymentStatus.FAILED,
+        "tx-cancelled": PaymentStatus.COMPLETED,
+    })
+    reconciler = PaymentReconciler(bulk_database(raw), chapa=chapa, kpis=MagicMock(), min_age_minutes=15)
+
+    assert await reconciler.run_pass() == 3
+    tickets = {t["_id"]: t async for t in raw.tickets.find()}
+    assert {ticket_id: (t["status"], t.get("signed_token")) for ticket_id, t in tickets.items()} == {
+        "ticket-tx-used": ("USED", "1.x"), "ticket-tx-used-failed": ("USED", "1.x"),
+        "ticket-tx-cancelled": ("CANCELLED", None),
+    }
+    await reconciler.stop()
+
+
+@pytest.mark.asyncio
+async def test_verifications_are_concurrent_but_bounded_and_rate_limited(bulk_database):
+    raw: Any = AsyncMongoMockClient()["guzosync_test"]
+    for index in range(12):
+        await seed(raw, f"tx-{index}", 60 - index)
+    chapa = FakeChapa({f"tx-{index}": PaymentStatus.PENDING for index in range(12)}, latency=0.05)
+    reconciler = PaymentReconciler(
+        bulk_database(raw), chapa=chapa, kpis=MagicMock(), min_age_minutes=15,
+        batch_size=5, concurrency=3, rate_per_second=100
+    )
+    clock = FakeClock()
+    reconciler.rate_limiter = RateLimiter(100, clock=clock.monotonic, sleep=clock.sleep)
+
+    started = time.monotonic()
+    assert await reconciler.run_pass() == 12
+    elapsed = time.monotonic() - started
+
+    assert chapa.max_in_flight == 3
+    # One call goes straight through, the others wait for consecutive 10ms slots
+    assert sorted(clock.wakeups) == [round(index * 0.01, 6) for index in range(1, 12)]
+    # Oldest first, in three batches, and far faster than one call at a time
+    assert [tx_ref for tx_ref, _ in chapa.calls[:5]] == [f"tx-{index}" for index in range(5)]
+    assert elapsed < 12 * 0.05
+
+
+@pytest.mark.asyncio
+async def test_only_the_lease_holder_reconciles(bulk_database):
+    raw: Any = AsyncMongoMockClient()["guzosync_test"]
+    await seed(raw, "tx-1", 60)
+    chapa = FakeChapa({"tx-1": PaymentStatus.PENDING})
+    first = PaymentReconciler(bulk_database(raw), chapa=chapa, kpis=MagicMock(), min_age_minutes=15)
+    second = PaymentReconciler(bulk_database(raw), chapa=chapa, kpis=MagicMock(), min_age_minutes=15)
+
+    assert await first.run_pass() == 1
+    await raw.payments.update_many({}, {"$unset": {"reconcile_after": ""}})
+    assert await second.run_pass() == 0
+    await first.stop()
+    assert await second.run_pass() == 1
+
+
+@pytest.mark.asyncio
+async def test_rate_limiter_spaces_calls():
+    clock = FakeClock()
+    limiter = RateLimiter(rate=50, clock=clock.monotonic, sleep=clock.sleep)
+    await asyncio.gather(*(limiter.acquire() for _ in range(6)))
+    assert clock.wakeups == [0.02, 0.04, 0.06, 0.08, 0.1]
+
+    # Once the clock has passed the last slot, the next call is not delayed
+    clock.now = 1.0
+    await limiter.acquire()
+    assert len(clock.wakeups) == 5
@@ -0,0 +1,228 @@
+"""
+Tests for queued, idempotent Chapa webhook processing.
+"""
+
+import asyncio
+import hashlib
+import json
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from typing import Any, Dict
+from unittest.mock import MagicMock, patch
+
+import pytest
+from bson import ObjectId
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from mongomock_motor import AsyncMongoMockClient
+
+from core.chapa_service import chapa_service
+from core.dependencies import get_current_user
+from core.payment_webhooks import EVENTS_COLLECTION, PaymentWebhookProcessor
+from models.payment import PaymentStatus
+from routers import payments
+
+
+def webhook_body(event="payment.success", tx_ref="tx-1"):
+    return json.dumps({
+        "event": event,
+        "data": {"tx_ref": tx_ref, "amount": "25"},
+        "timestamp": "2024-03-01T08:00:00"
+    })
+
+
+async def seed_payment(db, tx_ref="tx-1", ticket_status="ACTIVE"):
+    payment_id = ObjectId()
+    await db.payments.insert_one({
+        "_id": payment_id, "tx_ref": tx_ref, "amount": 25.0, "status": "PENDING",
+        "created_at": datetime.utcnow(), "customer_first_name": "Abebe", "customer_last_name": "Kebede"
+    })
+    await db.tickets.insert_one({
+        "_id": ObjectId(), "payment_id": str(payment_id), "ticket_number": f"TKT-{tx_ref}", "status": ticket_status,
+        "ticket_type": "SINGLE_TRIP", "valid_from": "2024-03-01T08:00:00", "valid_until": "2024-03-31T08:00:00"
+    })
+
+
+async def find(collection, query=None) -> Dict[str, Any]:
+    document = await collection.find_one(query or {})
+    assert document is not None
+    return document
+
+
+@pytest.fixture
+def processor():
+    return PaymentWebhookProcessor(kpis=MagicMock(), workers=2, retry_backoff=0.01, poll_interval=0.05)
+
+
+@pytest.fixture
+def db():
+    return AsyncMongoMockClient()["guzosync_test"]
+
+
+@pytest.fixture
+def client(processor, db):
+    processor.db = db
+    app = FastAPI()
+    app.include_router(payments.router)
+    app.state.mongodb = db
+    with patch("routers.payments.payment_webhook_processor", processor), TestClient(app) as test_client:
+        assert test_client.portal is not None
+        test_client.portal.call(processor.ensure_indexes, db)
+        yield test_client
+
+
+def test_webhook_records_event_once_and_returns_immediately(client, processor, db):
+    body = webhook_body()
+    signature = hashlib.sha256((body + chapa_service.secret_key).encode()).hexdigest()
+
+    first = client.post("/api/payments/webhook/chapa", content=body, headers={"x-chapa-signature": signature})
+    assert first.status_code == 200
+    assert first.json()["message"] == "Webhook queued for processing"
+
+    # Chapa's redelivery is acknowledged without a second record
+    again = client.post("/api/payments/webhook/chapa", content=body, headers={"x-chapa-signature": signature})
+    assert again.status_code == 200
+    assert again.json()["message"] == "Duplicate webhook ignored"
+
+    events = client.portal.call(lambda: db[EVENTS_COLLECTION].find().to_list(None))
+    assert len(events) == 1
+    assert (events[0]["tx_ref"], events[0]["event"], events[0]["status"]) == ("tx-1", "payment.success", "pending")
+    assert events[0]["payload"] == body
+    assert processor.stats["duplicates"] == 1
+
+    # A different event for the same transaction is a separate record
+    assert client.post("/api/payments/webhook/chapa", content=webhook_body("payment.failed")).status_code == 200
+
+    bad = client.post("/api/payments/webhook/chapa", content=body, headers={"x-chapa-signature": "forged"})
+    assert bad.status_code == 401
+    assert client.post("/api/payments/webhook/chapa", content="{}").status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_events_apply_idempotently(processor, db):
+    processor.db = db
+    await processor.ensure_indexes(db)
+    await seed_payment(db)
+
+    await processor.enqueue(db, "payment.success", {"tx_ref": "tx-1"}, "{}")
+    # A late failure for a completed payment must not revert it
+    await processor.enqueue(db, "payment.failed", {"tx_ref": "tx-1"}, "{}")
+    assert await processor.drain() == 2
+
+    payment = await find(db.payments, {"tx_ref": "tx-1"})
+    ticket = await find(db.tickets, {"ticket_number": "TKT-tx-1"})
+    assert payment["status"] == "COMPLETED"
+    assert ticket["status"] == "ACTIVE" and ticket["qr_code"]
+    assert ticket["signed_token"].startswith("1.TKT-tx-1.S.")
+    processor.kpis.record_payment.assert_called_once()
+
+    # Replaying the success event changes nothing
+    await db[EVENTS_COLLECTION].update_many({}, {"$set": {"status": "pending"}})
+    with patch("core.ticket_tokens.ticket_qr_fields") as generate:
+        assert await processor.drain() == 2
+    generate.assert_not_called()
+    processor.kpis.record_payment.assert_called_once()
+    assert processor.stats["processed"] == 4
+
+
+@pytest.mark.asyncio
+async def test_failures_are_retried_with_backoff_then_given_up(processor, db):
+    processor.db = db
+    processor.max_attempts = 2
+    processor.retry_backoff = 60
+    await processor.ensure_indexes(db)
+    await seed_payment(db)
+    await processor.enqueue(db, "payment.success", {"tx_ref": "tx-1"}, "{}")
+
+    with patch.object(processor, "apply", side_effect=RuntimeError("database hiccup")):
+        assert await processor.drain() == 1
+        event = await find(db[EVENTS_COLLECTION])
+        assert event["status"] == "pending"
+        assert event["attempts"] == 1
+        assert event["last_error"] == "database hiccup"
+        assert event["next_attempt_at"] > datetime.utcnow() - timedelta(seconds=1)
+
+        # Not due yet, unless the backoff has passed
+        await db[EVENTS_COLLECTION].update_one({}, {"$set": {"next_attempt_at": datetime.utcnow()}})
+        assert await processor.drain() == 1
+
+    event = await find(db[EVENTS_COLLECTION])
+    assert (event["status"], event["attempts"]) == ("failed", 2)
+    assert processor.stats == {"received": 1, "duplicates": 0, "processed": 0, "retried": 1, "failed": 1}
+
+
+@pytest.mark.asyncio
+async def test_workers_pick_up_new_and_abandoned_events(processor, db):
+    await seed_payment(db, "tx-1")
+    await seed_payment(db, "tx-2")
+    # Claimed by a worker that died before finishing
+    await db[EVENTS_COLLECTION].insert_one({
+        "tx_ref": "tx-2", "event": "payment.cancelled", "data": {"tx_ref": "tx-2"}, "status": "processing",
+        "attempts": 1, "next_attempt_at": datetime.utcnow(), "lease_until": datetime.utcnow() - timedelta(seconds=1)
+    })
+
+    await processor.start(db)
+    try:
+        await processor.enqueue(db, "payment.success", {"tx_ref": "tx-1"}, "{}")
+        for _ in range(100):
+            if await db[EVENTS_COLLECTION].count_documents({"status": "processed"}) == 2:
+                break
+            await asyncio.sleep(0.02)
+    finally:
+        await processor.stop()
+
+    assert (await find(db.payments, {"tx_ref": "tx-1"}))["status"] == "COMPLETED"
+    assert (await find(db.payments, {"tx_ref": "tx-2"}))["status"] == "CANCELLED"
+    assert await db.tickets.count_documents({"status": "CANCELLED"}) == 1
+
+
+@pytest.mark.asyncio
+async def test_replayed_events_leave_closed_tickets_alone(processor, db):
+    processor.db = db
+    await processor.ensure_indexes(db)
+    await seed_payment(db, "tx-1")
+    await seed_payment(db, "tx-2", ticket_status="EXPIRED")
+
+    await processor.enqueue(db, "payment.success", {"tx_ref": "tx-1"}, "{}")
+    assert await processor.drain() == 1
+    token = (await find(db.tickets, {"ticket_number": "TKT-tx-1"}))["signed_token"]
+    await db.tickets.update_one({"ticket_number": "TKT-tx-1"}, {"$set": {"status": "USED"}})
+
+    # Chapa redelivers the success after the ticket was ridden on
+    await db[EVENTS_COLLECTION].update_many({}, {"$set": {"status": "pending"}})
+    await processor.enqueue(db, "payment.cancelled", {"tx_ref": "tx-2"}, "{}")
+    assert await processor.drain() == 2
+
+    used = await find(db.tickets, {"ticket_number": "TKT-tx-1"})
+    assert (used["status"], used["signed_token"]) == ("USED", token)
+    assert (await find(db.tickets, {"ticket_number": "TKT-tx-2"}))["status"] == "EXPIRED"
+
+
+def test_verify_settles_tickets_only_when_it_moves_the_payment(db):
+    app = FastAPI()
+    app.include_router(payments.router)
+    app.state.mongodb = db
+    app.dependency_overrides[get_current_user] = lambda: SimpleNamespace(id="customer-1")
+    verdicts = iter([PaymentStatus.COMPLETED, PaymentStatus.FAILED])
+
+    async def verify(tx_ref):
+        return {"tx_ref": tx_ref, "status": next(verdicts), "chapa_response": {}}
+
+    with patch("routers.payments.chapa_service.verify_payment", verify), \
+            patch("routers.payments.kpi_aggregator") as kpis, TestClient(app) as client:
+        assert client.portal is not None
+        client.portal.call(seed_payment, db)
+        client.portal.call(lambda: db.payments.update_many({}, {"$set": {"customer_id": "customer-1"}}))
+
+        completed = client.post("/api/payments/verify", json={"tx_ref": "tx-1"})
+        assert completed.json()["status"] == "COMPLETED"
+        ticket = client.portal.call(find, db.tickets)
+        assert (ticket["status"], ticket["signed_token"].startswith("1.TKT-tx-1.S.")) == ("ACTIVE", True)
+
+        # A later, contradicting verdict neither reverts the payment nor cancels its ticket
+        late = client.post("/api/payments/verify", json={"tx_ref": "tx-1"})
+        assert late.json()["status"] == "COMPLETED"
+        assert client.portal.call(find, db.payments)["status"] == "COMPLETED"
+        assert client.portal.call(find, db.tickets)["status"] == "ACTIVE"
+
+    kpis.record_payment.assert_called_once()
@@ -0,0 +1,133 @@
+"""
+Tests for proximity alert deduplication and batched notification writes.
+"""
+
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from typing import Any, cast
+from unittest.mock import patch
+
+import pytest
+from fastapi import WebSocket
+from mongomock_motor import AsyncMongoMockClient
+
+from core.realtime.bus_tracking import BusTrackingService
+from core.realtime.proximity_alerts import (
+    APPROACHING, ARRIVED, COOLDOWN_COLLECTION, DEPARTED, ProximityAlertTracker
+)
+from core.websocket_manager import WebSocketManager
+
+
+def test_one_alert_per_approach():
+    tracker = ProximityAlertTracker(arrived_meters=50, cooldown_seconds=100, ttl_seconds=600)
+
+    assert tracker.observe("p1", "bus-1", "stop-1", 400, now=0)
+    assert not tracker.observe("p1", "bus-1", "stop-1", 200, now=5)
+    assert tracker.approaches[("p1", "bus-1", "stop-1")].state == APPROACHING
+    assert not tracker.observe("p1", "bus-1", "stop-1", 30, now=10)
+    assert tracker.approaches[("p1", "bus-1", "stop-1")].state == ARRIVED
+    # Other passengers and other buses are separate approaches
+    assert tracker.observe("p2", "bus-1", "stop-1", 30, now=10)
+    assert tracker.observe("p1", "bus-2", "stop-1", 300, now=10)
+
+    tracker.observe_bus("bus-1", [], now=20)
+    assert tracker.approaches[("p1", "bus-1", "stop-1")].state == DEPARTED
+    # Bouncing back within the cooldown does not alert again
+    assert not tracker.observe("p1", "bus-1", "stop-1", 480, now=50)
+    assert tracker.observe("p1", "bus-1", "stop-1", 480, now=130)
+
+    stats = tracker.get_stats()
+    assert (stats["alerts"], stats["suppressed"], stats["departures"]) == (4, 3, 2)
+    assert stats["approaches"] == {APPROACHING: 2, ARRIVED: 0, DEPARTED: 1}
+
+
+def test_stale_approaches_are_evicted():
+    tracker = ProximityAlertTracker(cooldown_seconds=100, ttl_seconds=60)
+    tracker.observe("p1", "bus-1", "stop-1", 300, now=0)
+    tracker.observe("p2", "bus-1", "stop-2", 300, now=0)
+    tracker.observe_bus("bus-1", ["stop-1"], now=10)
+
+    assert tracker.evict(now=50) == 0
+    tracker.observe("p1", "bus-1", "stop-1", 200, now=50)
+    # stop-2 departed and was not seen since; stop-1 is still live
+    assert tracker.evict(now=110) == 1
+    assert list(tracker.approaches) == [("p1", "bus-1", "stop-1")]
+    assert tracker.evict(now=200) == 1
+    assert tracker.approaches == {} and tracker.bus_approaches == {}
+
+
+@pytest.mark.asyncio
+async def test_location_updates_alert_once_and_write_in_batches(fake_socket):
+    db: Any = AsyncMongoMockClient()["proximity_test"]
+    await db.bus_stops.insert_one(
+        {"id": "stop-1", "name": "Meskel Square", "is_active": True, "location": {"latitude": 9.0, "longitude": 38.76}}
+    )
+    await db.users.insert_many([
+        {"id": f"p{index}", "role": "PASSENGER", "location_sharing_enabled": True,
+         "current_location": {"latitude": 9.001, "longitude": 38.76}}
+        for index in range(3)
+    ])
+    await db.buses.insert_one({"id": "bus-1", "license_plate": "AA-1", "assigned_route_id": "route-1"})
+    app_state = SimpleNamespace(mongodb=db)
+
+    manager = WebSocketManager()
+    sockets = {f"p{index}": fake_socket() for index in range(3)}
+    for user_id, socket in sockets.items():
+        await manager.connect_user(cast(WebSocket, socket), user_id, "PASSENGER")
+    manager.subscribe_to_notifications("p0", ["PROXIMITY_ALERT"])
+    manager.subscribe_to_notifications("p1", ["PROXIMITY_ALERT"])
+
+    tracker = ProximityAlertTracker(db, flush_interval=60, flush_batch=100)
+    with patch("core.realtime.bus_tracking.websocket_manager", manager), \
+            patch("core.realtime.bus_tracking.proximity_alert_tracker", tracker):
+        await tracker.start()
+        try:
+            # Ten updates as the bus closes in on the stop
+            for step in range(10):
+                await BusTrackingService.check_proximity_notifications(
+                    "bus-1", 9.0, 38.7640 - step * 0.0004, app_state=app_state
+                )
+            assert await db.notifications.count_documents({}) == 0
+        finally:
+            await tracker.stop()
+
+    for user_id, socket in sockets.items():
+        assert [message["type"] for message in socket.sent if message["type"] == "proximity_alert"] == [
+            "proximity_alert"]
+    # Only subscribers get a stored notification, written in one batch
+    notifications = await db.notifications.find().to_list(None)
+    assert sorted(notification["user_id"] for notification in notifications) == ["p0", "p1"]
+    live = [message for message in sockets["p0"].sent if message["type"] == "notification"]
+    assert live[0]["notification"]["id"] in {str(notification["_id"]) for notification in notifications}
+
+    stats = tracker.get_stats()
+    assert (stats["alerts"], stats["suppressed"], stats["flushes"]) == (3, 27, 1)
+    assert stats["approaches"][ARRIVED] == 3
+    # p0 and p1 were subscribed: 20 inserts before deduplication, one batch now
+    assert stats["baseline_inserts"] == 20
+    assert stats["write_reduction"] == pytest.approx(1 - 1 / 20, abs=1e-4)
+
+
+@pytest.mark.asyncio
+async def test_cooldowns_survive_a_restart(bulk_database):
+    db: Any = bulk_database(AsyncMongoMockClient()["proximity_cooldown_test"])
+    await db[COOLDOWN_COLLECTION].insert_one({
+        "_id": "p2:bus-1:stop-1", "passenger_id": "p2", "bus_id": "bus-1", "stop_id": "stop-1",
+        "expires_at": datetime.now(timezone.utc) - timedelta(seconds=1)
+    })
+
+    tracker = ProximityAlertTracker(db, cooldown_seconds=300)
+    tracker.observe("p1", "bus-1", "stop-1", 30)
+    tracker.observe_bus("bus-1", [])
+    await tracker.flush()
+    assert tracker.get_stats()["cooldown_writes"] == 1
+
+    restarted = ProximityAlertTracker(cooldown_seconds=300)
+    await restarted.start(db)
+    try:
+        assert restarted.get_stats()["restored_cooldowns"] == 1
+        assert not restarted.observe("p1", "bus-1", "stop-1", 400)
+        # Expired cooldowns are not restored
+        assert restarted.observe("p2", "bus-1", "stop-1", 400)
+    finally:
+        await restarted.stop()
@@ -0,0 +1,164 @@
+"""
+Tests for off-loop QR rendering and the content-addressed QR image cache.
+"""
+
+import asyncio
+import base64
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from typing import Any
+from unittest.mock import patch
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from mongomock_motor import AsyncMongoMockClient
+
+from core import qr_images
+from core.dependencies import get_current_user
+from core.qr_images import QRImageCache, payload_key, qr_payload
+from routers import payments
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+@pytest.mark.asyncio
+async def test_renders_each_payload_once_off_the_loop(tmp_path):
+    cache = QRImageCache(cache_dir=str(tmp_path), executor="thread", workers=2, memory_items=1)
+    render_threads = []
+    render = qr_images.render_qr_png
+
+    def recording_render(payload):
+        render_threads.append(threading.get_ident())
+        return render(payload)
+
+    try:
+        with patch("core.qr_images.render_qr_png", recording_render):
+            results = await asyncio.gather(*(cache.get(qr_payload("token-a")) for _ in range(5)))
+            await cache.get(qr_payload("token-b"))
+    finally:
+        cache.stop()
+
+    key, image = results[0]
+    assert key == payload_key("GUZOSYNC-TICKET:token-a")
+    assert image.startswith(PNG_SIGNATURE) and all(result == (key, image) for result in results)
+    assert len(render_threads) == 2 and threading.get_ident() not in render_threads
+    assert cache.stats["joined"] == 4
+    assert (tmp_path / key[:2] / f"{key}.png").read_bytes() == image
+
+    # A fresh instance (another worker, or after a restart) reads the disk instead of rendering
+    other = QRImageCache(cache_dir=str(tmp_path), executor="thread")
+    with patch("core.qr_images.render_qr_png", side_effect=AssertionError("rendered again")):
+        assert await other.get(qr_payload("token-a")) == (key, image)
+        assert await other.get(qr_payload("token-a")) == (key, image)
+    assert (other.stats["disk_hits"], other.stats["memory_hits"]) == (1, 1)
+
+
+@pytest.mark.asyncio
+async def test_process_pool_rendering(tmp_path):
+    cache = QRImageCache(cache_dir=str(tmp_path), executor="process", workers=1)
+    try:
+        _, image = await cache.get(qr_payload("token-p"))
+    finally:
+        cache.stop()
+    assert image == qr_images.render_qr_png(qr_payload("token-p"))
+
+
+@pytest.mark.asyncio
+async def test_cancelled_request_does_not_fail_joined_requests(tmp_path):
+    cache = QRImageCache(cache_dir=str(tmp_path), executor="thread", workers=1)
+    release = threading.Event()
+    render = qr_images.render_qr_png
+
+    def slow_render(payload):
+        release.wait(5)
+        return render(payload)
+
+    try:
+        with patch("core.qr_images.render_qr_png", slow_render):
+            leader = asyncio.create_task(cache.get(qr_payload("token-c")))
+            await asyncio.sleep(0.01)
+            follower = asyncio.create_task(cache.get(qr_payload("token-c")))
+            await asyncio.sleep(0.01)
+            leader.cancel()
+            release.set()
+            _, image = await follower
+    finally:
+        cache.stop()
+
+    assert leader.cancelled()
+    assert image.startswith(PNG_SIGNATURE)
+    assert (cache.stats["renders"], cache.stats["joined"]) == (1, 1)
+
+
+def test_prune_evicts_stale_then_least_recently_served_images(tmp_path):
+    cache = QRImageCache(cache_dir=str(tmp_path), executor="thread")
+    now = time.time()
+    for index, age_days in enumerate([40, 3, 2, 1]):
+        path = cache._path(f"{index:02d}" + "f" * 62)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b"x" * 100)
+        os.utime(path, (now - age_days * 86400, now - age_days * 86400))
+    cache.max_age_seconds = 30 * 86400
+    cache.max_bytes = 250
+
+    # The 40-day-old image is past the age limit, the 3-day-old one over the size limit
+    assert cache.prune(now=now) == 2
+    assert sorted(path.name[:2] for path in tmp_path.glob("*/*.png")) == ["02", "03"]
+    assert cache.prune(now=now) == 0
+
+    # Serving an image from disk makes it the most recently served
+    assert cache._read("02" + "f" * 62) is not None
+    cache.max_bytes = 150
+    assert cache.prune() == 1
+    assert [path.name[:2] for path in tmp_path.glob("*/*.png")] == ["02"]
+
+
+def test_qr_endpoints_serve_cached_images_with_etags(tmp_path):
+    db: Any = AsyncMongoMockClient()["guzosync_test"]
+    user = SimpleNamespace(id="customer-1", first_name="Abebe", last_name="Kebede")
+    app = FastAPI()
+    app.include_router(payments.router)
+    app.state.mongodb = db
+    app.dependency_overrides[get_current_user] = lambda: user
+    now = datetime.utcnow()
+    cache = QRImageCache(cache_dir=str(tmp_path), executor="thread")
+
+    with patch("routers.payments.qr_image_cache", cache), TestClient(app) as client:
+        assert client.portal is not None
+        # Activated before this change: a rendered base64 image on the document, no token
+        client.portal.call(lambda: db.tickets.insert_one({
+            "_id": "ticket-1", "ticket_number": "TKT-1", "customer_id": "customer-1", "status": "ACTIVE",
+            "ticket_type": "SINGLE_TRIP", "valid_from": now.isoformat(),
+            "valid_until": (now + timedelta(days=1)).isoformat(), "qr_code": "iVBORw0KGgo="
+        }))
+
+        response = client.get("/api/tickets/ticket-1/qr")
+        assert response.status_code == 200
+        body = response.json()
+        assert base64.b64decode(body["qr_code"]).startswith(PNG_SIGNATURE)
+        assert body["qr_image_url"].endswith("/api/tickets/ticket-1/qr.png")
+
+        # The document keeps only the payload
+        stored = client.portal.call(lambda: db.tickets.find_one({"_id": "ticket-1"}))
+        assert stored["qr_code"] == qr_payload(body["signed_token"])
+        etag = f'"{payload_key(stored["qr_code"])}"'
+        assert response.headers["etag"] == etag
+        assert response.headers["cache-control"] == "private, max-age=86400"
+
+        image = client.get("/api/tickets/ticket-1/qr.png")
+        assert image.headers["content-type"] == "image/png" and image.headers["etag"] == etag
+        assert image.content == base64.b64decode(body["qr_code"])
+
+        for path in ("/api/tickets/ticket-1/qr", "/api/tickets/ticket-1/qr.png"):
+            revalidated = client.get(path, headers={"If-None-Match": etag})
+            assert revalidated.status_code == 304 and revalidated.content == b""
+        assert client.get("/api/tickets/ticket-1/qr.png", headers={"If-None-Match": '"stale"'}).status_code == 200
+        assert cache.stats["renders"] == 1
+
+        user.id = "someone-else"
+        assert client.get("/api/tickets/ticket-1/qr.png").status_code == 404
+    cache.stop()
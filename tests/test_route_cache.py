@@ -0,0 +1,80 @@
+"""
+Tests for the shared route waypoint cache.
+"""
+
+import pytest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from simulation.bus_simulator import BusSimulator, BusState
+from simulation.route_cache import CompiledRoute, RouteWaypointCache, route_fingerprint
+
+
+def make_route_data(stop_ids=None):
+    return {"id": "route-1", "name": "Route 1", "stop_ids": stop_ids or ["stop-1", "stop-2"]}
+
+
+def make_waypoints(count: int = 20):
+    return [
+        {
+            "latitude": 9.0 + 0.001 * i,
+            "longitude": 38.7,
+            "is_bus_stop": i % 10 == 0,
+            "stop_id": f"stop-{i}" if i % 10 == 0 else None,
+            "estimated_speed": 0 if i % 10 == 0 else 30.0
+        }
+        for i in range(count)
+    ]
+
+
+class TestRouteWaypointCache:
+    """Test compiled route caching and invalidation."""
+
+    def test_compiled_route_arrays(self):
+        route = CompiledRoute.from_waypoints("route-1", "fp", make_waypoints())
+
+        assert len(route) == 20
+        assert route.stop_indices.tolist() == [0, 10]
+        assert route.stop_ids == ["stop-0", "stop-10"]
+        assert route.cumulative_distance[0] == 0.0
+        assert route.loop_length_km > route.cumulative_distance[-1]
+
+    def test_changed_stops_invalidate_entry(self):
+        cache = RouteWaypointCache()
+        route_data = make_route_data()
+        cache.put(CompiledRoute.from_waypoints("route-1", route_fingerprint(route_data), make_waypoints()))
+
+        assert cache.get(route_data) is not None
+        assert cache.get(make_route_data(["stop-1", "stop-3"])) is None
+        assert cache.get_stats()["invalidations"] == 1
+        assert cache.get_stats()["compiled_routes"] == 0
+
+    @pytest.mark.asyncio
+    async def test_buses_share_compiled_route(self):
+        simulator = BusSimulator(MagicMock(), route_cache=RouteWaypointCache())
+        route_data = make_route_data()
+
+        with patch.object(simulator, "_generate_route_waypoints", AsyncMock(return_value=make_waypoints())) as generate:
+            first = await simulator._get_compiled_route(route_data)
+            second = await simulator._get_compiled_route(route_data)
+
+        assert first is second
+        generate.assert_awaited_once()
+
+    def test_rebind_resnaps_buses_onto_new_geometry(self):
+        simulator = BusSimulator(MagicMock(), route_cache=RouteWaypointCache())
+        old_route = CompiledRoute.from_waypoints("route-1", "old", make_waypoints())
+        bus = BusState({"id": "bus-1", "assigned_route_id": "route-1",
+                        "current_location": {"latitude": 9.0152, "longitude": 38.7}})
+        bus.route, bus.current_waypoint_index = old_route, 16
+        simulator.buses["bus-1"] = bus
+
+        # Same corridor walked the other way with twice the waypoints: index 16 is now near the far end
+        reversed_waypoints = [
+            {"latitude": 9.019 - 0.0005 * i, "longitude": 38.7, "is_bus_stop": False, "estimated_speed": 30.0}
+            for i in range(40)
+        ]
+        simulator._rebind_route(CompiledRoute.from_waypoints("route-1", "new", reversed_waypoints))
+
+        assert bus.route.fingerprint == "new"
+        # Between 9.0155 (index 7) and 9.015 (index 8), heading on to index 8
+        assert bus.current_waypoint_index == 8
@@ -0,0 +1,58 @@
+"""
+Tests for sharded multi-process simulation.
+"""
+
+import pytest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from simulation.shard_supervisor import ShardSupervisor, assign_routes
+
+
+class TestShardSupervisor:
+    """Test route ownership and shard message handling."""
+
+    def test_routes_are_disjoint_and_balanced(self):
+        counts = {"r1": 40, "r2": 30, "r3": 20, "r4": 10, "r5": 10, "r6": 10}
+        shards = assign_routes(counts, 3)
+
+        owned = [route for shard in shards for route in shard]
+        assert sorted(owned) == sorted(counts)
+        loads = [sum(counts[r] for r in shard) for shard in shards]
+        assert max(loads) - min(loads) <= 10
+
+    def test_more_shards_than_routes(self):
+        shards = assign_routes({"r1": 5}, 3)
+        assert shards == [["r1"], [], []]
+
+    def test_shard_ticks_are_published_for_broadcast(self):
+        supervisor = ShardSupervisor(MagicMock(), shard_count=2)
+        bus = {"bus_id": "a", "route_id": "r1", "latitude": 9.0, "longitude": 38.7}
+
+        supervisor._handle_message({"type": "tick", "shard_id": 0, "buses": [bus]})
+        supervisor._handle_message({"type": "tick", "shard_id": 1, "buses": [dict(bus, bus_id="b")]})
+        supervisor._handle_message({"type": "status", "shard_id": 1, "status": {"total_buses": 7}})
+
+        assert supervisor.ticks_received == 2
+        assert supervisor.shard_ticks == {0: 1, 1: 1}
+        assert supervisor.publisher.published_ticks == 2
+        assert supervisor.shard_status[1]["total_buses"] == 7
+
+    @pytest.mark.asyncio
+    async def test_broadcast_tracks_headways_without_persisting(self):
+        db = MagicMock()
+        supervisor = ShardSupervisor(db, shard_count=2)
+        bus = {"bus_id": "a", "route_id": "r1", "latitude": 9.0, "longitude": 38.7}
+
+        with patch("core.realtime.bus_tracking.BusTrackingService._track_headways", new=AsyncMock()) as track:
+            await supervisor.publisher.start()
+            supervisor._handle_message({"type": "tick", "shard_id": 0, "buses": [bus]})
+            await supervisor.publisher.queue.join()
+            await supervisor.publisher.stop()
+
+        track.assert_awaited_once()
+        assert track.await_args_list[0].args[0] == [("a", "r1", 9.0, 38.7)]
+        db.buses.bulk_write.assert_not_called()
+
+    def test_shard_count_must_be_positive(self):
+        with pytest.raises(ValueError):
+            ShardSupervisor(MagicMock(), shard_count=0)
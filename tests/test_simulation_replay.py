@@ -0,0 +1,123 @@
+"""
+Tests for seeded, time-compressed simulation replays.
+"""
+
+import asyncio
+import pytest
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock
+
+from core.realtime import bus_tracking
+from simulation.bus_simulation_service import REPLAY_COLLECTION, REPLAY_ROOM_PREFIX, BusSimulationService
+from simulation.bus_simulator import BusSimulator, BusState
+from simulation.clock import ReplayClock
+from simulation.route_cache import CompiledRoute, RouteWaypointCache
+
+
+START = datetime(2024, 1, 1, 6, 0, tzinfo=timezone.utc)
+
+
+def make_route():
+    waypoints = [
+        {
+            "latitude": 9.0 + 0.002 * i,
+            "longitude": 38.7,
+            "is_bus_stop": i % 5 == 0,
+            "estimated_speed": 0 if i % 5 == 0 else 30.0
+        }
+        for i in range(20)
+    ]
+    return CompiledRoute.from_waypoints("route-1", "fingerprint", waypoints)
+
+
+def run_replay(seed: int, ticks: int = 120):
+    clock = ReplayClock(start_time=START, time_scale=60.0)
+    simulator = BusSimulator(MagicMock(), update_interval=5.0, route_cache=RouteWaypointCache(), clock=clock, seed=seed)
+    route = make_route()
+    for b in range(3):
+        bus_state = BusState({"id": f"bus-{b}", "assigned_route_id": "route-1", "bus_status": "OPERATIONAL"}, now=clock.now())
+        bus_state.route = route
+        bus_state.current_waypoint_index = b * 6
+        bus_state.latitude = float(route.latitude[b * 6])
+        bus_state.longitude = float(route.longitude[b * 6])
+        simulator.buses[bus_state.bus_id] = bus_state
+
+    stream = []
+    for _ in range(ticks):
+        stream.append(simulator._tick())
+        clock.advance(simulator.update_interval)
+    return stream
+
+
+class TestSimulationReplay:
+    """Test deterministic replay mode."""
+
+    def test_same_seed_reproduces_position_stream(self):
+        assert run_replay(seed=11) == run_replay(seed=11)
+
+    def test_different_seed_changes_position_stream(self):
+        assert run_replay(seed=11) != run_replay(seed=12)
+
+    def test_replay_clock_stops_at_duration(self):
+        clock = ReplayClock(start_time=START, time_scale=60.0, duration_seconds=10)
+        clock.advance(5)
+        assert not clock.finished()
+        clock.advance(5)
+        assert clock.finished()
+        assert clock.get_status()["simulated_elapsed_seconds"] == 10
+
+    @pytest.mark.asyncio
+    async def test_loop_runs_faster_than_real_time(self):
+        clock = ReplayClock(start_time=START, time_scale=3600.0, duration_seconds=60)
+        simulator = BusSimulator(MagicMock(), update_interval=5.0, clock=clock, seed=1)
+        simulator.is_running = True
+
+        await simulator._simulation_loop()
+
+        assert simulator.ticks == 12
+        assert clock.finished()
+        assert not simulator.is_running
+
+    @pytest.mark.asyncio
+    async def test_replay_frames_stay_out_of_live_tracking(self, monkeypatch):
+        db = {"buses": AsyncMock(), REPLAY_COLLECTION: AsyncMock()}
+        send = AsyncMock()
+        monkeypatch.setattr(bus_tracking.websocket_manager, "rooms", {
+            "bus_tracking:bus-0": set(),
+            f"{REPLAY_ROOM_PREFIX}bus_tracking:bus-0": set()
+        })
+        monkeypatch.setattr(bus_tracking.websocket_manager, "send_room_message", send)
+
+        service = BusSimulationService()
+        service.set_app_state(SimpleNamespace(mongodb=db))
+        service.replay_config = {"seed": 1, "time_scale": 60.0, "start_time": START, "duration_seconds": None}
+        publisher = service._create_simulator().tick_publisher
+
+        await publisher.start()
+        publisher.publish(1, [{"bus_id": "bus-0", "route_id": "route-1", "latitude": 9.0, "longitude": 38.7}])
+        await asyncio.wait_for(publisher.queue.join(), timeout=1)
+        await publisher.stop()
+
+        db[REPLAY_COLLECTION].bulk_write.assert_awaited_once()
+        db["buses"].bulk_write.assert_not_awaited()
+        assert [c.args[0] for c in send.await_args_list] == [f"{REPLAY_ROOM_PREFIX}bus_tracking:bus-0"]
+
+    @pytest.mark.asyncio
+    async def test_replay_is_rejected_when_it_cannot_run(self):
+        service = BusSimulationService()
+        service.enabled = False
+        with pytest.raises(RuntimeError):
+            await service.start_replay(seed=1)
+
+        service = BusSimulationService()
+        service.shard_count = 2
+        with pytest.raises(RuntimeError):
+            await service.start_replay(seed=1)
+        assert service.replay_config is None
+
+        service = BusSimulationService()
+        service.replay_config = {"seed": 1}
+        with pytest.raises(RuntimeError):
+            await service.start_shards(2)
+        assert service.shard_count == 0
@@ -0,0 +1,135 @@
+"""
+Tests for streaming CSV/NDJSON exports.
+"""
+
+import csv
+import io
+import json
+import pytest
+from datetime import datetime
+from types import SimpleNamespace
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from mongomock_motor import AsyncMongoMockClient
+
+from core.dependencies import get_current_user
+from core.mongo_utils import date_range_filter
+from core.streaming_export import iter_csv, iter_ndjson
+from models.user import UserRole
+from routers import analytics, approvals, control_center
+
+
+async def rows(count):
+    for i in range(count):
+        yield {"id": f"u{i}", "name": f"name,{i}", "created_at": datetime(2024, 3, 1, 8, i % 60)}
+
+
+@pytest.mark.asyncio
+async def test_csv_is_chunked_with_header_first():
+    chunks = [chunk async for chunk in iter_csv(rows(5), ["id", "name", "created_at"], chunk_rows=2)]
+
+    # header, then rows in chunks of two
+    assert len(chunks) == 4
+    assert chunks[0] == b"id,name,created_at\r\n"
+    parsed = list(csv.reader(io.StringIO(b"".join(chunks).decode())))
+    assert parsed[1] == ["u0", "name,0", "2024-03-01T08:00:00"]
+    assert len(parsed) == 6
+
+
+@pytest.mark.asyncio
+async def test_ndjson_lines():
+    chunks = [chunk async for chunk in iter_ndjson(rows(3), chunk_rows=2)]
+    assert len(chunks) == 2
+    lines = b"".join(chunks).decode().splitlines()
+    assert [json.loads(line)["id"] for line in lines] == ["u0", "u1", "u2"]
+
+
+def test_date_range_filter_matches_dates_and_iso_strings():
+    start, end = datetime(2024, 3, 1), datetime(2024, 3, 2)
+    assert date_range_filter("created_at", start, end) == {"$or": [
+        {"created_at": {"$gte": start, "$lte": end}},
+        {"created_at": {"$gte": "2024-03-01T00:00:00", "$lte": "2024-03-02T00:00:00"}}
+    ]}
+    assert date_range_filter("created_at") == {}
+
+
+@pytest.fixture
+def db():
+    return AsyncMongoMockClient()["guzosync_test"]
+
+
+@pytest.fixture
+def user():
+    return SimpleNamespace(role=UserRole.CONTROL_ADMIN, email="admin@example.com", id="admin")
+
+
+@pytest.fixture
+def client(db, user):
+    app = FastAPI()
+    for module in (analytics, approvals, control_center):
+        app.include_router(module.router)
+    app.state.mongodb = db
+    app.dependency_overrides[get_current_user] = lambda: user
+    with TestClient(app) as test_client:
+        yield test_client
+
+
+def test_personnel_export_projects_allowed_columns(client, db, user):
+    client.portal.call(db.users.insert_many, [
+        {"id": "a", "first_name": "Abebe", "email": "a@example.com", "role": "BUS_DRIVER",
+         "password": "hash", "created_at": "2024-03-01T09:00:00"},
+        {"id": "b", "first_name": "Sara", "email": "b@example.com", "role": "PASSENGER",
+         "password": "hash", "created_at": datetime(2024, 3, 5)},
+        {"id": "c", "first_name": "Kebede", "email": "c@example.com", "role": "BUS_DRIVER",
+         "password": "hash", "created_at": datetime(2024, 2, 1)},
+        # A load-test passenger from the bus simulation
+        {"id": "d", "first_name": "Sim", "email": "d@simulated.local", "role": "PASSENGER",
+         "password": "hash", "created_at": datetime(2024, 3, 6), "is_simulated": True}
+    ])
+
+    response = client.get("/api/control-center/personnel/export", params={
+        "fields": "id,first_name,role", "created_from": "2024-03-01T00:00:00"
+    })
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/csv")
+    parsed = list(csv.DictReader(io.StringIO(response.text)))
+    assert sorted(row["id"] for row in parsed) == ["a", "b"]
+    assert set(parsed[0]) == {"id", "first_name", "role"}
+
+    # Credentials are not exportable
+    assert client.get("/api/control-center/personnel/export", params={"fields": "password"}).status_code == 400
+
+    # Staff never see admins
+    user.role = UserRole.CONTROL_STAFF
+    response = client.get("/api/control-center/personnel/export", params={"format": "ndjson"})
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert "password" not in lines[0]
+    assert len(lines) == 3
+    assert "d" not in {line["id"] for line in lines}
+    # The personnel list shares the query
+    assert control_center._personnel_query(user, "passenger")["is_simulated"] == {"$ne": True}
+
+
+def test_approval_and_analytics_exports(client, db):
+    client.portal.call(db.approval_requests.insert_many, [
+        {"id": "r1", "email": "x@example.com", "status": "PENDING", "requested_at": "2024-03-01T09:00:00"},
+        {"id": "r2", "email": "y@example.com", "status": "APPROVED", "requested_at": "2024-03-02T09:00:00"}
+    ])
+    client.portal.call(db.payments.insert_many, [
+        {"id": f"p{i}", "amount": 10.0, "status": "COMPLETED", "chapa_response": {"secret": 1},
+         "created_at": datetime(2024, 3, 1 + i)}
+        for i in range(3)
+    ])
+
+    response = client.get("/api/approvals/requests/export", params={"status_filter": "pending", "format": "ndjson"})
+    assert [json.loads(line)["id"] for line in response.text.splitlines()] == ["r1"]
+
+    response = client.get("/api/analytics/export/stream", params={
+        "dataset": "payments", "end_date": "2024-03-02T00:00:00"
+    })
+    parsed = list(csv.DictReader(io.StringIO(response.text)))
+    assert [row["id"] for row in parsed] == ["p0", "p1"]
+    assert "chapa_response" not in parsed[0]
+
+    assert client.get("/api/analytics/export/stream", params={"dataset": "users"}).status_code == 400
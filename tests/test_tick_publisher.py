@@ -0,0 +1,87 @@
+"""
+Tests for the simulation tick publisher.
+"""
+
+import asyncio
+import pytest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from simulation.tick_publisher import TickPublisher
+
+
+def bus(bus_id: str, latitude: float = 9.0):
+    return {"bus_id": bus_id, "route_id": "route-1", "latitude": latitude, "longitude": 38.7}
+
+
+class TestTickPublisher:
+    """Test tick hand-off between the simulator and the tracking pipeline."""
+
+    def test_publish_does_not_block_when_full(self):
+        publisher = TickPublisher(MagicMock(), max_pending_ticks=1)
+
+        publisher.publish(1, [bus("a", 9.0), bus("b", 9.0)])
+        publisher.publish(2, [bus("a", 9.1)])
+
+        assert publisher.dropped_ticks == 1
+        assert publisher.queue.qsize() == 1
+
+        # The dropped tick is coalesced: latest position for "a", last known for "b"
+        event = publisher.queue.get_nowait()
+        positions = {b["bus_id"]: b["latitude"] for b in event["buses"]}
+        assert positions == {"a": 9.1, "b": 9.0}
+
+    def test_empty_ticks_are_not_published(self):
+        publisher = TickPublisher(MagicMock())
+        publisher.publish(1, [])
+        assert publisher.published_ticks == 0
+
+    @pytest.mark.asyncio
+    async def test_consumer_persists_batches(self):
+        publisher = TickPublisher(MagicMock())
+        with patch(
+            "simulation.tick_publisher.bus_tracking_service.update_bus_locations_batch",
+            new_callable=AsyncMock,
+            return_value=True
+        ) as update_batch:
+            await publisher.start()
+            publisher.publish(1, [bus("a"), bus("b")])
+            await asyncio.wait_for(publisher.queue.join(), timeout=1)
+            await publisher.stop()
+
+        update_batch.assert_awaited_once()
+        assert len(update_batch.await_args_list[0].args[0]) == 2
+        metrics = publisher.get_metrics()
+        assert metrics["processed_ticks"] == 1
+        assert metrics["pending_ticks"] == 0
+        assert metrics["last_batch_size"] == 2
+
+    @pytest.mark.asyncio
+    async def test_consumer_survives_pipeline_errors(self):
+        publisher = TickPublisher(MagicMock())
+        with patch(
+            "simulation.tick_publisher.bus_tracking_service.update_bus_locations_batch",
+            new_callable=AsyncMock,
+            side_effect=[RuntimeError("listener bug"), False, True]
+        ):
+            await publisher.start()
+            for tick in range(1, 4):
+                publisher.publish(tick, [bus("a")])
+                await asyncio.wait_for(publisher.queue.join(), timeout=1)
+            await publisher.stop()
+
+        assert publisher.failed_ticks == 2
+        assert publisher.processed_ticks == 1
+
+    @pytest.mark.asyncio
+    async def test_failed_writes_in_the_tracking_pipeline_are_counted(self):
+        db = MagicMock()
+        db["buses"].bulk_write = AsyncMock(side_effect=RuntimeError("mongo down"))
+        publisher = TickPublisher(db, track_headways=False)
+
+        await publisher.start()
+        publisher.publish(1, [bus("a")])
+        await asyncio.wait_for(publisher.queue.join(), timeout=1)
+        await publisher.stop()
+
+        assert publisher.get_metrics()["failed_ticks"] == 1
+        assert publisher.processed_ticks == 0
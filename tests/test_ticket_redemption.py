@@ -0,0 +1,267 @@
+"""
+Tests for atomic, single-round-trip ticket redemption.
+"""
+
+import asyncio
+import random
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from typing import Any, Dict
+from unittest.mock import patch
+
+import httpx
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from mongomock_motor import AsyncMongoMockClient
+
+from core.dependencies import get_current_user
+from core.mongo_utils import model_to_mongo_doc
+from core.ticket_redemption import redeem_scans, redeem_ticket
+from core.ticket_tokens import sign_ticket
+from core.ticket_tokens import TicketLedger
+from models.payment import Ticket, TicketType
+from models.user import UserRole
+from routers import payments
+
+
+def issued_ticket(number: str, days: int = 30, **overrides) -> dict:
+    """A ticket document as initiate_payment stores it (ISO-string dates)."""
+    now = datetime.utcnow()
+    return model_to_mongo_doc(Ticket(
+        ticket_number=number, customer_id="customer-1", customer_name="Abebe Kebede", payment_id="payment-1",
+        ticket_type=TicketType.SINGLE_TRIP, price=10, valid_from=now - timedelta(days=1),
+        valid_until=now + timedelta(days=days), **overrides
+    ))
+
+
+async def find(collection, query=None) -> Dict[str, Any]:
+    document = await collection.find_one(query or {})
+    assert document is not None
+    return document
+
+
+class LatentCollection:
+    """Yields to the event loop around every call, like a network round trip does."""
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def __getattr__(self, name):
+        method = getattr(self.collection, name)
+
+        async def call(*args, **kwargs):
+            await asyncio.sleep(random.uniform(0, 0.002))
+            result = await method(*args, **kwargs)
+            await asyncio.sleep(random.uniform(0, 0.002))
+            return result
+        return call
+
+
+class CountingCollection:
+    """Counts the calls made on a collection."""
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.calls = []
+
+    def __getattr__(self, name):
+        self.calls.append(name)
+        return getattr(self.collection, name)
+
+
+@pytest.mark.asyncio
+async def test_happy_path_is_one_round_trip_and_returns_post_image():
+    db: Any = AsyncMongoMockClient()["guzosync_test"]
+    await db.tickets.insert_one(issued_ticket("TKT-1"))
+    tickets = CountingCollection(db.tickets)
+    ledger = TicketLedger()
+
+    result = await redeem_ticket(SimpleNamespace(tickets=tickets), "TKT-1", trip_id="trip-1", ledger=ledger)
+    assert tickets.calls == ["find_one_and_update"]
+    assert result["is_valid"] is True
+    assert result["ticket"]["status"] == "USED"
+    assert result["ticket"]["customer_name"] == "Abebe Kebede"
+    assert ledger.status_of("TKT-1") == "USED"
+
+    stored = await find(db.tickets, {"ticket_number": "TKT-1"})
+    assert (stored["status"], stored["used_trip_id"]) == ("USED", "trip-1")
+
+
+@pytest.mark.asyncio
+async def test_rejections_explain_why():
+    db: Any = AsyncMongoMockClient()["guzosync_test"]
+    await db.tickets.insert_many([
+        issued_ticket("TKT-OLD", days=-1),
+        issued_ticket("TKT-OFF", status="CANCELLED"),
+        issued_ticket("TKT-OFFLINE"),
+    ])
+    ledger = TicketLedger()
+    ledger.record_closed("TKT-OFFLINE", "USED", datetime.utcnow() + timedelta(days=1))
+
+    expired = await redeem_ticket(db, "TKT-OLD", ledger=ledger)
+    assert (expired["is_valid"], expired["message"]) == (False, "Ticket has expired")
+    assert (await find(db.tickets, {"ticket_number": "TKT-OLD"}))["status"] == "EXPIRED"
+
+    assert (await redeem_ticket(db, "TKT-OFF", ledger=ledger))["message"] == "Ticket has been cancelled"
+    assert (await redeem_ticket(db, "TKT-NONE", ledger=ledger))["message"] == "Ticket not found"
+
+    # Redeemed with its token on this instance, not yet written back
+    offline = await redeem_ticket(db, "TKT-OFFLINE", ledger=ledger)
+    assert (offline["is_valid"], offline["ticket"]["status"]) == (False, "USED")
+    assert (await find(db.tickets, {"ticket_number": "TKT-OFFLINE"}))["status"] == "ACTIVE"
+
+
+@pytest.mark.asyncio
+async def test_concurrent_scans_redeem_exactly_once():
+    db: Any = AsyncMongoMockClient()["guzosync_test"]
+    await db.tickets.insert_many([issued_ticket(f"TKT-{index}") for index in range(20)])
+    await db.users.insert_one({"_id": "customer-1", "first_name": "Never", "last_name": "Read"})
+
+    app = FastAPI()
+    app.include_router(payments.router)
+    # Without latency mongomock never interleaves two scans, and a read-then-write would pass too
+    app.state.mongodb = SimpleNamespace(tickets=LatentCollection(db.tickets), users=LatentCollection(db.users))
+    app.dependency_overrides[get_current_user] = lambda: SimpleNamespace(role=UserRole.BUS_DRIVER)
+
+    # Every ticket scanned by 10 validators at once
+    scans = [{"ticket_number": f"TKT-{index}", "trip_id": f"trip-{validator}"}
+             for validator in range(10) for index in range(20)]
+    with patch("core.ticket_redemption.ticket_ledger", TicketLedger()):
+        # httpx types the ASGI callable more narrowly than Starlette does
+        transport = httpx.ASGITransport(app=app)  # type: ignore[arg-type]
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            responses = await asyncio.gather(*(client.post("/api/tickets/validate", json=scan) for scan in scans))
+
+    verdicts = [response.json() for response in responses]
+    assert all(response.status_code == 200 for response in responses)
+    for index in range(20):
+        per_ticket = [v for v in verdicts if v["ticket_number"] == f"TKT-{index}"]
+        assert sum(v["is_valid"] for v in per_ticket) == 1
+        assert {v["message"] for v in per_ticket if not v["is_valid"]} == {"Ticket has already been used"}
+    # The denormalized name is used; users is never read
+    assert {v["customer_name"] for v in verdicts} == {"Abebe Kebede"}
+    assert await db.tickets.count_documents({"status": "USED"}) == 20
+
+
+@pytest.mark.asyncio
+async def test_offline_batch_is_one_read_and_one_write_with_first_scan_winning(bulk_collection):
+    db: Any = AsyncMongoMockClient()["guzosync_test"]
+    now = datetime.utcnow()
+    await db.tickets.insert_many([
+        issued_ticket("TKT-A"),
+        {**issued_ticket("TKT-LATE", days=-1), "valid_from": (now - timedelta(days=3)).isoformat()},
+        issued_ticket("TKT-DONE", status="USED"),
+        issued_ticket("TKT-SIGNED"),
+    ])
+    tickets = bulk_collection(db.tickets)
+    scans = [
+        {"ticket_number": "TKT-A", "scanned_at": now - timedelta(minutes=5), "bus_id": "bus-2", "trip_id": "trip-2"},
+        {"ticket_number": "TKT-A", "scanned_at": now - timedelta(minutes=9), "bus_id": "bus-1", "trip_id": "trip-1"},
+        # Expired since, but scanned while it was still valid
+        {"ticket_number": "TKT-LATE", "scanned_at": now - timedelta(days=2), "bus_id": "bus-1"},
+        {"ticket_number": "TKT-DONE", "scanned_at": now - timedelta(minutes=1)},
+        {"ticket_number": "TKT-NONE", "scanned_at": now - timedelta(minutes=1)},
+        {"ticket_number": "TKT-SIGNED", "scanned_at": now, "token": sign_ticket(issued_ticket("TKT-SIGNED"))[:-2] + "xx"},
+    ]
+
+    verdicts = await redeem_scans(SimpleNamespace(tickets=tickets), scans, now=now, ledger=TicketLedger())
+    assert tickets.calls == ["find", "bulk_write"]
+    assert [(v["is_valid"], v["message"]) for v in verdicts] == [
+        (False, "Ticket has already been used"),
+        (True, "Ticket is valid"),
+        (True, "Ticket is valid"),
+        (False, "Ticket has already been used"),
+        (False, "Ticket not found"),
+        (False, "Invalid ticket signature"),
+    ]
+    assert verdicts[0]["ticket"]["status"] == "USED"
+
+    stored = await find(db.tickets, {"ticket_number": "TKT-A"})
+    assert (stored["used_bus_id"], stored["used_trip_id"]) == ("bus-1", "trip-1")
+    assert stored["used_at"] == verdicts[1]["scanned_at"]
+    assert (await find(db.tickets, {"ticket_number": "TKT-SIGNED"}))["status"] == "ACTIVE"
+
+
+@pytest.mark.asyncio
+async def test_offline_batch_reports_scans_that_lost_a_race(bulk_collection):
+    db: Any = AsyncMongoMockClient()["guzosync_test"]
+    await db.tickets.insert_many([issued_ticket("TKT-1"), issued_ticket("TKT-2")])
+
+    async def validated_online_meanwhile():
+        await redeem_ticket(db, "TKT-2", trip_id="trip-online", ledger=TicketLedger())
+
+    tickets = bulk_collection(db.tickets, before_write=validated_online_meanwhile)
+    scans = [{"ticket_number": number, "scanned_at": datetime.utcnow() - timedelta(hours=1)} for number in ("TKT-1", "TKT-2")]
+    ledger = TicketLedger()
+
+    verdicts = await redeem_scans(SimpleNamespace(tickets=tickets), scans, ledger=ledger)
+    assert [v["is_valid"] for v in verdicts] == [True, False]
+    assert verdicts[1]["message"] == "Ticket has already been used"
+    assert (await find(db.tickets, {"ticket_number": "TKT-2"}))["used_trip_id"] == "trip-online"
+    assert ledger.status_of("TKT-1") == "USED" and ledger.status_of("TKT-2") is None
+
+
+@pytest.mark.asyncio
+async def test_offline_batch_uploaded_again_gets_the_same_verdicts(bulk_collection):
+    db: Any = AsyncMongoMockClient()["guzosync_test"]
+    await db.tickets.insert_many([issued_ticket("TKT-1"), issued_ticket("TKT-2")])
+    scanned_at = datetime.utcnow() - timedelta(minutes=10)
+    scans = [
+        {"ticket_number": "TKT-1", "scanned_at": scanned_at, "device_id": "validator-7", "scan_id": "scan-1"},
+        {"ticket_number": "TKT-2", "scanned_at": scanned_at, "device_id": "validator-7", "scan_id": "scan-2"},
+        {"ticket_number": "TKT-2", "scanned_at": scanned_at + timedelta(minutes=1), "device_id": "validator-7",
+         "scan_id": "scan-3"},
+    ]
+    ledger = TicketLedger()
+
+    first = await redeem_scans(SimpleNamespace(tickets=bulk_collection(db.tickets)), scans, ledger=ledger)
+    assert [(v["is_valid"], v["message"]) for v in first] == [
+        (True, "Ticket is valid"), (True, "Ticket is valid"), (False, "Ticket has already been used")
+    ]
+    stored = await find(db.tickets, {"ticket_number": "TKT-1"})
+    assert (stored["used_device_id"], stored["used_scan_id"]) == ("validator-7", "scan-1")
+
+    # The response was lost and the device uploads the same batch again
+    tickets = bulk_collection(db.tickets)
+    again = await redeem_scans(SimpleNamespace(tickets=tickets), scans, ledger=ledger)
+    assert [(v["is_valid"], v["message"]) for v in again] == [(v["is_valid"], v["message"]) for v in first]
+    assert tickets.calls == ["find"]
+
+    # Another device's scan of the same ticket is still a duplicate
+    other = await redeem_scans(
+        SimpleNamespace(tickets=db.tickets), [{**scans[0], "device_id": "validator-8"}], ledger=ledger
+    )
+    assert (other[0]["is_valid"], other[0]["message"]) == (False, "Ticket has already been used")
+
+
+def test_batch_endpoint_returns_verdicts_in_scan_order(bulk_collection):
+    db: Any = AsyncMongoMockClient()["guzosync_test"]
+    role = SimpleNamespace(role=UserRole.BUS_DRIVER)
+    app = FastAPI()
+    app.include_router(payments.router)
+    app.state.mongodb = SimpleNamespace(tickets=bulk_collection(db.tickets), users=db.users)
+    app.dependency_overrides[get_current_user] = lambda: role
+
+    with patch("core.ticket_redemption.ticket_ledger", TicketLedger()), TestClient(app) as client:
+        assert client.portal is not None
+        legacy = {**issued_ticket("TKT-OLD"), "customer_name": None}
+        client.portal.call(lambda: db.tickets.insert_many([issued_ticket("TKT-NEW"), legacy]))
+        client.portal.call(lambda: db.users.insert_one({"_id": "customer-1", "first_name": "Almaz", "last_name": "Ayana"}))
+
+        scanned_at = (datetime.utcnow() - timedelta(minutes=3)).isoformat() + "Z"
+        scans = [{"ticket_number": number, "scanned_at": scanned_at, "bus_id": "bus-7", "trip_id": "trip-7"}
+                 for number in ("TKT-NEW", "TKT-OLD", "TKT-NEW")]
+        response = client.post("/api/tickets/validate/batch", json={"scans": scans})
+        assert response.status_code == 200
+        body = response.json()
+        assert (body["accepted"], body["rejected"]) == (2, 1)
+        assert [(r["ticket_number"], r["is_valid"], r["status"]) for r in body["results"]] == [
+            ("TKT-NEW", True, "USED"), ("TKT-OLD", True, "USED"), ("TKT-NEW", False, "USED")
+        ]
+        assert [r["customer_name"] for r in body["results"]] == ["Abebe Kebede", "Almaz Ayana", "Abebe Kebede"]
+        assert body["results"][0]["bus_id"] == "bus-7"
+
+        assert client.post("/api/tickets/validate/batch", json={"scans": []}).status_code == 422
+        role.role = UserRole.PASSENGER
+        assert client.post("/api/tickets/validate/batch", json={"scans": scans}).status_code == 403
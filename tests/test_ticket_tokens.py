@@ -0,0 +1,146 @@
+"""
+Tests for signed ticket tokens and the in-memory redemption ledger.
+"""
+
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from typing import Any
+from unittest.mock import AsyncMock, patch
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from mongomock_motor import AsyncMongoMockClient
+
+from core.dependencies import get_current_user
+from core.ticket_tokens import (
+    InvalidTicketToken, TicketLedger, sign_ticket, ticket_qr_fields, verify_ticket_token
+)
+from models.payment import TicketType
+from models.user import UserRole
+from routers import payments
+
+
+def ticket_doc(number="TKT-0A1B2C3D", days=30, **overrides):
+    now = datetime.utcnow()
+    return {
+        "ticket_number": number,
+        "ticket_type": "DAILY_PASS",
+        "valid_from": (now - timedelta(minutes=1)).isoformat(),
+        "valid_until": now + timedelta(days=days),
+        **overrides
+    }
+
+
+def test_token_round_trip_and_tampering():
+    token = sign_ticket(ticket_doc(), "Abebe Kebede Tesfaye")
+    assert len(token) < 64
+
+    claims = verify_ticket_token(token)
+    assert claims.ticket_number == "TKT-0A1B2C3D"
+    assert claims.ticket_type == TicketType.DAILY_PASS
+    assert claims.initials == "AKT"
+    assert claims.valid_from < time.time() < claims.valid_until
+
+    # Extending the validity window breaks the signature
+    parts = token.split(".")
+    parts[4] = format(int(parts[4], 16) + 86400, "x")
+    with pytest.raises(InvalidTicketToken, match="signature"):
+        verify_ticket_token(".".join(parts))
+    with pytest.raises(InvalidTicketToken):
+        verify_ticket_token("GUZOSYNC")
+
+    # Tokens from another deployment's secret do not verify
+    with patch.dict("os.environ", {"TICKET_SIGNING_SECRET": "another-secret"}):
+        with pytest.raises(InvalidTicketToken):
+            verify_ticket_token(token)
+
+    fields = ticket_qr_fields(ticket_doc(), "Abebe Kebede")
+    assert fields["signed_token"].startswith("1.TKT-0A1B2C3D.D.") and fields["qr_code"]
+
+
+def test_ledger_redeems_once_and_checks_window():
+    ledger = TicketLedger()
+    claims = verify_ticket_token(sign_ticket(ticket_doc()))
+
+    assert ledger.redeem(claims, trip_id="trip-1") is None
+    assert ledger.redeem(claims) == "Ticket has already been used"
+    assert ledger.redeem(claims, now=claims.valid_until + 1) == "Ticket has expired"
+    assert ledger.redeem(claims, now=claims.valid_from - 1) == "Ticket is not valid yet"
+    assert [p["trip_id"] for p in ledger.pending] == ["trip-1"]
+    assert ledger.get_stats() == {
+        "redeemed": 1, "rejected": 3, "flushed": 0, "conflicts": 0, "closed_tickets": 1, "pending_writes": 1
+    }
+
+
+@pytest.mark.asyncio
+async def test_flush_batches_conditional_updates_and_keeps_them_on_failure():
+    tickets = SimpleNamespace(bulk_write=AsyncMock(side_effect=[
+        RuntimeError("not primary"), SimpleNamespace(matched_count=2)
+    ]))
+    ledger = TicketLedger(db=SimpleNamespace(tickets=tickets))
+    for number in ("TKT-1", "TKT-2", "TKT-3"):
+        ledger.redeem(verify_ticket_token(sign_ticket(ticket_doc(number))))
+
+    await ledger.flush()
+    assert len(ledger.pending) == 3
+
+    await ledger.flush()
+    operations = tickets.bulk_write.await_args.args[0]
+    assert tickets.bulk_write.await_args.kwargs == {"ordered": False}
+    assert [op._filter for op in operations] == [
+        {"ticket_number": number, "status": "ACTIVE"} for number in ("TKT-1", "TKT-2", "TKT-3")
+    ]
+    assert ledger.pending == []
+    assert ledger.stats["conflicts"] == 1
+
+
+@pytest.mark.asyncio
+async def test_sync_loads_closed_tickets():
+    db: Any = AsyncMongoMockClient()["guzosync_test"]
+    now = datetime.utcnow()
+    await db.tickets.insert_many([
+        {**ticket_doc("TKT-USED"), "status": "USED", "valid_until": (now + timedelta(days=1)).isoformat()},
+        {**ticket_doc("TKT-OLD"), "status": "USED", "valid_until": (now - timedelta(days=1)).isoformat()},
+        {**ticket_doc("TKT-OPEN"), "status": "ACTIVE"},
+    ])
+    ledger = TicketLedger(db=db, sync_interval=1)
+    await ledger.sync()
+    assert ledger.closed.keys() == {"TKT-USED"}
+
+    # Cancelled elsewhere after the first sync
+    await db.tickets.update_one(
+        {"ticket_number": "TKT-OPEN"}, {"$set": {"status": "CANCELLED", "updated_at": datetime.utcnow()}}
+    )
+    await ledger.sync()
+    assert ledger.status_of("TKT-OPEN") == "CANCELLED"
+    claims = verify_ticket_token(sign_ticket(ticket_doc("TKT-OPEN")))
+    assert ledger.redeem(claims) == "Ticket has been cancelled"
+
+
+def test_validate_endpoint_uses_the_token_without_database_lookups():
+    db: Any = AsyncMongoMockClient()["guzosync_test"]
+    app = FastAPI()
+    app.include_router(payments.router)
+    app.state.mongodb = db
+    app.dependency_overrides[get_current_user] = lambda: SimpleNamespace(role=UserRole.BUS_DRIVER)
+    ledger = TicketLedger()
+    token = sign_ticket(ticket_doc(), "Abebe Kebede")
+
+    with patch("routers.payments.ticket_ledger", ledger), TestClient(app) as client:
+        scan = {"ticket_number": "TKT-0A1B2C3D", "token": token, "trip_id": "trip-9"}
+        # The ticket is not in the database at all: the token alone validates it
+        first = client.post("/api/tickets/validate", json=scan).json()
+        assert (first["is_valid"], first["customer_name"], first["message"]) == (True, "AK", "Ticket is valid")
+
+        second = client.post("/api/tickets/validate", json=scan).json()
+        assert (second["is_valid"], second["status"]) == (False, "USED")
+
+        forged = client.post("/api/tickets/validate", json={**scan, "token": token[:-2] + "xx"}).json()
+        assert (forged["is_valid"], forged["message"]) == (False, "Invalid ticket signature")
+
+        other = client.post("/api/tickets/validate", json={**scan, "ticket_number": "TKT-OTHER"}).json()
+        assert other["is_valid"] is False
+
+    assert ledger.pending[0]["trip_id"] == "trip-9"
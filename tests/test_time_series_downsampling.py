@@ -0,0 +1,106 @@
+"""
+Tests for time series downsampling (LTTB and min/max buckets).
+"""
+
+import math
+import random
+import pytest
+from datetime import datetime, timedelta
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import numpy as np
+
+from core.analytics_service import AnalyticsService
+from core.kpi_aggregator import KPIAggregator
+from core.time_series_downsampling import (
+    lttb_indices, minmax_indices, downsample_points, TimeSeriesCache
+)
+
+
+def reference_lttb(data, threshold):
+    """Straightforward LTTB (Steinarsson), one point at a time."""
+    n = len(data)
+    if threshold >= n or threshold < 3:
+        return list(range(n))
+    every = (n - 2) / (threshold - 2)
+    a = 0
+    sampled = [0]
+    for i in range(threshold - 2):
+        range_start = int(i * every) + 1
+        range_end = int((i + 1) * every) + 1 if i < threshold - 3 else n - 1
+        next_start = range_end
+        next_end = int((i + 2) * every) + 1 if i < threshold - 4 else n - 1
+        if next_start >= next_end:
+            avg_x, avg_y = data[n - 1]
+        else:
+            avg_x = sum(p[0] for p in data[next_start:next_end]) / (next_end - next_start)
+            avg_y = sum(p[1] for p in data[next_start:next_end]) / (next_end - next_start)
+
+        ax, ay = data[a]
+        max_area, chosen = -1.0, range_start
+        for j in range(range_start, range_end):
+            area = abs((ax - avg_x) * (data[j][1] - ay) - (ax - data[j][0]) * (avg_y - ay))
+            if area > max_area:
+                max_area, chosen = area, j
+        sampled.append(chosen)
+        a = chosen
+    sampled.append(n - 1)
+    return sampled
+
+
+@pytest.mark.parametrize("n,threshold", [(1000, 50), (997, 13), (120, 100), (10, 3)])
+def test_lttb_matches_reference(n, threshold):
+    rng = random.Random(n)
+    data = [(float(i), math.sin(i / 15) * 10 + rng.gauss(0, 1)) for i in range(n)]
+    x = np.array([p[0] for p in data])
+    y = np.array([p[1] for p in data])
+
+    assert lttb_indices(x, y, threshold).tolist() == reference_lttb(data, threshold)
+
+
+def test_minmax_keeps_extremes():
+    rng = np.random.default_rng(3)
+    y = rng.normal(size=1000)
+    y[417] = 50.0
+    y[808] = -50.0
+    indices = minmax_indices(y, 40)
+
+    assert len(indices) <= 40
+    assert 417 in indices and 808 in indices
+    assert np.all(np.diff(indices) > 0)
+
+
+def test_downsample_points_short_series_untouched():
+    points = [{"timestamp": datetime(2024, 3, 1, h).isoformat(), "value": h} for h in range(10)]
+    assert downsample_points(points, 20) is points
+    sampled = downsample_points(points, 5)
+    assert len(sampled) == 5
+    assert sampled[0] is points[0] and sampled[-1] is points[-1]
+    with pytest.raises(ValueError):
+        downsample_points(points, 5, method="average")
+
+
+@pytest.mark.asyncio
+async def test_downsampled_series_is_cached():
+    start = datetime(2024, 1, 1)
+    points = [
+        {"timestamp": (start + timedelta(hours=i)).isoformat(), "value": i % 24, "metric": "trip_count"}
+        for i in range(24 * 90)
+    ]
+    cache = TimeSeriesCache(ttl_seconds=60)
+    service = AnalyticsService(MagicMock(), kpis=KPIAggregator(), rollups=MagicMock(), series_cache=cache)
+    end = start + timedelta(days=90)
+    generate = AsyncMock(return_value=points)
+    with patch.object(service, "generate_time_series_data", generate):
+        first = await service.generate_downsampled_time_series("trip_count", start, end, "hourly", 200)
+        second = await service.generate_downsampled_time_series("trip_count", start, end, "hourly", 200)
+
+        assert first["source_points"] == len(points)
+        assert len(first["time_series"]) == 200
+        assert second is first
+        assert generate.await_count == 1
+
+        # A different resolution is a different entry
+        await service.generate_downsampled_time_series("trip_count", start, end, "hourly", 100, "minmax")
+        assert generate.await_count == 2
+    assert cache.get_stats()["entries"] == 2